@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import argparse
+import bz2file
+import sys
+
+from dark.blast.conversion import BlastTabularFormatReader, TABULAR_FIELDS
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Convert BLAST tabular output to JSON.',
+        epilog=('Give a BLAST tabular output file and convert it to JSON, '
+                'optionally compressing the output. You *must* invoke BLAST '
+                "with the following output specification: -outfmt '7 %s' "
+                '(output format 6, with the same fields, can also be read, '
+                'but it has no records for queries with no hits, so its JSON '
+                'can only be read by BlastReadsAlignments when it is given a '
+                'readIndex). Note that only each line of the output is JSON '
+                '(the full output is not valid JSON by itself).' %
+                TABULAR_FIELDS)
+    )
+
+    parser.add_argument(
+        '--json', metavar='JSON-output-file',
+        help=('The JSON filename to write the converted BLAST output to. If '
+              'omitted, standard output will be used.'))
+
+    parser.add_argument(
+        '--tabular', metavar='BLAST-tabular-file', default=sys.stdin,
+        help=('The BLAST tabular output file to convert. If omitted, '
+              'standard input will be read.'))
+
+    parser.add_argument(
+        '--application', default='blastn',
+        help=('The BLAST program that made the output. This is only used if '
+              'the output has no comment lines (i.e., is output format 6).'))
+
+    parser.add_argument(
+        '--bzip2', default=False, action='store_true',
+        help='Compress output using bzip2.')
+
+    args = parser.parse_args()
+
+    if args.bzip2:
+        fp = bz2file.BZ2File(args.json or sys.stdout, 'w')
+    else:
+        fp = open(args.json, 'w') if args.json else sys.stdout
+
+    reader = BlastTabularFormatReader(args.tabular, args.application)
+    reader.saveAsJSON(fp, writeBytes=args.bzip2)
+    fp.close()
@@ -29,6 +29,12 @@ if __name__ == '__main__':
         '--bzip2', default=False, action='store_true',
         help='If True, compress the JSON output using bzip2.')
 
+    parser.add_argument(
+        '--biopython', default=False, action='store_true',
+        help=('If True, use the (much slower) BioPython XML parser. This is '
+              'only needed for XML output from BLAST versions before '
+              '2.2.14, which contains one XML document per query.'))
+
     args = parser.parse_args()
 
     if args.bzip2:
@@ -36,6 +42,6 @@ if __name__ == '__main__':
     else:
         fp = open(args.json, 'w') if args.json else sys.stdout
 
-    reader = XMLRecordsReader(args.xml)
+    reader = XMLRecordsReader(args.xml, useBiopython=args.biopython)
     reader.saveAsJSON(fp)
     fp.close()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
 import argparse
 import bz2file
 import sys
@@ -34,13 +36,42 @@ if __name__ == '__main__':
         '--bzip2', default=False, action='store_true',
         help='Compress output using bzip2.')
 
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help=('The number of processes to use to convert (and, if --bzip2 is '
+              'used, compress) the DIAMOND output. The JSON is written in '
+              'the original order, and is identical to that made by a single '
+              'process (when --bzip2 is used, the output is a series of '
+              'concatenated bzip2 streams, which bzip2 and Python both read '
+              'as one file).'))
+
+    parser.add_argument(
+        '--compact', default=False, action='store_true',
+        help=('Do not save the matched query and subject sequences of the '
+              'HSPs. This makes much smaller JSON. The matched sequences can '
+              'be made again from the HSP btop strings and the reads when '
+              'the JSON is read.'))
+
     args = parser.parse_args()
 
-    if args.bzip2:
-        fp = bz2file.BZ2File(args.json or sys.stdout, 'w')
+    if args.workers < 1:
+        print('The number of workers must be at least 1.', file=sys.stderr)
+        sys.exit(1)
+
+    reader = DiamondTabularFormatReader(args.diamond, compact=args.compact)
+
+    if args.bzip2 and args.workers > 1:
+        # The workers compress the JSON, so write their bytes directly.
+        if args.json:
+            fp = open(args.json, 'wb')
+        else:
+            fp = getattr(sys.stdout, 'buffer', sys.stdout)
+        reader.saveAsJSON(fp, workers=args.workers, bzip2=True)
     else:
-        fp = open(args.json, 'w') if args.json else sys.stdout
+        if args.bzip2:
+            fp = bz2file.BZ2File(args.json or sys.stdout, 'w')
+        else:
+            fp = open(args.json, 'w') if args.json else sys.stdout
+        reader.saveAsJSON(fp, writeBytes=args.bzip2, workers=args.workers)
 
-    reader = DiamondTabularFormatReader(args.diamond)
-    reader.saveAsJSON(fp, writeBytes=args.bzip2)
     fp.close()
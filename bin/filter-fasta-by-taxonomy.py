@@ -14,9 +14,11 @@ in the NCBI reference sequence files. E.g. at
 ftp://ftp.ncbi.nih.gov/refseq/release/viral
 
 You must have the NCBI taxonomy database installed locally for this code to
-succeed.  See the file doc/taxonomy.md for instructions on how to set that up.
-If you see sequences unexpectedly rejected because they have no associated
-taxonomy, make sure you have the latest taxonomy files loaded into MySQL.
+succeed, either in MySQL or in an sqlite3 file made by
+make-taxonomy-database.py (use --taxonomyDatabase to give its name).  See the
+file doc/taxonomy.md for instructions on how to set that up.  If you see
+sequences unexpectedly rejected because they have no associated taxonomy, make
+sure you have the latest taxonomy files loaded into your database.
 """
 
 from __future__ import print_function
@@ -26,7 +28,7 @@ import argparse
 import re
 
 from dark.fasta import FastaReads
-from dark.taxonomy import LineageFetcher
+from dark.taxonomy import LineageFetcher, LocalLineageFetcher
 
 
 def writeDetails(accept, readId, taxonomy, fp):
@@ -63,6 +65,12 @@ if __name__ == '__main__':
         '--detailsFile', metavar='FILE', default=None,
         help='The name of a file to save taxonomy details to')
 
+    parser.add_argument(
+        '--taxonomyDatabase', metavar='FILE', default=None,
+        help=('The sqlite3 taxonomy database (made by '
+              'make-taxonomy-database.py) to use. If not given, the MySQL '
+              'taxonomy database is used.'))
+
     args = parser.parse_args()
 
     try:
@@ -80,7 +88,10 @@ if __name__ == '__main__':
         detailsFp = None
         details = lambda accept, readId, taxonomy: None
 
-    lineageFetcher = LineageFetcher()
+    if args.taxonomyDatabase is None:
+        lineageFetcher = LineageFetcher()
+    else:
+        lineageFetcher = LocalLineageFetcher(args.taxonomyDatabase)
     reads = FastaReads(sys.stdin)
     save = sys.stdout.write
     readCount = saveCount = noTaxonomyCount = 0
@@ -94,6 +94,12 @@ if __name__ == '__main__':
         help='a string of the taxonomic group on which should be '
         'filtered. eg "Vira" will filter on viruses.')
 
+    parser.add_argument(
+        '--taxonomyDatabase', metavar='FILE', default=None,
+        help=('the sqlite3 taxonomy database (made by '
+              'make-taxonomy-database.py) to use for --taxonomy. If not '
+              'given, the MySQL taxonomy database is used.'))
+
     # Args for filtering on TitlesAlignments.
     parser.add_argument(
         '--minMatchingReads', type=int, default=None,
@@ -138,7 +144,8 @@ if __name__ == '__main__':
         titleRegex=args.titleRegex,
         negativeTitleRegex=args.negativeTitleRegex,
         truncateTitlesAfter=args.truncateTitlesAfter,
-        taxonomy=args.taxonomy)
+        taxonomy=args.taxonomy,
+        taxonomyDatabase=args.taxonomyDatabase)
 
     reads = Reads()
 
@@ -136,6 +136,12 @@ if __name__ == '__main__':
         help=('the taxonomic group that subjects must match '
               'E.g., "Vira" will filter on viruses.'))
 
+    parser.add_argument(
+        '--taxonomyDatabase', metavar='FILE', default=None,
+        help=('the sqlite3 taxonomy database (made by '
+              'make-taxonomy-database.py) to use for --taxonomy. If not '
+              'given, the MySQL taxonomy database is used.'))
+
     args = parser.parse_args()
 
     # Flatten lists of lists that we get from using both nargs='+' and
@@ -193,7 +199,8 @@ if __name__ == '__main__':
         scoreCutoff=args.scoreCutoff,
         whitelist=whitelist, blacklist=blacklist,
         titleRegex=args.titleRegex, negativeTitleRegex=args.negativeTitleRegex,
-        truncateTitlesAfter=args.truncateTitlesAfter, taxonomy=args.taxonomy)
+        truncateTitlesAfter=args.truncateTitlesAfter, taxonomy=args.taxonomy,
+        taxonomyDatabase=args.taxonomyDatabase)
 
     format_ = 'fasta' if args.fasta else 'fastq'
     write = sys.stdout.write
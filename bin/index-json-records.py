@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""
+Make indices of the records in our JSON BLAST or DIAMOND files (which may be
+compressed with bzip2), so the record for a read, or a range of records, can
+be read without reading the records before it. An index is saved next to its
+JSON file, with a .dark-index.sqlite3 suffix. See dark/jsonindex.py.
+
+Indices are also made automatically when they are first needed, so running
+this is optional.
+"""
+
+from __future__ import print_function
+
+import sys
+from time import time
+
+from dark.jsonindex import JSONRecordIndex
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Index the records in JSON BLAST or DIAMOND files.')
+
+    parser.add_argument(
+        'json', metavar='JSON-file', nargs='+',
+        help=('The JSON files to index. These may be compressed with bzip2 '
+              '(and must then have a .bz2 suffix).'))
+
+    parser.add_argument(
+        '--force', default=False, action='store_true',
+        help='If True, remake indices even if they are up to date.')
+
+    parser.add_argument(
+        '--quiet', default=False, action='store_true',
+        help='If True do not print progress.')
+
+    args = parser.parse_args()
+
+    verbose = not args.quiet
+
+    for filename in args.json:
+        index = JSONRecordIndex(filename)
+        if index.isCurrent() and not args.force:
+            if verbose:
+                print('%s: index is up to date.' % filename, file=sys.stderr)
+            continue
+
+        start = time()
+        try:
+            count = index.make()
+        except (EnvironmentError, ValueError) as e:
+            print('%s: could not make index: %s' % (filename, e),
+                  file=sys.stderr)
+            sys.exit(1)
+
+        if verbose:
+            print('%s: indexed %d records in %.2f seconds.' %
+                  (filename, count, time() - start), file=sys.stderr)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+Make an sqlite3 taxonomy database from the NCBI taxonomy files, for use with
+the --taxonomyDatabase option of filter-fasta-by-taxonomy.py (and other
+scripts that filter on taxonomy). See doc/taxonomy.md for where to get the
+input files.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+from time import time
+from itertools import chain
+
+from dark.taxonomy import makeLocalTaxonomyDatabase
+from dark.utils import asHandle
+
+
+def openFiles(filenames):
+    """
+    Open (possibly compressed) files, one at a time.
+
+    @param filenames: A C{list} of C{str} file names.
+    @return: A generator that yields open files. Each file is closed when
+        the next one is requested.
+    """
+    for filename in filenames:
+        with asHandle(filename) as fp:
+            yield fp
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Create an sqlite3 database from NCBI taxonomy files.')
+
+    parser.add_argument(
+        '--out', required=True,
+        help=('the output file. This file must not exist (use --force to '
+              'overwrite).'))
+
+    parser.add_argument(
+        '--force', default=False, action='store_true',
+        help='If True and the output file already exists, overwrite it.')
+
+    parser.add_argument(
+        '--quiet', default=False, action='store_true',
+        help='If True do not print progress.')
+
+    parser.add_argument(
+        '--nodes', metavar='nodes.dmp', required=True,
+        help='the NCBI taxonomy nodes.dmp file.')
+
+    parser.add_argument(
+        '--names', metavar='names.dmp', required=True,
+        help='the NCBI taxonomy names.dmp file.')
+
+    parser.add_argument(
+        '--giTaxid', metavar='gi_taxid-file', nargs='+', action='append',
+        default=[],
+        help=('NCBI gi_taxid_*.dmp file(s) mapping gi numbers to taxonomy '
+              'ids. These may be compressed, with a .gz or .bz2 suffix.'))
+
+    parser.add_argument(
+        '--accessionTaxid', metavar='accession2taxid-file', nargs='+',
+        action='append', default=[],
+        help=('NCBI *.accession2taxid file(s) mapping accessions (and '
+              'possibly gi numbers) to taxonomy ids. These may be '
+              'compressed, with a .gz or .bz2 suffix.'))
+
+    args = parser.parse_args()
+
+    if os.path.exists(args.out):
+        if args.force:
+            os.unlink(args.out)
+        else:
+            print("Output file '%s' already exists. Use --force to overwrite."
+                  % args.out, file=sys.stderr)
+            sys.exit(1)
+
+    # Flatten the lists of lists that we get from using both nargs='+' and
+    # action='append'. See make-fasta-database.py for why we use both.
+    giTaxidFiles = list(chain.from_iterable(args.giTaxid))
+    accessionTaxidFiles = list(chain.from_iterable(args.accessionTaxid))
+
+    if not (giTaxidFiles or accessionTaxidFiles):
+        print('At least one --giTaxid or --accessionTaxid file must be given.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    verbose = not args.quiet
+
+    if verbose:
+        print("Making '%s' ... " % args.out, end='', file=sys.stderr)
+        start = time()
+
+    with asHandle(args.nodes) as nodesFp, asHandle(args.names) as namesFp:
+        nodeCount, giCount, accessionCount = makeLocalTaxonomyDatabase(
+            args.out, nodesFp, namesFp, openFiles(giTaxidFiles),
+            openFiles(accessionTaxidFiles))
+
+    if verbose:
+        elapsed = time() - start
+        print('stored %d taxonomy nodes, %d gi numbers and %d accessions in '
+              '%.2f seconds.' % (nodeCount, giCount, accessionCount, elapsed),
+              file=sys.stderr)
@@ -24,10 +24,11 @@ matplotlib.use('PDF')
 # These imports are here because dark.graphics imports matplotlib.pyplot
 # and we need to set the matplotlib backend (see above) before that import
 # happens. So please don't move these imports higher in this file.
-from dark.titles import TitlesAlignments
-from dark.fasta import FastaReads
+from dark.titles import TitlesAlignments, TitlesSummary
+from dark.fasta import FastaReads, IndexedFasta
 from dark.fastq import FastqReads
 from dark.graphics import DEFAULT_LOG_LINEAR_X_AXIS_BASE, alignmentPanelHTML
+from dark.snapshot import snapshotTitlesAlignments
 from dark.utils import numericallySortFilenames
 
 
@@ -194,6 +195,12 @@ if __name__ == '__main__':
         help=('a string of the taxonomic group on which should be '
               'filtered. eg "Vira" will filter on viruses.'))
 
+    parser.add_argument(
+        '--taxonomyDatabase', metavar='FILE', default=None,
+        help=('the sqlite3 taxonomy database (made by '
+              'make-taxonomy-database.py) to use for --taxonomy. If not '
+              'given, the MySQL taxonomy database is used.'))
+
     # Args for filtering on TitlesAlignments.
     parser.add_argument(
         '--minMatchingReads', type=int, default=None,
@@ -215,6 +222,13 @@ if __name__ == '__main__':
               'from all previously seen read sets in order to be considered '
               'acceptably different.'))
 
+    parser.add_argument(
+        '--minHashBands', type=int, default=None,
+        help=('With --minNewReads, the number of MinHash bands to use to find '
+              'the previously seen read sets to compare with. This is faster '
+              'when there are very many titles, but approximate (some '
+              'titles that would be rejected may be accepted).'))
+
     parser.add_argument(
         '--maxTitles', type=int, default=None,
         help=('The maximum number of titles to keep. If more titles than '
@@ -278,7 +292,8 @@ if __name__ == '__main__':
         '--showOrfs', default=False, action='store_true',
         help=('If specified, show subject ORFs in the individual panel plots. '
               'Use of this option requires that you also provide information '
-              'about the subject database, e.g., via --databaseFastaFilename.')
+              'about the subject database, e.g., via '
+              '--databaseFastaFilename.'))
 
     parser.add_argument(
         '--sortFilenames', default=False, action='store_true',
@@ -292,8 +307,55 @@ if __name__ == '__main__':
               'the results in the files from HTCondor does not match the '
               'order of sequences in the FASTA/Q file.'))
 
+    parser.add_argument(
+        '--snapshot', metavar='FILE',
+        help=('A file to save the matched titles and their alignments to, '
+              'before they are filtered by the title filtering options '
+              '(e.g., --minMatchingReads or --maxTitles). If the file '
+              'already exists and was made from the same FASTA/Q and JSON '
+              'files (with unchanged sizes and modification times) and the '
+              'same read filtering options, the titles and alignments are '
+              'loaded from it instead of being read again. This makes it '
+              'fast to re-run with different title filtering or sorting.'))
+
+    parser.add_argument(
+        '--workers', type=int, default=1, metavar='N',
+        help=('The number of processes to use to read the JSON files (if '
+              'there are several). The reads are looked up by id, so the '
+              'JSON files need not be in the order of the reads. Not used '
+              'with --summaryOnly, --truncateTitlesAfter, or --taxonomy.'))
+
+    parser.add_argument(
+        '--lazyReads', default=False, action='store_true',
+        help=('Do not keep the sequences of the matched reads in memory. '
+              'Instead, look them up (using an index that is saved next to '
+              'the FASTA file) when they are needed. Can only be used with '
+              'a single --fasta file.'))
+
+    parser.add_argument(
+        '--summaryOnly', default=False, action='store_true',
+        help=('Only print the summary of the interesting titles (implies '
+              '--earlyExit). The alignments are read once and only summary '
+              'information for each title is kept, so far less memory is '
+              'used. Cannot be used with --minNewReads or --snapshot.'))
+
+    parser.add_argument(
+        '--approximateMedian', default=False, action='store_true',
+        help=('With --summaryOnly, estimate the median score of each title '
+              'instead of keeping all scores to find it exactly.'))
+
     args = parser.parse_args()
 
+    if args.summaryOnly:
+        if args.minNewReads is not None or args.snapshot:
+            print('--summaryOnly cannot be used with --minNewReads or '
+                  '--snapshot.', file=sys.stderr)
+            sys.exit(1)
+    elif args.approximateMedian:
+        print('--approximateMedian can only be used with --summaryOnly.',
+              file=sys.stderr)
+        sys.exit(1)
+
     # Flatten lists of lists that we get from using both nargs='+' and
     # action='append'. We use both because it allows people to use (e.g.)
     # --json on the command line either via "--json file1 --json file2" or
@@ -322,6 +384,15 @@ if __name__ == '__main__':
             files = list(chain.from_iterable(args.fastq))
         reads = FastqReads(files)
 
+    if args.lazyReads:
+        if not args.fasta or len(files) != 1:
+            print('--lazyReads can only be used with a single --fasta file.',
+                  file=sys.stderr)
+            sys.exit(1)
+        readIndex = IndexedFasta(files[0])
+    else:
+        readIndex = None
+
     if args.matcher == 'blast':
         from dark.blast.alignments import BlastReadsAlignments
         readsAlignments = BlastReadsAlignments(
@@ -370,14 +441,30 @@ if __name__ == '__main__':
         scoreCutoff=args.scoreCutoff,
         whitelist=whitelist, blacklist=blacklist,
         titleRegex=args.titleRegex, negativeTitleRegex=args.negativeTitleRegex,
-        truncateTitlesAfter=args.truncateTitlesAfter, taxonomy=args.taxonomy)
+        truncateTitlesAfter=args.truncateTitlesAfter, taxonomy=args.taxonomy,
+        taxonomyDatabase=args.taxonomyDatabase)
+
+    if args.summaryOnly:
+        titlesAlignments = TitlesSummary(
+            readsAlignments, exactMedian=not args.approximateMedian)
+    elif args.snapshot:
+        titlesAlignments, loaded = snapshotTitlesAlignments(
+            readsAlignments, chain(files, jsonFiles), args.snapshot,
+            workers=args.workers, readIndex=readIndex)
+        if loaded:
+            print('Loaded titles and alignments from %r.' % args.snapshot,
+                  file=sys.stderr)
+    else:
+        titlesAlignments = TitlesAlignments(
+            readsAlignments, workers=args.workers, readIndex=readIndex)
 
-    titlesAlignments = TitlesAlignments(readsAlignments).filter(
+    titlesAlignments = titlesAlignments.filter(
         minMatchingReads=args.minMatchingReads,
         minMedianScore=args.minMedianScore,
         withScoreBetterThan=args.withScoreBetterThan,
         minNewReads=args.minNewReads, maxTitles=args.maxTitles,
-        sortOn=args.sortOn, minCoverage=args.minCoverage)
+        sortOn=args.sortOn, minCoverage=args.minCoverage,
+        minHashBands=args.minHashBands)
 
     nTitles = len(titlesAlignments)
     print('Found %d interesting title%s.' %
@@ -386,7 +473,7 @@ if __name__ == '__main__':
     if nTitles:
         print(titlesAlignments.tabSeparatedSummary(sortOn=args.sortOn))
 
-    if args.earlyExit:
+    if args.earlyExit or args.summaryOnly:
         sys.exit(0)
 
     if nTitles == 0:
@@ -1,25 +1,37 @@
 #!/usr/bin/env python
 
 """
-Read simplified XML BLAST records and report the elapsed time.
+Read XML BLAST records and report the elapsed time.
 """
 
 from __future__ import print_function
 
-from Bio.Blast import NCBIXML
+import argparse
 from time import time
-import sys
+
+from dark.blast.conversion import XMLRecordsReader
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage: %s file.json' % sys.argv[0], file=sys.stderr)
-        sys.exit(1)
-    else:
-        start = time()
-        with open(sys.argv[1]) as fp:
-            for count, record in enumerate(NCBIXML.parse(fp)):
-                pass
-        elapsed = time() - start
-        print('Read %d XML BLAST records in %.3f secs (%.0f records/sec)' % (
-            count, elapsed, float(count) / float(elapsed)))
+    parser = argparse.ArgumentParser(
+        description='Read XML BLAST records and report the elapsed time.')
+
+    parser.add_argument(
+        'xml', metavar='BLAST-XML-file',
+        help='the BLAST XML output file to read.')
+
+    parser.add_argument(
+        '--biopython', default=False, action='store_true',
+        help=('If True, use the (much slower) BioPython XML parser instead of '
+              'our streaming parser.'))
+
+    args = parser.parse_args()
+
+    start = time()
+    reader = XMLRecordsReader(args.xml, useBiopython=args.biopython)
+    count = 0
+    for count, record in enumerate(reader.dictRecords(), start=1):
+        pass
+    elapsed = time() - start
+    print('Read %d XML BLAST records in %.3f secs (%.0f records/sec)' % (
+        count, elapsed, float(count) / float(elapsed)))
@@ -1,6 +1,8 @@
 import re
 
-from dark.taxonomy import LineageFetcher
+from six.moves import intern
+
+from dark.taxonomy import LineageFetcher, LocalLineageFetcher
 from dark.filter import TitleFilter
 from dark.score import HigherIsBetterScore
 
@@ -21,6 +23,63 @@ def bestAlignment(readAlignments):
     return max(readAlignments, key=lambda alignment: alignment.hsps[0])
 
 
+class SubjectTitles(object):
+    """
+    Intern subject titles and give each distinct title a small C{int} id.
+
+    The same subject titles are found in very many alignments. Keeping
+    just one copy of each title saves a lot of memory, and the ids can be
+    used (instead of the titles) as keys or array indices when making
+    per-subject decisions.
+    """
+    def __init__(self):
+        self._ids = {}
+        self._titles = []
+
+    def __len__(self):
+        return len(self._titles)
+
+    def add(self, title):
+        """
+        Add a title (if it has not already been added).
+
+        @param title: A C{str} subject title.
+        @return: A 2-tuple with the interned C{str} title and its C{int} id.
+        """
+        try:
+            subjectId = self._ids[title]
+        except KeyError:
+            # On Python 2, titles read from JSON are unicode, which cannot
+            # be interned. The dict still keeps just one copy of them.
+            if isinstance(title, str):
+                title = intern(title)
+            subjectId = self._ids[title] = len(self._titles)
+            self._titles.append(title)
+            return title, subjectId
+        else:
+            return self._titles[subjectId], subjectId
+
+    def id(self, title):
+        """
+        Get the id of a title.
+
+        @param title: A C{str} subject title.
+        @raise KeyError: If C{title} has not been added.
+        @return: The C{int} id of C{title}.
+        """
+        return self._ids[title]
+
+    def title(self, subjectId):
+        """
+        Get the title with a given id.
+
+        @param subjectId: An C{int} subject id.
+        @raise IndexError: If there is no title with id C{subjectId}.
+        @return: The C{str} title with id C{subjectId}.
+        """
+        return self._titles[subjectId]
+
+
 class Alignment(object):
     """
     Hold information about a read alignment.
@@ -29,11 +88,14 @@ class Alignment(object):
         against.
     @param subjectTitle: The C{str} title of the sequence a read matched
         against.
+    @param subjectId: The C{int} id of C{subjectTitle} in a L{SubjectTitles}
+        instance, or C{None} if the title has no id.
     """
 
-    def __init__(self, subjectLength, subjectTitle):
+    def __init__(self, subjectLength, subjectTitle, subjectId=None):
         self.subjectLength = subjectLength
         self.subjectTitle = subjectTitle
+        self.subjectId = subjectId
         self.hsps = []
 
     def addHsp(self, hsp):
@@ -58,6 +120,20 @@ class ReadAlignments(list):
         self.read = read
         if alignments:
             self.extend(alignments)
+            self._setReadHolder()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setReadHolder()
+
+    def _setReadHolder(self):
+        """
+        Tell our HSPs that we hold their read (see
+        L{dark.hsp.HSP.setReadHolder}).
+        """
+        for alignment in self:
+            for hsp in alignment.hsps:
+                hsp.setReadHolder(self)
 
 
 class ReadsAlignmentsParams(object):
@@ -120,6 +196,9 @@ class ReadsAlignmentsFilter(object):
         viruses, while 11118 will filter on Coronaviridae.
     @param readIdRegex: A case-sensitive regex C{str} that read ids must
         match.
+    @param taxonomyDatabase: The C{str} file name of a local sqlite3 taxonomy
+        database (as made by make-taxonomy-database.py) to use when filtering
+        on C{taxonomy}. If C{None}, the MySQL taxonomy database is used.
     @return: C{self}.
     """
     def __init__(self, limit=None, maxAlignmentsPerRead=None,
@@ -128,7 +207,8 @@ class ReadsAlignmentsFilter(object):
                  oneAlignmentPerRead=False, maxHspsPerHit=None,
                  scoreCutoff=None, whitelist=None, blacklist=None,
                  titleRegex=None, negativeTitleRegex=None,
-                 truncateTitlesAfter=None, taxonomy=None, readIdRegex=None):
+                 truncateTitlesAfter=None, taxonomy=None, readIdRegex=None,
+                 taxonomyDatabase=None):
 
         self.limit = limit
         self.maxAlignmentsPerRead = maxAlignmentsPerRead
@@ -152,10 +232,16 @@ class ReadsAlignmentsFilter(object):
             self.titleFilter = None
 
         if taxonomy is not None:
-            self.lineageFetcher = LineageFetcher()
+            if taxonomyDatabase is None:
+                self.lineageFetcher = LineageFetcher()
+            else:
+                self.lineageFetcher = LocalLineageFetcher(taxonomyDatabase)
         else:
             self.lineageFetcher = None
         self.taxonomy = taxonomy
+        # Taxonomy decisions, keyed by subject id (or by title, for
+        # alignments whose titles have no id).
+        self._taxonomyDecisions = {}
 
         if readIdRegex is None:
             self.readIdRegex = None
@@ -245,16 +331,18 @@ class ReadsAlignmentsFilter(object):
         if self.taxonomy is not None:
             wantedAlignments = []
             for alignment in readAlignments:
-                lineage = self.lineageFetcher.lineage(alignment.subjectTitle)
-                if lineage:
-                    for taxonomyIdAndScientificName in lineage:
-                        if self.taxonomy in taxonomyIdAndScientificName:
-                            wantedAlignments.append(alignment)
-                else:
-                    # No lineage info was found. Keep the alignment
-                    # since we can't rule it out.  We could add another
-                    # option to control this.
-                    wantedAlignments.append(alignment)
+                # The number of times to keep the alignment. Note that an
+                # alignment is (perhaps unintentionally) kept once for each
+                # element of its lineage that matches the wanted taxonomy.
+                key = alignment.subjectId
+                if key is None:
+                    key = alignment.subjectTitle
+                try:
+                    count = self._taxonomyDecisions[key]
+                except KeyError:
+                    count = self._taxonomyDecisions[key] = (
+                        self._taxonomyCount(alignment.subjectTitle))
+                wantedAlignments.extend([alignment] * count)
             if wantedAlignments:
                 readAlignments[:] = wantedAlignments
             else:
@@ -317,6 +405,118 @@ class ReadsAlignmentsFilter(object):
         self.count += 1
         return readAlignments
 
+    def _taxonomyCount(self, title):
+        """
+        Find how many elements of the lineage of a title match our taxonomy.
+
+        @param title: A C{str} subject title.
+        @return: The C{int} number of elements of the lineage of C{title}
+            that match C{self.taxonomy}, or 1 if no lineage was found. In
+            the latter case we keep the alignment since we can't rule it
+            out. We could add another option to control this.
+        """
+        lineage = self.lineageFetcher.lineage(title)
+        if lineage:
+            return sum(self.taxonomy in taxonomyIdAndScientificName
+                       for taxonomyIdAndScientificName in lineage)
+        else:
+            return 1
+
+    def filterRecord(self, readId, record, scoreClass):
+        """
+        Apply the cheap parts of this filter to a raw (JSON-decoded) record
+        before any C{Alignment} or HSP instances are made from it. This
+        allows readers to avoid building objects for alignments (or whole
+        reads) that C{self.filter} would throw away.
+
+        The checks made here are a subset of those made by C{self.filter}
+        and are made in the same order, so the (stateful) title filter sees
+        exactly the titles it would have seen. The C{ReadAlignments} built
+        from the returned record must still be passed to C{self.filter}
+        (which will then not remove anything this method did not already
+        remove, except via the filtering that is not done here).
+
+        @param readId: The C{str} id of the read the record is for.
+        @param record: A C{dict} with 'alignments' and 'query' keys, as
+            produced by our BLAST and DIAMOND JSON conversion code.
+        @param scoreClass: The score class (see score.py) used by the reader.
+            If this is C{HigherIsBetterScore}, HSP scores are taken from the
+            'bits' key of the HSP dicts, else from the 'expect' key.
+        @return: C{False} if the read will be rejected by C{self.filter},
+            else a C{dict} record, holding only the wanted alignments and
+            HSPs (the passed C{record} is returned unchanged if nothing was
+            removed).
+        """
+        if self.limit is not None and self.count == self.limit:
+            return False
+
+        alignments = record['alignments']
+
+        if (self.maxAlignmentsPerRead is not None and
+                len(alignments) > self.maxAlignmentsPerRead):
+            return False
+
+        if self.readIdRegex and self.readIdRegex.search(readId) is None:
+            return False
+
+        if self.titleFilter:
+            accept = self.titleFilter.accept
+            alignments = [alignment for alignment in alignments
+                          if accept(alignment['title']) != TitleFilter.REJECT]
+            if not alignments:
+                return False
+
+        minSequenceLen = self.minSequenceLen
+        maxSequenceLen = self.maxSequenceLen
+        if minSequenceLen is not None or maxSequenceLen is not None:
+            alignments = [
+                alignment for alignment in alignments
+                if not ((minSequenceLen is not None and
+                         alignment['length'] < minSequenceLen) or
+                        (maxSequenceLen is not None and
+                         alignment['length'] > maxSequenceLen))]
+            if not alignments:
+                return False
+
+        # HSP score filtering can only be done here if it is not preceded
+        # (in self.filter) by the choice of a best alignment, because that
+        # choice is made on the basis of the unfiltered HSPs. Alignments
+        # without a wanted HSP are removed, but (because taxonomy filtering
+        # is not done here) we only reject the whole read if no alignment
+        # survives, which is also what self.filter would do.
+        if self.scoreCutoff is not None and not self.oneAlignmentPerRead:
+            if scoreClass is HigherIsBetterScore:
+                scoreKey = 'bits'
+            else:
+                scoreKey = 'expect'
+            scoreCutoff = self.scoreCutoff
+            maxHspsPerHit = self.maxHspsPerHit
+            wantedAlignments = []
+            for alignment in alignments:
+                hsps = alignment['hsps']
+                if maxHspsPerHit is not None:
+                    hsps = hsps[:maxHspsPerHit]
+                wantedHsps = [hsp for hsp in hsps if
+                              scoreClass(hsp[scoreKey]).betterThan(
+                                  scoreCutoff)]
+                if wantedHsps:
+                    if len(wantedHsps) == len(alignment['hsps']):
+                        wantedAlignments.append(alignment)
+                    else:
+                        wantedAlignment = dict(alignment)
+                        wantedAlignment['hsps'] = wantedHsps
+                        wantedAlignments.append(wantedAlignment)
+            if not wantedAlignments:
+                return False
+            alignments = wantedAlignments
+
+        if alignments is record['alignments']:
+            return record
+        else:
+            result = dict(record)
+            result['alignments'] = alignments
+            return result
+
     def close(self):
         """
         Close our lineage fetcher, if any.
@@ -325,6 +525,76 @@ class ReadsAlignmentsFilter(object):
             self.lineageFetcher.close()
 
 
+def lookupRead(readIndex, queryId):
+    """
+    Find the read for the query id in a BLAST or DIAMOND record.
+
+    If the query id is not in the index, and has more than one word, its
+    first word is looked up (the read id may have been truncated where the
+    query id was not). Indexes such as L{ReadIdIndex} and
+    L{dark.fasta.IndexedFasta} also find a read whose id has the query id as
+    its first word.
+
+    @param readIndex: A C{dict}-like object that returns the L{Read} with a
+        given id.
+    @param queryId: The C{str} query id.
+    @raise KeyError: If no read can be found.
+    @return: A L{dark.reads.Read} instance.
+    """
+    try:
+        return readIndex[queryId]
+    except KeyError:
+        words = queryId.split()
+        if len(words) > 1:
+            return readIndex[words[0]]
+        raise
+
+
+class ReadIdIndex(object):
+    """
+    Provide dictionary-like access to reads, given the query id found in a
+    BLAST or DIAMOND record.
+
+    This can be given (as C{readIndex}) to the L{ReadsAlignments}
+    subclasses, so that the records in their result files do not have to be
+    in the order of the reads.
+
+    @param reads: An iterable of L{dark.reads.Read} instances.
+    """
+    def __init__(self, reads):
+        self._reads = {}
+        self._firstWords = {}
+        for read in reads:
+            self._reads[read.id] = read
+            self._firstWords.setdefault(read.id.split()[0], read)
+
+    def __len__(self):
+        return len(self._reads)
+
+    def __getitem__(self, id_):
+        """
+        Find a read, given a query id.
+
+        As when matching reads and records in order, the query id in a record
+        may be just the first word of the read id (some tools truncate read
+        ids) or the read id may be the first word of the query id.
+
+        @param id_: A C{str} query id.
+        @raise KeyError: If no read has id C{id_}.
+        @return: A L{dark.reads.Read} instance.
+        """
+        read = self._reads.get(id_)
+        if read is None:
+            read = self._firstWords.get(id_)
+        if read is None:
+            words = id_.split()
+            if words:
+                read = self._reads.get(words[0])
+            if read is None:
+                raise KeyError(id_)
+        return read
+
+
 class ReadsAlignments(object):
     """
     Provide for filtering for a collection of reads and their alignments.
@@ -342,13 +612,23 @@ class ReadsAlignments(object):
     @param scoreClass: A class to hold and compare scores (see scores.py).
         Default is C{HigherIsBetterScore}, for comparing bit scores. If you
         are using e.g., BLAST e-values, pass LowerIsBetterScore instead.
+    @param subjectTitles: A L{SubjectTitles} instance to use to intern and
+        number the subject titles of alignments. If C{None}, a new one will
+        be made.
+    @ivar filterKwargs: A C{list} of the C{dict} keyword arguments given to
+        C{filter}, in the order the filters were added.
     """
 
-    def __init__(self, reads, params, scoreClass=HigherIsBetterScore):
+    def __init__(self, reads, params, scoreClass=HigherIsBetterScore,
+                 subjectTitles=None):
         self.reads = reads
         self.params = params
         self.scoreClass = scoreClass
+        self.subjectTitles = (SubjectTitles() if subjectTitles is None
+                              else subjectTitles)
+        self.filterKwargs = []
         self._filters = []
+        self._recordFilter = None
 
     def getSubjectSequence(self, title):
         """
@@ -366,6 +646,57 @@ class ReadsAlignments(object):
         raise NotImplementedError('getSubjectSequence must be implemented by '
                                   'a subclass')
 
+    def resultFilenames(self):
+        """
+        Get the names of the result files the alignments are read from.
+
+        @return: A C{list} of C{str} file names, in the order they are read.
+            This is empty if the alignments are not read from files.
+        """
+        return []
+
+    def readerOptions(self):
+        """
+        Get the options given to our subclass that change the alignments
+        that are read or how they are treated (e.g., for use in
+        L{dark.snapshot.fingerprint}).
+
+        @return: A C{dict} of option names and (JSON-serializable) values.
+        """
+        return {}
+
+    def readIdIndex(self):
+        """
+        Get an index to look up our reads by (query) id.
+
+        @return: The C{readIndex} given to our subclass, if any, else a new
+            L{ReadIdIndex} of our reads.
+        """
+        readIndex = getattr(self, '_readIndex', None)
+        return ReadIdIndex(self.reads) if readIndex is None else readIndex
+
+    def forFiles(self, filenames, readIndex):
+        """
+        Make a copy of this instance that reads the alignments in just some
+        of our result files (with the same parameters, score class, subject
+        titles, and filters), finding their reads by id.
+
+        The copy does not yield reads that have no alignments, since they
+        may have alignments in another shard of the result files.
+
+        Must be implemented by a subclass, e.g., see
+        L{blast.alignments.BlastReadsAlignments}.
+
+        @param filenames: A C{list} of C{str} file names, each of which must
+            be one of those returned by C{resultFilenames}.
+        @param readIndex: A L{ReadIdIndex} (or similar) instance to look up
+            the reads in the records by id.
+        @raise NotImplementedError: This method must be implemented by a
+            subclass.
+        """
+        raise NotImplementedError('forFiles must be implemented by a '
+                                  'subclass')
+
     def hsps(self):
         """
         Provide access to all HSPs for all alignments of all reads.
@@ -411,9 +742,28 @@ class ReadsAlignments(object):
         """
         Add a filter to this C{readsAlignments}.
 
+        Only the first filter sees the unfiltered alignments of each read,
+        so (cheap) parts of it are also handed to readers (via
+        C{recordFilter}) so they can discard unwanted alignments before
+        making objects for them.
+
         @param kwargs: Keyword arguments, as accepted by
             C{ReadsAlignmentsFilter}.
         @return: C{self}
         """
-        self._filters.append(ReadsAlignmentsFilter(**kwargs).filter)
+        readsAlignmentsFilter = ReadsAlignmentsFilter(**kwargs)
+        self.filterKwargs.append(kwargs)
+        if not self._filters:
+            self._recordFilter = readsAlignmentsFilter.filterRecord
+        self._filters.append(readsAlignmentsFilter.filter)
         return self
+
+    def recordFilter(self):
+        """
+        Get a function that readers can use to filter raw records before
+        converting them to C{ReadAlignments}.
+
+        @return: C{None} if there is no filtering to do, else a function
+            with the signature of C{ReadsAlignmentsFilter.filterRecord}.
+        """
+        return self._recordFilter
@@ -3,15 +3,20 @@ from math import log10
 import copy
 
 from dark.score import HigherIsBetterScore
-from dark.alignments import ReadsAlignments, ReadsAlignmentsParams
-from dark.blast.conversion import JSONRecordsReader
+from dark.alignments import (
+    ReadAlignments, ReadsAlignments, ReadsAlignmentsParams, SubjectTitles)
+from dark.blast.conversion import JSONRecordsReader, TabularRecordsReader
 from dark.blast.params import checkCompatibleParams
-from dark.fasta import FastaReads, SqliteIndex
+from dark.fasta import SqliteIndex, fastaIndex
 from dark.reads import AARead, DNARead
 from dark.utils import numericallySortFilenames
 
 ZERO_EVALUE_UPPER_RANDOM_INCREMENT = 150
 
+# File name suffixes for BLAST tabular output.
+TABULAR_SUFFIXES = ('.tsv', '.tab', '.tsv.gz', '.tab.gz', '.tsv.bz2',
+                    '.tab.bz2')
+
 
 class BlastReadsAlignments(ReadsAlignments):
     """
@@ -19,15 +24,21 @@ class BlastReadsAlignments(ReadsAlignments):
 
     @param reads: A L{dark.reads.Reads} instance providing the sequences that
         were given to BLAST as queries. Note that the order of the reads
-        *MUST* match the order of the records in the BLAST output files.
+        *MUST* match the order of the records in the BLAST output files,
+        unless C{readIndex} is given.
     @param blastFilenames: Either a single C{str} filename or a C{list} of
-        C{str} file names containing BLAST output. Files can either be XML
-        (-outfmt 5) BLAST output file or our smaller (possibly bzip2
-        compressed) converted JSON equivalent produced by
-        C{bin/convert-blast-xml-to-json.py} from a BLAST XML file.
+        C{str} file names containing BLAST output. Files can either be our
+        (possibly bzip2 compressed) JSON produced by
+        C{bin/convert-blast-xml-to-json.py} from a BLAST XML file (or by
+        C{bin/convert-blast-tabular-to-json.py}), or (possibly compressed)
+        BLAST tabular output (see
+        L{dark.blast.conversion.BlastTabularFormatReader}) with a C{.tsv} or
+        C{.tab} suffix.
     @param databaseFilename: A C{str} holding the name of the FASTA file used
         to make the BLAST database. Cannot be used with
-        C{sqliteDatabaseFilename}.
+        C{sqliteDatabaseFilename}. An index of the FASTA file is saved next
+        to it (see L{dark.fasta.IndexedFasta}) the first time a subject is
+        looked up.
     @param databaseDirectory: The directory where the FASTA file
         used to make the BLAST database can be found. This argument is only
         useful when sqliteDatabaseFilename is specified.
@@ -44,6 +55,15 @@ class BlastReadsAlignments(ReadsAlignments):
         by our HTCondor jobs.
     @param randomizeZeroEValues: If C{True}, e-values that are zero will be set
         to a random (very good) value.
+    @param readIndex: A C{dict}-like object that returns the read with a given
+        id (e.g., a L{dark.alignments.ReadIdIndex} made from C{reads}, or a
+        L{dark.fasta.IndexedFasta}). If given, the read for each BLAST record
+        is found by its query id, so the BLAST output files (and the records
+        in them) can be in any order. Reads in C{reads} that have no record
+        are yielded (with no alignments) after all records have been read.
+    @param tabularApplication: The C{str} BLAST program (e.g., 'blastn' or
+        'blastx') that made any tabular input files that have no comment
+        lines (i.e., BLAST output format 6).
     @raises ValueError: if a file type is not recognized, if the number of
         reads does not match the number of records found in the BLAST result
         files, or if BLAST parameters in all files do not match.
@@ -52,7 +72,8 @@ class BlastReadsAlignments(ReadsAlignments):
     def __init__(self, reads, blastFilenames,  databaseFilename=None,
                  databaseDirectory=None, sqliteDatabaseFilename=None,
                  scoreClass=HigherIsBetterScore,
-                 sortBlastFilenames=True, randomizeZeroEValues=True):
+                 sortBlastFilenames=True, randomizeZeroEValues=True,
+                 readIndex=None, tabularApplication='blastn'):
         if type(blastFilenames) == str:
             blastFilenames = [blastFilenames]
         if sortBlastFilenames:
@@ -64,9 +85,16 @@ class BlastReadsAlignments(ReadsAlignments):
         self._databaseDirectory = databaseDirectory
         self._subjectTitleToSubject = None
         self.randomizeZeroEValues = randomizeZeroEValues
+        self._readIndex = readIndex
+        self._tabularApplication = tabularApplication
+
+        # All readers share one subject title table, so titles are interned
+        # and numbered consistently across all input files.
+        subjectTitles = SubjectTitles()
 
         # Prepare application parameters in order to initialize self.
-        self._reader = self._getReader(self.blastFilenames[0], scoreClass)
+        self._reader = self._getReader(self.blastFilenames[0], scoreClass,
+                                       subjectTitles)
         application = self._reader.application
         blastParams = copy.deepcopy(self._reader.params)
         subjectIsNucleotides = application != 'blastx'
@@ -78,21 +106,79 @@ class BlastReadsAlignments(ReadsAlignments):
             subjectIsNucleotides=subjectIsNucleotides, scoreTitle=scoreTitle)
 
         ReadsAlignments.__init__(self, reads, applicationParams,
-                                 scoreClass=scoreClass)
+                                 scoreClass=scoreClass,
+                                 subjectTitles=subjectTitles)
 
-    def _getReader(self, filename, scoreClass):
+    def _getReader(self, filename, scoreClass, subjectTitles):
         """
-        Obtain a JSON record reader for BLAST records.
+        Obtain a JSON or tabular record reader for BLAST records.
 
-        @param filename: The C{str} file name holding the JSON.
+        @param filename: The C{str} file name holding the JSON or tabular
+            output.
         @param scoreClass: A class to hold and compare scores (see scores.py).
+        @param subjectTitles: The L{SubjectTitles} instance for the reader
+            to use.
         """
         if filename.endswith('.json') or filename.endswith('.json.bz2'):
-            return JSONRecordsReader(filename, scoreClass)
+            return JSONRecordsReader(filename, scoreClass, subjectTitles)
+        elif filename.endswith(TABULAR_SUFFIXES):
+            return TabularRecordsReader(filename, scoreClass, subjectTitles,
+                                        self._tabularApplication)
         else:
             raise ValueError(
                 'Unknown BLAST record file suffix for file %r.' % filename)
 
+    def resultFilenames(self):
+        """
+        Get the names of the BLAST files the alignments are read from.
+
+        @return: A C{list} of C{str} file names, in the order they are read.
+        """
+        return list(self.blastFilenames)
+
+    def readerOptions(self):
+        """
+        Get the options that change the alignments that are read or how they
+        are treated.
+
+        @return: A C{dict} of option names and values.
+        """
+        return {
+            'randomizeZeroEValues': self.randomizeZeroEValues,
+            'tabularApplication': self._tabularApplication,
+        }
+
+    def forFiles(self, filenames, readIndex):
+        """
+        Make a copy of this instance that reads the alignments in just some
+        of our BLAST files, finding their reads by id.
+
+        @param filenames: A non-empty C{list} of C{str} file names, each of
+            which must be one of those returned by C{resultFilenames}.
+        @param readIndex: A L{dark.alignments.ReadIdIndex} (or similar)
+            instance to look up the reads in the records by id.
+        @raise ValueError: If the BLAST parameters in the first of
+            C{filenames} are not compatible with those in our first file.
+        @return: A L{BlastReadsAlignments} instance.
+        """
+        result = copy.copy(self)
+        result.blastFilenames = filenames
+        result.reads = []
+        result._readIndex = readIndex
+        # Our own reader may already have been (partly) read, so the copy
+        # always gets a new one.
+        result._reader = self._getReader(filenames[0], self.scoreClass,
+                                         self.subjectTitles)
+        if filenames[0] != self.blastFilenames[0]:
+            differences = checkCompatibleParams(
+                self.params.applicationParams, result._reader.params)
+            if differences:
+                raise ValueError(
+                    'Incompatible BLAST parameters found. The parameters '
+                    'in %s differ from those originally found in %s. %s' %
+                    (filenames[0], self.blastFilenames[0], differences))
+        return result
+
     def iter(self):
         """
         Extract BLAST records and yield C{ReadAlignments} instances.
@@ -110,6 +196,11 @@ class BlastReadsAlignments(ReadsAlignments):
         count = 0
         reader = self._reader
         reads = iter(self.reads)
+        recordFilter = self.recordFilter()
+        readIndex = self._readIndex
+        # The ids of the reads found in the BLAST records, if we are looking
+        # reads up by id.
+        readIds = set()
         first = True
 
         for blastFilename in self.blastFilenames:
@@ -118,7 +209,8 @@ class BlastReadsAlignments(ReadsAlignments):
                 # them in and stored them in __init__.
                 first = False
             else:
-                reader = self._getReader(blastFilename, self.scoreClass)
+                reader = self._getReader(blastFilename, self.scoreClass,
+                                         self.subjectTitles)
                 differences = checkCompatibleParams(
                     self.params.applicationParams, reader.params)
                 if differences:
@@ -127,9 +219,29 @@ class BlastReadsAlignments(ReadsAlignments):
                         'in %s differ from those originally found in %s. %s' %
                         (blastFilename, self.blastFilenames[0], differences))
 
-            for readAlignments in reader.readAlignments(reads):
-                count += 1
+            if readIndex is None:
+                readsAlignments = reader.readAlignments(
+                    reads, recordFilter=recordFilter)
+            else:
+                readsAlignments = reader.readAlignmentsById(
+                    readIndex, recordFilter=recordFilter, readIds=readIds)
+
+            for readAlignments in readsAlignments:
                 yield readAlignments
+            count += reader.recordCount
+
+        if readIndex is not None:
+            # Yield the reads that had no BLAST record.
+            for read in self.reads:
+                if read.id not in readIds:
+                    yield ReadAlignments(read, [])
+            return
+
+        if not reader.hasRecordForEveryRead:
+            # Any remaining query reads must have had no hits.
+            for read in reads:
+                yield ReadAlignments(read, [])
+            return
 
         # Make sure all reads were used.
         try:
@@ -149,10 +261,10 @@ class BlastReadsAlignments(ReadsAlignments):
         This information is cached in self._subjectTitleToSubject. It can
         be obtained from either a) an sqlite database (given via the
         sqliteDatabaseFilename argument to __init__), b) the FASTA that was
-        originally given to BLAST (via the databaseFilename argument), or
-        c) from the BLAST database using blastdbcmd (which can be
-        unreliable - occasionally failing to find subjects that are in its
-        database).
+        originally given to BLAST (via the databaseFilename argument, see
+        L{dark.fasta.IndexedFasta}), or c) from the BLAST database using
+        blastdbcmd (which can be unreliable - occasionally failing to find
+        subjects that are in its database).
 
         @param title: A C{str} sequence title from a BLAST hit. Of the form
             'gi|63148399|gb|DQ011818.1| Description...'.
@@ -182,13 +294,11 @@ class BlastReadsAlignments(ReadsAlignments):
                         fastaDirectory=self._databaseDirectory,
                         readClass=readClass)
             else:
-                # Build an in-memory dict to look up subjects. This only
-                # works for small databases, obviously.
-                titles = {}
-                for read in FastaReads(self._databaseFilename,
-                                       readClass=readClass):
-                    titles[read.id] = read
-                self._subjectTitleToSubject = titles
+                # Use an index of the offsets of the subjects in the FASTA
+                # (if it can be made), so only the subjects actually asked
+                # for are read.
+                self._subjectTitleToSubject = fastaIndex(
+                    self._databaseFilename, readClass=readClass)
 
         return self._subjectTitleToSubject[title]
 
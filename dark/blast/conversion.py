@@ -2,16 +2,50 @@ from __future__ import print_function
 
 import six
 import bz2
+import bz2file
 from json import dumps, loads
 from operator import itemgetter
 
 from Bio.Blast import NCBIXML
 from Bio.File import as_handle
 
+try:
+    from xml.etree.cElementTree import XML
+except ImportError:
+    from xml.etree.ElementTree import XML
+
 from dark.hsp import HSP, LSP
 from dark.score import HigherIsBetterScore
-from dark.alignments import Alignment, ReadAlignments
-from dark.blast.hsp import normalizeHSP
+from dark.alignments import (
+    Alignment, ReadAlignments, SubjectTitles, lookupRead)
+from dark.blast.hsp import normalizeHSP, normalizeHSPs
+from dark.jsonindex import JSONRecordIndex
+from dark.utils import asHandle
+
+# The fields BLAST must be asked for (in this order) when making tabular
+# output (-outfmt 6 or 7) that BlastTabularFormatReader can read.
+TABULAR_FIELDS = ('qseqid sseqid stitle bitscore evalue qframe sframe qseq '
+                  'qstart qend sseq sstart send slen btop nident positive')
+
+
+def _int(value):
+    """
+    Convert a (possibly missing) XML text value to an C{int}.
+
+    @param value: A C{str} or C{None}.
+    @return: An C{int}, or C{None} if C{value} is C{None}.
+    """
+    return None if value is None else int(value)
+
+
+def _float(value):
+    """
+    Convert a (possibly missing) XML text value to a C{float}.
+
+    @param value: A C{str} or C{None}.
+    @return: A C{float}, or C{None} if C{value} is C{None}.
+    """
+    return None if value is None else float(value)
 
 
 class XMLRecordsReader(object):
@@ -22,11 +56,19 @@ class XMLRecordsReader(object):
     @ivar params: A C{dict} of global BLAST parameters.
     @param filename: A C{str} filename or an open file pointer, containing XML
         BLAST records.
+    @param useBiopython: If C{True}, C{dictRecords} (and hence C{saveAsJSON})
+        will use the (much slower) BioPython NCBIXML parser instead of our own
+        streaming parser. The BioPython parser can also read the concatenated
+        XML documents written by BLAST versions before 2.2.14.
     """
 
-    def __init__(self, filename):
+    # The number of characters of XML to read at a time.
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, filename, useBiopython=False):
         self._filename = filename
-        self.params = None  # Set below, in records.
+        self._useBiopython = useBiopython
+        self.params = None  # Set below, in records or dictRecords.
 
     def _convertBlastRecordToDict(self, record):
         """
@@ -50,7 +92,10 @@ class XMLRecordsReader(object):
                 hsps.append({
                     'bits': hsp.bits,
                     'expect': hsp.expect,
-                    'frame': hsp.frame,
+                    # BioPython leaves out a missing hit frame (and also a
+                    # missing query frame, if there is no hit frame), but
+                    # the readers of our JSON need both.
+                    'frame': (tuple(hsp.frame) + (0, 0))[:2],
                     'identicalCount': hsp.identities,
                     'positiveCount': hsp.positives,
                     'query': hsp.query,
@@ -152,6 +197,279 @@ class XMLRecordsReader(object):
                     first = False
                 yield record
 
+    def _header(self, root):
+        """
+        Extract the BLAST header information that is repeated in every
+        BioPython BLAST record.
+
+        @param root: The root C{Element} of the BLAST XML, with (at least) its
+            header child elements already parsed.
+        @return: A C{dict} with the header values, converted as done by the
+            BioPython NCBIXML parser.
+        """
+        findtext = root.findtext
+        version = findtext('BlastOutput_version', '').split()
+        date = ''
+        if len(version) > 2:
+            date = version[2]
+            if date[0] == '[' and date[-1] == ']':
+                date = date[1:-1]
+
+        parameters = root.find('BlastOutput_param/Parameters')
+        if parameters is None:
+            matrix = ''
+            scMatch = scMismatch = None
+            gapPenalties = (None, None)
+        else:
+            findParameter = parameters.findtext
+            matrix = findParameter('Parameters_matrix', '')
+            scMatch = _int(findParameter('Parameters_sc-match'))
+            scMismatch = _int(findParameter('Parameters_sc-mismatch'))
+            gapPenalties = (_int(findParameter('Parameters_gap-open')),
+                            _int(findParameter('Parameters_gap-extend')))
+
+        return {
+            'application': findtext('BlastOutput_program', '').upper(),
+            'version': version[1] if len(version) > 1 else '',
+            'date': date,
+            'reference': findtext('BlastOutput_reference', ''),
+            'database': findtext('BlastOutput_db', ''),
+            'query': findtext('BlastOutput_query-def', ''),
+            'query_id': findtext('BlastOutput_query-ID'),
+            'query_letters': _int(findtext('BlastOutput_query-len')),
+            'matrix': matrix,
+            'sc_match': scMatch,
+            'sc_mismatch': scMismatch,
+            'gap_penalties': gapPenalties,
+        }
+
+    def _convertIterationToParamsDict(self, iteration, header):
+        """
+        Make the global BLAST parameters from the first XML iteration, with
+        the same values L{_convertBlastParamsToDict} gets from the BioPython
+        record for that iteration.
+
+        @param iteration: An C{Element} for a BLAST XML C{Iteration}.
+        @param header: A C{dict} of header values, as returned by C{_header}.
+        @return: A C{dict}, as described above.
+        """
+        findtext = iteration.findtext
+        statistics = iteration.find('Iteration_stat/Statistics')
+        if statistics is None:
+            dbNum = dbLen = []
+            hspLen = effSpace = None
+            kaParams = (None, None, None)
+        else:
+            findStatistic = statistics.findtext
+            # BioPython uses empty lists for these if they are missing.
+            dbNum = _int(findStatistic('Statistics_db-num'))
+            dbNum = [] if dbNum is None else dbNum
+            dbLen = _int(findStatistic('Statistics_db-len'))
+            dbLen = [] if dbLen is None else dbLen
+            hspLen = _int(findStatistic('Statistics_hsp-len'))
+            effSpace = _float(findStatistic('Statistics_eff-space'))
+            kappa = findStatistic('Statistics_kappa')
+            lambda_ = findStatistic('Statistics_lambda')
+            entropy = findStatistic('Statistics_entropy')
+            if kappa is None and lambda_ is None and entropy is None:
+                kaParams = (None, None, None)
+            else:
+                kaParams = (_float(lambda_), _float(kappa), _float(entropy))
+
+        queryLetters = (_int(findtext('Iteration_query-len')) or
+                        header['query_letters'])
+
+        return {
+            'application': header['application'],
+            'version': header['version'],
+            'date': header['date'],
+            'reference': header['reference'],
+            'query': findtext('Iteration_query-def') or header['query'],
+            'query_letters': queryLetters,
+            'database': header['database'],
+            'database_sequences': dbNum,
+            'database_letters': None,
+            'database_name': [],
+            'posted_date': [],
+            'num_letters_in_database': dbLen,
+            'num_sequences_in_database': dbNum,
+            'ka_params': kaParams,
+            'gapped': 0,
+            'ka_params_gap': (None, None, None),
+            'matrix': header['matrix'],
+            'gap_penalties': header['gap_penalties'],
+            'sc_match': header['sc_match'],
+            'sc_mismatch': header['sc_mismatch'],
+            'num_hits': None,
+            'num_sequences': None,
+            'num_good_extends': None,
+            'num_seqs_better_e': None,
+            'hsps_no_gap': None,
+            'hsps_prelim_gapped': None,
+            'hsps_prelim_gapped_attemped': None,
+            'hsps_gapped': None,
+            'query_id': findtext('Iteration_query-ID') or header['query_id'],
+            'query_length': queryLetters,
+            'database_length': dbLen,
+            'effective_hsp_length': hspLen,
+            'effective_query_length': None,
+            'effective_database_length': None,
+            'effective_search_space': effSpace,
+            'effective_search_space_used': None,
+            'frameshift': (None, None),
+            'threshold': None,
+            'window_size': None,
+            'dropoff_1st_pass': (None, None),
+            'gap_x_dropoff': (None, None),
+            'gap_x_dropoff_final': (None, None),
+            'gap_trigger': (None, None),
+            'blast_cutoff': (None, None),
+        }
+
+    def _convertIterationToDict(self, iteration, header):
+        """
+        Pull (only) the fields we use out of a BLAST XML iteration and return
+        them as a C{dict} identical to the one made from the corresponding
+        BioPython record by L{_convertBlastRecordToDict}.
+
+        @param iteration: An C{Element} for a BLAST XML C{Iteration}.
+        @param header: A C{dict} of header values, as returned by C{_header}.
+        @return: A C{dict} with 'alignments' and 'query' keys.
+        """
+        alignments = []
+        for hit in iteration.iterfind('Iteration_hits/Hit'):
+            findHit = hit.findtext
+            hitId = findHit('Hit_id')
+            hitDef = findHit('Hit_def', '')
+            hsps = []
+            for hsp in hit.iterfind('Hit_hsps/Hsp'):
+                findHsp = hsp.findtext
+                # A missing frame is 0, as in _convertBlastRecordToDict.
+                frame = (int(findHsp('Hsp_query-frame', 0)),
+                         int(findHsp('Hsp_hit-frame', 0)))
+                identities = findHsp('Hsp_identity')
+                positives = findHsp('Hsp_positive', identities)
+                hsps.append({
+                    'bits': _float(findHsp('Hsp_bit-score')),
+                    'expect': _float(findHsp('Hsp_evalue')),
+                    'frame': frame,
+                    'identicalCount': (
+                        (None, None) if identities is None
+                        else int(identities)),
+                    'positiveCount': _int(positives),
+                    'query': findHsp('Hsp_qseq', ''),
+                    'query_start': _int(findHsp('Hsp_query-from')),
+                    'query_end': _int(findHsp('Hsp_query-to')),
+                    'sbjct': findHsp('Hsp_hseq', ''),
+                    'sbjct_start': _int(findHsp('Hsp_hit-from')),
+                    'sbjct_end': _int(findHsp('Hsp_hit-to')),
+                })
+
+            alignments.append({
+                'hsps': hsps,
+                'length': _int(findHit('Hit_len')),
+                'title': hitDef if hitId is None else hitId + ' ' + hitDef,
+            })
+
+        return {
+            'alignments': alignments,
+            'query': iteration.findtext('Iteration_query-def') or
+            header['query'],
+        }
+
+    def _streamRecords(self):
+        """
+        Incrementally parse BLAST XML, going directly from the XML to the
+        C{dict}s we save as JSON (without making BioPython records), and set
+        self.params from the first XML iteration.
+
+        The input is read in blocks and the XML of each iteration (i.e.,
+        BLAST query) is parsed into an C{ElementTree} on its own and
+        discarded as soon as it has been converted, so memory use is bounded
+        by the size of the largest single query result rather than the size
+        of the file. Parsing whole iterations (rather than handling the events
+        for every element, as C{ElementTree.iterparse} does) keeps nearly all
+        the parsing work in C.
+
+        @raise ValueError: If the XML is not in the (version 1) BLAST XML
+            format, with a BlastOutput root element.
+        @return: A generator that yields C{dict}s, as described in
+            C{_convertIterationToDict}.
+        """
+        iterationsTag = '<BlastOutput_iterations>'
+        startTag = '<Iteration>'
+        endTag = '</Iteration>'
+        header = None
+        first = True
+        buffered = ''
+
+        with as_handle(self._filename) as fp:
+            while True:
+                block = fp.read(self.BLOCK_SIZE)
+                if not block:
+                    break
+
+                # Only look for a new end tag in the newly read data (and
+                # just before it, in case the tag spans the two).
+                searchFrom = max(0, len(buffered) - len(endTag))
+                buffered += block
+
+                if header is None:
+                    offset = buffered.find(iterationsTag)
+                    if offset == -1:
+                        continue
+                    header = self._header(
+                        XML(buffered[:offset] + '</BlastOutput>'))
+                    buffered = buffered[offset + len(iterationsTag):]
+                    searchFrom = 0
+
+                if buffered.find(endTag, searchFrom) == -1:
+                    continue
+
+                iterations = buffered.split(endTag)
+                # The last piece is the (possibly empty) start of the next
+                # iteration.
+                buffered = iterations.pop()
+
+                for iteration in iterations:
+                    element = XML(iteration[iteration.index(startTag):] +
+                                  endTag)
+                    if first:
+                        self.params = self._convertIterationToParamsDict(
+                            element, header)
+                        first = False
+                    yield self._convertIterationToDict(element, header)
+
+        if header is None and buffered.strip():
+            # There was no iterations element. Check the XML is at least
+            # something we know how to read (this will raise a ParseError
+            # if it is not XML at all).
+            root = XML(buffered)
+            if root.tag != 'BlastOutput':
+                raise ValueError(
+                    'Unrecognized BLAST XML root element %r. Only '
+                    'BlastOutput XML (version 1) can be parsed. Use the '
+                    'BioPython parser for other XML.' % root.tag)
+
+    def dictRecords(self):
+        """
+        Yield BLAST records as C{dict}s holding just the fields we use, as
+        returned by C{_convertBlastRecordToDict}. Set self.params from data
+        in the first record.
+
+        Unless C{useBiopython} was passed to C{__init__}, the XML is parsed
+        with our streaming parser, which is much faster than the BioPython
+        parser and does not make BioPython records.
+
+        @return: A generator that yields C{dict}s.
+        """
+        if self._useBiopython:
+            for record in self.records():
+                yield self._convertBlastRecordToDict(record)
+        else:
+            for record in self._streamRecords():
+                yield record
+
     def saveAsJSON(self, fp):
         """
         Write the records out as JSON. The first JSON object saved contains
@@ -160,12 +478,160 @@ class XMLRecordsReader(object):
         @param fp: A C{str} file pointer to write to.
         """
         first = True
-        for record in self.records():
+        for record in self.dictRecords():
             if first:
                 print(dumps(self.params, separators=(',', ':')), file=fp)
                 first = False
-            print(dumps(self._convertBlastRecordToDict(record),
-                        separators=(',', ':')), file=fp)
+            print(dumps(record, separators=(',', ':')), file=fp)
+
+
+class BlastTabularFormatReader(object):
+    """
+    Provide a method that yields records (in the same form as those made from
+    BLAST XML by L{XMLRecordsReader}) from BLAST tabular output. Store and
+    make accessible the global BLAST parameters.
+
+    Make sure you run BLAST with the right output format. You must use:
+        -outfmt '7 qseqid sseqid stitle bitscore evalue qframe sframe qseq
+                   qstart qend sseq sstart send slen btop nident positive'
+
+    Output format 6 (with the same fields) can also be read, but it has no
+    comment lines, so queries that had no hits do not appear in it at all
+    and the BLAST program and database are unknown.
+
+    @param filename: A C{str} filename (possibly compressed with gzip or
+        bzip2) or an open file pointer, containing BLAST tabular output.
+    @param application: The C{str} BLAST program (e.g., 'blastn' or 'blastx')
+        that made the output. This is only used if the output has no comment
+        lines (i.e., for output format 6).
+    """
+
+    def __init__(self, filename, application='blastn'):
+        self._filename = filename
+        self.params = {
+            'application': application.upper(),
+            'database': '',
+            'version': '',
+        }
+
+    def records(self):
+        """
+        Parse the BLAST tabular output and yield records. Set self.params from
+        the comment lines (if any) preceding the first record.
+
+        @raise ValueError: If a line of the output does not have the expected
+            number of fields.
+        @return: A generator that produces C{dict}s containing 'alignments' and
+            'query' C{str} keys.
+        """
+        fieldCount = len(TABULAR_FIELDS.split())
+        record = None
+        alignments = {}
+        with asHandle(self._filename) as fp:
+            for lineNumber, line in enumerate(fp, start=1):
+                line = line.rstrip('\r\n')
+                if line.startswith('#'):
+                    if line.startswith('# Query: '):
+                        if record is not None:
+                            yield record
+                        record = {'alignments': [], 'query': line[9:]}
+                        alignments = {}
+                    elif line.startswith('# Database: '):
+                        self.params['database'] = line[12:]
+                    elif line.startswith('# BLAST'):
+                        # E.g., '# BLASTN 2.2.29+' (but not the final
+                        # '# BLAST processed 3 queries').
+                        words = line[2:].split()
+                        if len(words) == 2:
+                            self.params['application'] = words[0]
+                            self.params['version'] = words[1]
+                    continue
+
+                if not line:
+                    continue
+
+                fields = line.split('\t')
+                if len(fields) != fieldCount:
+                    raise ValueError(
+                        'Line %d of %r has %d tab-separated fields (expected '
+                        '%d). BLAST must be run with -outfmt \'6 %s\' or '
+                        '-outfmt \'7 %s\'.' %
+                        (lineNumber, self._filename, len(fields), fieldCount,
+                         TABULAR_FIELDS, TABULAR_FIELDS))
+
+                (qseqid, sseqid, stitle, bitscore, evalue, qframe, sframe,
+                 qseq, qstart, qend, sseq, sstart, send, slen, btop, nident,
+                 positive) = fields
+
+                if record is None or record['query'].split()[0] != qseqid:
+                    # This is the first hit for a new query.
+                    if record is not None:
+                        yield record
+                    record = {'alignments': [], 'query': qseqid}
+                    alignments = {}
+
+                hsp = {
+                    'bits': float(bitscore),
+                    'btop': btop,
+                    'expect': float(evalue),
+                    'frame': (int(qframe), int(sframe)),
+                    'identicalCount': int(nident),
+                    'positiveCount': int(positive),
+                    'query': qseq,
+                    'query_start': int(qstart),
+                    'query_end': int(qend),
+                    'sbjct': sseq,
+                    'sbjct_start': int(sstart),
+                    'sbjct_end': int(send),
+                }
+
+                # Make the title the same as the one in BLAST XML output.
+                title = sseqid + ' ' + stitle
+                try:
+                    alignments[title]['hsps'].append(hsp)
+                except KeyError:
+                    alignment = alignments[title] = {
+                        'hsps': [hsp],
+                        'length': int(slen),
+                        'title': title,
+                    }
+                    record['alignments'].append(alignment)
+
+        # Yield the last record, if any.
+        if record is not None:
+            yield record
+
+    def saveAsJSON(self, fp, writeBytes=False):
+        """
+        Write the records out as JSON. The first JSON object saved contains
+        the BLAST parameters.
+
+        @param fp: A C{str} file pointer to write to.
+        @param writeBytes: If C{True}, the JSON will be written out as bytes
+            (not strings). This is required when we are writing to a BZ2 file.
+        """
+        def write(obj):
+            line = dumps(obj, separators=(',', ':'))
+            if writeBytes:
+                fp.write(line.encode('UTF-8'))
+                fp.write(b'\n')
+            else:
+                fp.write(six.u(line))
+                fp.write(six.u('\n'))
+
+        first = True
+        for record in self.records():
+            if first:
+                # The params are only known once the comment lines before
+                # the first record have been read.
+                write(self.params)
+                first = False
+            write(record)
+
+        if first:
+            # There were no records. Write the params anyway, so the
+            # output can still be read.
+            write(self.params)
 
 
 class JSONRecordsReader(object):
@@ -173,23 +639,42 @@ class JSONRecordsReader(object):
     Provide a method that yields JSON records from a file. Store, check, and
     make accessible the global BLAST parameters.
 
+    @ivar recordCount: The C{int} number of records read by the most recent
+        call to C{readAlignments}.
     @param filename: A C{str} filename containing JSON BLAST records.
     @param scoreClass: A class to hold and compare scores (see scores.py).
         Default is C{HigherIsBetterScore}, for comparing bit scores. If you
         are using e-values, pass LowerIsBetterScore instead.
+    @param subjectTitles: A L{dark.alignments.SubjectTitles} instance to use
+        to intern and number the subject titles of alignments. If C{None}, a
+        new one will be made.
     """
 
     # Note that self._fp is opened in self.__init__, accessed in
     # self._params and in self.records, and closed in self.close.
 
-    def __init__(self, filename, scoreClass=HigherIsBetterScore):
+    # Our JSON has a record for every read given to BLAST, even those with
+    # no hits.
+    hasRecordForEveryRead = True
+
+    # The number of records whose HSPs are normalized together. Batch
+    # normalization only beats normalizing HSPs one at a time when it is
+    # given many HSPs, so this should not be small.
+    CHUNK_SIZE = 1000
+
+    def __init__(self, filename, scoreClass=HigherIsBetterScore,
+                 subjectTitles=None):
         self._filename = filename
         self._scoreClass = scoreClass
+        self._subjectTitles = (SubjectTitles() if subjectTitles is None
+                               else subjectTitles)
         if scoreClass is HigherIsBetterScore:
             self._hspClass = HSP
         else:
             self._hspClass = LSP
 
+        self.recordCount = 0
+        self._index = None
         self._open(filename)
         self.application = self.params['application'].lower()
 
@@ -207,7 +692,10 @@ class JSONRecordsReader(object):
             if six.PY3:
                 self._fp = bz2.open(filename, mode='rt', encoding='UTF-8')
             else:
-                self._fp = bz2.BZ2File(filename)
+                # The bz2 module of Python 2 stops reading at the end of
+                # the first bzip2 stream, but a file may hold several (see
+                # DiamondTabularFormatReader.saveAsJSON).
+                self._fp = bz2file.BZ2File(filename)
         else:
             self._fp = open(filename)
 
@@ -228,7 +716,26 @@ class JSONRecordsReader(object):
                     'parameters. Please re-run convert-blast-xml-to-json.py '
                     'to convert it to the newest format.' % self._filename)
 
-    def _dictToAlignments(self, blastDict, read):
+    def _checkQuery(self, blastDict, read):
+        """
+        Check that a BLAST record dict is for a given read.
+
+        @param blastDict: A C{dict}, from convertBlastRecordToDict.
+        @param read: A C{Read} instance, containing the read that BLAST used
+            to create this record.
+        @raise ValueError: If the query id in the BLAST dictionary does not
+            match the id of the read (either may be just the first word of
+            the other).
+        """
+        query = blastDict['query']
+        if (query != read.id and query.split()[0] != read.id and
+                read.id.split()[0] != query):
+            raise ValueError(
+                'The reads you have provided do not match the BLAST output: '
+                'BLAST record query id (%s) does not match the id of the '
+                'supposedly corresponding read (%s).' % (query, read.id))
+
+    def _dictToAlignments(self, blastDict, read, normalized=None):
         """
         Take a dict (made by XMLRecordsReader._convertBlastRecordToDict)
         and convert it to a list of alignments.
@@ -236,38 +743,40 @@ class JSONRecordsReader(object):
         @param blastDict: A C{dict}, from convertBlastRecordToDict.
         @param read: A C{Read} instance, containing the read that BLAST used
             to create this record.
+        @param normalized: An iterator yielding the already normalized
+            offsets (as returned by C{normalizeHSP}) of the HSPs in
+            C{blastDict}, or C{None} if the HSPs should be normalized here.
         @raise ValueError: If the query id in the BLAST dictionary does not
             match the id of the read.
         @return: A C{list} of L{dark.alignment.Alignment} instances.
         """
-        if (blastDict['query'] != read.id and
-                blastDict['query'].split()[0] != read.id):
-            raise ValueError(
-                'The reads you have provided do not match the BLAST output: '
-                'BLAST record query id (%s) does not match the id of the '
-                'supposedly corresponding read (%s).' %
-                (blastDict['query'], read.id))
+        self._checkQuery(blastDict, read)
 
         alignments = []
         getScore = itemgetter('bits' if self._hspClass is HSP else 'expect')
 
+        addTitle = self._subjectTitles.add
+
         for blastAlignment in blastDict['alignments']:
-            alignment = Alignment(blastAlignment['length'],
-                                  blastAlignment['title'])
+            title, subjectId = addTitle(blastAlignment['title'])
+            alignment = Alignment(blastAlignment['length'], title, subjectId)
             alignments.append(alignment)
             for blastHsp in blastAlignment['hsps']:
                 score = getScore(blastHsp)
-                normalized = normalizeHSP(blastHsp, len(read),
-                                          self.application)
+                if normalized is None:
+                    offsets = normalizeHSP(blastHsp, len(read),
+                                           self.application)
+                else:
+                    offsets = next(normalized)
                 hsp = self._hspClass(
                     score,
-                    readStart=normalized['readStart'],
-                    readEnd=normalized['readEnd'],
-                    readStartInSubject=normalized['readStartInSubject'],
-                    readEndInSubject=normalized['readEndInSubject'],
+                    readStart=offsets['readStart'],
+                    readEnd=offsets['readEnd'],
+                    readStartInSubject=offsets['readStartInSubject'],
+                    readEndInSubject=offsets['readEndInSubject'],
                     readFrame=blastHsp['frame'][0],
-                    subjectStart=normalized['subjectStart'],
-                    subjectEnd=normalized['subjectEnd'],
+                    subjectStart=offsets['subjectStart'],
+                    subjectEnd=offsets['subjectEnd'],
                     subjectFrame=blastHsp['frame'][1],
                     readMatchedSequence=blastHsp['query'],
                     subjectMatchedSequence=blastHsp['sbjct'],
@@ -284,22 +793,144 @@ class JSONRecordsReader(object):
 
         return alignments
 
-    def readAlignments(self, reads):
+    def _chunkToReadAlignments(self, chunk):
         """
-        Read lines of JSON from self._filename, convert them to read alignments
-        and yield them.
+        Convert a chunk of records to read alignments, normalizing all their
+        HSPs with one call to C{normalizeHSPs}.
 
-        @param reads: An iterable of L{Read} instances, corresponding to the
-            reads that were given to BLAST.
-        @raise ValueError: If any of the lines in the file cannot be converted
-            to JSON.
+        @param chunk: A C{list} of (L{Read}, C{dict}) 2-tuples, each with a
+            read and its BLAST record. The record may be C{None} for a read
+            that had no BLAST hits.
+        @raise AssertionError: If an HSP cannot be normalized.
         @return: A generator that yields C{dark.alignments.ReadAlignments}
             instances.
         """
+        hsps = []
+        readLens = []
+        normalized = iter(())
+        for read, record in chunk:
+            if record is not None:
+                readLen = len(read)
+                for alignment in record['alignments']:
+                    for hsp in alignment['hsps']:
+                        hsps.append(hsp)
+                        readLens.append(readLen)
+
+        if hsps:
+            try:
+                normalized = normalizeHSPs(
+                    [hsp['query_start'] for hsp in hsps],
+                    [hsp['query_end'] for hsp in hsps],
+                    [hsp['sbjct_start'] for hsp in hsps],
+                    [hsp['sbjct_end'] for hsp in hsps],
+                    [hsp['frame'][0] for hsp in hsps],
+                    [hsp['frame'][1] for hsp in hsps],
+                    readLens,
+                    [hsp['query'].count('-') for hsp in hsps],
+                    [hsp['sbjct'].count('-') for hsp in hsps],
+                    self.application)
+            except AssertionError:
+                # Normalize the HSPs one at a time, to get the detailed
+                # debugging output of normalizeHSP for the offending HSP.
+                for read, record in chunk:
+                    if record is not None:
+                        self._dictToAlignments(record, read)
+                raise
+
+            keys = sorted(normalized)
+            normalized = (dict(zip(keys, values)) for values in
+                          zip(*[normalized[key].tolist() for key in keys]))
+
+        for read, record in chunk:
+            if record is None:
+                alignments = []
+            else:
+                alignments = self._dictToAlignments(record, read, normalized)
+            yield ReadAlignments(read, alignments)
+
+    def _readAlignmentsInChunks(self, pairs):
+        """
+        Convert (read, record) pairs to read alignments, CHUNK_SIZE records at
+        a time.
+
+        @param pairs: An iterable of (L{Read}, C{dict}) 2-tuples, as accepted
+            by C{_chunkToReadAlignments}.
+        @return: A generator that yields C{dark.alignments.ReadAlignments}
+            instances, in the order of C{pairs}.
+        """
+        chunk = []
+        for pair in pairs:
+            chunk.append(pair)
+            if len(chunk) == self.CHUNK_SIZE:
+                for readAlignments in self._chunkToReadAlignments(chunk):
+                    yield readAlignments
+                chunk = []
+
+        for readAlignments in self._chunkToReadAlignments(chunk):
+            yield readAlignments
+
+    def _getIndex(self):
+        """
+        Get the index of the records in our file, making it if need be.
+
+        @return: A L{dark.jsonindex.JSONRecordIndex} instance.
+        """
+        if self._index is None:
+            self._index = JSONRecordIndex(self._filename)
+        return self._index
+
+    def recordFor(self, readId):
+        """
+        Get the record for a read, using an index (see
+        L{dark.jsonindex.JSONRecordIndex}) to avoid reading the records that
+        precede it.
+
+        @param readId: The C{str} id of a read. If no record has this query
+            id, the record for the first word of C{readId} is looked for.
+        @raise KeyError: If there is no record for C{readId}.
+        @return: The record C{dict}.
+        """
+        index = self._getIndex()
+        try:
+            ordinal = index.ordinal(readId)
+        except KeyError:
+            try:
+                ordinal = index.ordinal(readId.split()[0])
+            except (KeyError, IndexError):
+                raise KeyError(readId)
+
+        for line in index.lines(ordinal, ordinal + 1):
+            return loads(line)
+
+    def recordsInRange(self, start, stop):
+        """
+        Get a range of records, using an index (see
+        L{dark.jsonindex.JSONRecordIndex}) to avoid reading the records that
+        precede them. This allows several processes to each work on a
+        separate part of a file.
+
+        @param start: The C{int} number of the first record wanted. Records
+            are numbered from zero.
+        @param stop: The C{int} number of the record after the last one
+            wanted (as with Python's C{range}).
+        @return: A generator that yields record C{dict}s.
+        """
+        for line in self._getIndex().lines(start, stop):
+            yield loads(line)
+
+    def _records(self):
+        """
+        Read lines of JSON from self._filename and convert them to dicts.
+
+        @raise ValueError: If any of the lines in the file cannot be converted
+            to JSON.
+        @return: A generator that yields 2-tuples, each with the C{int}
+            number of a record (starting at 1) and the record C{dict}.
+        """
         if self._fp is None:
             self._open(self._filename)
 
-        reads = iter(reads)
+        self.recordCount = 0
 
         try:
             for lineNumber, line in enumerate(self._fp, start=2):
@@ -311,16 +942,233 @@ class JSONRecordsReader(object):
                         'Line is %r.' %
                         (lineNumber, self._filename, e, line[:-1]))
                 else:
+                    self.recordCount += 1
+                    yield lineNumber - 1, record
+        finally:
+            self._fp.close()
+            self._fp = None
+
+    def readAlignments(self, reads, recordFilter=None):
+        """
+        Read lines of JSON from self._filename, convert them to read alignments
+        and yield them.
+
+        @param reads: An iterable of L{Read} instances, corresponding to the
+            reads that were given to BLAST.
+        @param recordFilter: A function with the signature of
+            L{dark.alignments.ReadsAlignmentsFilter.filterRecord}, or C{None}.
+            If given, it is used to discard unwanted alignments (or the read)
+            before any alignment or HSP instances are made for them. Reads
+            that the record filter rejects are not yielded.
+        @raise ValueError: If any of the lines in the file cannot be converted
+            to JSON.
+        @return: A generator that yields C{dark.alignments.ReadAlignments}
+            instances.
+        """
+        def pairs():
+            readsIter = iter(reads)
+            for recordNumber, record in self._records():
+                try:
+                    read = next(readsIter)
+                except StopIteration:
+                    raise ValueError(
+                        'Read generator failed to yield read number %d '
+                        'during parsing of BLAST file %r.' %
+                        (recordNumber, self._filename))
+                else:
+                    if recordFilter:
+                        self._checkQuery(record, read)
+                        record = recordFilter(read.id, record,
+                                              self._scoreClass)
+                        if not record:
+                            continue
+                    yield read, record
+
+        return self._readAlignmentsInChunks(pairs())
+
+    def readAlignmentsById(self, readIndex, recordFilter=None, readIds=None):
+        """
+        Read lines of JSON from self._filename, convert them to read alignments
+        and yield them, finding the read for each record by its query id (so
+        the records do not need to be in any particular order).
+
+        @param readIndex: A C{dict}-like object that returns the L{Read} with
+            a given id, e.g., a L{dark.alignments.ReadIdIndex} or a
+            L{dark.fasta.IndexedFasta}.
+        @param recordFilter: A function with the signature of
+            L{dark.alignments.ReadsAlignmentsFilter.filterRecord}, or C{None}.
+            See C{readAlignments}.
+        @param readIds: A C{set} to which the id of the read for each record
+            will be added (including those rejected by C{recordFilter}), or
+            C{None}.
+        @raise ValueError: If any of the lines in the file cannot be converted
+            to JSON, or if a record is for a read that is not in
+            C{readIndex}.
+        @return: A generator that yields C{dark.alignments.ReadAlignments}
+            instances.
+        """
+        def pairs():
+            for recordNumber, record in self._records():
+                try:
+                    read = lookupRead(readIndex, record['query'])
+                except KeyError:
+                    raise ValueError(
+                        'No read with id %r (from record number %d of BLAST '
+                        'file %r) could be found.' %
+                        (record['query'], recordNumber, self._filename))
+                if readIds is not None:
+                    readIds.add(read.id)
+                if recordFilter:
+                    record = recordFilter(read.id, record, self._scoreClass)
+                    if not record:
+                        continue
+                yield read, record
+
+        return self._readAlignmentsInChunks(pairs())
+
+
+class TabularRecordsReader(JSONRecordsReader):
+    """
+    Provide a method that yields read alignments from BLAST tabular output
+    (see L{BlastTabularFormatReader}), so that output can be used directly,
+    without first converting it to JSON.
+
+    @ivar recordCount: The C{int} number of records read by the most recent
+        call to C{readAlignments}.
+    @param filename: A C{str} filename (possibly compressed with gzip or
+        bzip2) containing BLAST tabular output.
+    @param scoreClass: A class to hold and compare scores (see scores.py).
+        Default is C{HigherIsBetterScore}, for comparing bit scores. If you
+        are using e-values, pass LowerIsBetterScore instead.
+    @param subjectTitles: A L{dark.alignments.SubjectTitles} instance to use
+        to intern and number the subject titles of alignments. If C{None}, a
+        new one will be made.
+    @param application: The C{str} BLAST program (e.g., 'blastn' or 'blastx')
+        that made the output, for output with no comment lines (output
+        format 6).
+    """
+
+    # Tabular output format 6 has no records for queries that had no hits.
+    hasRecordForEveryRead = False
+
+    def __init__(self, filename, scoreClass=HigherIsBetterScore,
+                 subjectTitles=None, application='blastn'):
+        self._application = application
+        JSONRecordsReader.__init__(self, filename, scoreClass, subjectTitles)
+
+    def _open(self, filename):
+        """
+        Start reading the input file. Read its first record (if any) so the
+        BLAST parameters in the comment lines that precede it are known.
+
+        @param filename: A C{str} filename containing BLAST tabular output.
+        """
+        reader = BlastTabularFormatReader(filename, self._application)
+        self._fp = reader.records()
+        self._firstRecord = next(self._fp, None)
+        self.params = reader.params
+
+    def _checkQuery(self, blastDict, read):
+        """
+        Check that a BLAST record dict is for a given read.
+
+        @param blastDict: A C{dict}, from L{BlastTabularFormatReader.records}.
+        @param read: A C{Read} instance, containing the read that BLAST used
+            to create this record.
+        @raise ValueError: If the query id in the BLAST dictionary does not
+            match the id of the read.
+        """
+        if not self._queryMatches(blastDict['query'], read):
+            JSONRecordsReader._checkQuery(self, blastDict, read)
+
+    def _getIndex(self):
+        """
+        Record indices can only be made for JSON files.
+
+        @raise ValueError: Unconditionally.
+        """
+        raise ValueError('Records in BLAST tabular output file %r cannot be '
+                         'indexed. Convert it to JSON first.' % self._filename)
+
+    @staticmethod
+    def _queryMatches(query, read):
+        """
+        Does a query id from tabular BLAST output match a read?
+
+        @param query: The C{str} query id of a record. In output with no
+            comment lines this is just the first word of the read id.
+        @param read: A C{Read} instance.
+        @return: C{True} if C{query} is for C{read}.
+        """
+        return (read.id == query or read.id.split()[0] == query or
+                query.split()[0] == read.id)
+
+    def _records(self):
+        """
+        Read BLAST tabular output from self._filename.
+
+        @raise ValueError: If a line of the output does not have the expected
+            number of fields.
+        @return: A generator that yields 2-tuples, each with the C{int}
+            number of a record (starting at 1) and the record C{dict}.
+        """
+        if self._fp is None:
+            self._open(self._filename)
+
+        self.recordCount = 0
+        records = self._fp
+        firstRecord = self._firstRecord
+        self._fp = self._firstRecord = None
+
+        if firstRecord is not None:
+            self.recordCount += 1
+            yield self.recordCount, firstRecord
+            for record in records:
+                self.recordCount += 1
+                yield self.recordCount, record
+
+    def readAlignments(self, reads, recordFilter=None):
+        """
+        Read records from self._filename, convert them to read alignments and
+        yield them.
+
+        Because tabular output (format 6) has no records for queries that
+        had no hits, input reads that do not match the next record are
+        yielded with no alignments.
+
+        @param reads: An iterator of L{Read} instances, corresponding to the
+            reads that were given to BLAST. This is shared with the readers
+            of later files, so reads with no hits that follow the last record
+            in this file are left for them (or for the caller) to yield.
+        @param recordFilter: A function with the signature of
+            L{dark.alignments.ReadsAlignmentsFilter.filterRecord}, or C{None}.
+            See L{JSONRecordsReader.readAlignments}.
+        @raise ValueError: If a record is found for which there is no read.
+        @return: A generator that yields C{dark.alignments.ReadAlignments}
+            instances.
+        """
+        def pairs():
+            for recordNumber, record in self._records():
+                query = record['query']
+                while True:
                     try:
                         read = next(reads)
                     except StopIteration:
                         raise ValueError(
-                            'Read generator failed to yield read number %d '
-                            'during parsing of BLAST file %r.' %
-                            (lineNumber - 1, self._filename))
+                            'Read generator failed to yield a read with id '
+                            '%r as found in record number %d during parsing '
+                            'of BLAST file %r.' %
+                            (query, recordNumber, self._filename))
+                    if self._queryMatches(query, read):
+                        if recordFilter:
+                            record = recordFilter(read.id, record,
+                                                  self._scoreClass)
+                        if record:
+                            yield read, record
+                        break
                     else:
-                        alignments = self._dictToAlignments(record, read)
-                        yield ReadAlignments(read, alignments)
-        finally:
-            self._fp.close()
-            self._fp = None
+                        # This input read had no hits, so it does not
+                        # appear in the BLAST output.
+                        yield read, None
+
+        return self._readAlignmentsInChunks(pairs())
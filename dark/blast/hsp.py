@@ -1,3 +1,8 @@
+import numpy as np
+
+from dark.hsp import sanityCheckHSPs
+
+
 def printHSP(hsp, indent=''):
     for attr in ['bits', 'expect', 'frame', 'query_end', 'query_start',
                  'sbjct', 'query', 'sbjct_end', 'sbjct_start']:
@@ -178,3 +183,107 @@ def normalizeHSP(hsp, readLen, blastApplication):
         'subjectStart': subjectStart,
         'subjectEnd': subjectEnd,
     }
+
+
+def normalizeHSPs(readStarts, readEnds, subjectStarts, subjectEnds,
+                  readFrames, subjectFrames, readLens, readGaps, subjectGaps,
+                  blastApplication):
+    """
+    Normalize many HSPs at once. This computes exactly what calling
+    C{normalizeHSP} on each HSP would, but does the arithmetic on arrays.
+    That's only faster when there are more than a few dozen HSPs, so callers
+    should collect the HSPs for many records (not just one) before calling.
+
+    All arguments except C{blastApplication} are C{numpy} arrays (or
+    sequences that can be converted to one) of C{int}s, with one element per
+    HSP. Offsets are 1-based, as found in BLAST output.
+
+    @param readStarts: The HSP query start offsets.
+    @param readEnds: The HSP query end offsets.
+    @param subjectStarts: The HSP subject start offsets.
+    @param subjectEnds: The HSP subject end offsets.
+    @param readFrames: The HSP query frames.
+    @param subjectFrames: The HSP subject frames.
+    @param readLens: The lengths of the reads.
+    @param readGaps: The number of gaps ('-' characters) in the HSP query
+        match sequences.
+    @param subjectGaps: The number of gaps ('-' characters) in the HSP
+        subject match sequences.
+    @param blastApplication: The C{str} command line program that was
+        run (e.g., 'blastn', 'blastx').
+    @raise AssertionError: If any HSP fails the sanity checks made by
+        C{normalizeHSP}.
+    @return: A C{dict} with the same keys as the C{dict} returned by
+        C{normalizeHSP}, whose values are C{numpy} C{int} arrays.
+    """
+    read_start = np.asarray(readStarts, dtype=np.int64)
+    read_end = np.asarray(readEnds, dtype=np.int64)
+    sbjct_start = np.asarray(subjectStarts, dtype=np.int64)
+    sbjct_end = np.asarray(subjectEnds, dtype=np.int64)
+    readPositive = np.asarray(readFrames) > 0
+    hitPositive = np.asarray(subjectFrames) > 0
+    readLen = np.asarray(readLens, dtype=np.int64)
+    readGaps = np.asarray(readGaps, dtype=np.int64)
+    hitGaps = np.asarray(subjectGaps, dtype=np.int64)
+
+    readReversed = read_start > read_end
+    hitReversed = sbjct_start > sbjct_end
+    hitDescending = hitPositive & hitReversed
+
+    # See normalizeHSP for why negative hits may need swapping.
+    swap = ~hitPositive & hitReversed
+    sbjct_start, sbjct_end = (np.where(swap, sbjct_end, sbjct_start),
+                              np.where(swap, sbjct_start, sbjct_end))
+
+    readStartInSubject = read_start - 1
+    readEndInSubject = read_end
+    subjectStart = sbjct_start - 1
+    subjectEnd = sbjct_end
+
+    if blastApplication == 'blastx':
+        # Truncate towards zero, as int(x / 3) does in normalizeHSP.
+        readStartInSubject = (np.sign(readStartInSubject) *
+                              (np.abs(readStartInSubject) // 3))
+        readEndInSubject = (np.sign(readEndInSubject) *
+                            (np.abs(readEndInSubject) // 3))
+
+    subjectLengthWithGaps = subjectEnd - subjectStart + hitGaps
+    readLengthWithGaps = readEndInSubject - readStartInSubject + readGaps
+
+    unmatchedReadLeft = np.where(readPositive, readStartInSubject,
+                                 readLen - readEndInSubject)
+
+    positiveStart = subjectStart - unmatchedReadLeft
+    negativeEnd = subjectEnd + unmatchedReadLeft
+    readStartInSubject = np.where(hitPositive, positiveStart,
+                                  negativeEnd - readLen - readGaps)
+    readEndInSubject = np.where(hitPositive,
+                                positiveStart + readLen + readGaps,
+                                negativeEnd)
+
+    sanityCheckHSPs([
+        (readReversed,
+         lambda i: ('Assertion "read_start <= read_end" failed. Read '
+                    'positive is %s. read_start = %d, read_end = %d' %
+                    (bool(readPositive[i]), read_start[i], read_end[i]))),
+        (hitDescending,
+         lambda i: ('sbjct_start (%d) > sbjct_end (%d)' %
+                    (sbjct_start[i], sbjct_end[i]))),
+        (subjectLengthWithGaps != readLengthWithGaps,
+         lambda i: ('Including gaps, hit match length (%d) != Read match '
+                    'length (%d)' % (subjectLengthWithGaps[i],
+                                     readLengthWithGaps[i]))),
+        (readStartInSubject > subjectStart,
+         lambda i: 'readStartInSubject > subjectStart'),
+        (readEndInSubject < subjectEnd,
+         lambda i: 'readEndInSubject < subjectEnd'),
+    ])
+
+    return {
+        'readStart': read_start - 1,
+        'readEnd': read_end,
+        'readStartInSubject': readStartInSubject,
+        'readEndInSubject': readEndInSubject,
+        'subjectStart': subjectStart,
+        'subjectEnd': subjectEnd,
+    }
@@ -1,3 +1,77 @@
+from __future__ import division
+
+import re
+from operator import eq
+
+import numpy as np
+
+_DIGITS = re.compile(r'(\d+)')
+_CIGAR = re.compile(r'(\d+)([^\d])')
+
+
+def _btopError(s, run, offset, last):
+    """
+    Raise a C{ValueError} describing the first error in a run of letters in a
+    btop string.
+
+    @param s: The C{str} btop sequence.
+    @param run: The C{str} run of letters (between match counts) in C{s} that
+        contains an error.
+    @param offset: The C{int} offset of C{run} in C{s}.
+    @param last: If C{True}, C{run} is at the end of C{s}.
+    @raise ValueError: Unconditionally.
+    """
+    for index in range(0, len(run) - 1, 2):
+        queryLetter, subjectLetter = run[index], run[index + 1]
+        if queryLetter == subjectLetter:
+            if queryLetter == '-':
+                raise ValueError(
+                    'btop string %r has two consecutive gaps at offset %d' %
+                    (s, offset + index))
+            else:
+                raise ValueError(
+                    'btop string %r has two consecutive identical %r '
+                    'letters at offset %d' % (s, queryLetter, offset + index))
+
+    # The run must have an odd number of letters.
+    if last:
+        raise ValueError('btop string %r has a trailing query letter %r with '
+                         'no corresponding subject letter' % (s, run[-1]))
+    else:
+        raise ValueError(
+            'btop string %r has a query letter %r at offset %d with no '
+            'corresponding subject letter' % (s, run[-1],
+                                              offset + len(run) - 1))
+
+
+def _splitBtop(s):
+    """
+    Split a btop string into its runs of (query, subject) letter pairs and
+    its match counts, and check that it is valid.
+
+    The work is done on whole runs of letters or digits, using regular
+    expression splitting and string slicing, rather than one character at a
+    time.
+
+    @param s: A C{str} btop sequence.
+    @raise ValueError: If C{s} is not valid btop.
+    @return: A C{list} of C{str}s. Those at even indices are runs of letter
+        pairs (some may be empty) and those at odd indices are match counts.
+    """
+    parts = _DIGITS.split(s)
+    offset = 0
+    lastIndex = len(parts) - 1
+    for index in range(0, len(parts), 2):
+        run = parts[index]
+        if run and (len(run) % 2 or any(map(eq, run[::2], run[1::2]))):
+            _btopError(s, run, offset, index == lastIndex)
+        offset += len(run)
+        if index < lastIndex:
+            offset += len(parts[index + 1])
+
+    return parts
+
+
 def parseBtop(s):
     """
     Parse a btop string.
@@ -45,19 +119,294 @@ def parseBtop(s):
                          'no corresponding subject letter' % (s, queryLetter))
 
 
+def btopRuns(s):
+    """
+    Parse a btop string into run-length arrays of matches, mismatches, and
+    gaps, and the letters of the query and subject where they differ.
+
+    Unlike L{parseBtop}, this does not produce a separate token for each
+    pair of differing letters. Consecutive pairs of the same kind are one
+    run, and runs of matches separated by a zero count are merged.
+
+    The query is taken to be the read and the subject the reference, as in
+    SAM. So a gap in the subject is an insertion ('I') and a gap in the query
+    is a deletion ('D').
+
+    @param s: A C{str} btop sequence.
+    @raise ValueError: If C{s} is not valid btop.
+    @return: A 3-tuple with
+        - A numpy array of the one-letter C{str} kinds of the runs, '=' for
+          matches, 'X' for mismatches, 'I' for insertions, and 'D' for
+          deletions, in the order they occur in C{s}.
+        - A numpy C{int} array (parallel to the first) of the run lengths.
+        - A C{str} of the (query, subject) letter pairs of all runs that are
+          not matches, in order (so query letters are at even offsets and
+          subject letters at odd offsets).
+    """
+    kinds, lengths, letters = _runLists(s)
+    return (np.array(kinds, dtype='U1'), np.array(lengths, dtype=int),
+            letters)
+
+
+def _runLists(s, matchKind='=', mismatchKind='X'):
+    """
+    Parse a btop string into runs, as for L{btopRuns}, but without making
+    numpy arrays (which is slower for L{btopToCigar}).
+
+    @param s: A C{str} btop sequence.
+    @param matchKind: The C{str} kind to give runs of matches.
+    @param mismatchKind: The C{str} kind to give runs of mismatches. If this
+        is the same as C{matchKind}, adjacent runs of matches and mismatches
+        are merged.
+    @raise ValueError: If C{s} is not valid btop.
+    @return: A 3-tuple with a C{list} of C{str} run kinds, a C{list} of
+        C{int} run lengths, and the C{str} letters of the runs that are not
+        matches (see L{btopRuns}).
+    """
+    kinds = []
+    lengths = []
+    parts = _splitBtop(s)
+
+    for index, part in enumerate(parts):
+        if index % 2:
+            count = int(part)
+            if count:
+                if kinds and kinds[-1] == matchKind:
+                    lengths[-1] += count
+                else:
+                    kinds.append(matchKind)
+                    lengths.append(count)
+        else:
+            for queryLetter, subjectLetter in zip(part[::2], part[1::2]):
+                if queryLetter == '-':
+                    kind = 'D'
+                elif subjectLetter == '-':
+                    kind = 'I'
+                else:
+                    kind = mismatchKind
+                if kinds and kinds[-1] == kind:
+                    lengths[-1] += 1
+                else:
+                    kinds.append(kind)
+                    lengths.append(1)
+
+    return kinds, lengths, ''.join(parts[::2])
+
+
 def countGaps(s):
     """
     Count the query and subject gaps in a btop string.
 
-    @raises ValueError: If L{parseBtop} finds an error in the btop string C{s}.
+    @raises ValueError: If C{s} is not valid btop.
     @return: A 2-tuple of C{int}s, with the (query, subject) gaps counts as
         found in C{s}.
     """
-    queryGaps = subjectGaps = 0
-    for countOrMismatch in parseBtop(s):
-        if isinstance(countOrMismatch, tuple):
-            queryChar, subjectChar = countOrMismatch
-            queryGaps += int(queryChar == '-')
-            subjectGaps += int(subjectChar == '-')
+    # All runs of letters have an even length, so after joining them the
+    # query letters are still at even offsets and subject letters at odd.
+    letters = ''.join(_splitBtop(s)[::2])
+    return letters[::2].count('-'), letters[1::2].count('-')
+
+
+def alignmentFromBtop(s, query=None, subject=None):
+    """
+    Reconstruct the (gapped) query and subject sequences of an alignment from
+    its btop string and the (ungapped) matched region of either the query or
+    the subject.
+
+    Only one of the query and subject is needed because btop gives the
+    letters of both sequences at every position where they differ.
+
+    @param s: A C{str} btop sequence.
+    @param query: The C{str} matched region of the query, or C{None}.
+    @param subject: The C{str} matched region of the subject, or C{None}.
+    @raise ValueError: If neither or both of C{query} and C{subject} are
+        given, or if C{s} is not valid btop.
+    @return: A 2-tuple of C{str}s, with the query and subject sequences of the
+        alignment (which have equal lengths and contain '-' for gaps).
+    """
+    if (query is None) == (subject is None):
+        raise ValueError('Exactly one of query and subject must be given.')
+
+    if query is None:
+        sequence, start = subject, 1
+    else:
+        sequence, start = query, 0
+
+    offset = 0
+    queryParts = []
+    subjectParts = []
+
+    for index, part in enumerate(_splitBtop(s)):
+        if index % 2:
+            count = int(part)
+            matched = sequence[offset:offset + count]
+            queryParts.append(matched)
+            subjectParts.append(matched)
+            offset += count
+        elif part:
+            queryParts.append(part[::2])
+            subjectParts.append(part[1::2])
+            # Skip the letters of our sequence that are in the run (i.e.,
+            # those that are not gaps).
+            letters = part[start::2]
+            offset += len(letters) - letters.count('-')
+
+    return ''.join(queryParts), ''.join(subjectParts)
+
+
+def btopStats(btops):
+    """
+    Calculate alignment statistics for many btop strings at once.
+
+    @param btops: An iterable of C{str} btop sequences.
+    @raise ValueError: If any btop string is not valid.
+    @return: A C{dict} with C{str} keys and numpy array values, with one
+        element per btop string. Keys are
+            alignmentLength
+            identicalCount
+            mismatchCount
+            queryGaps
+            subjectGaps
+        whose values are C{int} arrays, and 'identity', whose value is a
+        C{float} array of the fraction of the alignment length that is
+        identical (zero for an empty btop string).
+    """
+    identicalCounts = []
+    pairCounts = []
+    queryGaps = []
+    subjectGaps = []
+
+    for s in btops:
+        parts = _splitBtop(s)
+        letters = ''.join(parts[::2])
+        identicalCounts.append(sum(map(int, parts[1::2])))
+        pairCounts.append(len(letters) >> 1)
+        queryGaps.append(letters[::2].count('-'))
+        subjectGaps.append(letters[1::2].count('-'))
+
+    identicalCount = np.array(identicalCounts, dtype=int)
+    pairCount = np.array(pairCounts, dtype=int)
+    queryGaps = np.array(queryGaps, dtype=int)
+    subjectGaps = np.array(subjectGaps, dtype=int)
+    alignmentLength = identicalCount + pairCount
+
+    identity = np.zeros(len(alignmentLength))
+    nonEmpty = alignmentLength > 0
+    identity[nonEmpty] = identicalCount[nonEmpty] / alignmentLength[nonEmpty]
+
+    return {
+        'alignmentLength': alignmentLength,
+        'identicalCount': identicalCount,
+        'identity': identity,
+        'mismatchCount': pairCount - queryGaps - subjectGaps,
+        'queryGaps': queryGaps,
+        'subjectGaps': subjectGaps,
+    }
+
+
+def btopToCigar(s, concise=False):
+    """
+    Convert a btop string to a CIGAR string.
+
+    The query is taken to be the read and the subject the reference, as in
+    SAM. So a gap in the subject is an insertion ('I') and a gap in the query
+    is a deletion ('D').
+
+    @param s: A C{str} btop sequence.
+    @param concise: If C{True}, use 'M' for both matches and mismatches.
+        Otherwise, use '=' for matches and 'X' for mismatches.
+    @raise ValueError: If C{s} is not valid btop.
+    @return: A C{str} CIGAR string.
+    """
+    if concise:
+        kinds, lengths, _ = _runLists(s, 'M', 'M')
+    else:
+        kinds, lengths, _ = _runLists(s)
+
+    return ''.join('%d%s' % (length, kind)
+                   for length, kind in zip(lengths, kinds))
+
+
+def cigarToBtop(cigar, query, subject):
+    """
+    Convert a CIGAR string to a btop string.
+
+    A CIGAR string does not give the letters where the query and subject
+    differ, so the (ungapped) query and subject are needed too. As in SAM,
+    the query is taken to be the read and the subject the reference.
+
+    @param cigar: A C{str} CIGAR string. Only the 'M', '=', 'X', 'I', 'D',
+        'S', and 'H' operations may be used.
+    @param query: The C{str} query. If C{cigar} has soft clipping ('S'),
+        this must include the clipped letters.
+    @param subject: The C{str} matched region of the subject.
+    @raise ValueError: If C{cigar} is not valid, has an operation that cannot
+        be converted, or is not consistent with C{query} and C{subject}.
+    @return: A C{str} btop string.
+    """
+    operations = _CIGAR.findall(cigar)
+    if sum(len(count) + 1 for count, _ in operations) != len(cigar):
+        raise ValueError('Invalid CIGAR string %r.' % cigar)
+
+    parts = []
+    matches = queryOffset = subjectOffset = 0
+
+    for count, operation in operations:
+        count = int(count)
+        queryEnd = queryOffset + count
+        subjectEnd = subjectOffset + count
+
+        if operation in 'M=XIS' and queryEnd > len(query):
+            raise ValueError('CIGAR string %r is longer than the query.' %
+                             cigar)
+        if operation in 'M=XD' and subjectEnd > len(subject):
+            raise ValueError('CIGAR string %r is longer than the subject.' %
+                             cigar)
+
+        if operation == '=':
+            matches += count
+        elif operation in 'MX':
+            for queryLetter, subjectLetter in zip(
+                    query[queryOffset:queryEnd],
+                    subject[subjectOffset:subjectEnd]):
+                if queryLetter == subjectLetter:
+                    if operation == 'X':
+                        raise ValueError(
+                            'CIGAR string %r has a mismatch where the query '
+                            'and subject both have %r.' %
+                            (cigar, queryLetter))
+                    matches += 1
+                else:
+                    if matches:
+                        parts.append(str(matches))
+                        matches = 0
+                    parts.append(queryLetter + subjectLetter)
+        elif operation == 'I':
+            if matches:
+                parts.append(str(matches))
+                matches = 0
+            parts.extend(letter + '-' for letter in
+                         query[queryOffset:queryEnd])
+            subjectEnd = subjectOffset
+        elif operation == 'D':
+            if matches:
+                parts.append(str(matches))
+                matches = 0
+            parts.extend('-' + letter for letter in
+                         subject[subjectOffset:subjectEnd])
+            queryEnd = queryOffset
+        elif operation == 'S':
+            subjectEnd = subjectOffset
+        elif operation == 'H':
+            queryEnd, subjectEnd = queryOffset, subjectOffset
+        else:
+            raise ValueError('CIGAR string %r has an operation (%r) that '
+                             'cannot be converted to btop.' %
+                             (cigar, operation))
+
+        queryOffset, subjectOffset = queryEnd, subjectEnd
+
+    if matches:
+        parts.append(str(matches))
 
-    return (queryGaps, subjectGaps)
+    return ''.join(parts)
@@ -3,9 +3,9 @@ from math import log10
 import copy
 
 from dark.alignments import (
-    ReadsAlignments, ReadAlignments, ReadsAlignmentsParams)
+    ReadsAlignments, ReadAlignments, ReadsAlignmentsParams, SubjectTitles)
 from dark.diamond.conversion import JSONRecordsReader
-from dark.fasta import FastaReads, SqliteIndex
+from dark.fasta import SqliteIndex, fastaIndex
 from dark.reads import AAReadWithX
 from dark.score import HigherIsBetterScore
 from dark.utils import numericallySortFilenames
@@ -19,7 +19,8 @@ class DiamondReadsAlignments(ReadsAlignments):
 
     @param reads: A L{dark.reads.Reads} instance providing the sequences that
         were given to DIAMOND as queries. Note that the order of the reads
-        *MUST* match the order of the records in the DIAMOND output files.
+        *MUST* match the order of the records in the DIAMOND output files,
+        unless C{readIndex} is given.
     @param filenames: Either a single C{str} filename or a C{list} of C{str}
         file names containing our (possibly bzip2 compressed) per-line JSON
         produced by C{bin/convert-diamond-to-json.py} from DIAMOND XML output.
@@ -28,7 +29,9 @@ class DiamondReadsAlignments(ReadsAlignments):
         produced by C{bin/convert-diamond-to-json.py} from DIAMOND XML output.
     @param databaseFilename: A C{str} holding the name of the FASTA file used
         to make the DIAMOND database. Cannot be used with
-        C{sqliteDatabaseFilename}.
+        C{sqliteDatabaseFilename}. An index of the FASTA file is saved next
+        to it (see L{dark.fasta.IndexedFasta}) the first time a subject is
+        looked up.
     @param databaseDirectory: The directory where the FASTA file
         used to make the DIAMOND database can be found. This argument is only
         useful when sqliteDatabaseFilename is specified.
@@ -45,6 +48,16 @@ class DiamondReadsAlignments(ReadsAlignments):
         by our HTCondor jobs.
     @param randomizeZeroEValues: If C{True}, e-values that are zero will be set
         to a random (very good) value.
+    @param readIndex: A C{dict}-like object that returns the read with a given
+        id (e.g., a L{dark.alignments.ReadIdIndex} made from C{reads}, or a
+        L{dark.fasta.IndexedFasta}). If given, the read for each DIAMOND record
+        is found by its query id, so the DIAMOND output files (and the records
+        in them) can be in any order. Reads in C{reads} that have no record
+        are yielded (with no alignments) after all records have been read.
+    @param compact: If C{True}, HSPs do not hold the matched read and subject
+        sequences given in the JSON. Instead, these are made from the HSP
+        btop string and the read the first time they are used. This saves
+        memory when the matched sequences are not needed.
     @raises ValueError: if a file type is not recognized, or if the number of
         reads does not match the number of records found in the DIAMOND result
         files, or if neither (or both) of databaseFilename and
@@ -54,7 +67,7 @@ class DiamondReadsAlignments(ReadsAlignments):
     def __init__(self, reads, filenames, databaseFilename=None,
                  databaseDirectory=None, sqliteDatabaseFilename=None,
                  scoreClass=HigherIsBetterScore, sortFilenames=False,
-                 randomizeZeroEValues=True):
+                 randomizeZeroEValues=True, readIndex=None, compact=False):
         if databaseFilename is None and sqliteDatabaseFilename is None:
             raise ValueError(
                 'Either databaseFilename or sqliteDatabaseFilename must be '
@@ -75,9 +88,16 @@ class DiamondReadsAlignments(ReadsAlignments):
         self._databaseDirectory = databaseDirectory
         self._subjectTitleToSubject = None
         self.randomizeZeroEValues = randomizeZeroEValues
+        self._readIndex = readIndex
+        self._compact = compact
+
+        # All readers share one subject title table, so titles are interned
+        # and numbered consistently across all input files.
+        subjectTitles = SubjectTitles()
 
         # Prepare diamondTask parameters in order to initialize self.
-        self._reader = self._getReader(self.filenames[0], scoreClass)
+        self._reader = self._getReader(self.filenames[0], scoreClass,
+                                       subjectTitles)
         diamondTask = self._reader.diamondTask
         diamondParams = copy.deepcopy(self._reader.params)
         scoreTitle = ('Bit score' if scoreClass is HigherIsBetterScore
@@ -89,21 +109,66 @@ class DiamondReadsAlignments(ReadsAlignments):
             scoreTitle=scoreTitle)
 
         ReadsAlignments.__init__(self, reads, diamondTaskParams,
-                                 scoreClass=scoreClass)
+                                 scoreClass=scoreClass,
+                                 subjectTitles=subjectTitles)
 
-    def _getReader(self, filename, scoreClass):
+    def _getReader(self, filename, scoreClass, subjectTitles):
         """
         Obtain a JSON record reader for DIAMOND records.
 
         @param filename: The C{str} file name holding the JSON.
         @param scoreClass: A class to hold and compare scores (see scores.py).
+        @param subjectTitles: The L{SubjectTitles} instance for the reader
+            to use.
         """
         if filename.endswith('.json') or filename.endswith('.json.bz2'):
-            return JSONRecordsReader(filename, scoreClass)
+            return JSONRecordsReader(filename, scoreClass, subjectTitles,
+                                     compact=self._compact)
         else:
             raise ValueError(
                 'Unknown DIAMOND record file suffix for file %r.' % filename)
 
+    def resultFilenames(self):
+        """
+        Get the names of the DIAMOND files the alignments are read from.
+
+        @return: A C{list} of C{str} file names, in the order they are read.
+        """
+        return list(self.filenames)
+
+    def readerOptions(self):
+        """
+        Get the options that change the alignments that are read or how they
+        are treated.
+
+        @return: A C{dict} of option names and values.
+        """
+        return {
+            'compact': self._compact,
+            'randomizeZeroEValues': self.randomizeZeroEValues,
+        }
+
+    def forFiles(self, filenames, readIndex):
+        """
+        Make a copy of this instance that reads the alignments in just some
+        of our DIAMOND files, finding their reads by id.
+
+        @param filenames: A non-empty C{list} of C{str} file names, each of
+            which must be one of those returned by C{resultFilenames}.
+        @param readIndex: A L{dark.alignments.ReadIdIndex} (or similar)
+            instance to look up the reads in the records by id.
+        @return: A L{DiamondReadsAlignments} instance.
+        """
+        result = copy.copy(self)
+        result.filenames = filenames
+        result.reads = []
+        result._readIndex = readIndex
+        # Our own reader may already have been (partly) read, so the copy
+        # always gets a new one.
+        result._reader = self._getReader(filenames[0], self.scoreClass,
+                                         self.subjectTitles)
+        return result
+
     def iter(self):
         """
         Extract DIAMOND records and yield C{ReadAlignments} instances.
@@ -116,6 +181,11 @@ class DiamondReadsAlignments(ReadsAlignments):
         # each input file.
 
         reads = iter(self.reads)
+        recordFilter = self.recordFilter()
+        readIndex = self._readIndex
+        # The ids of the reads found in the DIAMOND records, if we are looking
+        # reads up by id.
+        readIds = set()
         first = True
 
         for filename in self.filenames:
@@ -124,14 +194,28 @@ class DiamondReadsAlignments(ReadsAlignments):
                 first = False
                 reader = self._reader
             else:
-                reader = self._getReader(filename, self.scoreClass)
+                reader = self._getReader(filename, self.scoreClass,
+                                         self.subjectTitles)
+
+            if readIndex is None:
+                readsAlignments = reader.readAlignments(
+                    reads, recordFilter=recordFilter)
+            else:
+                readsAlignments = reader.readAlignmentsById(
+                    readIndex, recordFilter=recordFilter, readIds=readIds)
 
-            for readAlignments in reader.readAlignments(reads):
+            for readAlignments in readsAlignments:
                 yield readAlignments
 
-        # Any remaining query reads must have had no subject matches.
-        for read in reads:
-            yield ReadAlignments(read, [])
+        if readIndex is None:
+            # Any remaining query reads must have had no subject matches.
+            for read in reads:
+                yield ReadAlignments(read, [])
+        else:
+            # Yield the reads that had no DIAMOND record.
+            for read in self.reads:
+                if read.id not in readIds:
+                    yield ReadAlignments(read, [])
 
     def getSubjectSequence(self, title):
         """
@@ -150,12 +234,11 @@ class DiamondReadsAlignments(ReadsAlignments):
                     fastaDirectory=self._databaseDirectory,
                     readClass=AAReadWithX)
             else:
-                # Build a dict to look up subjects.
-                titles = {}
-                for read in FastaReads(self._databaseFilename,
-                                       readClass=AAReadWithX):
-                    titles[read.id] = read
-                self._subjectTitleToSubject = titles
+                # Use an index of the offsets of the subjects in the FASTA
+                # (if it can be made), so only the subjects actually asked
+                # for are read.
+                self._subjectTitleToSubject = fastaIndex(
+                    self._databaseFilename, readClass=AAReadWithX)
 
         return self._subjectTitleToSubject[title]
 
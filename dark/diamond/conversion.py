@@ -2,15 +2,211 @@ from __future__ import print_function
 
 import six
 import bz2
+import bz2file
+from collections import deque
+from functools import partial
 from json import dumps, loads
+from multiprocessing import Pool
 from operator import itemgetter
 
 from Bio.File import as_handle
+from Bio.Seq import translate
 
 from dark.hsp import HSP, LSP
 from dark.score import HigherIsBetterScore
-from dark.alignments import Alignment, ReadAlignments
-from dark.diamond.hsp import normalizeHSP
+from dark.alignments import (
+    Alignment, ReadAlignments, SubjectTitles, lookupRead)
+from dark.btop import alignmentFromBtop, countGaps
+from dark.diamond.hsp import normalizeHSP, normalizeHSPs
+from dark.jsonindex import JSONRecordIndex
+from dark.reads import DNARead
+
+
+def _recordsFromLines(lines, compact=False):
+    """
+    Convert lines of DIAMOND tabular output to records.
+
+    @param lines: An iterable of C{str} lines of DIAMOND tabular output (see
+        L{DiamondTabularFormatReader} for the required format).
+    @param compact: If C{True}, do not include the matched query and subject
+        sequences ('query' and 'sbjct') in the HSPs. They can be made again
+        from the HSP btop string and the query (see L{_matchedSequences}).
+    @return: A generator that produces C{dict}s containing 'alignments' and
+        'query' C{str} keys.
+    """
+    previousQtitle = None
+    subjectsSeen = {}
+    record = {}
+    for line in lines:
+        line = line[:-1]
+        try:
+            (qtitle, stitle, bitscore, evalue, qframe, qseq,
+             qstart, qend, sseq, sstart, send, slen, btop, nident,
+             positive) = line.split('\t')
+        except ValueError as e:
+            # We may not be able to find 'nident' and 'positives'
+            # because they were added in version 2.0.3 and will not
+            # be present in any of our JSON output generated before
+            # that. So those values will be None when reading
+            # DIAMOND output without those fields, but that's much
+            # better than no longer being able to read that data.
+            if six.PY2:
+                error = 'need more than 13 values to unpack'
+            else:
+                error = (
+                    'not enough values to unpack (expected 15, '
+                    'got 13)')
+            if str(e) == error:
+                (qtitle, stitle, bitscore, evalue, qframe,
+                 qseq, qstart, qend, sseq, sstart, send, slen,
+                 btop) = line.split('\t')
+                nident = positive = None
+            else:
+                raise
+        hsp = {
+            'bits': float(bitscore),
+            'btop': btop,
+            'expect': float(evalue),
+            'frame': int(qframe),
+            'identicalCount': None if nident is None else int(nident),
+            'positiveCount': (
+                None if positive is None else int(positive)),
+            'query': qseq,
+            'query_start': int(qstart),
+            'query_end': int(qend),
+            'sbjct': sseq,
+            'sbjct_start': int(sstart),
+            'sbjct_end': int(send),
+        }
+        if compact:
+            del hsp['query'], hsp['sbjct']
+        if previousQtitle == qtitle:
+            # We have already started accumulating alignments for this
+            # query.
+            if stitle not in subjectsSeen:
+                # We have not seen this subject before, so this is a
+                # new alignment.
+                subjectsSeen.add(stitle)
+                alignment = {
+                    'hsps': [hsp],
+                    'length': int(slen),
+                    'title': stitle,
+                }
+                record['alignments'].append(alignment)
+            else:
+                # We have already seen this subject, so this is another
+                # HSP in an already existing alignment.
+                for alignment in record['alignments']:
+                    if alignment['title'] == stitle:
+                        alignment['hsps'].append(hsp)
+                        break
+        else:
+            # All alignments for the previous query id (if any)
+            # have been seen.
+            if previousQtitle is not None:
+                yield record
+
+            # Start building up the new record.
+            record = {}
+            subjectsSeen = {stitle}
+            alignment = {
+                'hsps': [hsp],
+                'length': int(slen),
+                'title': stitle,
+            }
+            record['alignments'] = [alignment]
+            record['query'] = qtitle
+
+            previousQtitle = qtitle
+
+    # Yield the last record, if any.
+    if record:
+        yield record
+
+
+def _queryBlocks(lines, blockSize):
+    """
+    Split lines of DIAMOND tabular output into blocks, without splitting the
+    lines for any query across blocks.
+
+    @param lines: An iterable of C{str} lines of DIAMOND tabular output.
+    @param blockSize: The C{int} minimum number of lines in a block. Only the
+        last block may have fewer lines.
+    @return: A generator that produces C{list}s of C{str} lines.
+    """
+    block = []
+    previousQtitle = None
+    for line in lines:
+        qtitle = line.split('\t', 1)[0]
+        if len(block) >= blockSize and qtitle != previousQtitle:
+            yield block
+            block = []
+        block.append(line)
+        previousQtitle = qtitle
+
+    if block:
+        yield block
+
+
+def _matchedSequences(btop, frame, queryStart, queryEnd, diamondTask,
+                      sequence):
+    """
+    Make the matched query and subject sequences of a DIAMOND HSP from its
+    btop string and the query.
+
+    The sequences are those DIAMOND gives (as 'qseq' and 'sseq') and that
+    are kept in our JSON when it is not compact, i.e., they have no gaps.
+
+    @param btop: The C{str} btop string of the HSP.
+    @param frame: The C{int} query frame of the HSP.
+    @param queryStart: The C{int} 1-based query start offset of the HSP, as
+        given by DIAMOND.
+    @param queryEnd: The C{int} 1-based query end offset of the HSP, as given
+        by DIAMOND.
+    @param diamondTask: The C{str} command-line matching algorithm that was
+        run (either 'blastx' or 'blastp').
+    @param sequence: The C{str} query sequence (nucleotides for blastx, amino
+        acids for blastp). This is the last argument so the others can be
+        given (with C{functools.partial}) when an HSP is made, and the query
+        only looked up if the matched sequences are needed.
+    @raise ValueError: If C{btop} is not valid.
+    @return: A 2-tuple with the C{str} matched query and subject sequences.
+    """
+    if diamondTask == 'blastx':
+        if frame < 0:
+            # DIAMOND gives the offsets of reverse complemented matches
+            # from the end of the query.
+            matched = DNARead(
+                'id', sequence[queryEnd - 1:queryStart]).reverseComplement()
+            matched = matched.sequence
+        else:
+            matched = sequence[queryStart - 1:queryEnd]
+        matched = translate(matched[:len(matched) - len(matched) % 3])
+    else:
+        matched = sequence[queryStart - 1:queryEnd]
+
+    query, subject = alignmentFromBtop(btop, query=matched)
+
+    return query.replace('-', ''), subject.replace('-', '')
+
+
+def _linesToJSON(lines, bzip2=False, compact=False):
+    """
+    Convert lines of DIAMOND tabular output to our JSON format (one line of
+    JSON per record). This is run in worker processes by
+    L{DiamondTabularFormatReader.saveAsJSON}, so must be a module-level
+    function.
+
+    @param lines: A C{list} of C{str} lines of DIAMOND tabular output, which
+        must hold all the lines for the queries they are for.
+    @param bzip2: If C{True}, return the JSON compressed as a bzip2 stream.
+    @param compact: If C{True}, do not include the matched sequences in the
+        HSPs (see L{_recordsFromLines}).
+    @return: A C{str} of JSON, or C{bytes} if C{bzip2} is C{True}.
+    """
+    json = ''.join(dumps(record, sort_keys=True) + '\n'
+                   for record in _recordsFromLines(lines, compact))
+    return bz2.compress(json.encode('UTF-8')) if bzip2 else json
 
 
 class DiamondTabularFormatReader(object):
@@ -24,10 +220,19 @@ class DiamondTabularFormatReader(object):
 
     @param filename: A C{str} filename or an open file pointer, containing
         DIAMOND tabular records.
+    @param compact: If C{True}, do not include the matched query and subject
+        sequences in the HSPs of the records. This makes much smaller JSON.
+        The sequences are made again (from the HSP btop and the reads) when
+        the JSON is read, but only if they are used.
     """
 
-    def __init__(self, filename):
+    # The minimum number of lines of DIAMOND output given to a worker process
+    # at once by saveAsJSON.
+    BLOCK_SIZE = 10000
+
+    def __init__(self, filename, compact=False):
         self._filename = filename
+        self._compact = compact
         self.application = 'DIAMOND'
         self.params = {
             'application': self.application,
@@ -49,94 +254,10 @@ class DiamondTabularFormatReader(object):
             'query' C{str} keys.
         """
         with as_handle(self._filename) as fp:
-            previousQtitle = None
-            subjectsSeen = {}
-            record = {}
-            for line in fp:
-                line = line[:-1]
-                try:
-                    (qtitle, stitle, bitscore, evalue, qframe, qseq,
-                     qstart, qend, sseq, sstart, send, slen, btop, nident,
-                     positive) = line.split('\t')
-                except ValueError as e:
-                    # We may not be able to find 'nident' and 'positives'
-                    # because they were added in version 2.0.3 and will not
-                    # be present in any of our JSON output generated before
-                    # that. So those values will be None when reading
-                    # DIAMOND output without those fields, but that's much
-                    # better than no longer being able to read that data.
-                    if six.PY2:
-                        error = 'need more than 13 values to unpack'
-                    else:
-                        error = (
-                            'not enough values to unpack (expected 15, '
-                            'got 13)')
-                    if str(e) == error:
-                        (qtitle, stitle, bitscore, evalue, qframe,
-                         qseq, qstart, qend, sseq, sstart, send, slen,
-                         btop) = line.split('\t')
-                        nident = positive = None
-                    else:
-                        raise
-                hsp = {
-                    'bits': float(bitscore),
-                    'btop': btop,
-                    'expect': float(evalue),
-                    'frame': int(qframe),
-                    'identicalCount': None if nident is None else int(nident),
-                    'positiveCount': (
-                        None if positive is None else int(positive)),
-                    'query': qseq,
-                    'query_start': int(qstart),
-                    'query_end': int(qend),
-                    'sbjct': sseq,
-                    'sbjct_start': int(sstart),
-                    'sbjct_end': int(send),
-                }
-                if previousQtitle == qtitle:
-                    # We have already started accumulating alignments for this
-                    # query.
-                    if stitle not in subjectsSeen:
-                        # We have not seen this subject before, so this is a
-                        # new alignment.
-                        subjectsSeen.add(stitle)
-                        alignment = {
-                            'hsps': [hsp],
-                            'length': int(slen),
-                            'title': stitle,
-                        }
-                        record['alignments'].append(alignment)
-                    else:
-                        # We have already seen this subject, so this is another
-                        # HSP in an already existing alignment.
-                        for alignment in record['alignments']:
-                            if alignment['title'] == stitle:
-                                alignment['hsps'].append(hsp)
-                                break
-                else:
-                    # All alignments for the previous query id (if any)
-                    # have been seen.
-                    if previousQtitle is not None:
-                        yield record
-
-                    # Start building up the new record.
-                    record = {}
-                    subjectsSeen = {stitle}
-                    alignment = {
-                        'hsps': [hsp],
-                        'length': int(slen),
-                        'title': stitle,
-                    }
-                    record['alignments'] = [alignment]
-                    record['query'] = qtitle
-
-                    previousQtitle = qtitle
-
-            # Yield the last record, if any.
-            if record:
+            for record in _recordsFromLines(fp, self._compact):
                 yield record
 
-    def saveAsJSON(self, fp, writeBytes=False):
+    def saveAsJSON(self, fp, writeBytes=False, workers=1, bzip2=False):
         """
         Write the records out as JSON. The first JSON object saved contains
         information about the DIAMOND algorithm.
@@ -144,8 +265,21 @@ class DiamondTabularFormatReader(object):
         @param fp: A C{str} file pointer to write to.
         @param writeBytes: If C{True}, the JSON will be written out as bytes
             (not strings). This is required when we are writing to a BZ2 file.
+        @param workers: The C{int} number of processes to use to convert the
+            records to JSON. If greater than one, the DIAMOND output is split
+            into blocks of at least C{BLOCK_SIZE} lines (without splitting
+            the lines for a query) that are converted by worker processes.
+            The JSON is written in the original record order and is the same
+            as that written by a single process.
+        @param bzip2: If C{True}, compress the JSON (in the worker processes,
+            if C{workers} is greater than one) and write it as C{bytes} to
+            C{fp}, which must not itself be a BZ2 file. The output is a series
+            of concatenated bzip2 streams (one per block), which can be read
+            by the Python C{bz2} module and by bzip2 itself.
         """
-        if writeBytes:
+        if workers > 1 or bzip2:
+            self._saveBlocksAsJSON(fp, writeBytes, workers, bzip2)
+        elif writeBytes:
             fp.write(dumps(self.params, sort_keys=True).encode('UTF-8'))
             fp.write(b'\n')
             for record in self.records():
@@ -158,6 +292,45 @@ class DiamondTabularFormatReader(object):
                 fp.write(six.u(dumps(record, sort_keys=True)))
                 fp.write(six.u('\n'))
 
+    def _saveBlocksAsJSON(self, fp, writeBytes, workers, bzip2):
+        """
+        Write the records out as JSON, converting blocks of DIAMOND output
+        in worker processes. See C{saveAsJSON} for the arguments.
+        """
+        def write(json):
+            if bzip2:
+                fp.write(json)
+            elif writeBytes:
+                fp.write(json.encode('UTF-8'))
+            else:
+                fp.write(six.u(json))
+
+        params = dumps(self.params, sort_keys=True) + '\n'
+        write(bz2.compress(params.encode('UTF-8')) if bzip2 else params)
+
+        with as_handle(self._filename) as inFp:
+            blocks = _queryBlocks(inFp, self.BLOCK_SIZE)
+            if workers > 1:
+                pool = Pool(workers)
+                try:
+                    # Keep only a few blocks pending, so we don't read all the
+                    # input into memory if the workers can't keep up.
+                    pending = deque()
+                    for block in blocks:
+                        pending.append(
+                            pool.apply_async(_linesToJSON,
+                                             (block, bzip2, self._compact)))
+                        if len(pending) > 2 * workers:
+                            write(pending.popleft().get())
+                    while pending:
+                        write(pending.popleft().get())
+                finally:
+                    pool.terminate()
+                    pool.join()
+            else:
+                for block in blocks:
+                    write(_linesToJSON(block, bzip2, self._compact))
+
 
 class JSONRecordsReader(object):
     """
@@ -168,15 +341,34 @@ class JSONRecordsReader(object):
     @param scoreClass: A class to hold and compare scores (see scores.py).
         Default is C{HigherIsBetterScore}, for comparing bit scores. If you
         are using e-values, pass LowerIsBetterScore instead.
+    @param subjectTitles: A L{dark.alignments.SubjectTitles} instance to use
+        to intern and number the subject titles of alignments. If C{None}, a
+        new one will be made.
+    @param compact: If C{True}, do not keep the matched sequences given in
+        the JSON in HSPs. Instead, keep the HSP btop and make the matched
+        sequences from it (and the read) if they are used. HSPs in JSON
+        written without matched sequences (see L{DiamondTabularFormatReader})
+        are always handled this way.
     """
-    def __init__(self, filename, scoreClass=HigherIsBetterScore):
+
+    # The number of records whose HSPs are normalized together. Batch
+    # normalization only beats normalizing HSPs one at a time when it is
+    # given many HSPs, so this should not be small.
+    CHUNK_SIZE = 1000
+
+    def __init__(self, filename, scoreClass=HigherIsBetterScore,
+                 subjectTitles=None, compact=False):
         self._filename = filename
         self._scoreClass = scoreClass
+        self._compact = compact
+        self._subjectTitles = (SubjectTitles() if subjectTitles is None
+                               else subjectTitles)
         if scoreClass is HigherIsBetterScore:
             self._hspClass = HSP
         else:
             self._hspClass = LSP
 
+        self._index = None
         self._open(filename)
         self.diamondTask = self.params['task']
 
@@ -194,7 +386,10 @@ class JSONRecordsReader(object):
             if six.PY3:
                 self._fp = bz2.open(filename, mode='rt', encoding='UTF-8')
             else:
-                self._fp = bz2.BZ2File(filename)
+                # The bz2 module of Python 2 stops reading at the end of
+                # the first bzip2 stream, but a file may hold several (see
+                # DiamondTabularFormatReader.saveAsJSON).
+                self._fp = bz2file.BZ2File(filename)
         else:
             self._fp = open(filename)
 
@@ -209,7 +404,7 @@ class JSONRecordsReader(object):
                 'Could not convert first line of %r to JSON (%s). '
                 'Line is %r.' % (self._filename, e, line[:-1]))
 
-    def _dictToAlignments(self, diamondDict, read):
+    def _dictToAlignments(self, diamondDict, read, normalized=None):
         """
         Take a dict (made by DiamondTabularFormatReader.records)
         and convert it to a list of alignments.
@@ -217,30 +412,51 @@ class JSONRecordsReader(object):
         @param diamondDict: A C{dict}, from records().
         @param read: A C{Read} instance, containing the read that DIAMOND used
             to create this record.
+        @param normalized: An iterator yielding the already normalized
+            offsets (as returned by C{normalizeHSP}) of the HSPs in
+            C{diamondDict}, or C{None} if the HSPs should be normalized here.
         @return: A C{list} of L{dark.alignment.Alignment} instances.
         """
         alignments = []
         getScore = itemgetter('bits' if self._hspClass is HSP else 'expect')
 
+        addTitle = self._subjectTitles.add
+
         for diamondAlignment in diamondDict['alignments']:
-            alignment = Alignment(diamondAlignment['length'],
-                                  diamondAlignment['title'])
+            title, subjectId = addTitle(diamondAlignment['title'])
+            alignment = Alignment(diamondAlignment['length'], title, subjectId)
             alignments.append(alignment)
             for diamondHsp in diamondAlignment['hsps']:
                 score = getScore(diamondHsp)
-                normalized = normalizeHSP(diamondHsp, len(read),
-                                          self.diamondTask)
+                if normalized is None:
+                    offsets = normalizeHSP(diamondHsp, len(read),
+                                           self.diamondTask)
+                else:
+                    offsets = next(normalized)
+                if self._compact or 'query' not in diamondHsp:
+                    readMatchedSequence = subjectMatchedSequence = None
+                    # The read is not given here. The HSP finds it (via
+                    # the ReadAlignments or TitleAlignment that holds it)
+                    # only if the matched sequences are needed.
+                    matchedSequences = partial(
+                        _matchedSequences, diamondHsp['btop'],
+                        diamondHsp['frame'], diamondHsp['query_start'],
+                        diamondHsp['query_end'], self.diamondTask)
+                else:
+                    readMatchedSequence = diamondHsp['query']
+                    subjectMatchedSequence = diamondHsp['sbjct']
+                    matchedSequences = None
                 hsp = self._hspClass(
                     score,
-                    readStart=normalized['readStart'],
-                    readEnd=normalized['readEnd'],
-                    readStartInSubject=normalized['readStartInSubject'],
-                    readEndInSubject=normalized['readEndInSubject'],
+                    readStart=offsets['readStart'],
+                    readEnd=offsets['readEnd'],
+                    readStartInSubject=offsets['readStartInSubject'],
+                    readEndInSubject=offsets['readEndInSubject'],
                     readFrame=diamondHsp['frame'],
-                    subjectStart=normalized['subjectStart'],
-                    subjectEnd=normalized['subjectEnd'],
-                    readMatchedSequence=diamondHsp['query'],
-                    subjectMatchedSequence=diamondHsp['sbjct'],
+                    subjectStart=offsets['subjectStart'],
+                    subjectEnd=offsets['subjectEnd'],
+                    readMatchedSequence=readMatchedSequence,
+                    subjectMatchedSequence=subjectMatchedSequence,
                     # Use blastHsp.get on identicalCount and positiveCount
                     # because they were added in version 2.0.3 and will not
                     # be present in any of our JSON output generated before
@@ -248,29 +464,151 @@ class JSONRecordsReader(object):
                     # but that's much better than no longer being able to
                     # read all that data.
                     identicalCount=diamondHsp.get('identicalCount'),
-                    positiveCount=diamondHsp.get('positiveCount'))
+                    positiveCount=diamondHsp.get('positiveCount'),
+                    btop=diamondHsp['btop'],
+                    matchedSequences=matchedSequences)
 
                 alignment.addHsp(hsp)
 
         return alignments
 
-    def readAlignments(self, reads):
+    def _chunkToReadAlignments(self, chunk):
         """
-        Read lines of JSON from self._filename, convert them to read alignments
-        and yield them.
+        Convert a chunk of records to read alignments, normalizing all their
+        HSPs with one call to C{normalizeHSPs}.
 
-        @param reads: An iterable of L{Read} instances, corresponding to the
-            reads that were given to DIAMOND.
-        @raise ValueError: If any of the lines in the file cannot be converted
-            to JSON.
+        @param chunk: A C{list} of (L{Read}, C{dict}) 2-tuples, each with a
+            read and its DIAMOND record. The record may be C{None} for a read
+            that had no DIAMOND matches.
+        @raise AssertionError: If an HSP cannot be normalized.
         @return: A generator that yields C{dark.alignments.ReadAlignments}
             instances.
         """
+        hsps = []
+        queryLens = []
+        normalized = iter(())
+        for read, record in chunk:
+            if record is not None:
+                queryLen = len(read)
+                for alignment in record['alignments']:
+                    for hsp in alignment['hsps']:
+                        hsps.append(hsp)
+                        queryLens.append(queryLen)
+
+        if hsps:
+            gaps = [countGaps(hsp['btop']) for hsp in hsps]
+            try:
+                normalized = normalizeHSPs(
+                    [hsp['query_start'] for hsp in hsps],
+                    [hsp['query_end'] for hsp in hsps],
+                    [hsp['sbjct_start'] for hsp in hsps],
+                    [hsp['sbjct_end'] for hsp in hsps],
+                    [hsp['frame'] for hsp in hsps],
+                    queryLens,
+                    [queryGaps for queryGaps, _ in gaps],
+                    [subjectGaps for _, subjectGaps in gaps],
+                    self.diamondTask)
+            except AssertionError:
+                # Normalize the HSPs one at a time, to get the detailed
+                # debugging output of normalizeHSP for the offending HSP.
+                for read, record in chunk:
+                    if record is not None:
+                        self._dictToAlignments(record, read)
+                raise
+
+            keys = sorted(normalized)
+            normalized = (dict(zip(keys, values)) for values in
+                          zip(*[normalized[key].tolist() for key in keys]))
+
+        for read, record in chunk:
+            if record is None:
+                alignments = []
+            else:
+                alignments = self._dictToAlignments(record, read, normalized)
+            yield ReadAlignments(read, alignments)
+
+    def _readAlignmentsInChunks(self, pairs):
+        """
+        Convert (read, record) pairs to read alignments, CHUNK_SIZE records at
+        a time.
+
+        @param pairs: An iterable of (L{Read}, C{dict}) 2-tuples, as accepted
+            by C{_chunkToReadAlignments}.
+        @return: A generator that yields C{dark.alignments.ReadAlignments}
+            instances, in the order of C{pairs}.
+        """
+        chunk = []
+        for pair in pairs:
+            chunk.append(pair)
+            if len(chunk) == self.CHUNK_SIZE:
+                for readAlignments in self._chunkToReadAlignments(chunk):
+                    yield readAlignments
+                chunk = []
+
+        for readAlignments in self._chunkToReadAlignments(chunk):
+            yield readAlignments
+
+    def _getIndex(self):
+        """
+        Get the index of the records in our file, making it if need be.
+
+        @return: A L{dark.jsonindex.JSONRecordIndex} instance.
+        """
+        if self._index is None:
+            self._index = JSONRecordIndex(self._filename)
+        return self._index
+
+    def recordFor(self, readId):
+        """
+        Get the record for a read, using an index (see
+        L{dark.jsonindex.JSONRecordIndex}) to avoid reading the records that
+        precede it.
+
+        @param readId: The C{str} id of a read. If no record has this query
+            id, the record for the first word of C{readId} is looked for.
+        @raise KeyError: If there is no record for C{readId}.
+        @return: The record C{dict}.
+        """
+        index = self._getIndex()
+        try:
+            ordinal = index.ordinal(readId)
+        except KeyError:
+            try:
+                ordinal = index.ordinal(readId.split()[0])
+            except (KeyError, IndexError):
+                raise KeyError(readId)
+
+        for line in index.lines(ordinal, ordinal + 1):
+            return loads(line)
+
+    def recordsInRange(self, start, stop):
+        """
+        Get a range of records, using an index (see
+        L{dark.jsonindex.JSONRecordIndex}) to avoid reading the records that
+        precede them. This allows several processes to each work on a
+        separate part of a file.
+
+        @param start: The C{int} number of the first record wanted. Records
+            are numbered from zero.
+        @param stop: The C{int} number of the record after the last one
+            wanted (as with Python's C{range}).
+        @return: A generator that yields record C{dict}s.
+        """
+        for line in self._getIndex().lines(start, stop):
+            yield loads(line)
+
+    def _records(self):
+        """
+        Read lines of JSON from self._filename and convert them to dicts.
+
+        @raise ValueError: If any of the lines in the file cannot be converted
+            to JSON.
+        @return: A generator that yields 2-tuples, each with the C{int}
+            number of a record (starting at 1) and the record C{dict}.
+        """
         if self._fp is None:
             self._open(self._filename)
 
-        reads = iter(reads)
-
         try:
             for lineNumber, line in enumerate(self._fp, start=2):
                 try:
@@ -281,38 +619,107 @@ class JSONRecordsReader(object):
                         'Line is %r.' %
                         (lineNumber, self._filename, e, line[:-1]))
                 else:
-                    recordTitle = record['query']
-                    while True:
-                        # Iterate through the input reads until we find the
-                        # one that matches this DIAMOND record.
-                        try:
-                            read = next(reads)
-                        except StopIteration:
-                            raise ValueError(
-                                'Read generator failed to yield a read '
-                                'with id \'%s\' as found in record number %d '
-                                'during parsing of DIAMOND output file %r.' %
-                                (recordTitle, lineNumber - 1, self._filename))
-                        else:
-                            # Look for an exact read id / subject title match.
-                            # If that doesn't work, allow for the case where
-                            # the JSON record has a truncated query (i.e.,
-                            # read) id. This covers the situation where a tool
-                            # we use (e.g., bwa mem) unconditionally does this
-                            # truncation in the output it writes.
-                            if (read.id == recordTitle or
-                                    read.id.split()[0] == recordTitle):
-                                alignments = self._dictToAlignments(record,
-                                                                    read)
-                                yield ReadAlignments(read, alignments)
-                                break
-                            else:
-                                # This is an input read that had no DIAMOND
-                                # matches. So it does not appear in the
-                                # DIAMOND's output. Yield an empty
-                                # ReadAlignments for it.
-                                yield ReadAlignments(read, [])
-
+                    yield lineNumber - 1, record
         finally:
             self._fp.close()
             self._fp = None
+
+    def readAlignments(self, reads, recordFilter=None):
+        """
+        Read lines of JSON from self._filename, convert them to read alignments
+        and yield them.
+
+        @param reads: An iterable of L{Read} instances, corresponding to the
+            reads that were given to DIAMOND.
+        @param recordFilter: A function with the signature of
+            L{dark.alignments.ReadsAlignmentsFilter.filterRecord}, or C{None}.
+            If given, it is used to discard unwanted alignments (or the read)
+            before any alignment or HSP instances are made for them. Reads
+            that the record filter rejects are not yielded.
+        @raise ValueError: If any of the lines in the file cannot be converted
+            to JSON.
+        @return: A generator that yields C{dark.alignments.ReadAlignments}
+            instances.
+        """
+        reads = iter(reads)
+
+        def pairs():
+            for recordNumber, record in self._records():
+                recordTitle = record['query']
+                while True:
+                    # Iterate through the input reads until we find the
+                    # one that matches this DIAMOND record.
+                    try:
+                        read = next(reads)
+                    except StopIteration:
+                        raise ValueError(
+                            'Read generator failed to yield a read '
+                            'with id \'%s\' as found in record number %d '
+                            'during parsing of DIAMOND output file %r.' %
+                            (recordTitle, recordNumber, self._filename))
+                    else:
+                        # Look for an exact read id / subject title match.
+                        # If that doesn't work, allow for the case where
+                        # the JSON record has a truncated query (i.e.,
+                        # read) id. This covers the situation where a tool
+                        # we use (e.g., bwa mem) unconditionally does this
+                        # truncation in the output it writes.
+                        if (read.id == recordTitle or
+                                read.id.split()[0] == recordTitle):
+                            if recordFilter:
+                                record = recordFilter(
+                                    read.id, record, self._scoreClass)
+                            if record:
+                                yield read, record
+                            break
+                        else:
+                            # This is an input read that had no DIAMOND
+                            # matches. So it does not appear in the
+                            # DIAMOND's output. Yield it with no record
+                            # so it gets an empty ReadAlignments.
+                            yield read, None
+
+        return self._readAlignmentsInChunks(pairs())
+
+    def readAlignmentsById(self, readIndex, recordFilter=None, readIds=None):
+        """
+        Read lines of JSON from self._filename, convert them to read alignments
+        and yield them, finding the read for each record by its query id (so
+        the records do not need to be in any particular order).
+
+        Note that, unlike C{readAlignments}, nothing is yielded for reads that
+        had no DIAMOND matches.
+
+        @param readIndex: A C{dict}-like object that returns the L{Read} with
+            a given id, e.g., a L{dark.alignments.ReadIdIndex} or a
+            L{dark.fasta.IndexedFasta}.
+        @param recordFilter: A function with the signature of
+            L{dark.alignments.ReadsAlignmentsFilter.filterRecord}, or C{None}.
+            See C{readAlignments}.
+        @param readIds: A C{set} to which the id of the read for each record
+            will be added (including those rejected by C{recordFilter}), or
+            C{None}.
+        @raise ValueError: If any of the lines in the file cannot be converted
+            to JSON, or if a record is for a read that is not in
+            C{readIndex}.
+        @return: A generator that yields C{dark.alignments.ReadAlignments}
+            instances.
+        """
+        def pairs():
+            for recordNumber, record in self._records():
+                try:
+                    read = lookupRead(readIndex, record['query'])
+                except KeyError:
+                    raise ValueError(
+                        'No read with id %r (from record number %d of '
+                        'DIAMOND output file %r) could be found.' %
+                        (record['query'], recordNumber, self._filename))
+                if readIds is not None:
+                    readIds.add(read.id)
+                if recordFilter:
+                    record = recordFilter(read.id, record, self._scoreClass)
+                    if not record:
+                        continue
+                yield read, record
+
+        return self._readAlignmentsInChunks(pairs())
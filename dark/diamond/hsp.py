@@ -1,7 +1,10 @@
 from __future__ import division, print_function
 import sys
 
+import numpy as np
+
 from dark.btop import countGaps
+from dark.hsp import sanityCheckHSPs
 
 
 def _debugPrint(hsp, queryLen, localDict, msg=''):
@@ -195,3 +198,88 @@ def normalizeHSP(hsp, queryLen, diamondTask):
         'subjectStart': subjectStart,
         'subjectEnd': subjectEnd,
     }
+
+
+def normalizeHSPs(queryStarts, queryEnds, subjectStarts, subjectEnds, frames,
+                  queryLens, queryGaps, subjectGaps, diamondTask):
+    """
+    Normalize many HSPs at once. The result is identical to calling
+    C{normalizeHSP} on each HSP, but the arithmetic is done on arrays. This
+    is only a win for more than a few dozen HSPs, so callers should collect
+    the HSPs of many records before calling.
+
+    All arguments except C{diamondTask} are C{numpy} arrays (or sequences
+    that can be converted to one) of C{int}s, with one element per HSP.
+    Offsets are 1-based, as found in DIAMOND output.
+
+    @param queryStarts: The HSP query start offsets.
+    @param queryEnds: The HSP query end offsets.
+    @param subjectStarts: The HSP subject start offsets.
+    @param subjectEnds: The HSP subject end offsets.
+    @param frames: The HSP query frames.
+    @param queryLens: The lengths of the queries.
+    @param queryGaps: The number of gaps in the query of each HSP (e.g., as
+        returned by C{dark.btop.countGaps}).
+    @param subjectGaps: The number of gaps in the subject of each HSP.
+    @param diamondTask: The C{str} command-line matching algorithm that was
+        run (either 'blastx' or 'blastp').
+    @raise AssertionError: If any HSP fails the sanity checks made by
+        C{normalizeHSP}.
+    @return: A C{dict} with the same keys as the C{dict} returned by
+        C{normalizeHSP}, whose values are C{numpy} C{int} arrays.
+    """
+    queryStart = np.asarray(queryStarts, dtype=np.int64) - 1
+    queryEnd = np.asarray(queryEnds, dtype=np.int64)
+    subjectStart = np.asarray(subjectStarts, dtype=np.int64) - 1
+    subjectEnd = np.asarray(subjectEnds, dtype=np.int64)
+    frames = np.asarray(frames, dtype=np.int64)
+    queryLen = np.asarray(queryLens, dtype=np.int64)
+    queryGaps = np.asarray(queryGaps, dtype=np.int64)
+    subjectGaps = np.asarray(subjectGaps, dtype=np.int64)
+
+    # See normalizeHSP for the details of the following.
+    queryBackwards = queryStart >= queryEnd
+
+    if diamondTask == 'blastx':
+        reverse = queryBackwards & (frames < 0)
+        queryBackwards &= ~reverse
+        queryStart, queryEnd = (
+            np.where(reverse, queryLen - (queryStart + 1), queryStart),
+            np.where(reverse, queryLen - (queryEnd - 1), queryEnd))
+
+        initiallyIgnored = np.abs(frames) - 1
+        queryLen = (queryLen - initiallyIgnored) // 3
+        queryStart = (queryStart - initiallyIgnored) // 3
+        queryEnd = (queryEnd - initiallyIgnored) // 3
+
+    queryStartInSubject = subjectStart - queryStart
+    queryEndInSubject = queryStartInSubject + queryLen + queryGaps
+
+    subjectMatchLengthWithGaps = subjectEnd - subjectStart + subjectGaps
+    queryMatchLengthWithGaps = queryEnd - queryStart + queryGaps
+
+    sanityCheckHSPs([
+        (queryBackwards,
+         lambda i: 'queryStart >= queryEnd'),
+        (subjectStart >= subjectEnd,
+         lambda i: 'subjectStart >= subjectEnd'),
+        (subjectMatchLengthWithGaps != queryMatchLengthWithGaps,
+         lambda i: ('Including gaps, subject match length (%d) != Query '
+                    'match length (%d)' % (subjectMatchLengthWithGaps[i],
+                                           queryMatchLengthWithGaps[i]))),
+        (queryStartInSubject > subjectStart,
+         lambda i: ('queryStartInSubject (%d) > subjectStart (%d)' %
+                    (queryStartInSubject[i], subjectStart[i]))),
+        (queryEndInSubject < subjectEnd,
+         lambda i: ('queryEndInSubject (%d) < subjectEnd (%d)' %
+                    (queryEndInSubject[i], subjectEnd[i]))),
+    ])
+
+    return {
+        'readStart': queryStart,
+        'readEnd': queryEnd,
+        'readStartInSubject': queryStartInSubject,
+        'readEndInSubject': queryEndInSubject,
+        'subjectStart': subjectStart,
+        'subjectEnd': subjectEnd,
+    }
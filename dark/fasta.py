@@ -2,12 +2,13 @@ from six import PY3
 from hashlib import md5
 import sqlite3
 import os
+from collections import OrderedDict
 
 from Bio import SeqIO, bgzf
 from pyfaidx import Fasta
 
 from dark.reads import Reads, DNARead
-from dark.utils import asHandle
+from dark.utils import asHandle, connectExisting, replaceFile
 
 
 def fastaToList(fastaFilename):
@@ -239,10 +240,18 @@ class SqliteIndex(object):
         can be found. If provided, this directory is only used by __getitem__,
         which will combine it with the basename of the files given to
         C{addFile} to locate the FASTA.
+    @param readOnly: If C{True}, C{dbFilename} must be an existing database,
+        which is opened read-only (see L{dark.utils.connectExisting}).
+    @raise sqlite3.OperationalError: If C{readOnly} is C{True} and
+        C{dbFilename} cannot be opened.
     """
-    def __init__(self, dbFilename, readClass=DNARead, fastaDirectory=None):
+    def __init__(self, dbFilename, readClass=DNARead, fastaDirectory=None,
+                 readOnly=False):
         self._readClass = readClass
         self._fastaDirectory = fastaDirectory
+        if readOnly:
+            self._connection = connectExisting(dbFilename)
+            return
         creating = dbFilename == ':memory:' or not os.path.exists(dbFilename)
         self._connection = sqlite3.connect(dbFilename)
         if creating:
@@ -420,6 +429,28 @@ class SqliteIndex(object):
         else:
             return self._getFilename(row[0]), row[1]
 
+    def idForFirstWord(self, firstWord):
+        """
+        Find the full id of a sequence, given the first word of its id (as
+        found in the output of tools such as BLAST and DIAMOND, which drop
+        the rest of the id).
+
+        @param firstWord: A C{str} sequence id, with no whitespace.
+        @return: The C{str} id of the first sequence (in id order) whose id
+            starts with C{firstWord} followed by whitespace, or C{None} if
+            there is no such sequence.
+        """
+        cur = self._connection.cursor()
+        # Ids that start with firstWord and then whitespace are all in this
+        # range (ASCII whitespace sorts below '!'), so the id index is used.
+        cur.execute(
+            'SELECT id FROM sequences WHERE id > ? AND id < ? ORDER BY id',
+            (firstWord + '\t', firstWord + '!'))
+        for (id_,) in cur:
+            if id_.split()[0] == firstWord:
+                return id_
+        return None
+
     def __getitem__(self, id_):
         """
         Return a read, given its id.
@@ -464,3 +495,175 @@ class SqliteIndex(object):
     def close(self):
         self._connection.close()
         self._connection = None
+
+
+class IndexedFasta(object):
+    """
+    Provide dictionary-like access to the sequences in a FASTA file, without
+    reading the whole file into memory.
+
+    The first time a sequence is requested, an L{SqliteIndex} of the
+    offsets of the sequences in the FASTA file is made and saved next to the
+    file, so it can be re-used later (it is remade if the FASTA file is
+    newer than the index). If the index cannot be saved, an in-memory index
+    is made instead. The most recently requested sequences are cached.
+
+    @param filename: A C{str} FASTA file name. The file may be uncompressed
+        or compressed with bgzip (from samtools).
+    @param readClass: The class of read that should be returned by
+        __getitem__.
+    @param cacheSize: The C{int} maximum number of sequences to cache.
+    @param indexFilename: The C{str} file name of the index. If C{None},
+        C{filename} with C{INDEX_SUFFIX} appended is used.
+    """
+    INDEX_SUFFIX = '.dark-index.sqlite3'
+
+    def __init__(self, filename, readClass=DNARead, cacheSize=1000,
+                 indexFilename=None):
+        self._filename = filename
+        self._readClass = readClass
+        self._cacheSize = cacheSize
+        self._indexFilename = indexFilename or filename + self.INDEX_SUFFIX
+        self._index = None
+        self._cache = OrderedDict()
+
+    def __getstate__(self):
+        # The index (which has an open database connection) and the cache
+        # are not pickled. The index is opened again when next needed.
+        state = self.__dict__.copy()
+        state['_index'] = None
+        state['_cache'] = OrderedDict()
+        return state
+
+    def _indexIsCurrent(self):
+        """
+        Is there a saved index that is at least as new as the FASTA file?
+
+        @return: A C{bool}.
+        """
+        return (os.path.exists(self._indexFilename) and
+                os.path.getmtime(self._indexFilename) >=
+                os.path.getmtime(self._filename))
+
+    def _makeIndex(self):
+        """
+        Make an index of the FASTA file and save it to C{self._indexFilename}.
+
+        The index is written to a temporary file which then atomically
+        replaces any existing index, so another process can never see a
+        partly written index (or no index at all).
+
+        @raise EnvironmentError: If the index cannot be saved.
+        """
+        tmpFilename = '%s.%d.tmp' % (self._indexFilename, os.getpid())
+        try:
+            index = SqliteIndex(tmpFilename, readClass=self._readClass)
+            try:
+                index.addFile(self._filename)
+            finally:
+                index.close()
+            replaceFile(tmpFilename, self._indexFilename)
+        finally:
+            if os.path.exists(tmpFilename):
+                os.unlink(tmpFilename)
+
+    def _getIndex(self):
+        """
+        Get the index, making it if needed.
+
+        @return: An L{SqliteIndex} instance.
+        """
+        if self._index is None:
+            # Use the directory of the FASTA file (not the file name stored in
+            # the index) to find it, in case we were given a relative path
+            # and the current directory has changed since the index was made.
+            fastaDirectory = os.path.dirname(os.path.abspath(self._filename))
+            try:
+                if not self._indexIsCurrent():
+                    self._makeIndex()
+                # Open the index read-only, so an empty database is never
+                # made in its place if it is not there.
+                self._index = SqliteIndex(
+                    self._indexFilename, readClass=self._readClass,
+                    fastaDirectory=fastaDirectory, readOnly=True)
+            except (EnvironmentError, sqlite3.Error):
+                self._index = SqliteIndex(
+                    ':memory:', readClass=self._readClass,
+                    fastaDirectory=fastaDirectory)
+                self._index.addFile(self._filename)
+
+        return self._index
+
+    def makeIndex(self):
+        """
+        Make (or open) the index now, instead of when the first sequence is
+        requested.
+
+        @raise ValueError: If the FASTA file cannot be indexed, because it
+            is compressed but not with bgzip, or has a duplicated id.
+        """
+        self._getIndex()
+
+    def __getitem__(self, id_):
+        """
+        Return a read, given its id.
+
+        As with L{dark.alignments.ReadIdIndex}, C{id_} may be just the first
+        word of the id of the sequence (BLAST and DIAMOND query ids usually
+        are).
+
+        @param id_: A C{str} sequence id.
+        @raise KeyError: If C{id_} is not a known sequence.
+        @return: A read of our read class.
+        """
+        cache = self._cache
+        try:
+            read = cache.pop(id_)
+        except KeyError:
+            index = self._getIndex()
+            try:
+                read = index[id_]
+            except KeyError:
+                fullId = index.idForFirstWord(id_)
+                if fullId is None:
+                    raise
+                read = index[fullId]
+            if self._cacheSize < 1:
+                return read
+            if len(cache) >= self._cacheSize:
+                cache.popitem(last=False)
+
+        # (Re-)add the read so it is the most recently used.
+        cache[id_] = read
+        return read
+
+    def close(self):
+        """
+        Close the index.
+        """
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        self._cache.clear()
+
+
+def fastaIndex(filename, readClass=DNARead):
+    """
+    Make a C{dict}-like object to look up the sequences in a FASTA file by
+    id, using an L{IndexedFasta} if possible.
+
+    @param filename: A C{str} FASTA file name.
+    @param readClass: The class of read that should be returned by lookups.
+    @return: An L{IndexedFasta} instance or, if the FASTA file cannot be
+        indexed (because it is compressed but not with bgzip, or has a
+        duplicated id), a C{dict} of all its reads, keyed by id. If an id is
+        duplicated, the C{dict} has the last read with that id.
+    """
+    index = IndexedFasta(filename, readClass=readClass)
+    try:
+        index.makeIndex()
+    except ValueError:
+        return dict((read.id, read)
+                    for read in FastaReads(filename, readClass=readClass))
+    else:
+        return index
@@ -1,6 +1,9 @@
 import re
 from math import ceil
-from collections import OrderedDict
+from collections import Counter, OrderedDict, defaultdict
+from zlib import crc32
+
+import numpy as np
 
 from dark.simplify import simplifyTitle
 from dark.utils import parseRangeString
@@ -25,6 +28,14 @@ class TitleFilter(object):
     @param truncateAfter: A C{str} that titles will be truncated beyond. If
         a truncated title has already been seen, that title will no longer
         be acceptable.
+    @param cache: If C{True}, the decision for each title is remembered so
+        that repeated calls to C{accept} with the same title do no regex
+        matching or title simplification. This is exact, because the
+        decision for a title never changes once it has been made (when
+        C{truncateAfter} is used, the first title seen with a given truncated
+        form is the one that is accepted). Pass C{False} when titles are not
+        expected to repeat (e.g., when filtering read ids) to avoid storing a
+        decision for each one.
     """
 
     REJECT = 0
@@ -33,7 +44,8 @@ class TitleFilter(object):
 
     def __init__(self, whitelist=None, blacklist=None,
                  whitelistFile=None, blacklistFile=None,
-                 positiveRegex=None, negativeRegex=None, truncateAfter=None):
+                 positiveRegex=None, negativeRegex=None, truncateAfter=None,
+                 cache=True):
         whitelist = whitelist or set()
         if whitelistFile:
             with open(whitelistFile) as fp:
@@ -64,6 +76,8 @@ class TitleFilter(object):
         else:
             self._negativeRegex = re.compile(negativeRegex, re.I)
 
+        self._cache = {} if cache else None
+
     def accept(self, title):
         """
         Return a value (see below) to indicate if a title is acceptable (and,
@@ -79,6 +93,43 @@ class TitleFilter(object):
             These three values are needed so our caller can distinguish between
             the two reasons for acceptance.
         """
+        if self._cache is None:
+            return self._accept(title)
+
+        try:
+            return self._cache[title]
+        except KeyError:
+            result = self._cache[title] = self._accept(title)
+            return result
+
+    def precompute(self, titles):
+        """
+        Make (and cache) the decisions for a known set of titles, e.g., all the
+        titles in the FASTA file of a DIAMOND database.
+
+        Note that if C{truncateAfter} was given, the first title (in the order
+        of C{titles}) with a given truncated form will be the only one of those
+        titles that is accepted. Without precomputation, the accepted title is
+        instead the first one passed to C{accept}. So precomputing can change
+        which of a group of similar titles is accepted (but never how many).
+
+        @param titles: An iterable of C{str} titles.
+        @raise ValueError: If this filter was made with C{cache=False}.
+        """
+        if self._cache is None:
+            raise ValueError('Cannot precompute title decisions without a '
+                             'cache.')
+
+        for title in titles:
+            self.accept(title)
+
+    def _accept(self, title):
+        """
+        Decide if a title is acceptable. See C{accept} for details.
+
+        @param title: A C{str} sequence title.
+        @return: An C{int}, as described in C{accept}.
+        """
         if self._whitelist and title in self._whitelist:
             return self.WHITELIST_ACCEPT
 
@@ -114,17 +165,68 @@ class ReadSetFilter(object):
     """
     Provide an acceptance test based on sequence read set.
 
+    A read set is compared only with the previously accepted read sets that
+    it has reads in common with. These are found (with the number of reads
+    in common) from an index of the accepted titles that each read is in.
+
+    If C{minHashBands} is given, the accepted read sets to compare with are
+    instead those that share at least one MinHash locality-sensitive hashing
+    band (of C{MINHASH_ROWS} hash values) with the new read set. This is
+    faster when there are very many titles and reads are in many of them,
+    but it is approximate: an accepted read set that shares too few reads
+    with the new one may not be found, so some titles that would otherwise
+    be rejected may be accepted.
+
     @param minNew: The C{float} fraction of its reads by which a new read set
         must differ from all previously seen read sets in order to be
         considered acceptably different.
+    @param minHashBands: If not C{None}, the C{int} number of MinHash bands
+        to use to find the accepted read sets to compare with.
     """
+    MINHASH_ROWS = 2
+    # A prime, small enough that the products in _signature fit in 64 bits.
+    _MINHASH_PRIME = (1 << 31) - 1
 
-    def __init__(self, minNew):
+    def __init__(self, minNew, minHashBands=None):
         self._minNew = minNew
         # Use an OrderedDict so that each time we walk through self._titles
         # we do it in the same order. This makes our runs deterministic /
         # reproducible.
         self._titles = OrderedDict()
+        # The accepted titles, in the order they were accepted.
+        self._accepted = []
+        # Map read ids (or MinHash bands, if minHashBands is given) to the
+        # (increasing) indices in self._accepted of the accepted titles
+        # whose read sets contain them.
+        self._index = defaultdict(list)
+        self._minHashBands = minHashBands
+        if minHashBands is not None:
+            # Use a fixed seed so runs are reproducible.
+            state = np.random.RandomState(0)
+            count = minHashBands * self.MINHASH_ROWS
+            self._minHashA = state.randint(
+                1, self._MINHASH_PRIME, size=count).astype(np.uint64)
+            self._minHashB = state.randint(
+                0, self._MINHASH_PRIME, size=count).astype(np.uint64)
+
+    def _bands(self, readIds):
+        """
+        Find the MinHash bands of a read set.
+
+        @param readIds: A non-empty C{set} of C{str} read ids.
+        @return: A C{list} of C{tuple}s, each with the C{int} number of a band
+            and the MinHash values in it.
+        """
+        # Use crc32, as (unlike hash) it gives the same values in every run.
+        hashes = np.array(
+            [crc32(readId.encode('UTF-8')) & 0x7fffffff
+             for readId in readIds], dtype=np.uint64)
+        signature = ((np.outer(self._minHashA, hashes) +
+                      self._minHashB[:, np.newaxis]) %
+                     self._MINHASH_PRIME).min(axis=1).tolist()
+        rows = self.MINHASH_ROWS
+        return [(band, tuple(signature[band * rows:(band + 1) * rows]))
+                for band in range(self._minHashBands)]
 
     def accept(self, title, titleAlignments):
         """
@@ -143,16 +245,52 @@ class ReadSetFilter(object):
 
         readIds = titleAlignments.readIds()
         newReadsRequired = ceil(self._minNew * len(readIds))
+        # A previously accepted read set invalidates this title if the two
+        # have more than this number of reads in common.
+        maxShared = len(readIds) - newReadsRequired
+
+        if maxShared < 0:
+            # Even a read set with no reads in common invalidates this
+            # title, so the first accepted title (if any) does.
+            invalidator = 0 if self._accepted else None
+        elif self._minHashBands is None:
+            shared = Counter()
+            for readId in readIds:
+                shared.update(self._index.get(readId, ()))
+            invalidators = [index for index, count in shared.items()
+                            if count > maxShared]
+            invalidator = min(invalidators) if invalidators else None
+        elif readIds:
+            bands = self._bands(readIds)
+            candidates = set()
+            for band in bands:
+                candidates.update(self._index.get(band, ()))
+            invalidator = None
+            for index in sorted(candidates):
+                readSet = self._titles[self._accepted[index]][0]
+                if len(readIds & readSet) > maxShared:
+                    invalidator = index
+                    break
+        else:
+            invalidator = None
 
-        for readSet, invalidatedTitles in self._titles.values():
-            if len(readIds - readSet) < newReadsRequired:
-                # Add this title to the set of titles invalidated by this
-                # previously seen read set.
-                invalidatedTitles.append(title)
-                return False
+        if invalidator is not None:
+            # Add this title to the set of titles invalidated by this
+            # previously seen read set.
+            self._titles[self._accepted[invalidator]][1].append(title)
+            return False
 
         # Remember the new read set and an empty list of invalidated titles.
         self._titles[title] = (readIds, [])
+        index = len(self._accepted)
+        self._accepted.append(title)
+
+        if self._minHashBands is None:
+            for readId in readIds:
+                self._index[readId].append(index)
+        elif readIds:
+            for band in self._bands(readIds):
+                self._index[band].append(index)
 
         return True
 
@@ -1,5 +1,4 @@
 import os
-from copy import deepcopy
 from stat import S_ISDIR
 from math import ceil
 from collections import defaultdict
@@ -169,10 +168,11 @@ def alignmentGraph(titlesAlignments, title, addQueryLines=True,
         else:
             readsAx = readsAx or plt.subplot(111)
 
-    # Make a deep copy of the title alignments. We're potentially going to
-    # change the HSP scores, the X axis offsets, etc., and we don't want to
-    # interfere with the data we were passed.
-    titleAlignments = deepcopy(titlesAlignments[title])
+    # Make a copy of the title alignments. We're potentially going to change
+    # the HSP scores, the X axis offsets, etc., and we don't want to
+    # interfere with the data we were passed. The reads and matched
+    # sequences are not changed, so they are shared rather than copied.
+    titleAlignments = titlesAlignments[title].plottingCopy()
 
     readsAlignments = titlesAlignments.readsAlignments
     subjectIsNucleotides = readsAlignments.params.subjectIsNucleotides
@@ -203,8 +203,7 @@ def alignmentGraph(titlesAlignments, title, addQueryLines=True,
             readIntervals.add(hsp.readStartInSubject, hsp.readEndInSubject)
         # Now adjust offsets in all HSPs.
         offsetAdjuster = OffsetAdjuster(readIntervals, base=logBase)
-        for hsp in titleAlignments.hsps():
-            offsetAdjuster.adjustHSP(hsp)
+        offsetAdjuster.adjustHSPs(titleAlignments)
         # A function for adjusting other offsets, below.
         adjustOffset = offsetAdjuster.adjustOffset
     else:
@@ -272,16 +271,18 @@ def alignmentGraph(titlesAlignments, title, addQueryLines=True,
             maxX - minX, maxY - minY + (1 if rankScores else 0),
             xScale, yScale)
         for alignment in titleAlignments:
+            # Get the read just once, as it may have to be looked up.
+            read = alignment.read
             for hsp in alignment.hsps:
                 y = hsp.score.score - minY
                 # If the product of the subject and read frame values is +ve,
                 # then they're either both +ve or both -ve, so we just use the
                 # read as is. Otherwise, we need to reverse complement it.
                 if hsp.subjectFrame * hsp.readFrame > 0:
-                    query = alignment.read.sequence
+                    query = read.sequence
                 else:
                     # One of the subject or query has negative sense.
-                    query = alignment.read.reverseComplement().sequence
+                    query = read.reverseComplement().sequence
                 readStartInSubject = hsp.readStartInSubject
                 # There are 3 parts of the query string we need to
                 # display. 1) the left part (if any) before the matched
@@ -387,7 +388,7 @@ def alignmentGraph(titlesAlignments, title, addQueryLines=True,
 
         # Draw the matched region.
         for titleAlignment in titleAlignments:
-            readId = titleAlignment.read.id
+            readId = titleAlignment.readId
             for hsp in titleAlignment.hsps:
                 y = hsp.score.score
                 line = Line2D([hsp.subjectStart, hsp.subjectEnd], [y, y],
@@ -1,7 +1,61 @@
 from functools import total_ordering
 
+import numpy as np
+
 from dark.score import HigherIsBetterScore, LowerIsBetterScore
 
+# The attributes of an HSP (apart from its score) that are pickled as a
+# tuple of values, in this order. See _Base.__reduce__.
+_PICKLED_ATTRIBUTES = (
+    'readStart', 'readEnd', 'readStartInSubject', 'readEndInSubject',
+    'readFrame', 'subjectStart', 'subjectEnd', 'subjectFrame',
+    '_readMatchedSequence', '_subjectMatchedSequence', 'identicalCount',
+    'positiveCount', 'btop', '_matchedSequences')
+
+# The attributes of an HSP that are not in _PICKLED_ATTRIBUTES and are not
+# pickled as extra attributes. See _Base.__reduce__.
+_NOT_PICKLED = frozenset(('score', '_readHolder'))
+
+
+def _unpickle(hspClass, scoreClass, score, values):
+    """
+    Make an HSP (or LSP) from the values pickled by C{_Base.__reduce__}.
+
+    @param hspClass: The class of the HSP.
+    @param scoreClass: The class of the HSP score.
+    @param score: The numeric score of the HSP.
+    @param values: A C{tuple} of values, for the attributes in
+        C{_PICKLED_ATTRIBUTES}.
+    @return: An instance of C{hspClass}.
+    """
+    hsp = hspClass.__new__(hspClass)
+    hsp.__dict__.update(zip(_PICKLED_ATTRIBUTES, values))
+    hsp.score = scoreClass(score)
+    return hsp
+
+
+def sanityCheckHSPs(checks):
+    """
+    Perform vectorized sanity checks on a batch of HSPs.
+
+    @param checks: A C{list} of (C{numpy.ndarray}, C{function}) 2-tuples,
+        in the order the checks are made by C{normalizeHSP} (in
+        L{dark.blast.hsp} or L{dark.diamond.hsp}). Each array is a
+        C{bool} mask of the HSPs that fail a check, and each function takes
+        the C{int} index of a failing HSP and returns a C{str} message.
+    @raise AssertionError: If any HSP fails a check. The error message
+        describes the first check failed by the first failing HSP.
+    """
+    failed = np.zeros(len(checks[0][0]), dtype=bool)
+    for mask, _ in checks:
+        failed |= mask
+
+    if failed.any():
+        index = int(np.argmax(failed))
+        for mask, message in checks:
+            if mask[index]:
+                raise AssertionError('HSP %d: %s' % (index, message(index)))
+
 
 @total_ordering
 class _Base(object):
@@ -62,12 +116,26 @@ class _Base(object):
         and query had a positive score in the scoring matrix used during
         matching (this is probably only different from the C{identicalCount}
         when matching amino acids (i.e., not nucleotides).
+    @param btop: The C{str} BLAST traceback operations (btop) string for the
+        alignment, or C{None} if not known.
+    @param matchedSequences: A function, or C{None}. If given, it will be
+        called (with the C{str} sequence of the read) the first time
+        C{readMatchedSequence} or C{subjectMatchedSequence} is needed but was
+        not passed, and must return a 2-tuple with the C{str} matched parts
+        of the read and the subject. This allows the matched sequences to be
+        made from C{btop} only if they are actually used. The read is found
+        (only when needed) via the object the HSP belongs to, which must call
+        C{setReadHolder}.
     """
+    # The object (with a 'read' attribute) that holds the read of this HSP.
+    # See setReadHolder.
+    _readHolder = None
+
     def __init__(self, readStart=None, readEnd=None, readStartInSubject=None,
                  readEndInSubject=None, readFrame=None, subjectStart=None,
                  subjectEnd=None, subjectFrame=None, readMatchedSequence=None,
                  subjectMatchedSequence=None, identicalCount=None,
-                 positiveCount=None):
+                 positiveCount=None, btop=None, matchedSequences=None):
         self.readStart = readStart
         self.readEnd = readEnd
         self.readStartInSubject = readStartInSubject
@@ -76,10 +144,100 @@ class _Base(object):
         self.subjectStart = subjectStart
         self.subjectEnd = subjectEnd
         self.subjectFrame = subjectFrame
-        self.readMatchedSequence = readMatchedSequence
-        self.subjectMatchedSequence = subjectMatchedSequence
+        self._readMatchedSequence = readMatchedSequence
+        self._subjectMatchedSequence = subjectMatchedSequence
         self.identicalCount = identicalCount
         self.positiveCount = positiveCount
+        self.btop = btop
+        self._matchedSequences = matchedSequences
+
+    def setReadHolder(self, holder):
+        """
+        Set the object that holds the read of this HSP, so the read can be
+        found if our matched sequences need to be made (if they do not, this
+        does nothing). The read is not looked up until then, so (e.g.) a
+        L{dark.titles.TitleAlignment} that looks up its read in an index
+        does not need to keep it in memory.
+
+        @param holder: An object with a C{read} attribute, such as a
+            L{dark.alignments.ReadAlignments} or L{dark.titles.TitleAlignment}
+            instance.
+        """
+        if self._matchedSequences is not None:
+            self._readHolder = holder
+
+    def _makeMatchedSequences(self):
+        """
+        Make the matched read and subject sequences (those not already set)
+        using our C{matchedSequences} function, if we have one.
+
+        @raise ValueError: If we have a C{matchedSequences} function but no
+            read holder (see C{setReadHolder}).
+        """
+        if self._matchedSequences is not None:
+            if self._readHolder is None:
+                raise ValueError('The matched sequences of this HSP cannot '
+                                 'be made because its read is not known.')
+            read, subject = self._matchedSequences(
+                self._readHolder.read.sequence)
+            self._matchedSequences = None
+            del self._readHolder
+            if self._readMatchedSequence is None:
+                self._readMatchedSequence = read
+            if self._subjectMatchedSequence is None:
+                self._subjectMatchedSequence = subject
+
+    @property
+    def readMatchedSequence(self):
+        if self._readMatchedSequence is None:
+            self._makeMatchedSequences()
+        return self._readMatchedSequence
+
+    @readMatchedSequence.setter
+    def readMatchedSequence(self, value):
+        self._readMatchedSequence = value
+
+    @property
+    def subjectMatchedSequence(self):
+        if self._subjectMatchedSequence is None:
+            self._makeMatchedSequences()
+        return self._subjectMatchedSequence
+
+    @subjectMatchedSequence.setter
+    def subjectMatchedSequence(self, value):
+        self._subjectMatchedSequence = value
+
+    def __reduce__(self):
+        """
+        Pickle an HSP compactly, as a tuple of attribute values. Unpickling
+        this is much faster than unpickling the default instance C{dict}
+        (which matters when saving and loading many HSPs, e.g., in
+        L{dark.snapshot}).
+
+        @return: A C{tuple} as described in the Python C{pickle} docs.
+        """
+        state = self.__dict__
+        values = tuple([state.get(name) for name in _PICKLED_ATTRIBUTES])
+        # The read holder is not pickled. Its owner sets it again when
+        # it is unpickled.
+        extra = dict((name, value) for name, value in state.items()
+                     if name not in _NOT_PICKLED and
+                     name not in _PICKLED_ATTRIBUTES)
+        return (_unpickle, (self.__class__, self.score.__class__,
+                            self.score.score, values), extra or None)
+
+    def plottingCopy(self):
+        """
+        Make a copy of this HSP whose score and offsets can be changed (e.g.,
+        when plotting) without changing this HSP. Unlike C{copy.deepcopy},
+        the (unchanging) matched sequences are shared, not copied.
+
+        @return: A new instance of our class.
+        """
+        hsp = self.__class__.__new__(self.__class__)
+        hsp.__dict__.update(self.__dict__)
+        hsp.score = self.score.__class__(self.score.score)
+        return hsp
 
     def __lt__(self, other):
         return self.score < other.score
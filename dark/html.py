@@ -48,10 +48,12 @@ def _sortHTML(titlesAlignments, by, limit=None):
     @return: An HTML instance with sorted titles and information about
         hit read count, length, and e-values.
     """
+    if limit is None:
+        titles = titlesAlignments.sortTitles(by)
+    else:
+        titles = titlesAlignments.topTitles(by, limit)
     out = []
-    for i, title in enumerate(titlesAlignments.sortTitles(by), start=1):
-        if limit is not None and i > limit:
-            break
+    for i, title in enumerate(titles, start=1):
         titleAlignments = titlesAlignments[title]
         link = NCBISequenceLink(title, title)
         out.append(
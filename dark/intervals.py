@@ -1,11 +1,18 @@
+from bisect import bisect_left, bisect_right
 from math import log
 from collections import Counter
 
+import numpy as np
+
 
 class ReadIntervals(object):
     """
     Hold information about the set of reads that match a subject.
 
+    The intervals are merged (for C{walk} and C{coverage}) and counted (for
+    C{coverageCounts} and C{depth}) using numpy arrays, so subjects matched
+    by very many reads can be processed quickly.
+
     @param targetLength: The C{int} length of the target sequence that the
         reads are against.
     """
@@ -15,7 +22,11 @@ class ReadIntervals(object):
 
     def __init__(self, targetLength):
         self._targetLength = targetLength
-        self._intervals = []
+        self._starts = []
+        self._ends = []
+        # The arrays of starts and ends, and the merged intervals, are made
+        # when first needed and kept until another interval is added.
+        self._arrays = self._merged = None
 
     def add(self, start, end):
         """
@@ -26,7 +37,72 @@ class ReadIntervals(object):
             This is Python-style: the end offset is not included in the match.
         """
         assert start <= end
-        self._intervals.append((start, end))
+        self._starts.append(start)
+        self._ends.append(end)
+        self._arrays = self._merged = None
+
+    def addIntervals(self, starts, ends):
+        """
+        Add the start and end offsets of many matching reads.
+
+        @param starts: An iterable of C{int} start offsets of read matches in
+            the subject.
+        @param ends: An iterable of C{int} end offsets of read matches in the
+            subject, corresponding to those in C{starts}.
+        """
+        starts = list(starts)
+        ends = list(ends)
+        assert len(starts) == len(ends)
+        assert np.all(np.array(starts, dtype=int) <= np.array(ends, dtype=int))
+        self._starts.extend(starts)
+        self._ends.extend(ends)
+        self._arrays = self._merged = None
+
+    def _getArrays(self):
+        """
+        Get the starts and ends of the intervals as arrays.
+
+        @return: A 2-tuple of C{int} numpy arrays, with the starts and the
+            ends of the intervals, in the order they were added.
+        """
+        if self._arrays is None:
+            self._arrays = (np.array(self._starts, dtype=int),
+                            np.array(self._ends, dtype=int))
+        return self._arrays
+
+    def _merge(self):
+        """
+        Merge overlapping (or touching) intervals.
+
+        @return: A 2-tuple of C{int} numpy arrays, with the (increasing) starts
+            and the corresponding ends of the merged intervals.
+        """
+        if self._merged is None:
+            self._merged = self._mergeArrays(*self._getArrays())
+        return self._merged
+
+    @staticmethod
+    def _mergeArrays(starts, ends):
+        """
+        Merge overlapping (or touching) intervals.
+
+        @param starts: An C{int} numpy array of interval starts.
+        @param ends: An C{int} numpy array of the corresponding interval ends.
+        @return: A 2-tuple of C{int} numpy arrays, with the (increasing) starts
+            and the corresponding ends of the merged intervals.
+        """
+        if len(starts) == 0:
+            return starts, ends
+
+        order = np.argsort(starts)
+        starts = starts[order]
+        # The furthest end of any interval so far.
+        ends = np.maximum.accumulate(ends[order])
+        # An interval begins a new merged interval if it starts after all
+        # the intervals before it end.
+        first = np.flatnonzero(starts[1:] > ends[:-1]) + 1
+        last = np.append(first - 1, len(starts) - 1)
+        return starts[np.insert(first, 0, 0)], ends[last]
 
     def walk(self):
         """
@@ -37,36 +113,27 @@ class ReadIntervals(object):
             the interval. The endpoint (STOP) of the interval is not considered
             to be in the interval. I.e., the interval is really [START, STOP).
         """
-        intervals = sorted(self._intervals)
+        starts, ends = self._merge()
 
-        def nextFull():
-            start, stop = intervals.pop(0)
-            while intervals:
-                if intervals[0][0] <= stop:
-                    _, thisStop = intervals.pop(0)
-                    if thisStop > stop:
-                        stop = thisStop
-                else:
-                    break
-            return (start, stop)
+        if len(starts):
+            starts = starts.tolist()
+            ends = ends.tolist()
 
-        if intervals:
             # If the first interval (read) starts after zero, yield an
             # initial empty section to get us to the first interval.
-            if intervals[0][0] > 0:
-                yield (self.EMPTY, (0, intervals[0][0]))
+            if starts[0] > 0:
+                yield (self.EMPTY, (0, starts[0]))
 
-            while intervals:
-                # Yield a full interval followed by an empty one (if there
-                # is another interval pending).
-                lastFull = nextFull()
-                yield (self.FULL, lastFull)
-                if intervals:
-                    yield (self.EMPTY, (lastFull[1], intervals[0][0]))
+            # Yield each full interval followed by an empty one (if there
+            # is another interval pending).
+            for index, start in enumerate(starts):
+                yield (self.FULL, (start, ends[index]))
+                if index + 1 < len(starts):
+                    yield (self.EMPTY, (ends[index], starts[index + 1]))
 
             # Yield the final empty section, if any.
-            if lastFull[1] < self._targetLength:
-                yield (self.EMPTY, (lastFull[1], self._targetLength))
+            if ends[-1] < self._targetLength:
+                yield (self.EMPTY, (ends[-1], self._targetLength))
 
         else:
             yield (self.EMPTY, (0, self._targetLength))
@@ -80,14 +147,31 @@ class ReadIntervals(object):
         if self._targetLength == 0:
             return 0.0
 
-        coverage = 0
-        for (intervalType, (start, end)) in self.walk():
-            if intervalType == self.FULL:
-                # Adjust start and end to ignore areas where the read falls
-                # outside the target.
-                coverage += (min(end, self._targetLength) - max(0, start))
+        starts, ends = self._merge()
+        # Adjust starts and ends to ignore areas where reads fall outside the
+        # target.
+        coverage = (np.minimum(ends, self._targetLength) -
+                    np.maximum(starts, 0)).sum()
         return float(coverage) / self._targetLength
 
+    def depth(self):
+        """
+        For each location in the subject, find how many times that location
+        is covered by a read.
+
+        @return: A numpy C{int} array with the number of reads covering each
+            location on the subject.
+        """
+        targetLength = self._targetLength
+        starts, ends = self._getArrays()
+        starts = np.clip(starts, 0, targetLength)
+        ends = np.clip(ends, 0, targetLength)
+        # A difference array, with +1 where each interval starts and -1 where
+        # it ends.
+        difference = (np.bincount(starts, minlength=targetLength + 1) -
+                      np.bincount(ends, minlength=targetLength + 1))
+        return np.cumsum(difference[:targetLength])
+
     def coverageCounts(self):
         """
         For each location in the subject, return a count of how many times that
@@ -97,11 +181,79 @@ class ReadIntervals(object):
             subject and the value is the number of times the location is
             covered by a read.
         """
-        coverageCounts = Counter()
-        for start, end in self._intervals:
-            coverageCounts.update(range(max(0, start),
-                                        min(self._targetLength, end)))
-        return coverageCounts
+        depth = self.depth()
+        locations = np.flatnonzero(depth)
+        return Counter(dict(zip(locations.tolist(),
+                                depth[locations].tolist())))
+
+
+class MergedIntervals(object):
+    """
+    Hold the merged set of intervals of the reads that match a subject.
+
+    Unlike L{ReadIntervals}, this does not keep every interval that is added,
+    only the disjoint intervals that result from merging them. So the memory
+    it uses does not grow with the number of intervals added (once the
+    subject is covered).
+
+    @param targetLength: The C{int} length of the target sequence that the
+        reads are against.
+    """
+    def __init__(self, targetLength):
+        self._targetLength = targetLength
+        # The (sorted) starts and ends of disjoint intervals. Overlapping or
+        # touching intervals are merged (as in ReadIntervals.walk).
+        self._starts = []
+        self._ends = []
+
+    def __len__(self):
+        return len(self._starts)
+
+    def add(self, start, end):
+        """
+        Add the start and end offsets of a matching read.
+
+        @param start: The C{int} start offset of the read match in the subject.
+        @param end: The C{int} end offset of the read match in the subject.
+            This is Python-style: the end offset is not included in the match.
+        """
+        assert start <= end
+        starts, ends = self._starts, self._ends
+        # The intervals at indices first to last - 1 overlap or touch the
+        # new one.
+        first = bisect_left(ends, start)
+        last = bisect_right(starts, end)
+        if first < last:
+            start = min(start, starts[first])
+            end = max(end, ends[last - 1])
+        starts[first:last] = [start]
+        ends[first:last] = [end]
+
+    def intervals(self):
+        """
+        Get the merged intervals.
+
+        @return: A C{list} of (START, END) C{int} 2-tuples, sorted by START.
+        """
+        return list(zip(self._starts, self._ends))
+
+    def coverage(self):
+        """
+        Get the fraction of a subject is matched by its set of reads.
+
+        @return: The C{float} fraction of a subject matched by its reads (the
+            same as that given by L{ReadIntervals.coverage}).
+        """
+        if self._targetLength == 0:
+            return 0.0
+
+        targetLength = self._targetLength
+        coverage = 0
+        for start, end in zip(self._starts, self._ends):
+            # Adjust start and end to ignore areas where the read falls
+            # outside the target.
+            coverage += min(end, targetLength) - max(0, start)
+        return float(coverage) / targetLength
 
 
 class OffsetAdjuster(object):
@@ -109,6 +261,9 @@ class OffsetAdjuster(object):
     A class that knows how to adjust the offsets in a normalized HSP according
     to the overall set of reads being plotted.
 
+    The total reduction for each adjustment offset is kept, so the
+    reduction for any offset can be found with a binary search.
+
     @param intervals: An instance of L{ReadIntervals}.
     @param base: The C{float} logarithmic base to use when adjusting empty
         spaces in the hit sequence.
@@ -124,6 +279,20 @@ class OffsetAdjuster(object):
                     logWidth = log(width) / divisor
                     self._adjustments.append((stop, width - logWidth))
 
+        # The X offsets of the adjustments (which are increasing), and the
+        # total reduction for an offset that is at or beyond none, the first,
+        # the first two, etc., of them. The totals are summed in the same
+        # order (and start from the same int zero) as they would be if each
+        # offset's adjustments were added up, so the results are identical.
+        self._offsets = [offset for offset, _ in self._adjustments]
+        self._reductions = [0]
+        total = 0
+        for _, reduction in self._adjustments:
+            total += reduction
+            self._reductions.append(total)
+        self._offsetsArray = np.array(self._offsets, dtype=float)
+        self._reductionsArray = np.array(self._reductions, dtype=float)
+
     def adjustments(self):
         """
         Provide the adjustment values for this instance.
@@ -141,13 +310,7 @@ class OffsetAdjuster(object):
         @return: The total C{float} reduction that should be made for this
             offset.
         """
-        reduction = 0
-        for (thisOffset, thisReduction) in self._adjustments:
-            if offset >= thisOffset:
-                reduction += thisReduction
-            else:
-                break
-        return reduction
+        return self._reductions[bisect_right(self._offsets, offset)]
 
     def adjustOffset(self, offset):
         """
@@ -158,6 +321,18 @@ class OffsetAdjuster(object):
         """
         return offset - self._reductionForOffset(offset)
 
+    def adjustOffsets(self, offsets):
+        """
+        Adjust many X offsets.
+
+        @param offsets: An iterable of C{int} offsets to adjust (e.g., a
+            C{list} or a numpy array).
+        @return: A numpy C{float} array of the adjusted offsets.
+        """
+        offsets = np.asarray(offsets)
+        indices = np.searchsorted(self._offsetsArray, offsets, side='right')
+        return offsets - self._reductionsArray[indices]
+
     def adjustHSP(self, hsp):
         """
         Adjust the read and subject start and end offsets in an HSP.
@@ -171,3 +346,30 @@ class OffsetAdjuster(object):
         hsp.readStartInSubject = hsp.readStartInSubject - reduction
         hsp.subjectEnd = hsp.subjectEnd - reduction
         hsp.subjectStart = hsp.subjectStart - reduction
+
+    def adjustHSPs(self, titleAlignments):
+        """
+        Adjust the read and subject start and end offsets in all the HSPs of
+        a title's alignments, as C{adjustHSP} would.
+
+        @param titleAlignments: A L{dark.titles.TitleAlignments} instance.
+            Its cached HSP statistics (if any) are cleared, as the coverage
+            of its subject changes.
+        """
+        hsps = list(titleAlignments.hsps())
+        if not hsps:
+            return
+
+        starts = np.array([min(hsp.readStartInSubject, hsp.subjectStart)
+                           for hsp in hsps], dtype=float)
+        indices = np.searchsorted(self._offsetsArray, starts, side='right')
+        reductions = self._reductions
+
+        for hsp, index in zip(hsps, indices.tolist()):
+            reduction = reductions[index]
+            hsp.readEndInSubject = hsp.readEndInSubject - reduction
+            hsp.readStartInSubject = hsp.readStartInSubject - reduction
+            hsp.subjectEnd = hsp.subjectEnd - reduction
+            hsp.subjectStart = hsp.subjectStart - reduction
+
+        titleAlignments.invalidateStats()
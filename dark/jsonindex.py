@@ -0,0 +1,259 @@
+import os
+import sqlite3
+from bz2 import BZ2Decompressor
+from json import loads
+
+import bz2file
+
+from dark.utils import connectExisting, replaceFile
+
+
+def _lineOffsets(filename, chunkSize=1 << 20):
+    """
+    Find the offsets of the lines in a file, which may be compressed with
+    bzip2.
+
+    A bzip2 file may consist of several concatenated streams (as written by
+    convert-diamond-to-json.py --workers N --bzip2, for example). The offset
+    of a line in such a file is given as the offset of the compressed stream
+    the line starts in, plus the offset of the line in the uncompressed data
+    of that stream. A file that is not compressed is treated as one stream,
+    at offset zero.
+
+    @param filename: A C{str} file name. If it ends with '.bz2' the file
+        will be decompressed.
+    @param chunkSize: The C{int} number of bytes to read from the file at
+        once.
+    @return: A generator that yields 3-tuples, each with the C{int} offset
+        of the stream a line starts in, the C{int} offset of the line in the
+        uncompressed stream, and the C{bytes} line.
+    """
+    if not filename.endswith('.bz2'):
+        with open(filename, 'rb') as fp:
+            offset = 0
+            for line in fp:
+                yield 0, offset, line
+                offset += len(line)
+        return
+
+    with open(filename, 'rb') as fp:
+        # The offset in the file of the start of the current stream, the
+        # offset in the file of the compressed data being decompressed, and
+        # the offset in the uncompressed stream of the data it gives.
+        streamOffset = dataOffset = uncompressedOffset = 0
+        # Where the (possibly partial) line being accumulated started.
+        lineStreamOffset = lineOffset = 0
+        pending = b''
+        decompressor = BZ2Decompressor()
+        data = fp.read(chunkSize)
+
+        while data:
+            uncompressed = decompressor.decompress(data)
+            start = 0
+            while True:
+                end = uncompressed.find(b'\n', start) + 1
+                if end == 0:
+                    break
+                yield (lineStreamOffset, lineOffset,
+                       pending + uncompressed[start:end])
+                pending = b''
+                lineStreamOffset = streamOffset
+                lineOffset = uncompressedOffset + end
+                start = end
+            pending += uncompressed[start:]
+            uncompressedOffset += len(uncompressed)
+
+            if decompressor.eof:
+                # Another stream may follow this one.
+                unused = decompressor.unused_data
+                streamOffset = dataOffset + len(data) - len(unused)
+                dataOffset = streamOffset
+                uncompressedOffset = 0
+                decompressor = BZ2Decompressor()
+                if not pending:
+                    lineStreamOffset, lineOffset = streamOffset, 0
+                data = unused or fp.read(chunkSize)
+            else:
+                dataOffset += len(data)
+                data = fp.read(chunkSize)
+
+        if pending:
+            yield lineStreamOffset, lineOffset, pending
+
+
+class JSONRecordIndex(object):
+    """
+    Provide random access to the records in one of our JSON BLAST or DIAMOND
+    files (possibly compressed with bzip2), via an index of the offsets of
+    the records.
+
+    The index is an sqlite3 database, which is made the first time it is
+    needed and saved next to the JSON file so it can be re-used later (it is
+    remade if the JSON file is newer than the index). If the index cannot be
+    saved, an in-memory index is made instead.
+
+    Records are numbered from zero, in the order they appear in the file
+    (the line of parameters at the start of the file is not a record).
+
+    Finding a record in a bzip2 file needs only the compressed stream it is
+    in to be decompressed, from its start up to the record. So there is
+    only a real saving if the file was written as many streams, as
+    convert-diamond-to-json.py --workers N --bzip2 does.
+
+    @param filename: A C{str} JSON file name. If it ends with '.bz2' the
+        file will be decompressed.
+    @param indexFilename: The C{str} file name of the index. If C{None},
+        C{filename} with C{INDEX_SUFFIX} appended is used.
+    """
+    INDEX_SUFFIX = '.dark-index.sqlite3'
+
+    def __init__(self, filename, indexFilename=None):
+        self._filename = filename
+        self._indexFilename = indexFilename or filename + self.INDEX_SUFFIX
+        self._connection = None
+
+    def isCurrent(self):
+        """
+        Is there a saved index that is at least as new as the JSON file?
+
+        @return: A C{bool}.
+        """
+        return (os.path.exists(self._indexFilename) and
+                os.path.getmtime(self._indexFilename) >=
+                os.path.getmtime(self._filename))
+
+    def _fill(self, connection):
+        """
+        Make the index table and add the offsets of all records to it.
+
+        @param connection: An sqlite3 database connection.
+        @raise ValueError: If a record has no query id.
+        @return: The C{int} number of records indexed.
+        """
+        cur = connection.cursor()
+        cur.executescript('''
+            CREATE TABLE records (
+                ordinal INTEGER PRIMARY KEY,
+                query VARCHAR NOT NULL,
+                streamOffset INTEGER NOT NULL,
+                offset INTEGER NOT NULL
+            );
+        ''')
+
+        def records():
+            lines = _lineOffsets(self._filename)
+            # Skip the parameters line.
+            next(lines, None)
+            for ordinal, (streamOffset, offset, line) in enumerate(lines):
+                try:
+                    query = loads(line.decode('UTF-8'))['query']
+                except (ValueError, KeyError) as e:
+                    raise ValueError(
+                        'Could not find the query id in record %d of %r '
+                        '(%s).' % (ordinal, self._filename, e))
+                yield ordinal, query, streamOffset, offset
+
+        cur.executemany('INSERT INTO records VALUES (?, ?, ?, ?)', records())
+        cur.execute('CREATE INDEX query_idx ON records (query)')
+        connection.commit()
+        return cur.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def make(self):
+        """
+        Make an index of the JSON file and save it to C{self._indexFilename}.
+
+        The index is written to a temporary file which then atomically
+        replaces any existing index, so another process can never see a
+        partly written index (or no index at all).
+
+        @raise EnvironmentError: If the index cannot be saved.
+        @return: The C{int} number of records indexed.
+        """
+        self.close()
+        tmpFilename = '%s.%d.tmp' % (self._indexFilename, os.getpid())
+        try:
+            connection = sqlite3.connect(tmpFilename)
+            try:
+                count = self._fill(connection)
+            finally:
+                connection.close()
+            replaceFile(tmpFilename, self._indexFilename)
+        finally:
+            if os.path.exists(tmpFilename):
+                os.unlink(tmpFilename)
+
+        return count
+
+    def _getConnection(self):
+        """
+        Get a connection to the index database, making the index if needed.
+
+        @return: An sqlite3 database connection.
+        """
+        if self._connection is None:
+            try:
+                if not self.isCurrent():
+                    self.make()
+                # Open the index read-only, so an empty database is never
+                # made in its place if it is not there.
+                self._connection = connectExisting(self._indexFilename)
+            except (EnvironmentError, sqlite3.Error):
+                self._connection = sqlite3.connect(':memory:')
+                self._fill(self._connection)
+
+        return self._connection
+
+    def __len__(self):
+        return self._getConnection().execute(
+            'SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def ordinal(self, query):
+        """
+        Find the number of the (first) record for a query.
+
+        @param query: A C{str} query id, as given in the records.
+        @raise KeyError: If there is no record for C{query}.
+        @return: The C{int} number of the record.
+        """
+        row = self._getConnection().execute(
+            'SELECT MIN(ordinal) FROM records WHERE query = ?',
+            (query,)).fetchone()
+        if row[0] is None:
+            raise KeyError(query)
+        return row[0]
+
+    def lines(self, start, stop):
+        """
+        Get the JSON of a range of records.
+
+        @param start: The C{int} number of the first record wanted.
+        @param stop: The C{int} number of the record after the last one
+            wanted (as with Python's C{range}). If this is beyond the last
+            record, all records from C{start} are returned.
+        @return: A generator that yields C{str} lines of JSON (including
+            their trailing newlines).
+        """
+        count = min(stop, len(self)) - start
+        if start < 0 or count < 1:
+            return
+
+        streamOffset, offset = self._getConnection().execute(
+            'SELECT streamOffset, offset FROM records WHERE ordinal = ?',
+            (start,)).fetchone()
+
+        with open(self._filename, 'rb') as fp:
+            fp.seek(streamOffset)
+            if self._filename.endswith('.bz2'):
+                # Reading carries on into following streams, if need be.
+                fp = bz2file.BZ2File(fp)
+            fp.seek(offset)
+            for _ in range(count):
+                yield fp.readline().decode('UTF-8')
+
+    def close(self):
+        """
+        Close the index database connection.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
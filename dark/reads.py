@@ -919,7 +919,7 @@ class ReadFilter(object):
                 whitelist=whitelist, blacklist=blacklist,
                 whitelistFile=whitelistFile, blacklistFile=blacklistFile,
                 positiveRegex=titleRegex, negativeRegex=negativeTitleRegex,
-                truncateAfter=truncateTitlesAfter)
+                truncateAfter=truncateTitlesAfter, cache=False)
         else:
             self.titleFilter = None
 
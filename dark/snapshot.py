@@ -0,0 +1,197 @@
+import gc
+import os
+from hashlib import sha256
+from json import dumps
+
+from six.moves import cPickle as pickle
+
+from dark import __version__
+from dark.alignments import ReadsAlignments
+from dark.titles import TitlesAlignments
+from dark.utils import replaceFile
+
+# Increase this if the contents of snapshot files change.
+SNAPSHOT_FORMAT = 2
+
+
+def _jsonDefault(value):
+    """
+    Convert values that JSON cannot represent, so filter arguments can be
+    included in a fingerprint.
+
+    @param value: A value that C{json.dumps} cannot convert.
+    @return: A C{list} or C{str} that C{json.dumps} can convert.
+    """
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    elif isinstance(value, type):
+        return value.__name__
+    else:
+        return repr(value)
+
+
+def fingerprint(filenames, readsAlignments, readIndex=None):
+    """
+    Make a fingerprint of the inputs used to make a L{TitlesAlignments}
+    instance.
+
+    The fingerprint changes if any input file is replaced, changed, or
+    touched, if different filtering is done, if the options of
+    C{readsAlignments} (see L{ReadsAlignments.readerOptions}) change, or if
+    reads are (or are no longer) looked up via a C{readIndex}.
+
+    @param filenames: An iterable of the C{str} names of the files (reads and
+        BLAST or DIAMOND results) that C{readsAlignments} reads.
+    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance,
+        with any filters already added.
+    @param readIndex: The C{dict}-like object the L{TitlesAlignments} uses to
+        look up reads by id, or C{None} if it keeps the reads in memory.
+    @raise EnvironmentError: If a file cannot be found.
+    @return: A C{str} fingerprint.
+    """
+    files = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        files.append([os.path.abspath(filename), stat.st_size,
+                      stat.st_mtime])
+
+    data = {
+        'files': files,
+        'filters': readsAlignments.filterKwargs,
+        'format': SNAPSHOT_FORMAT,
+        'lazyReads': readIndex is not None,
+        'options': readsAlignments.readerOptions(),
+        'scoreClass': readsAlignments.scoreClass,
+        'version': __version__,
+    }
+
+    return sha256(dumps(data, sort_keys=True, default=_jsonDefault).encode(
+        'UTF-8')).hexdigest()
+
+
+def saveSnapshot(titlesAlignments, filename, fingerprint):
+    """
+    Save a L{TitlesAlignments} instance (with the parameters of its
+    C{readsAlignments}) to a file.
+
+    The snapshot is written to a temporary file which then atomically
+    replaces any existing snapshot, so an interrupted save can never leave a
+    partly written snapshot (and another process never finds it missing).
+
+    The read index of a L{TitlesAlignments} made with one is not saved (see
+    L{dark.titles.TitleAlignment}). It must be given to L{loadSnapshot}.
+
+    @param titlesAlignments: A L{TitlesAlignments} instance.
+    @param filename: The C{str} name of the file to save to.
+    @param fingerprint: The C{str} fingerprint of the inputs used to make
+        C{titlesAlignments}, as returned by L{fingerprint}.
+    @raise EnvironmentError: If the snapshot cannot be saved.
+    """
+    data = {
+        'fingerprint': fingerprint,
+        'format': SNAPSHOT_FORMAT,
+        'params': titlesAlignments.readsAlignments.params,
+        'scoreClass': titlesAlignments.scoreClass,
+        'titles': dict(titlesAlignments),
+    }
+
+    tmpFilename = '%s.%d.tmp' % (filename, os.getpid())
+    try:
+        with open(tmpFilename, 'wb') as fp:
+            pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+        replaceFile(tmpFilename, filename)
+    finally:
+        if os.path.exists(tmpFilename):
+            os.unlink(tmpFilename)
+
+
+def loadSnapshot(filename, fingerprint, readsAlignments=None,
+                 readIndex=None):
+    """
+    Load a L{TitlesAlignments} instance saved by L{saveSnapshot}, if it was
+    made from the same inputs.
+
+    @param filename: The C{str} name of the snapshot file.
+    @param fingerprint: The C{str} fingerprint of the current inputs, as
+        returned by L{fingerprint}.
+    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance for
+        the loaded L{TitlesAlignments} to use (e.g., to find subject
+        sequences when plotting). If C{None}, a L{ReadsAlignments} that has
+        the saved parameters (but no reads or alignments) is used.
+    @param readIndex: A C{dict}-like object to look up reads by id, if the
+        snapshot was made from a L{TitlesAlignments} that was given one
+        (whether it was is part of the fingerprint made by L{fingerprint}).
+    @return: A L{TitlesAlignments} instance, or C{None} if C{filename} does
+        not exist, cannot be read, or was made from different inputs.
+    """
+    # Unpickling makes many objects (none of them garbage), which triggers
+    # many pointless (and increasingly slow) garbage collections.
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(filename, 'rb') as fp:
+            data = pickle.load(fp)
+    except (EnvironmentError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError, ValueError):
+        return None
+    finally:
+        if gcEnabled:
+            gc.enable()
+
+    if (not isinstance(data, dict) or
+            data.get('format') != SNAPSHOT_FORMAT or
+            data.get('fingerprint') != fingerprint):
+        return None
+
+    if readsAlignments is None:
+        readsAlignments = ReadsAlignments(None, data['params'],
+                                          scoreClass=data['scoreClass'])
+
+    titlesAlignments = TitlesAlignments(
+        readsAlignments, scoreClass=data['scoreClass'],
+        importReadsAlignmentsTitles=False, readIndex=readIndex)
+    titlesAlignments.update(data['titles'])
+
+    if readIndex is not None:
+        for titleAlignments in titlesAlignments.values():
+            for titleAlignment in titleAlignments:
+                titleAlignment.setReadIndex(readIndex)
+
+    return titlesAlignments
+
+
+def snapshotTitlesAlignments(readsAlignments, filenames, snapshotFilename,
+                             workers=1, readIndex=None):
+    """
+    Get a L{TitlesAlignments} instance for a L{ReadsAlignments}, re-using a
+    snapshot if it was made from the same inputs, else making a new one (and
+    saving a snapshot of it).
+
+    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance,
+        with any filters already added.
+    @param filenames: An iterable of the C{str} names of the files (reads and
+        BLAST or DIAMOND results) that C{readsAlignments} reads.
+    @param snapshotFilename: The C{str} name of the snapshot file.
+    @param workers: The C{int} number of processes to use to read the
+        alignments, if no snapshot can be used (see L{TitlesAlignments}).
+    @param readIndex: A C{dict}-like object to look up reads by id, if the
+        L{TitlesAlignments} should not keep the reads in memory (see
+        L{TitlesAlignments}).
+    @return: A 2-tuple with a L{TitlesAlignments} instance and a C{bool}
+        that is C{True} if it was loaded from the snapshot.
+    """
+    currentFingerprint = fingerprint(filenames, readsAlignments, readIndex)
+    titlesAlignments = loadSnapshot(snapshotFilename, currentFingerprint,
+                                    readsAlignments, readIndex)
+
+    if titlesAlignments is None:
+        titlesAlignments = TitlesAlignments(readsAlignments, workers=workers,
+                                            readIndex=readIndex)
+        try:
+            saveSnapshot(titlesAlignments, snapshotFilename,
+                         currentFingerprint)
+        except EnvironmentError:
+            pass
+        return titlesAlignments, False
+    else:
+        return titlesAlignments, True
@@ -0,0 +1,434 @@
+import os
+from collections import OrderedDict
+from shutil import rmtree
+from tempfile import mkdtemp
+from zlib import crc32
+
+from six.moves import cPickle as pickle
+
+from dark.titles import TitleAlignment, TitleAlignments, _TitlesMixin
+
+
+class _SpillDirectory(object):
+    """
+    Hold the files of a L{SpilledTitlesAlignments} in a new directory, which
+    is removed when C{close} is called or when the instance is no longer
+    referenced.
+
+    @param directory: The C{str} name of the directory to make the new
+        directory in. If C{None}, the system's temporary directory is used.
+    """
+
+    # The name of the file that holds the alignments of all titles.
+    TITLES = 'titles'
+
+    def __init__(self, directory=None):
+        self.dirname = mkdtemp(prefix='dark-spill-', dir=directory)
+        self._fp = None
+
+    def __del__(self):
+        self.close()
+
+    def path(self, name):
+        """
+        Get the path of a file in the directory.
+
+        @param name: The C{str} name of the file.
+        @return: The C{str} path of the file.
+        """
+        return os.path.join(self.dirname, name)
+
+    def load(self, offset):
+        """
+        Load the alignments of a title.
+
+        @param offset: The C{int} offset in the titles file of the pickled
+            alignments.
+        @return: A C{list} of C{(read, hsps)} 2-tuples.
+        """
+        if self._fp is None:
+            self._fp = open(self.path(self.TITLES), 'rb')
+        self._fp.seek(offset)
+        return pickle.load(self._fp)
+
+    def close(self):
+        """
+        Close the titles file and remove the directory.
+        """
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if self.dirname is not None:
+            rmtree(self.dirname, ignore_errors=True)
+            self.dirname = None
+
+
+class SpilledTitleAlignments(object):
+    """
+    Hold the statistics of the alignments against a sequence, whose reads
+    and HSPs are kept on disk and only loaded when they are needed.
+
+    This has the methods of L{dark.titles.TitleAlignments} that are used to
+    filter, sort, and summarize titles (which all use the statistics).
+    Other methods (e.g., C{hsps} or iteration) load the alignments, each
+    time they are called. Use C{load} to get a L{TitleAlignments} instance
+    to use repeatedly (e.g., for plotting).
+
+    @param spillDirectory: The L{_SpillDirectory} the alignments are in.
+    @param offset: The C{int} offset of the alignments in the titles file.
+    @param titleAlignments: The L{TitleAlignments} instance whose statistics
+        should be kept.
+    """
+
+    def __init__(self, spillDirectory, offset, titleAlignments):
+        self._spillDirectory = spillDirectory
+        self._offset = offset
+        self.subjectTitle = titleAlignments.subjectTitle
+        self.subjectLength = titleAlignments.subjectLength
+        self._readCount = titleAlignments.readCount()
+        self._hspCount = titleAlignments.hspCount()
+        if self._hspCount:
+            self._bestHsp = titleAlignments.bestHsp()
+            self._worstHsp = titleAlignments.worstHsp()
+            self._medianScore = titleAlignments.medianScore()
+        else:
+            self._bestHsp = self._worstHsp = self._medianScore = None
+        self._coverage = titleAlignments.coverage()
+
+    def load(self):
+        """
+        Load the alignments against this title.
+
+        @return: A L{TitleAlignments} instance.
+        """
+        titleAlignments = TitleAlignments(self.subjectTitle,
+                                          self.subjectLength)
+        for read, hsps in self._spillDirectory.load(self._offset):
+            titleAlignments.addAlignment(TitleAlignment(read, hsps))
+        return titleAlignments
+
+    def plottingCopy(self):
+        """
+        Load the alignments against this title, for plotting. As they are
+        loaded afresh, their HSPs can be changed without changing ours.
+
+        @return: A L{TitleAlignments} instance.
+        """
+        return self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return self._readCount
+
+    def reads(self):
+        """
+        Find the set of reads matching this title.
+
+        @return: A generator that yields C{dark.reads.Read} instances (or one
+            of its subclasses).
+        """
+        return self.load().reads()
+
+    def readIds(self):
+        """
+        Find the set of read ids that matched the title.
+
+        @return: A C{set} of read ids that aligned to this title.
+        """
+        return self.load().readIds()
+
+    def hsps(self):
+        """
+        Get all HSPs for the alignments to a title.
+
+        @return: A generator yielding L{dark.hsp.HSP} instances.
+        """
+        return self.load().hsps()
+
+    def readCount(self):
+        """
+        Find out how many reads aligned to this title.
+
+        @return: The C{int} number of reads that aligned to this title.
+        """
+        return self._readCount
+
+    def hspCount(self):
+        """
+        How many HSPs were there in total for all the alignments to a title.
+
+        @return: The C{int} number of HSPs for the alignments to this title.
+        """
+        return self._hspCount
+
+    def bestHsp(self):
+        """
+        Find the HSP with the best score.
+
+        @raise ValueError: If there are no HSPs.
+        @return: The C{dark.hsp.HSP} instance (or a subclass) with the best
+        score.
+        """
+        if self._bestHsp is None:
+            raise ValueError('No HSPs have been added.')
+        return self._bestHsp
+
+    def worstHsp(self):
+        """
+        Find the HSP with the worst score.
+
+        @raise ValueError: If there are no HSPs.
+        @return: The C{dark.hsp.HSP} instance (or a subclass) with the worst
+        score.
+        """
+        if self._worstHsp is None:
+            raise ValueError('No HSPs have been added.')
+        return self._worstHsp
+
+    def hasScoreBetterThan(self, score):
+        """
+        Is there an HSP with a score better than a given value?
+
+        @return: A C{bool}, C{True} if there is at least one HSP in the
+        alignments for this title with a score better than C{score}.
+        """
+        return self._bestHsp is not None and self._bestHsp.betterThan(score)
+
+    def medianScore(self):
+        """
+        Find the median score for the HSPs in the alignments that match
+        this title.
+
+        @raise ValueError: If there are no HSPs.
+        @return: The C{float} median score of HSPs in alignments matching the
+            title.
+        """
+        if self._medianScore is None:
+            raise ValueError('No HSPs have been added.')
+        return self._medianScore
+
+    def coverage(self):
+        """
+        Get the fraction of this title sequence that is matched by its reads.
+
+        @return: The C{float} fraction of the title sequence matched by its
+            reads.
+        """
+        return self._coverage
+
+    def summary(self):
+        """
+        Summarize the alignments for this subject.
+
+        @return: A C{dict} with the keys described in
+            L{TitleAlignments.summary}.
+        """
+        return {
+            'bestScore': self.bestHsp().score.score,
+            'coverage': self.coverage(),
+            'hspCount': self.hspCount(),
+            'medianScore': self.medianScore(),
+            'readCount': self.readCount(),
+            'subjectLength': self.subjectLength,
+            'subjectTitle': self.subjectTitle,
+        }
+
+
+class SpilledTitlesAlignments(_TitlesMixin, dict):
+    """
+    Holds (as a dictionary) a set of titles, each with a
+    L{SpilledTitleAlignments} whose alignments are kept on disk, for when
+    a L{dark.titles.TitlesAlignments} would not fit in memory.
+
+    The alignments in C{readsAlignments} are read once. Each alignment is
+    put into one of C{segmentCount} segment files, chosen by a hash of its
+    title. Alignments are held in memory until C{maxBufferedHsps} HSPs have
+    been read, and are then appended to their segment files. Each segment
+    is then loaded in turn, to find the statistics of its titles and to
+    write the alignments of each of its titles together into one file, from
+    which they can be loaded one title at a time. So at most one segment
+    (roughly 1 / C{segmentCount} of the alignments) is ever in memory.
+
+    Filtering and sorting use the statistics, and so do not load any
+    alignments (except that filtering with C{minNewReads} loads the read
+    ids of each title it tests).
+
+    The files are removed when C{close} is called, or when this instance,
+    all instances made from it by C{filter}, and all of their values are no
+    longer referenced.
+
+    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance.
+    @param scoreClass: A class to hold and compare scores. If C{None},
+        the score class from readsAlignments will be used.
+    @param directory: The C{str} name of the directory to make a (new)
+        directory for the files in. If C{None}, the system's temporary
+        directory is used.
+    @param maxBufferedHsps: The C{int} number of HSPs to hold in memory
+        before writing them to the segment files.
+    @param segmentCount: The C{int} number of segment files.
+    @param readSetFilter: An instance of dark.filter.ReadSetFilter, or C{None}.
+        This can be used to pass a previously used title filter for ongoing
+        use in filtering.
+    @param importReadsAlignmentsTitles: If C{True}, titles from
+        C{readsAlignments} will be added to self. This argument is only used
+        by the filtering function to make a new instance without reading its
+        titles.
+    @param spillDirectory: A L{_SpillDirectory} instance to use. This
+        argument is only used by the filtering function.
+    """
+
+    def __init__(self, readsAlignments, scoreClass=None, directory=None,
+                 maxBufferedHsps=1000000, segmentCount=64,
+                 readSetFilter=None, importReadsAlignmentsTitles=True,
+                 spillDirectory=None):
+        dict.__init__(self)
+        self.readsAlignments = readsAlignments
+        self.scoreClass = scoreClass or readsAlignments.scoreClass
+        self.readSetFilter = readSetFilter
+        self._spillDirectory = spillDirectory or _SpillDirectory(directory)
+        if importReadsAlignmentsTitles:
+            subjectLengths = self._writeSegments(maxBufferedHsps,
+                                                 segmentCount)
+            self._writeTitles(subjectLengths, segmentCount)
+
+    def _segmentFilename(self, segment):
+        """
+        Get the name of a segment file.
+
+        @param segment: The C{int} segment number.
+        @return: The C{str} path of the segment file.
+        """
+        return self._spillDirectory.path('segment-%d' % segment)
+
+    def _writeSegments(self, maxBufferedHsps, segmentCount):
+        """
+        Read the alignments of our C{readsAlignments} and write them to the
+        segment files.
+
+        Each time the buffered alignments are written, each segment file has
+        a pickled C{list} of C{(title, read, hsps)} 3-tuples appended to it.
+
+        @param maxBufferedHsps: The C{int} number of HSPs to hold in memory
+            before writing them to the segment files.
+        @param segmentCount: The C{int} number of segment files.
+        @return: A C{dict} mapping each C{str} title to its C{int} subject
+            length, in the order the titles were first seen.
+        """
+        subjectLengths = OrderedDict()
+        segments = {}
+        buffers = [[] for _ in range(segmentCount)]
+        bufferedHsps = 0
+
+        for readAlignments in self.readsAlignments:
+            read = readAlignments.read
+            for alignment in readAlignments:
+                title = alignment.subjectTitle
+                try:
+                    segment = segments[title]
+                except KeyError:
+                    segment = segments[title] = (
+                        (crc32(title.encode('UTF-8')) & 0xffffffff) %
+                        segmentCount)
+                    subjectLengths[title] = alignment.subjectLength
+                buffers[segment].append((title, read, alignment.hsps))
+                bufferedHsps += len(alignment.hsps)
+                if bufferedHsps >= maxBufferedHsps:
+                    self._flush(buffers)
+                    bufferedHsps = 0
+
+        self._flush(buffers)
+        return subjectLengths
+
+    def _flush(self, buffers):
+        """
+        Append buffered alignments to their segment files and empty the
+        buffers.
+
+        @param buffers: A C{list} with a C{list} of buffered C{(title, read,
+            hsps)} 3-tuples for each segment.
+        """
+        for segment, records in enumerate(buffers):
+            if records:
+                with open(self._segmentFilename(segment), 'ab') as fp:
+                    pickle.dump(records, fp, pickle.HIGHEST_PROTOCOL)
+                del records[:]
+
+    def _writeTitles(self, subjectLengths, segmentCount):
+        """
+        Load each segment, write the alignments of each of its titles to the
+        titles file, and add the titles to self (in the order they were
+        first seen, as in a L{TitlesAlignments}). The segment files are
+        removed once they have been read.
+
+        @param subjectLengths: A C{dict} mapping each C{str} title to its
+            C{int} subject length, in the order the titles were first seen.
+        @param segmentCount: The C{int} number of segment files.
+        """
+        spillDirectory = self._spillDirectory
+        spilled = {}
+        with open(spillDirectory.path(spillDirectory.TITLES), 'wb') as out:
+            for segment in range(segmentCount):
+                filename = self._segmentFilename(segment)
+                if not os.path.exists(filename):
+                    continue
+
+                titles = {}
+                with open(filename, 'rb') as fp:
+                    while True:
+                        try:
+                            records = pickle.load(fp)
+                        except EOFError:
+                            break
+                        for title, read, hsps in records:
+                            try:
+                                titleAlignments = titles[title]
+                            except KeyError:
+                                titleAlignments = titles[title] = (
+                                    TitleAlignments(title,
+                                                    subjectLengths[title]))
+                            titleAlignments.addAlignment(
+                                TitleAlignment(read, hsps))
+                os.unlink(filename)
+
+                for title, titleAlignments in titles.items():
+                    offset = out.tell()
+                    pickle.dump([(alignment.read, alignment.hsps)
+                                 for alignment in titleAlignments],
+                                out, pickle.HIGHEST_PROTOCOL)
+                    spilled[title] = SpilledTitleAlignments(
+                        spillDirectory, offset, titleAlignments)
+
+        for title in subjectLengths:
+            self[title] = spilled[title]
+
+    def _new(self):
+        """
+        Make a new, empty, L{SpilledTitlesAlignments} instance with our
+        attributes, that shares our files.
+
+        @return: A L{SpilledTitlesAlignments} instance.
+        """
+        return SpilledTitlesAlignments(
+            self.readsAlignments, self.scoreClass,
+            readSetFilter=self.readSetFilter,
+            importReadsAlignmentsTitles=False,
+            spillDirectory=self._spillDirectory)
+
+    def hsps(self):
+        """
+        Get all HSPs for all the alignments for all titles, loading the
+        alignments of one title at a time.
+
+        @return: A generator yielding L{dark.hsp.HSP} instances.
+        """
+        return (hsp for titleAlignments in self.values()
+                for hsp in titleAlignments.hsps())
+
+    def close(self):
+        """
+        Remove our files. After this, the alignments of our titles (and those
+        of any instance made from this one by C{filter}) cannot be loaded.
+        """
+        self._spillDirectory.close()
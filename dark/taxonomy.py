@@ -1,4 +1,10 @@
-from dark.database import getDatabaseConnection
+import sqlite3
+from array import array
+from itertools import islice
+
+# The number of accession2taxid lines to stage at once when making a local
+# taxonomy database. See makeLocalTaxonomyDatabase.
+_ACCESSION_BATCH_SIZE = 1000000
 
 
 class LineageFetcher(object):
@@ -7,7 +13,12 @@ class LineageFetcher(object):
     of title sequences hit by BLAST.
     """
     def __init__(self, db=None, cursor=None):
-        self._db = db or getDatabaseConnection()
+        if db is None:
+            # Import here so the MySQL connector is only needed if we
+            # actually use a MySQL database.
+            from dark.database import getDatabaseConnection
+            db = getDatabaseConnection()
+        self._db = db
         self._cursor = cursor or self._db.cursor()
         self._cache = {}
 
@@ -52,6 +63,16 @@ class LineageFetcher(object):
         self._cache[title] = lineage
         return lineage
 
+    def lineages(self, titles):
+        """
+        Get lineage information for many titles.
+
+        @param titles: An iterable of C{str} sequence titles.
+        @return: A C{list} with the lineage (as returned by C{lineage}) of
+            each title in C{titles}.
+        """
+        return [self.lineage(title) for title in titles]
+
     def close(self):
         """
         Close the database connection and render self invalid. Any subsequent
@@ -60,3 +81,262 @@ class LineageFetcher(object):
         self._cursor.close()
         self._db.close()
         self._cursor = self._db = self._cache = None
+
+
+def _titleKeys(title):
+    """
+    Find the gi number and the (unversioned) accession in a sequence title.
+
+    @param title: A C{str} sequence title, either of the form
+        'gi|63148399|gb|DQ011818.1| Description...' or of the form
+        'DQ011818.1 Description...'.
+    @return: A 2-tuple with the C{int} gi number and the C{str} accession
+        (without a version suffix) in C{title}. Either may be C{None} if it
+        cannot be found.
+    """
+    fields = title.split('|')
+    if len(fields) > 3 and fields[0] == 'gi':
+        try:
+            gi = int(fields[1])
+        except ValueError:
+            gi = None
+        accession = fields[3] or None
+    else:
+        gi = None
+        words = title.split(None, 1)
+        if words:
+            accession = [field for field in words[0].split('|') if field][-1]
+        else:
+            accession = None
+
+    if accession:
+        accession = accession.split('.')[0]
+
+    return gi, accession
+
+
+def makeLocalTaxonomyDatabase(dbFilename, nodesFp, namesFp, giTaxIdFps=(),
+                              accessionTaxIdFps=()):
+    """
+    Make an sqlite3 taxonomy database for use by L{LocalLineageFetcher}.
+
+    @param dbFilename: A C{str} file name for the database. The file must not
+        already hold a taxonomy database.
+    @param nodesFp: An open file with the contents of the NCBI nodes.dmp file.
+    @param namesFp: An open file with the contents of the NCBI names.dmp file.
+    @param giTaxIdFps: An iterable of open files with the contents of NCBI
+        gi_taxid_*.dmp files (lines with a gi number and a taxonomy id).
+    @param accessionTaxIdFps: An iterable of open files with the contents of
+        NCBI *.accession2taxid files (a header line, then lines with an
+        accession, a versioned accession, a taxonomy id and a gi number).
+    @return: A 3-tuple of C{int}s, giving the number of taxonomy nodes, gi
+        numbers, and accessions in the database.
+    """
+    names = {}
+    for line in namesFp:
+        fields = line.split('\t|\t')
+        if fields[3].startswith('scientific name'):
+            names[int(fields[0])] = fields[1]
+
+    db = sqlite3.connect(dbFilename)
+    cur = db.cursor()
+    cur.executescript('''
+        CREATE TABLE nodes (
+            taxID INTEGER PRIMARY KEY,
+            parentTaxID INTEGER NOT NULL,
+            name VARCHAR
+        );
+
+        CREATE TABLE gi_taxid (
+            gi INTEGER PRIMARY KEY,
+            taxID INTEGER NOT NULL
+        );
+
+        CREATE TABLE accession_taxid (
+            accession VARCHAR PRIMARY KEY,
+            taxID INTEGER NOT NULL
+        );
+    ''')
+
+    def nodes():
+        for line in nodesFp:
+            fields = line.split('\t|\t', 2)
+            taxID = int(fields[0])
+            yield taxID, int(fields[1]), names.get(taxID)
+
+    cur.executemany('INSERT INTO nodes VALUES (?, ?, ?)', nodes())
+
+    for fp in giTaxIdFps:
+        cur.executemany('INSERT OR IGNORE INTO gi_taxid VALUES (?, ?)',
+                        (tuple(map(int, line.split())) for line in fp))
+
+    def accessionRows(fp):
+        for line in fp:
+            fields = line.split()
+            # Skip the header line.
+            if fields[0] != 'accession':
+                # Newer accession2taxid files have no gi column, or have
+                # 'na' in it (which is then not stored as an integer).
+                yield (fields[0], int(fields[2]),
+                       fields[3] if len(fields) > 3 else None)
+
+    # Each line can add to two tables, so batches of lines are inserted (by
+    # one executemany) into a staging table, and copied from there into both
+    # tables by SQLite, in the order of the lines.
+    cur.execute('CREATE TEMPORARY TABLE accession_staging '
+                '(accession VARCHAR, taxID INTEGER, gi INTEGER)')
+    for fp in accessionTaxIdFps:
+        rows = accessionRows(fp)
+        while True:
+            cur.executemany('INSERT INTO accession_staging VALUES (?, ?, ?)',
+                            islice(rows, _ACCESSION_BATCH_SIZE))
+            if cur.rowcount < 1:
+                break
+            cur.execute('INSERT OR IGNORE INTO accession_taxid '
+                        'SELECT accession, taxID FROM accession_staging '
+                        'ORDER BY rowid')
+            cur.execute('INSERT OR IGNORE INTO gi_taxid '
+                        'SELECT gi, taxID FROM accession_staging '
+                        "WHERE typeof(gi) = 'integer' ORDER BY rowid")
+            cur.execute('DELETE FROM accession_staging')
+    cur.execute('DROP TABLE accession_staging')
+
+    db.commit()
+
+    counts = tuple(
+        cur.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+        for table in ('nodes', 'gi_taxid', 'accession_taxid'))
+    db.close()
+    return counts
+
+
+class LocalLineageFetcher(object):
+    """
+    Provide access to a local (sqlite3) copy of the NCBI taxonomy database,
+    as made by L{makeLocalTaxonomyDatabase} (or bin/make-taxonomy-database.py)
+    so we can retrieve the lineage of title sequences without needing a MySQL
+    server.
+
+    The taxonomy tree (the parent and scientific name of each node) is read
+    into memory when an instance is created, so finding a lineage needs just
+    one indexed database lookup, to find the taxonomy id of the title.
+
+    @param dbFilename: A C{str} file name containing an sqlite3 taxonomy
+        database.
+    """
+    # The maximum number of values to look up in one SQL query.
+    BATCH_SIZE = 500
+
+    def __init__(self, dbFilename):
+        self._db = sqlite3.connect(dbFilename)
+        self._cache = {}
+        cur = self._db.cursor()
+        maxTaxID = cur.execute('SELECT MAX(taxID) FROM nodes').fetchone()[0]
+        size = 0 if maxTaxID is None else maxTaxID + 1
+        # Parents are held in an array and names in a list, both indexed by
+        # taxonomy id. A parent of 0 means there is no node with that id.
+        self._parents = array('l', [0]) * size
+        self._names = [None] * size
+        for taxID, parentTaxID, name in cur.execute(
+                'SELECT taxID, parentTaxID, name FROM nodes'):
+            self._parents[taxID] = parentTaxID
+            self._names[taxID] = name
+
+    def _lineageForTaxID(self, taxID):
+        """
+        Get the lineage of a taxonomy id.
+
+        @param taxID: An C{int} taxonomy id.
+        @return: A C{list} of (C{int}, C{str}) 2-tuples, as described in
+            C{lineage}.
+        """
+        lineage = []
+        parents = self._parents
+        names = self._names
+        while taxID != 1:
+            if not 0 < taxID < len(parents) or parents[taxID] == 0:
+                return []
+            lineage.append((taxID, names[taxID]))
+            taxID = parents[taxID]
+        return lineage
+
+    def _taxIDs(self, table, column, keys):
+        """
+        Look up the taxonomy ids for a collection of keys.
+
+        @param table: The C{str} name of the table to look in.
+        @param column: The C{str} name of the key column of C{table}.
+        @param keys: A C{list} of keys to look up.
+        @return: A C{dict} mapping keys to C{int} taxonomy ids. Keys that are
+            not in the table are not present.
+        """
+        result = {}
+        cur = self._db.cursor()
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            batch = keys[start:start + self.BATCH_SIZE]
+            cur.execute(
+                'SELECT %s, taxID FROM %s WHERE %s IN (%s)' %
+                (column, table, column, ', '.join('?' * len(batch))), batch)
+            result.update(cur.fetchall())
+        return result
+
+    def lineage(self, title):
+        """
+        Get lineage information from the taxonomy database for a given title.
+
+        @param title: A C{str} sequence title (e.g., from a BLAST hit). Either
+            of the form 'gi|63148399|gb|DQ011818.1| Description...', in which
+            case the gi number (63148399) is looked up in the taxonomy database
+            (followed by the accession, DQ011818, if the gi number is not
+            found), or of the form 'DQ011818.1 Description...', in which case
+            the accession (DQ011818) is looked up.
+        @return: A C{list} of the taxonomic categories of the title. Each list
+            element is an (C{int}, C{str}) 2-tuple, giving a taxonomy id and
+            a scientific name. The first element in the list will correspond to
+            C{title}, and each successive element is the parent of the
+            preceeding one. If no taxonomy is found, the returned list will be
+            empty.
+        """
+        return self.lineages([title])[0]
+
+    def lineages(self, titles):
+        """
+        Get lineage information for many titles, using just a few database
+        queries.
+
+        @param titles: An iterable of C{str} sequence titles.
+        @return: A C{list} with the lineage (as returned by C{lineage}) of
+            each title in C{titles}.
+        """
+        titles = list(titles)
+        cache = self._cache
+        keys = {}
+        for title in titles:
+            if title not in cache:
+                keys[title] = _titleKeys(title)
+
+        if keys:
+            giTaxIDs = self._taxIDs(
+                'gi_taxid', 'gi',
+                list(set(gi for gi, _ in keys.values() if gi is not None)))
+
+            # Only look up accessions for titles whose gi was not found.
+            accessionTaxIDs = self._taxIDs(
+                'accession_taxid', 'accession',
+                list(set(accession for gi, accession in keys.values()
+                         if gi not in giTaxIDs and accession is not None)))
+
+            for title, (gi, accession) in keys.items():
+                taxID = giTaxIDs.get(gi) or accessionTaxIDs.get(accession)
+                cache[title] = (
+                    [] if taxID is None else self._lineageForTaxID(taxID))
+
+        return [cache[title] for title in titles]
+
+    def close(self):
+        """
+        Close the database connection and render self invalid. Any subsequent
+        re-use of self will raise an error.
+        """
+        self._db.close()
+        self._db = self._cache = self._parents = self._names = None
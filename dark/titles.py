@@ -1,8 +1,14 @@
+import copy
+import heapq
+import multiprocessing
+import os
 from collections import defaultdict, Counter
 
-from dark.utils import median
+import numpy as np
+
+from dark.utils import ApproximateMedian, median
 from dark.filter import ReadSetFilter
-from dark.intervals import ReadIntervals
+from dark.intervals import MergedIntervals, ReadIntervals
 
 
 def titleCounts(readsAlignments):
@@ -23,34 +29,127 @@ def titleCounts(readsAlignments):
     return titles
 
 
+class _UnsetReadIndex(object):
+    """
+    Stand in for the read index of an unpickled L{TitleAlignment} (read
+    indices are not pickled), until L{TitleAlignment.setReadIndex} is called.
+    """
+    def __getitem__(self, id_):
+        raise ValueError('The read index of the alignment of read %r has not '
+                         'been set (see TitleAlignment.setReadIndex).' % id_)
+
+
 class TitleAlignment(object):
     """
     Hold information about a read's HSPs for a title alignment.
 
-    @param read: The C{Read} that aligned.
+    If a C{readIndex} is given, only the id of the read is kept, and the
+    read is looked up in C{readIndex} each time it is needed (so its
+    sequence is not kept in memory, unless C{readIndex} caches it).
+
+    @param read: The C{Read} that aligned, or its C{str} id if C{readIndex}
+        is given.
     @param hsps: A C{list} of L{dark.hsp.HSP} (or subclass) instances.
+    @param readIndex: A C{dict}-like object that returns the L{Read} with a
+        given id, e.g., a L{dark.fasta.IndexedFasta}, or C{None}. This is not
+        pickled (see C{setReadIndex}).
     """
 
-    def __init__(self, read, hsps):
-        self.read = read
+    def __init__(self, read, hsps, readIndex=None):
+        self._read = read
         self.hsps = hsps
+        self._readIndex = readIndex
+        self._setReadHolder()
+
+    def __getstate__(self):
+        # A read index is not pickled, as it may hold all the reads (or an
+        # open database connection). It must be set again, with
+        # setReadIndex, when we are unpickled.
+        if self._readIndex is None:
+            return self.__dict__
+        state = self.__dict__.copy()
+        state['_readIndex'] = _UnsetReadIndex()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setReadHolder()
+
+    def setReadIndex(self, readIndex):
+        """
+        Set the index to look up our read in. This must be called after a
+        L{TitleAlignment} made with a C{readIndex} is unpickled.
+
+        @param readIndex: A C{dict}-like object that returns the L{Read} with
+            a given id.
+        """
+        self._readIndex = readIndex
+
+    def _setReadHolder(self):
+        """
+        Tell our HSPs that we hold their read (see
+        L{dark.hsp.HSP.setReadHolder}), so they can find it (only) if their
+        matched sequences need to be made.
+        """
+        for hsp in self.hsps:
+            hsp.setReadHolder(self)
+
+    @property
+    def read(self):
+        """
+        Get the read that aligned.
+
+        @return: A C{Read} instance.
+        """
+        if self._readIndex is None:
+            return self._read
+        return self._readIndex[self._read]
+
+    @property
+    def readId(self):
+        """
+        Get the id of the read that aligned, without looking the read up.
+
+        @return: The C{str} read id.
+        """
+        if self._readIndex is None:
+            return self._read.id
+        return self._read
 
 
 class TitleAlignments(list):
     """
     Holds information about a list of alignments against a sequence.
 
+    Statistics about the HSPs (their number, the best and worst HSP, the
+    median score, and the coverage of the subject) are computed together
+    when first needed and cached. The cache is cleared when the list of
+    alignments is changed. If the HSPs of an alignment already in the list
+    are changed, L{invalidateStats} must be called.
+
     @param subjectTitle: The C{str} title of the sequence the read matched
         against.
     @param subjectLength: The C{int} length of the sequence the read matched
         against.
     """
 
+    # The cached statistics (see _getStats). This is a class attribute so
+    # that instances pickled without it (see __getstate__) have it.
+    _stats = None
+
     def __init__(self, subjectTitle, subjectLength):
         # TODO: Do we need the title in here?
         self.subjectTitle = subjectTitle
         self.subjectLength = subjectLength
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_stats', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
     def addAlignment(self, alignment):
         """
         Add an alignment to the list of alignments that matched this title.
@@ -59,6 +158,63 @@ class TitleAlignments(list):
         """
         self.append(alignment)
 
+    def plottingCopy(self):
+        """
+        Make a copy of these alignments whose HSP scores and offsets can be
+        changed (e.g., when plotting) without changing ours. The reads and
+        the matched sequences of the HSPs are shared, not copied.
+
+        @return: A new L{TitleAlignments} instance.
+        """
+        titleAlignments = TitleAlignments(self.subjectTitle,
+                                          self.subjectLength)
+        for alignment in self:
+            titleAlignments.append(TitleAlignment(
+                alignment._read,
+                [hsp.plottingCopy() for hsp in alignment.hsps],
+                alignment._readIndex))
+        return titleAlignments
+
+    def invalidateStats(self):
+        """
+        Clear the cached HSP statistics, so they are recomputed when next
+        needed.
+        """
+        self._stats = None
+
+    def _getStats(self):
+        """
+        Get the HSP statistics, computing them if they are not cached.
+
+        @return: A C{dict} with keys 'hsps' (a C{list} of all HSPs), 'scores'
+            (a numpy array of their scores), 'best' and 'worst' (the best and
+            worst HSPs, or C{None} if there are no HSPs), and 'coverage' (the
+            C{float} fraction of the subject matched by the HSPs, or C{None}
+            until it is first needed).
+        """
+        if self._stats is None:
+            hsps = list(self.hsps())
+            scores = np.array([hsp.score.score for hsp in hsps], dtype=float)
+            if hsps:
+                # Use the first index of the best (or worst) score, to match
+                # Python's max and min.
+                scoreClass = hsps[0].score.__class__
+                if scoreClass(0) < scoreClass(1):
+                    best, worst = scores.argmax(), scores.argmin()
+                else:
+                    best, worst = scores.argmin(), scores.argmax()
+                best, worst = hsps[best], hsps[worst]
+            else:
+                best = worst = None
+            self._stats = {
+                'best': best,
+                'coverage': None,
+                'hsps': hsps,
+                'scores': scores,
+                'worst': worst,
+            }
+        return self._stats
+
     def reads(self):
         """
         Find the set of reads matching this title.
@@ -82,7 +238,7 @@ class TitleAlignments(list):
 
         @return: The C{int} number of HSPs for the alignments to this title.
         """
-        return sum(len(alignment.hsps) for alignment in self)
+        return len(self._getStats()['hsps'])
 
     def readIds(self):
         """
@@ -90,7 +246,7 @@ class TitleAlignments(list):
 
         @return: A C{set} of read ids that aligned to this title.
         """
-        return set(alignment.read.id for alignment in self)
+        return set(alignment.readId for alignment in self)
 
     def hsps(self):
         """
@@ -108,7 +264,11 @@ class TitleAlignments(list):
         @return: The C{dark.hsp.HSP} instance (or a subclass) with the best
         score.
         """
-        return max(hsp for hsp in self.hsps())
+        best = self._getStats()['best']
+        if best is None:
+            # Raise the ValueError that max raises for an empty sequence.
+            return max(hsp for hsp in self.hsps())
+        return best
 
     def worstHsp(self):
         """
@@ -118,7 +278,11 @@ class TitleAlignments(list):
         @return: The C{dark.hsp.HSP} instance (or a subclass) with the worst
         score.
         """
-        return min(hsp for hsp in self.hsps())
+        worst = self._getStats()['worst']
+        if worst is None:
+            # Raise the ValueError that min raises for an empty sequence.
+            return min(hsp for hsp in self.hsps())
+        return worst
 
     def hasScoreBetterThan(self, score):
         """
@@ -128,12 +292,10 @@ class TitleAlignments(list):
         alignments for this title with a score better than C{score}.
         """
         # Note: Do not assume that HSPs in an alignment are sorted in
-        # decreasing order (as they are in BLAST output). If we could
-        # assume that, we could just check the first HSP in each alignment.
-        for hsp in self.hsps():
-            if hsp.betterThan(score):
-                return True
-        return False
+        # decreasing order (as they are in BLAST output). The best HSP is
+        # found by looking at all of them.
+        best = self._getStats()['best']
+        return best is not None and best.betterThan(score)
 
     def medianScore(self):
         """
@@ -144,7 +306,19 @@ class TitleAlignments(list):
         @return: The C{float} median score of HSPs in alignments matching the
             title.
         """
-        return median([hsp.score.score for hsp in self.hsps()])
+        return median(self._getStats()['scores'])
+
+    def _readIntervals(self):
+        """
+        Make a L{ReadIntervals} holding the subject offsets of all our HSPs.
+
+        @return: A L{dark.intervals.ReadIntervals} instance.
+        """
+        intervals = ReadIntervals(self.subjectLength)
+        hsps = self._getStats()['hsps']
+        intervals.addIntervals([hsp.subjectStart for hsp in hsps],
+                               [hsp.subjectEnd for hsp in hsps])
+        return intervals
 
     def coverage(self):
         """
@@ -153,20 +327,90 @@ class TitleAlignments(list):
         @return: The C{float} fraction of the title sequence matched by its
             reads.
         """
-        intervals = ReadIntervals(self.subjectLength)
-        for hsp in self.hsps():
-            intervals.add(hsp.subjectStart, hsp.subjectEnd)
-        return intervals.coverage()
+        stats = self._getStats()
+        if stats['coverage'] is None:
+            stats['coverage'] = self._readIntervals().coverage()
+        return stats['coverage']
 
     def coverageCounts(self):
         """
         For each location in the title sequence, return a count of how many
         times that location is covered by a read.
         """
-        intervals = ReadIntervals(self.subjectLength)
-        for hsp in self.hsps():
-            intervals.add(hsp.subjectStart, hsp.subjectEnd)
-        return intervals.coverageCounts()
+        return self._readIntervals().coverageCounts()
+
+    def _residueArrays(self, includeWhiskers, convert=None):
+        """
+        Get the subject offsets, residues, and HSP scores of all the residues
+        of all HSPs, in the order that C{Read.walkHSP} would give them.
+
+        The residues of each HSP (and its whiskers) are joined into one
+        string, so the arrays are made with a few numpy calls instead of a
+        Python loop per residue.
+
+        @param includeWhiskers: If C{True} include the (possibly empty)
+            non-matching ends of the reads.
+        @param convert: A function to convert the case of a C{str} of
+            residues, or C{None}.
+        @return: A 3-tuple of numpy arrays, of the C{int} subject offsets,
+            the C{uint8} (ASCII) codes of the residues, and the C{float}
+            scores of the HSPs the residues are in.
+        """
+        pieces = []
+        starts = []
+        scores = []
+
+        for titleAlignment in self:
+            if includeWhiskers:
+                # Only look up the read (which may be slow, see
+                # TitleAlignment) if its whiskers are needed.
+                sequence = titleAlignment.read.sequence
+            for hsp in titleAlignment.hsps:
+                score = hsp.score.score
+                if includeWhiskers:
+                    count = hsp.subjectStart - hsp.readStartInSubject
+                    if count > 0:
+                        pieces.append(sequence[:count])
+                        starts.append(hsp.readStartInSubject)
+                        scores.append(score)
+                pieces.append(hsp.readMatchedSequence)
+                starts.append(hsp.subjectStart)
+                scores.append(score)
+                if includeWhiskers:
+                    count = hsp.readEndInSubject - hsp.subjectEnd
+                    if count > 0:
+                        pieces.append(
+                            sequence[hsp.readEnd:hsp.readEnd + count])
+                        starts.append(hsp.subjectEnd)
+                        scores.append(score)
+
+        residues = ''.join(pieces)
+        if convert is not None:
+            residues = convert(residues)
+        codes = np.frombuffer(residues.encode('ascii'), dtype=np.uint8)
+        lengths = np.array([len(piece) for piece in pieces], dtype=int)
+        # The offset of each residue is the start of its piece plus its
+        # index in the piece, i.e., its index in all residues less the index
+        # of the first residue of its piece.
+        firstIndices = np.cumsum(lengths) - lengths
+        offsets = np.arange(len(codes)) + np.repeat(
+            np.array(starts, dtype=int) - firstIndices, lengths)
+
+        return (offsets, codes,
+                np.repeat(np.array(scores, dtype=float), lengths))
+
+    def coverageArrays(self):
+        """
+        Get the bases found at each location in our title sequence, as
+        arrays.
+
+        @return: A 3-tuple of numpy arrays with an element for each base of
+            each read that matched the subject: the C{int} subject offset
+            of the base, the C{uint8} (ASCII) code of the base, and the
+            C{float} score of the HSP the base is in. These are in the order
+            of the alignments and their HSPs.
+        """
+        return self._residueArrays(False)
 
     def coverageInfo(self):
         """
@@ -178,31 +422,43 @@ class TitleAlignments(list):
             bases from reads that matched the subject at subject location,
             along with the bit score of the matching read.
         """
+        offsets, codes, scores = self.coverageArrays()
         result = defaultdict(list)
 
-        for titleAlignment in self:
-            for hsp in titleAlignment.hsps:
-                score = hsp.score.score
-                for (subjectOffset, base, _) in titleAlignment.read.walkHSP(
-                        hsp, includeWhiskers=False):
-                    result[subjectOffset].append((score, base))
+        # Group by offset, keeping the bases at each offset in order.
+        order = np.argsort(offsets, kind='mergesort')
+        offsets = offsets[order]
+        bases = codes[order].tobytes().decode('ascii')
+        scores = scores[order].tolist()
+        uniqueOffsets, starts = np.unique(offsets, return_index=True)
+        ends = starts.tolist()[1:] + [len(bases)]
+        for offset, start, end in zip(uniqueOffsets.tolist(), starts.tolist(),
+                                      ends):
+            result[offset] = list(zip(scores[start:end], bases[start:end]))
 
         return result
 
-    def residueCounts(self, convertCaseTo='upper'):
+    def residueCountMatrix(self, convertCaseTo='upper'):
         """
-        Count residue frequencies at all sequence locations matched by reads.
+        Count residue frequencies at all sequence locations matched by reads,
+        as a matrix.
 
         @param convertCaseTo: A C{str}, 'upper', 'lower', or 'none'.
             If 'none', case will not be converted (both the upper and lower
             case string of a residue will be present in the result if they are
             present in the read - usually due to low complexity masking).
-        @return: A C{dict} whose keys are C{int} offsets into the title
-            sequence and whose values are C{Counters} with the residue as keys
-            and the count of that residue at that location as values.
+        @raise ValueError: If C{convertCaseTo} is unknown.
+        @return: A 3-tuple with 1) the C{int} offset in the title sequence of
+            the first row of the matrix (this is negative if a read extends
+            to the left of the title sequence), 2) a sorted C{list} of the
+            C{str} residues found, and 3) a numpy C{int} array with a row for
+            each offset (from the first offset to the end of the title
+            sequence or of the rightmost read, whichever is further) and a
+            column for each residue, holding the count of that residue at
+            that offset.
         """
         if convertCaseTo == 'none':
-            convert = lambda x: x
+            convert = None
         elif convertCaseTo == 'lower':
             convert = str.lower
         elif convertCaseTo == 'upper':
@@ -211,13 +467,45 @@ class TitleAlignments(list):
             raise ValueError(
                 "convertCaseTo must be one of 'none', 'lower', or 'upper'")
 
+        offsets, codes, _ = self._residueArrays(True, convert)
+
+        if len(offsets):
+            start = min(0, int(offsets.min()))
+            stop = max(self.subjectLength, int(offsets.max()) + 1)
+        else:
+            start, stop = 0, self.subjectLength
+
+        # Give each residue code found a column, in code order.
+        alphabetCodes = np.flatnonzero(np.bincount(codes, minlength=256))
+        width = len(alphabetCodes)
+        columnOf = np.zeros(256, dtype=int)
+        columnOf[alphabetCodes] = np.arange(width)
+        counts = np.bincount(
+            (offsets - start) * width + columnOf[codes],
+            minlength=(stop - start) * width).reshape(stop - start, width)
+
+        return start, [chr(code) for code in alphabetCodes.tolist()], counts
+
+    def residueCounts(self, convertCaseTo='upper'):
+        """
+        Count residue frequencies at all sequence locations matched by reads.
+
+        @param convertCaseTo: A C{str}, 'upper', 'lower', or 'none'.
+            If 'none', case will not be converted (both the upper and lower
+            case string of a residue will be present in the result if they are
+            present in the read - usually due to low complexity masking).
+        @raise ValueError: If C{convertCaseTo} is unknown.
+        @return: A C{dict} whose keys are C{int} offsets into the title
+            sequence and whose values are C{Counters} with the residue as keys
+            and the count of that residue at that location as values.
+        """
+        start, alphabet, matrix = self.residueCountMatrix(convertCaseTo)
         counts = defaultdict(Counter)
 
-        for titleAlignment in self:
-            read = titleAlignment.read
-            for hsp in titleAlignment.hsps:
-                for (subjectOffset, residue, inMatch) in read.walkHSP(hsp):
-                    counts[subjectOffset][convert(residue)] += 1
+        rows, columns = np.nonzero(matrix)
+        for row, column, count in zip(rows.tolist(), columns.tolist(),
+                                      matrix[rows, columns].tolist()):
+            counts[start + row][alphabet[column]] = count
 
         return counts
 
@@ -246,59 +534,191 @@ class TitleAlignments(list):
         }
 
 
-class TitlesAlignments(dict):
+def _invalidatingMethod(name):
     """
-    Holds (as a dictionary) a set of titles, each with its alignments.
+    Make a L{TitleAlignments} method that clears the cached HSP statistics
+    and then calls a C{list} method.
 
-    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance.
-    @param scoreClass: A class to hold and compare scores. If C{None},
-        the score class from readsAlignments will be used.
-    @param readSetFilter: An instance of dark.filter.ReadSetFilter, or C{None}.
-        This can be used to pass a previously used title filter for ongoing
-        use in filtering.
-    @param importReadsAlignmentsTitles: If C{True}, titles from
-        C{readsAlignments} will be added to self. This argument is only used
-        by the filtering function to make a new instance without reading its
-        titles.
+    @param name: The C{str} name of the C{list} method.
+    @return: A function.
     """
+    listMethod = getattr(list, name)
 
-    def __init__(self, readsAlignments, scoreClass=None, readSetFilter=None,
-                 importReadsAlignmentsTitles=True):
-        dict.__init__(self)
-        self.readsAlignments = readsAlignments
-        self.scoreClass = scoreClass or readsAlignments.scoreClass
-        self.readSetFilter = readSetFilter
-        if importReadsAlignmentsTitles:
-            for readAlignments in readsAlignments:
-                for alignment in readAlignments:
-                    title = alignment.subjectTitle
-                    try:
-                        titleAlignments = self[title]
-                    except KeyError:
-                        titleAlignments = self[title] = TitleAlignments(
-                            title, alignment.subjectLength)
-                    titleAlignments.addAlignment(
-                        TitleAlignment(readAlignments.read, alignment.hsps))
+    def method(self, *args, **kwargs):
+        self._stats = None
+        return listMethod(self, *args, **kwargs)
+
+    method.__name__ = name
+    method.__doc__ = listMethod.__doc__
+    return method
+
+
+for _name in ('__delitem__', '__delslice__', '__iadd__', '__setitem__',
+              '__setslice__', 'append', 'clear', 'extend', 'insert', 'pop',
+              'remove', 'reverse', 'sort'):
+    if hasattr(list, _name):
+        setattr(TitleAlignments, _name, _invalidatingMethod(_name))
+
+del _name
+
+
+class TitleSummary(object):
+    """
+    Hold summary information about the alignments against a sequence, without
+    keeping the reads or HSPs of the alignments.
+
+    @param subjectTitle: The C{str} title of the sequence the reads matched
+        against.
+    @param subjectLength: The C{int} length of the sequence the reads matched
+        against.
+    @param exactMedian: If C{True}, keep all HSP scores so the median score
+        is exact. Otherwise, estimate the median score in constant memory
+        using L{dark.utils.ApproximateMedian}.
+    """
+
+    def __init__(self, subjectTitle, subjectLength, exactMedian=True):
+        self.subjectTitle = subjectTitle
+        self.subjectLength = subjectLength
+        self._readCount = 0
+        self._hspCount = 0
+        self._bestHsp = None
+        self._scores = [] if exactMedian else ApproximateMedian()
+        self._intervals = MergedIntervals(subjectLength)
+
+    def addHsps(self, hsps):
+        """
+        Add the HSPs of a read's alignment against this title.
+
+        @param hsps: An iterable of L{dark.hsp.HSP} (or subclass) instances.
+        """
+        self._readCount += 1
+        best = self._bestHsp
+        addScore = (self._scores.append if isinstance(self._scores, list)
+                    else self._scores.add)
+        add = self._intervals.add
+        for hsp in hsps:
+            self._hspCount += 1
+            if best is None or hsp > best:
+                best = hsp
+            addScore(hsp.score.score)
+            add(hsp.subjectStart, hsp.subjectEnd)
+        self._bestHsp = best
+
+    def readCount(self):
+        """
+        Find out how many reads aligned to this title.
+
+        @return: The C{int} number of reads that aligned to this title.
+        """
+        return self._readCount
+
+    def hspCount(self):
+        """
+        How many HSPs were there in total for all the alignments to a title.
+
+        @return: The C{int} number of HSPs for the alignments to this title.
+        """
+        return self._hspCount
+
+    def bestHsp(self):
+        """
+        Find the HSP with the best score.
+
+        @raise ValueError: If there are no HSPs.
+        @return: The C{dark.hsp.HSP} instance (or a subclass) with the best
+        score.
+        """
+        if self._bestHsp is None:
+            raise ValueError('No HSPs have been added.')
+        return self._bestHsp
+
+    def hasScoreBetterThan(self, score):
+        """
+        Is there an HSP with a score better than a given value?
+
+        @return: A C{bool}, C{True} if there is at least one HSP in the
+        alignments for this title with a score better than C{score}.
+        """
+        return self._bestHsp is not None and self._bestHsp.betterThan(score)
+
+    def medianScore(self):
+        """
+        Find the median score for the HSPs in the alignments that match
+        this title. This is an estimate if C{exactMedian} was C{False}.
+
+        @raise ValueError: If there are no HSPs.
+        @return: The C{float} median score of HSPs in alignments matching the
+            title.
+        """
+        if isinstance(self._scores, list):
+            return median(self._scores)
+        else:
+            return self._scores.median()
+
+    def coverage(self):
+        """
+        Get the fraction of this title sequence that is matched by its reads.
+
+        @return: The C{float} fraction of the title sequence matched by its
+            reads.
+        """
+        return self._intervals.coverage()
+
+    def summary(self):
+        """
+        Summarize the alignments for this subject.
+
+        @return: A C{dict} with the keys described in
+            L{TitleAlignments.summary}.
+        """
+        return {
+            'bestScore': self.bestHsp().score.score,
+            'coverage': self.coverage(),
+            'hspCount': self.hspCount(),
+            'medianScore': self.medianScore(),
+            'readCount': self.readCount(),
+            'subjectLength': self.subjectLength,
+            'subjectTitle': self.subjectTitle,
+        }
+
+
+class _TitlesMixin(object):
+    """
+    Methods shared by L{TitlesAlignments}, L{TitlesSummary}, and
+    L{dark.spill.SpilledTitlesAlignments}, all of which are C{dict}s whose
+    values (L{TitleAlignments}, L{TitleSummary}, or
+    L{dark.spill.SpilledTitleAlignments} instances) have the methods used
+    here.
+    """
+
+    def _new(self):
+        """
+        Make a new, empty, instance of our class, with our attributes.
+
+        @return: An instance of our class.
+        """
+        raise NotImplementedError('_new must be implemented by a subclass')
 
     def addTitle(self, title, titleAlignments):
         """
         Add a new title to self.
 
         @param title: A C{str} title.
-        @param titleAlignments: An instance of L{TitleAlignments}.
+        @param titleAlignments: An instance of L{TitleAlignments} (or
+            L{TitleSummary}, for a L{TitlesSummary}).
         @raises KeyError: If the title is already present.
         """
         if title in self:
-            raise KeyError('Title %r already present in TitlesAlignments '
-                           'instance.' % title)
+            raise KeyError('Title %r already present in %s '
+                           'instance.' % (title, self.__class__.__name__))
         else:
             self[title] = titleAlignments
 
     def filter(self, minMatchingReads=None, minMedianScore=None,
                withScoreBetterThan=None, minNewReads=None, minCoverage=None,
-               maxTitles=None, sortOn='maxScore'):
+               maxTitles=None, sortOn='maxScore', minHashBands=None):
         """
-        Filter the titles in self to create another TitlesAlignments.
+        Filter the titles in self to create another instance of our class.
 
         @param minMatchingReads: titles that are matched by fewer reads
             are unacceptable.
@@ -318,10 +738,14 @@ class TitlesAlignments(dict):
         @param sortOn: A C{str} attribute to sort on, used only if C{maxTitles}
             is not C{None}. See the C{sortTitles} method below for the legal
             values.
+        @param minHashBands: If not C{None}, the C{int} number of MinHash
+            bands to use to (approximately) find the previously seen titles
+            whose read sets a title's read set is compared with, if
+            C{minNewReads} is given. See L{dark.filter.ReadSetFilter}.
         @raise: C{ValueError} if C{maxTitles} is less than zero or the value of
             C{sortOn} is unknown.
-        @return: A new L{TitlesAlignments} instance containing only the
-            matching titles.
+        @return: A new instance of our class containing only the matching
+            titles.
         """
         # Use a ReadSetFilter only if we're checking that read sets are
         # sufficiently new.
@@ -329,26 +753,24 @@ class TitlesAlignments(dict):
             readSetFilter = None
         else:
             if self.readSetFilter is None:
-                self.readSetFilter = ReadSetFilter(minNewReads)
+                self.readSetFilter = ReadSetFilter(minNewReads, minHashBands)
             readSetFilter = self.readSetFilter
 
-        result = TitlesAlignments(
-            self.readsAlignments, self.scoreClass, self.readSetFilter,
-            importReadsAlignmentsTitles=False)
+        result = self._new()
 
         if maxTitles is not None and len(self) > maxTitles:
             if maxTitles < 0:
                 raise ValueError('maxTitles (%r) cannot be negative.' %
                                  maxTitles)
             else:
-                # There are too many titles. Make a sorted list of them so
-                # we loop through them (below) in the desired order and can
-                # break when/if we've reached the maximum. We can't just
-                # take the first maxTitles titles from the sorted list now,
-                # as some of those titles might later be discarded by the
-                # filter and then we'd return a result with fewer titles
-                # than we should.
-                titles = self.sortTitles(sortOn)
+                # There are too many titles. Loop through them (below) in
+                # the desired order so we can break when/if we've reached
+                # the maximum. We can't just take the first maxTitles titles
+                # now, as some of those titles might later be discarded by
+                # the filter and then we'd return a result with fewer titles
+                # than we should. So titles are sorted only as they are
+                # needed.
+                titles = self.iterSortedTitles(sortOn)
         else:
             titles = self.keys()
 
@@ -388,14 +810,36 @@ class TitlesAlignments(dict):
 
         return result
 
-    def hsps(self):
+    def _sortKey(self, by):
         """
-        Get all HSPs for all the alignments for all titles.
+        Make a function that gives the primary sort key for a title, so that
+        titles with smaller keys are sorted first (titles with equal keys
+        are then sorted by title).
 
-        @return: A generator yielding L{dark.hsp.HSP} instances.
+        @param by: A C{str}, one of 'length', 'maxScore', 'medianScore',
+            'readCount', or 'title'.
+        @raise ValueError: If an unknown C{by} value is given.
+        @return: A function that takes a C{str} title and returns its
+            numeric key, or C{None} if C{by} is 'title'.
         """
-        return (hsp for titleAlignments in self.values()
-                for alignment in titleAlignments for hsp in alignment.hsps)
+        if by in ('maxScore', 'medianScore'):
+            # Negate scores if higher scores are better, so the best scores
+            # have the smallest keys.
+            sign = -1 if self.scoreClass(0) < self.scoreClass(1) else 1
+
+        if by == 'length':
+            return lambda title: -self[title].subjectLength
+        if by == 'maxScore':
+            return lambda title: sign * self[title].bestHsp().score.score
+        if by == 'medianScore':
+            return lambda title: sign * self[title].medianScore()
+        if by == 'readCount':
+            return lambda title: -self[title].readCount()
+        if by == 'title':
+            return None
+
+        raise ValueError('Sort attribute must be one of "length", "maxScore", '
+                         '"medianScore", "readCount", "title".')
 
     def sortTitles(self, by):
         """
@@ -406,30 +850,60 @@ class TitlesAlignments(dict):
         @raise ValueError: If an unknown C{by} value is given.
         @return: A sorted C{list} of titles.
         """
+        key = self._sortKey(by)
+
         # First sort titles by the secondary key, which is always the title.
-        titles = sorted(iter(self))
+        titles = sorted(self)
 
-        # Then sort on the primary key (if any).
-        if by == 'length':
-            return sorted(
-                titles, reverse=True,
-                key=lambda title: self[title].subjectLength)
-        if by == 'maxScore':
-            return sorted(
-                titles, reverse=True, key=lambda title: self[title].bestHsp())
-        if by == 'medianScore':
-            return sorted(
-                titles, reverse=True,
-                key=lambda title: self.scoreClass(self[title].medianScore()))
-        if by == 'readCount':
-            return sorted(
-                titles, reverse=True,
-                key=lambda title: self[title].readCount())
-        if by == 'title':
-            return titles
+        # Then (stably) sort on the primary key (if any).
+        return titles if key is None else sorted(titles, key=key)
 
-        raise ValueError('Sort attribute must be one of "length", "maxScore", '
-                         '"medianScore", "readCount", "title".')
+    def topTitles(self, by, n):
+        """
+        Find the first titles, as they would be sorted by C{sortTitles},
+        without sorting all titles.
+
+        @param by: A C{str}, one of 'length', 'maxScore', 'medianScore',
+            'readCount', or 'title'.
+        @param n: The C{int} number of titles wanted.
+        @raise ValueError: If an unknown C{by} value is given.
+        @return: A sorted C{list} of (at most) C{n} titles.
+        """
+        key = self._sortKey(by)
+        if key is None:
+            return heapq.nsmallest(n, self)
+        else:
+            return heapq.nsmallest(n, self, key=lambda title: (key(title),
+                                                               title))
+
+    def iterSortedTitles(self, by):
+        """
+        Get titles in the order given by C{sortTitles}, sorting them only as
+        they are needed. Finding the first k of n titles takes time
+        proportional to n + k log n, not n log n.
+
+        @param by: A C{str}, one of 'length', 'maxScore', 'medianScore',
+            'readCount', or 'title'.
+        @raise ValueError: If an unknown C{by} value is given.
+        @return: A generator that yields C{str} titles.
+        """
+        key = self._sortKey(by)
+        if key is None:
+            heap = list(self)
+            heapq.heapify(heap)
+
+            def titles():
+                while heap:
+                    yield heapq.heappop(heap)
+        else:
+            heap = [(key(title), title) for title in self]
+            heapq.heapify(heap)
+
+            def titles():
+                while heap:
+                    yield heapq.heappop(heap)[1]
+
+        return titles()
 
     def summary(self, sortOn=None):
         """
@@ -482,3 +956,304 @@ class TitlesAlignments(dict):
                 '%(subjectTitle)s',
             ]) % titleSummary)
         return '\n'.join(result)
+
+
+# Read filtering arguments that make a filter keep state from one read to the
+# next (or hold a database connection), so the filtering cannot be split
+# across processes.
+_STATEFUL_FILTER_ARGS = ('limit', 'truncateTitlesAfter', 'taxonomy')
+
+# The number of shards of the result files to make for each worker process,
+# so that workers given small files do not sit idle at the end.
+_SHARDS_PER_WORKER = 4
+
+# The (readsAlignments, readIndex) used by _titlesPartial in a worker
+# process. This is set by _initShardWorker when the worker starts.
+_shardState = None
+
+
+def _initShardWorker(readsAlignments, readIndex):
+    """
+    Set the state used by C{_titlesPartial} in a worker process. The
+    arguments are inherited when the worker is forked, so they never need
+    to be pickled.
+
+    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance.
+    @param readIndex: A C{dict}-like object to look up reads by id.
+    """
+    global _shardState
+    _shardState = (readsAlignments, readIndex)
+
+
+def _shardFilenames(filenames, count):
+    """
+    Split a list of file names into contiguous shards of (nearly) equal size.
+
+    @param filenames: A C{list} of C{str} file names.
+    @param count: The C{int} number of shards to make. This must not be
+        more than the number of file names.
+    @return: A generator that yields C{count} non-empty C{list}s of C{str}
+        file names, which together are C{filenames} (in order).
+    """
+    size, extra = divmod(len(filenames), count)
+    start = 0
+    for index in range(count):
+        end = start + size + (1 if index < extra else 0)
+        yield filenames[start:end]
+        start = end
+
+
+def _titlesPartial(filenames):
+    """
+    Collect the alignments, by title, in a shard of the result files of the
+    C{readsAlignments} in C{_shardState}. This is run in a worker process.
+
+    @param filenames: A C{list} of C{str} result file names.
+    @return: A C{list} with a 3-tuple for each title matched, in the order
+        the titles were first seen. Each has the C{str} title, its C{int}
+        subject length, and a C{list} of C{(readId, hsps)} 2-tuples (in the
+        order the reads were found), with the C{str} id of a read and the
+        C{list} of its HSPs for the title. Read ids are returned instead of
+        reads, as the parent process can find the reads itself.
+    """
+    readsAlignments, readIndex = _shardState
+    titles = {}
+    partial = []
+    for readAlignments in readsAlignments.forFiles(filenames, readIndex):
+        readId = readAlignments.read.id
+        for alignment in readAlignments:
+            title = alignment.subjectTitle
+            alignments = titles.get(title)
+            if alignments is None:
+                alignments = titles[title] = []
+                partial.append((title, alignment.subjectLength, alignments))
+            alignments.append((readId, alignment.hsps))
+    return partial
+
+
+class TitlesAlignments(_TitlesMixin, dict):
+    """
+    Holds (as a dictionary) a set of titles, each with its alignments.
+
+    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance.
+    @param scoreClass: A class to hold and compare scores. If C{None},
+        the score class from readsAlignments will be used.
+    @param readSetFilter: An instance of dark.filter.ReadSetFilter, or C{None}.
+        This can be used to pass a previously used title filter for ongoing
+        use in filtering.
+    @param importReadsAlignmentsTitles: If C{True}, titles from
+        C{readsAlignments} will be added to self. This argument is only used
+        by the filtering function to make a new instance without reading its
+        titles.
+    @param workers: The C{int} number of processes to use to read the
+        alignments of C{readsAlignments}, if it has several result files.
+        The result is the same as when just one process is used. See
+        C{_importTitlesInParallel} for when more than one cannot be used.
+    @param readIndex: A C{dict}-like object that returns the L{Read} with a
+        given id, e.g., a L{dark.fasta.IndexedFasta} (which reads sequences
+        from disk and caches only the most recently used). If not C{None},
+        only the ids of the reads are kept in the L{TitleAlignment}
+        instances, and the reads are looked up in C{readIndex} when needed.
+        So the sequences of the reads are not all kept in memory.
+    """
+
+    def __init__(self, readsAlignments, scoreClass=None, readSetFilter=None,
+                 importReadsAlignmentsTitles=True, workers=1, readIndex=None):
+        dict.__init__(self)
+        self.readsAlignments = readsAlignments
+        self.scoreClass = scoreClass or readsAlignments.scoreClass
+        self.readSetFilter = readSetFilter
+        self.readIndex = readIndex
+        if (importReadsAlignmentsTitles and
+                not self._importTitlesInParallel(workers)):
+            # Alignments that have a subject id are grouped using a list
+            # indexed by id, so their (often long) titles are only looked
+            # up in self the first time each subject is seen.
+            byId = []
+            for readAlignments in readsAlignments:
+                read = (readAlignments.read if readIndex is None
+                        else readAlignments.read.id)
+                for alignment in readAlignments:
+                    subjectId = alignment.subjectId
+                    if subjectId is not None and subjectId < len(byId):
+                        titleAlignments = byId[subjectId]
+                    else:
+                        titleAlignments = None
+                    if titleAlignments is None:
+                        title = alignment.subjectTitle
+                        try:
+                            titleAlignments = self[title]
+                        except KeyError:
+                            titleAlignments = self[title] = TitleAlignments(
+                                title, alignment.subjectLength)
+                        if subjectId is not None:
+                            if subjectId >= len(byId):
+                                byId.extend(
+                                    [None] * (subjectId + 1 - len(byId)))
+                            byId[subjectId] = titleAlignments
+                    titleAlignments.addAlignment(
+                        TitleAlignment(read, alignment.hsps, readIndex))
+
+    def _importTitlesInParallel(self, workers):
+        """
+        Add the titles from our C{readsAlignments} to self, reading shards of
+        its result files in worker processes and merging their alignments in
+        file order, so the result is the same as reading them all here.
+
+        The reads are found by id, in our C{readIndex} if we have one, else
+        in C{ReadsAlignments.readIdIndex} (which holds all the reads in
+        memory unless C{readsAlignments} was given a C{readIndex}). So,
+        unlike a serial read without a C{readIndex}, the reads and the
+        records in the result files are not checked to be in the same order.
+
+        @param workers: The C{int} number of worker processes to use.
+        @return: C{True} if the titles were added, or C{False} if they must
+            be read serially instead. That is the case if C{workers} is less
+            than two, if there are fewer than two result files, if processes
+            cannot be forked, or if a read filter has an argument in
+            C{_STATEFUL_FILTER_ARGS}.
+        """
+        readsAlignments = self.readsAlignments
+        filenames = readsAlignments.resultFilenames()
+        if (workers < 2 or len(filenames) < 2 or not hasattr(os, 'fork') or
+                any(kwargs.get(arg) is not None
+                    for kwargs in readsAlignments.filterKwargs
+                    for arg in _STATEFUL_FILTER_ARGS)):
+            return False
+
+        if self.readIndex is None:
+            readIndex = readsAlignments.readIdIndex()
+        else:
+            # Make an index that is made on first use (e.g., that of a
+            # dark.fasta.IndexedFasta) now, so the workers do not all try
+            # to make it at once.
+            makeIndex = getattr(self.readIndex, 'makeIndex', None)
+            if makeIndex is not None:
+                makeIndex()
+            # Give the workers a copy, so an index that holds open files or
+            # a database connection (e.g., a dark.fasta.IndexedFasta) opens
+            # its own in each worker instead of sharing ours.
+            readIndex = copy.copy(self.readIndex)
+        shards = list(_shardFilenames(
+            filenames, min(len(filenames), workers * _SHARDS_PER_WORKER)))
+
+        # Fork explicitly, as the workers rely on inheriting the arguments
+        # of _initShardWorker (whose filters are closures and cannot be
+        # pickled).
+        if hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing
+
+        addTitle = readsAlignments.subjectTitles.add
+        pool = context.Pool(min(workers, len(shards)),
+                            initializer=_initShardWorker,
+                            initargs=(readsAlignments, readIndex))
+        try:
+            for partial in pool.imap(_titlesPartial, shards):
+                for title, subjectLength, alignments in partial:
+                    title, _ = addTitle(title)
+                    try:
+                        titleAlignments = self[title]
+                    except KeyError:
+                        titleAlignments = self[title] = TitleAlignments(
+                            title, subjectLength)
+                    for readId, hsps in alignments:
+                        if self.readIndex is None:
+                            titleAlignment = TitleAlignment(
+                                readIndex[readId], hsps)
+                        else:
+                            titleAlignment = TitleAlignment(
+                                readId, hsps, self.readIndex)
+                        titleAlignments.addAlignment(titleAlignment)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        return True
+
+    def _new(self):
+        """
+        Make a new, empty, L{TitlesAlignments} instance with our attributes.
+
+        @return: A L{TitlesAlignments} instance.
+        """
+        return TitlesAlignments(
+            self.readsAlignments, self.scoreClass, self.readSetFilter,
+            importReadsAlignmentsTitles=False, readIndex=self.readIndex)
+
+    def hsps(self):
+        """
+        Get all HSPs for all the alignments for all titles.
+
+        @return: A generator yielding L{dark.hsp.HSP} instances.
+        """
+        return (hsp for titleAlignments in self.values()
+                for alignment in titleAlignments for hsp in alignment.hsps)
+
+
+class TitlesSummary(_TitlesMixin, dict):
+    """
+    Holds (as a dictionary) a set of titles, each with a L{TitleSummary} of
+    its alignments.
+
+    The alignments in C{readsAlignments} are read just once, and no reads or
+    HSPs are kept (apart from the best HSP for each title). So, unlike a
+    L{TitlesAlignments}, the memory used does not grow with the number of
+    reads and HSPs (except for the HSP scores, if C{exactMedian} is C{True}).
+    This makes it possible to summarize, filter, and sort titles when there
+    are too many alignments to hold in memory.
+
+    @param readsAlignments: A L{dark.alignments.ReadsAlignments} instance, or
+        C{None} to make an empty instance.
+    @param scoreClass: A class to hold and compare scores. If C{None},
+        the score class from readsAlignments will be used (so it must be
+        given if C{readsAlignments} is C{None}).
+    @param exactMedian: If C{True}, median scores are exact. Else they are
+        estimated, so no HSP scores need to be kept.
+    """
+
+    def __init__(self, readsAlignments=None, scoreClass=None,
+                 exactMedian=True):
+        dict.__init__(self)
+        self.readsAlignments = readsAlignments
+        self.scoreClass = scoreClass or readsAlignments.scoreClass
+        self.exactMedian = exactMedian
+        if readsAlignments is not None:
+            for readAlignments in readsAlignments:
+                for alignment in readAlignments:
+                    title = alignment.subjectTitle
+                    try:
+                        titleSummary = self[title]
+                    except KeyError:
+                        titleSummary = self[title] = TitleSummary(
+                            title, alignment.subjectLength, exactMedian)
+                    titleSummary.addHsps(alignment.hsps)
+
+    def _new(self):
+        """
+        Make a new, empty, L{TitlesSummary} instance with our attributes.
+
+        @return: A L{TitlesSummary} instance.
+        """
+        result = TitlesSummary(None, self.scoreClass, self.exactMedian)
+        result.readsAlignments = self.readsAlignments
+        return result
+
+    def filter(self, minNewReads=None, **kwargs):
+        """
+        Filter the titles in self to create another L{TitlesSummary}.
+
+        @param minNewReads: Must be C{None}, as the read ids needed to compare
+            the read sets of titles are not kept.
+        @param kwargs: Other keyword arguments, as for
+            L{TitlesAlignments.filter}.
+        @raise ValueError: If C{minNewReads} is not C{None}, or as for
+            L{TitlesAlignments.filter}.
+        @return: A new L{TitlesSummary} instance containing only the matching
+            titles.
+        """
+        if minNewReads is not None:
+            raise ValueError('minNewReads cannot be used to filter a '
+                             'TitlesSummary, as no read ids are kept.')
+        return _TitlesMixin.filter(self, **kwargs)
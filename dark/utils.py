@@ -4,10 +4,14 @@ import string
 import six
 import bz2
 import gzip
-from os.path import basename
+import os
+import sqlite3
+from os.path import abspath, basename, exists
 from contextlib import contextmanager
 from re import compile
 
+from six.moves.urllib.request import pathname2url
+
 
 def numericallySortFilenames(names):
     """
@@ -102,6 +106,132 @@ def median(l):
         return _median(l)
 
 
+class ApproximateMedian(object):
+    """
+    Estimate the median of a stream of numbers in constant memory, using the
+    P-squared algorithm of Jain and Chlamtac ("The P2 algorithm for dynamic
+    calculation of quantiles and histograms without storing observations",
+    Communications of the ACM, 28(10), 1985).
+
+    The numbers are kept (and the median is exact) until there are more than
+    C{exactLimit} of them. Then the five P-squared markers are set from the
+    quartiles of the kept numbers, which are discarded. The markers are then
+    adjusted (using piecewise-parabolic interpolation) as each number is
+    added.
+
+    @param exactLimit: The C{int} number of numbers to keep before switching
+        to estimating the median. Must be at least 5.
+    @raise ValueError: If C{exactLimit} is less than 5.
+    """
+    # The desired marker position increments, for the median.
+    _INCREMENTS = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+    def __init__(self, exactLimit=100):
+        if exactLimit < 5:
+            raise ValueError('exactLimit must be at least 5.')
+        self._exactLimit = exactLimit
+        self._values = []
+        self._count = 0
+        # Marker heights, actual positions, and desired positions.
+        self._heights = self._positions = self._desired = None
+
+    def __len__(self):
+        return self._count
+
+    def _setMarkers(self):
+        """
+        Set the markers from the quartiles of the numbers kept so far, and
+        discard the numbers.
+        """
+        values = sorted(self._values)
+        last = len(values) - 1
+        self._positions = [0, last // 4, last // 2, (3 * last) // 4, last]
+        self._heights = [values[position] for position in self._positions]
+        self._desired = [0.0, last / 4, last / 2, 3 * last / 4, float(last)]
+        self._values = None
+
+    def add(self, value):
+        """
+        Add a number.
+
+        @param value: A numeric value.
+        """
+        self._count += 1
+
+        if self._values is not None:
+            self._values.append(value)
+            if self._count > self._exactLimit:
+                self._setMarkers()
+            return
+
+        heights = self._heights
+        positions = self._positions
+        desired = self._desired
+
+        # Find the cell the value falls in, adjusting the extreme markers if
+        # it is a new minimum or maximum.
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+        for index in range(5):
+            desired[index] += self._INCREMENTS[index]
+
+        # Adjust the heights of the three middle markers, if necessary.
+        for index in 1, 2, 3:
+            delta = desired[index] - positions[index]
+            if ((delta >= 1 and
+                 positions[index + 1] - positions[index] > 1) or
+                    (delta <= -1 and
+                     positions[index - 1] - positions[index] < -1)):
+                step = 1 if delta > 0 else -1
+                height = self._parabolic(index, step)
+                if not heights[index - 1] < height < heights[index + 1]:
+                    # Use linear interpolation instead.
+                    height = heights[index] + step * (
+                        (heights[index + step] - heights[index]) /
+                        (positions[index + step] - positions[index]))
+                heights[index] = height
+                positions[index] += step
+
+    def _parabolic(self, index, step):
+        """
+        Calculate a new marker height using the piecewise-parabolic formula.
+
+        @param index: The C{int} index of the marker.
+        @param step: The C{int} (1 or -1) the marker position will move by.
+        @return: The C{float} new height for the marker.
+        """
+        heights = self._heights
+        positions = self._positions
+        below = positions[index] - positions[index - 1]
+        above = positions[index + 1] - positions[index]
+        return heights[index] + step / (below + above) * (
+            (below + step) * (heights[index + 1] - heights[index]) / above +
+            (above - step) * (heights[index] - heights[index - 1]) / below)
+
+    def median(self):
+        """
+        Get the (estimated) median of the numbers added so far.
+
+        @raise ValueError: If no numbers have been added.
+        @return: The median.
+        """
+        if self._values is None:
+            return self._heights[2]
+        else:
+            return median(self._values)
+
+
 @contextmanager
 def asHandle(fileNameOrHandle, mode='r'):
     """
@@ -130,6 +260,43 @@ def asHandle(fileNameOrHandle, mode='r'):
         yield fileNameOrHandle
 
 
+def replaceFile(source, destination):
+    """
+    Rename a file, atomically replacing any existing file with the new name.
+    So another process that opens C{destination} always finds either the
+    old or the new file.
+
+    @param source: The C{str} name of the file to rename.
+    @param destination: The C{str} new name of the file.
+    """
+    if six.PY3:
+        os.replace(source, destination)
+    else:
+        # On POSIX, os.rename atomically replaces an existing file.
+        os.rename(source, destination)
+
+
+def connectExisting(filename):
+    """
+    Open an existing sqlite3 database (read-only, on Python 3). Unlike
+    C{sqlite3.connect}, this never creates an empty database if C{filename}
+    does not exist (e.g., because another process has not yet finished
+    making it).
+
+    @param filename: The C{str} file name of an sqlite3 database.
+    @raise sqlite3.OperationalError: If C{filename} cannot be opened.
+    @return: An C{sqlite3.Connection}.
+    """
+    if six.PY3:
+        return sqlite3.connect(
+            'file:%s?mode=ro' % pathname2url(abspath(filename)), uri=True)
+    else:
+        # Python 2 cannot open an sqlite3 URI.
+        if not exists(filename):
+            raise sqlite3.OperationalError('unable to open database file')
+        return sqlite3.connect(filename)
+
+
 _rangeRegex = compile(r'^\s*(\d+)(?:\s*-\s*(\d+))?\s*$')
 
 
@@ -32,6 +32,7 @@ scripts = [
     'bin/check-fasta-json-blast-consistency.py',
     'bin/codon-distance.py',
     'bin/compare-sequences.py',
+    'bin/convert-blast-tabular-to-json.py',
     'bin/convert-blast-xml-to-json.py',
     'bin/convert-diamond-to-json.py',
     'bin/convert-sam-to-fastq.sh',
@@ -59,8 +60,10 @@ scripts = [
     'bin/get-features.py',
     'bin/get-reads.py',
     'bin/graph-evalues.py',
+    'bin/index-json-records.py',
     'bin/local-align.py',
     'bin/make-fasta-database.py',
+    'bin/make-taxonomy-database.py',
     'bin/ncbi-fetch-id.py',
     'bin/noninteractive-alignment-panel.py',
     'bin/position-summary.py',
@@ -0,0 +1,57 @@
+import os
+from json import dumps
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from .sample_data import PARAMS, RECORD0, RECORD1, RECORD2, RECORD3
+
+from dark.blast.alignments import BlastReadsAlignments
+from dark.fasta import FastaReads
+
+
+class BlastFilesMixin(object):
+    """
+    Make a FASTA file of reads and BLAST JSON files (with the records in
+    sample_data) in a temporary directory, for tests that need real files.
+
+    A test class can override READ_IDS (the ids of the reads, each of which
+    has a sequence of 70 As) and JSON_RECORDS (a C{list} of the records to
+    write to each JSON file, each of which starts with PARAMS).
+    """
+    READ_IDS = ('id0', 'id1', 'id2', 'id3')
+    JSON_RECORDS = ([RECORD0, RECORD1, RECORD2, RECORD3],)
+
+    def setUp(self):
+        self.dirname = mkdtemp()
+        self.fastaFilename = os.path.join(self.dirname, 'reads.fasta')
+        with open(self.fastaFilename, 'w') as fp:
+            for readId in self.READ_IDS:
+                fp.write('>%s\n%s\n' % (readId, 'A' * 70))
+        self.jsonFilenames = []
+        for index, records in enumerate(self.JSON_RECORDS):
+            filename = os.path.join(self.dirname, '%d.json' % index)
+            with open(filename, 'w') as fp:
+                for record in [PARAMS] + records:
+                    fp.write(dumps(record) + '\n')
+            self.jsonFilenames.append(filename)
+        self.jsonFilename = self.jsonFilenames[0]
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def readsAlignments(self, readIndex=None, **filterKwargs):
+        """
+        Make a BlastReadsAlignments for our files.
+
+        @param readIndex: A C{dict}-like object to look up reads by id (see
+            L{BlastReadsAlignments}), or C{None}.
+        @param filterKwargs: If not empty, keyword arguments for a filter to
+            add to the BlastReadsAlignments.
+        @return: A L{BlastReadsAlignments} instance.
+        """
+        readsAlignments = BlastReadsAlignments(
+            FastaReads(self.fastaFilename), self.jsonFilenames,
+            readIndex=readIndex)
+        if filterKwargs:
+            readsAlignments.filter(**filterKwargs)
+        return readsAlignments
@@ -1,5 +1,6 @@
 # TODO: Add tests based on taxonomy, once we know how to mock mysql.
 
+import bz2
 import six
 import platform
 from six.moves import builtins
@@ -7,6 +8,9 @@ from copy import deepcopy
 from json import dumps
 from unittest import TestCase
 import sqlite3
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
 
 try:
     from unittest.mock import patch
@@ -19,12 +23,16 @@ from Bio import SeqIO
 from ..mocking import mockOpen, File
 from .sample_data import PARAMS, RECORD0, RECORD1, RECORD2, RECORD3, RECORD4
 
+from dark.alignments import ReadIdIndex
 from dark.reads import Read, Reads, DNARead
 from dark.hsp import HSP, LSP
 from dark.score import LowerIsBetterScore
 from dark.blast.alignments import (
     BlastReadsAlignments,  ZERO_EVALUE_UPPER_RANDOM_INCREMENT)
+from dark.blast.conversion import JSONRecordsReader
+from dark.blast.hsp import normalizeHSP
 from dark.titles import TitlesAlignments
+from dark.fasta import IndexedFasta
 from dark import ncbidb
 
 
@@ -209,6 +217,206 @@ class TestBlastReadsAlignments(TestCase):
             six.assertRaisesRegex(self, ValueError, error, list,
                                   readsAlignments)
 
+    def testIncorrectReadIdWhenFilteredOut(self):
+        """
+        If the query id of a hit does not match the id of the corresponding
+        input read, a C{ValueError} must be raised even if a filter would
+        reject the read.
+        """
+        mockOpener = mockOpen(
+            read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('not id0', 'A' * 70))
+            error = ("The reads you have provided do not match the BLAST "
+                     "output: BLAST record query id \\(id0\\) does "
+                     "not match the id of the supposedly corresponding read "
+                     "\\(not id0\\)\\.")
+            readsAlignments = BlastReadsAlignments(reads, 'file.json')
+            readsAlignments.filter(readIdRegex='^xxx$')
+            six.assertRaisesRegex(self, ValueError, error, list,
+                                  readsAlignments)
+
+    def testTabularInput(self):
+        """
+        BLAST tabular output (format 6) must be readable directly, with reads
+        that have no hits (which are not in the output) given no alignments,
+        including those after the last record.
+        """
+        line = '\t'.join(['id1', 'gi|3|', 'Subject', '30.0', '1e-5', '1',
+                          '1', 'ACGT', '1', '4', 'ACGT', '%d', '%d', '100',
+                          '4', '4', '4'])
+        mockOpener = mockOpen(
+            read_data='\n'.join([line % (1, 4), line % (50, 53)]) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'ACGT'))
+            reads.add(Read('id1', 'ACGT'))
+            reads.add(Read('id2', 'ACGT'))
+            readsAlignments = BlastReadsAlignments(reads, 'file.tsv')
+            self.assertEqual('blastn', readsAlignments.params.application)
+            result = list(readsAlignments)
+            self.assertEqual(['id0', 'id1', 'id2'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual([0, 1, 0], [len(readAlignments)
+                                         for readAlignments in result])
+            alignment = result[1][0]
+            self.assertEqual('gi|3| Subject', alignment.subjectTitle)
+            self.assertEqual([0, 49], [hsp.subjectStart
+                                       for hsp in alignment.hsps])
+
+    def testTabularInputApplication(self):
+        """
+        The BLAST program given by tabularApplication must be used for BLAST
+        tabular output with no comment lines.
+        """
+        mockOpener = mockOpen(read_data='')
+        with patch.object(builtins, 'open', mockOpener):
+            readsAlignments = BlastReadsAlignments(
+                Reads(), 'file.tab', tabularApplication='blastx')
+            self.assertEqual('blastx', readsAlignments.params.application)
+            self.assertFalse(readsAlignments.params.subjectIsNucleotides)
+
+    def testReadIndexRecordsOutOfOrder(self):
+        """
+        If a read index is given, records that are not in the order of the
+        reads must be matched to the correct reads.
+        """
+        mockOpener = mockOpen(
+            read_data=(dumps(PARAMS) + '\n' + dumps(RECORD1) + '\n' +
+                       dumps(RECORD0) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'G' * 70))
+            readsAlignments = BlastReadsAlignments(
+                reads, 'file.json', readIndex=ReadIdIndex(reads))
+            result = list(readsAlignments)
+            self.assertEqual(['id1', 'id0'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual('G' * 70, result[0].read.sequence)
+            self.assertEqual('A' * 70, result[1].read.sequence)
+
+    def testReadIndexMoreReadsThanRecords(self):
+        """
+        If a read index is given, reads that have no record must not cause a
+        C{ValueError} but must be yielded (with no alignments) after all
+        records have been read.
+        """
+        mockOpener = mockOpen(
+            read_data=dumps(PARAMS) + '\n' + dumps(RECORD1) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'G' * 70))
+            reads.add(Read('id2', 'T' * 70))
+            readsAlignments = BlastReadsAlignments(
+                reads, 'file.json', readIndex=ReadIdIndex(reads))
+            result = list(readsAlignments)
+            self.assertEqual(['id1', 'id0', 'id2'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual([2, 0, 0], [len(readAlignments)
+                                         for readAlignments in result])
+
+    def testIndexedFastaReadIndexIdWithSpace(self):
+        """
+        If an L{IndexedFasta} is given as the read index, a record must be
+        matched to a read whose id is the record's query id followed by a
+        description.
+        """
+        dirname = mkdtemp()
+        try:
+            fastaFilename = join(dirname, 'reads.fasta')
+            jsonFilename = join(dirname, 'file.json')
+            with open(fastaFilename, 'w') as fp:
+                fp.write('>id0 description\n%s\n' % ('A' * 70))
+            with open(jsonFilename, 'w') as fp:
+                fp.write(dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+            reads = Reads()
+            reads.add(Read('id0 description', 'A' * 70))
+            readIndex = IndexedFasta(fastaFilename)
+            readsAlignments = BlastReadsAlignments(
+                reads, jsonFilename,
+                readIndex=readIndex)
+            result = list(readsAlignments)
+            readIndex.close()
+            self.assertEqual(['id0 description'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual('A' * 70, result[0].read.sequence)
+        finally:
+            rmtree(dirname)
+
+    def testReadIndexUnknownReadId(self):
+        """
+        If a read index is given and a record is for a read that is not in
+        the index, a C{ValueError} must be raised.
+        """
+        mockOpener = mockOpen(
+            read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id1', 'A' * 70))
+            error = ("^No read with id 'id0' \\(from record number 1 of "
+                     "BLAST file 'file.json'\\) could be found\\.$")
+            readsAlignments = BlastReadsAlignments(
+                reads, 'file.json', readIndex=ReadIdIndex(reads))
+            six.assertRaisesRegex(self, ValueError, error, list,
+                                  readsAlignments)
+
+    def testChunkedNormalizationMatchesNormalizeHSP(self):
+        """
+        The HSPs of records read in chunks (whose HSPs are normalized
+        together) must have the offsets given by normalizeHSP.
+        """
+        records = [RECORD0, RECORD1, RECORD2, RECORD3, RECORD4]
+        mockOpener = mockOpen(
+            read_data=(dumps(PARAMS) + '\n' +
+                       '\n'.join(dumps(record) for record in records) +
+                       '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            for i in range(5):
+                reads.add(Read('id%d' % i, 'A' * 70))
+            readsAlignments = BlastReadsAlignments(reads, 'file.json')
+            with patch.object(JSONRecordsReader, 'CHUNK_SIZE', 2):
+                result = list(readsAlignments)
+
+        expected = [
+            [normalizeHSP(hsp, 70, 'blastn')
+             for alignment in record['alignments']
+             for hsp in alignment['hsps']]
+            for record in records]
+
+        keys = ('readStart', 'readEnd', 'readStartInSubject',
+                'readEndInSubject', 'subjectStart', 'subjectEnd')
+        self.assertEqual(expected, [
+            [dict((key, getattr(hsp, key)) for key in keys)
+             for alignment in readAlignments
+             for hsp in alignment.hsps]
+            for readAlignments in result])
+
+    def testReadIndexFilteredOutReadNotYielded(self):
+        """
+        If a read index is given and the record for a read is rejected by a
+        filter, the read must not be yielded again as a read with no
+        alignments.
+        """
+        mockOpener = mockOpen(
+            read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'G' * 70))
+            readsAlignments = BlastReadsAlignments(
+                reads, 'file.json', readIndex=ReadIdIndex(reads))
+            readsAlignments.filter(readIdRegex='^id1$')
+            self.assertEqual(['id1'], [readAlignments.read.id
+                                       for readAlignments in readsAlignments])
+
     def testOneJSONInput(self):
         """
         If a JSON file contains a parameters section and one record, it must
@@ -333,6 +541,67 @@ class TestBlastReadsAlignments(TestCase):
             self.assertEqual('id1', result[1].read.id)
             self.assertEqual('id2', result[2].read.id)
 
+    def testForFiles(self):
+        """
+        The L{BlastReadsAlignments} returned by forFiles must read just the
+        given files, find the reads by id, and not yield reads that have no
+        record.
+        """
+        files = {
+            'file1.json': [PARAMS, RECORD0],
+            'file2.json': [PARAMS, RECORD1],
+        }
+
+        def sideEffect(filename, **kwargs):
+            return File([dumps(record) + '\n' for record in files[filename]])
+
+        with patch.object(builtins, 'open') as mockMethod:
+            mockMethod.side_effect = sideEffect
+            reads = Reads()
+            reads.add(Read('id2', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            reads.add(Read('id0', 'A' * 70))
+            readsAlignments = BlastReadsAlignments(
+                reads, ['file1.json', 'file2.json'])
+            shard = readsAlignments.forFiles(['file2.json'],
+                                             ReadIdIndex(reads))
+            self.assertEqual(['file2.json'], shard.resultFilenames())
+            self.assertEqual(['id1'],
+                             [readAlignments.read.id
+                              for readAlignments in shard])
+            self.assertEqual(['file1.json', 'file2.json'],
+                             readsAlignments.resultFilenames())
+
+    def testForFilesIncompatibleParameters(self):
+        """
+        If forFiles is given files whose first file has parameters that are
+        incompatible with those of the first file of the
+        L{BlastReadsAlignments}, a C{ValueError} must be raised.
+        """
+        params = deepcopy(PARAMS)
+        params['application'] = 'Skype'
+        files = {
+            'file1.json': [PARAMS, RECORD0],
+            'file2.json': [params, RECORD1],
+        }
+
+        def sideEffect(filename, **kwargs):
+            return File([dumps(record) + '\n' for record in files[filename]])
+
+        with patch.object(builtins, 'open') as mockMethod:
+            mockMethod.side_effect = sideEffect
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            readsAlignments = BlastReadsAlignments(
+                reads, ['file1.json', 'file2.json'])
+            error = ('^Incompatible BLAST parameters found\\. The '
+                     'parameters in file2\\.json differ from those '
+                     'originally found in file1\\.json\\. ')
+            six.assertRaisesRegex(self, ValueError, error,
+                                  readsAlignments.forFiles, ['file2.json'],
+                                  ReadIdIndex(reads))
+
     def testIncompatibleParameters(self):
         """
         If two compressed (bz2) JSON files with incompatible parameters
@@ -380,6 +649,26 @@ class TestBlastReadsAlignments(TestCase):
             six.assertRaisesRegex(self, ValueError, error, list,
                                   readsAlignments)
 
+    def testSubjectTitlesInterned(self):
+        """
+        Alignments against the same subject in different records must have
+        the same subject id and the same (interned) subject title object.
+        """
+        mockOpener = mockOpen(
+            read_data=(dumps(PARAMS) + '\n' + dumps(RECORD2) + '\n' +
+                       dumps(RECORD3) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id2', 'A' * 70))
+            reads.add(Read('id3', 'A' * 70))
+            readsAlignments = BlastReadsAlignments(reads, 'file.json')
+            alignment2, alignment3 = [readAlignments[0] for readAlignments
+                                      in readsAlignments]
+            self.assertEqual(0, alignment2.subjectId)
+            self.assertEqual(0, alignment3.subjectId)
+            self.assertIs(alignment2.subjectTitle, alignment3.subjectTitle)
+            self.assertEqual(1, len(readsAlignments.subjectTitles))
+
     def testGetSubjectSequenceBlastdbcmd(self):
         """
         The getSubjectSequence function must return a correct C{DNARead}
@@ -403,36 +692,52 @@ class TestBlastReadsAlignments(TestCase):
         """
         The getSubjectSequence function must return the correct C{DNARead}
         instance when a FASTA database filename is given to the
-        BlastReadsAlignments constructor.
-        """
-        class SideEffect(object):
-            def __init__(self, test):
-                self.test = test
-                self.count = 0
-
-            def sideEffect(self, filename, mode='r'):
-                if self.count == 0:
-                    self.test.assertEqual('file.json', filename)
-                    self.count += 1
-                    return File([dumps(PARAMS) + '\n', dumps(RECORD0) + '\n'])
-                elif self.count == 1:
-                    self.count += 1
-                    return File(['>id1 Description', 'AA\n'])
-                else:
-                    self.fail('Unexpected third call to open.')
-
-        sideEffect = SideEffect(self)
-
-        with patch.object(builtins, 'open') as mockMethod:
-            mockMethod.side_effect = sideEffect.sideEffect
-            reads = Reads()
-            readsAlignments = BlastReadsAlignments(
-                reads, 'file.json', databaseFilename='database.fasta')
+        BlastReadsAlignments constructor, and must save an index of the
+        FASTA file next to it.
+        """
+        dirname = mkdtemp()
+        try:
+            databaseFilename = join(dirname, 'database.fasta')
+            with open(databaseFilename, 'w') as fp:
+                fp.write('>id0 Other\nCC\n>id1 Description\nAA\n')
+            mockOpener = mockOpen(
+                read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+            with patch.object(builtins, 'open', mockOpener):
+                reads = Reads()
+                readsAlignments = BlastReadsAlignments(
+                    reads, 'file.json', databaseFilename=databaseFilename)
             subject = readsAlignments.getSubjectSequence('id1 Description')
             self.assertIsInstance(subject, DNARead)
             self.assertIsInstance(subject.sequence, str)
             self.assertEqual('id1 Description', subject.id)
             self.assertEqual('AA', subject.sequence)
+            self.assertTrue(
+                exists(databaseFilename + IndexedFasta.INDEX_SUFFIX))
+        finally:
+            rmtree(dirname)
+
+    def testGetSubjectSequenceBzip2FASTADatabase(self):
+        """
+        The getSubjectSequence function must return the correct C{DNARead}
+        instance when the FASTA database given to the BlastReadsAlignments
+        constructor is compressed with bzip2 (and so cannot be indexed).
+        """
+        dirname = mkdtemp()
+        try:
+            databaseFilename = join(dirname, 'database.fasta.bz2')
+            with bz2.BZ2File(databaseFilename, 'wb') as fp:
+                fp.write(b'>id0 Other\nCC\n>id1 Description\nAA\n')
+            mockOpener = mockOpen(
+                read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+            with patch.object(builtins, 'open', mockOpener):
+                reads = Reads()
+                readsAlignments = BlastReadsAlignments(
+                    reads, 'file.json', databaseFilename=databaseFilename)
+            self.assertEqual(
+                DNARead('id1 Description', 'AA'),
+                readsAlignments.getSubjectSequence('id1 Description'))
+        finally:
+            rmtree(dirname)
 
     @patch('os.path.exists')
     def testGetSubjectSequenceSqliteDatabase(self, existsMock):
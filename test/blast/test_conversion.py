@@ -1,4 +1,10 @@
+import os
+import re
+import six
+from six import StringIO
 from six.moves import builtins
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest import TestCase
 
 try:
@@ -8,9 +14,11 @@ except ImportError:
 
 from ..mocking import mockOpen
 
-from json import dumps
+from json import dumps, loads
 
-from dark.blast.conversion import XMLRecordsReader, JSONRecordsReader
+from dark.blast.conversion import (
+    XMLRecordsReader, JSONRecordsReader, BlastTabularFormatReader,
+    TabularRecordsReader)
 from dark.reads import Reads, DNARead
 
 
@@ -165,6 +173,124 @@ class TestXMLRecordsReader(TestCase):
             self.assertEqual(0, len(record1.alignments))
             self.assertEqual(2, len(record2.alignments))
 
+    def testDictRecords(self):
+        """
+        The dictRecords method must yield C{dict}s with the query id and the
+        alignments of each record.
+        """
+        mockOpener = mockOpen(read_data=RECORD)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = XMLRecordsReader('file.xml')
+            record1, record2 = list(reader.dictRecords())
+            self.assertEqual({'alignments': [], 'query': 'ICUR3MX01AGWKS'},
+                             record1)
+            self.assertEqual('ICUR3MX01C58U5', record2['query'])
+            self.assertEqual(
+                ['gi|157694982|gb|EF990688.1| Rotavirus A strain '
+                 'RVA/Pig-tc/VEN/A131/1988',
+                 'gi|157694972|gb|EF990692.1| Rotavirus A strain '
+                 'RVA/Pig-tc/VEN/A411/1989'],
+                [alignment['title'] for alignment in record2['alignments']])
+            self.assertEqual(
+                {
+                    'bits': 30.1402,
+                    'expect': 4.0824,
+                    'frame': (1, 1),
+                    'identicalCount': 16,
+                    'positiveCount': 17,
+                    'query': 'ATTCATCAGTAGCAAT',
+                    'query_start': 6,
+                    'query_end': 21,
+                    'sbjct': 'ATTCATCAGTAGCAAT',
+                    'sbjct_start': 738,
+                    'sbjct_end': 753,
+                },
+                record2['alignments'][0]['hsps'][0])
+            self.assertEqual(1059, record2['alignments'][0]['length'])
+
+    def testDictRecordsMatchBiopython(self):
+        """
+        The records and parameters from our streaming XML parser must be the
+        same as those obtained via the BioPython parser.
+        """
+        mockOpener = mockOpen(read_data=RECORD)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = XMLRecordsReader('file.xml', useBiopython=True)
+            expectedRecords = list(reader.dictRecords())
+            expectedParams = reader.params
+
+        mockOpener = mockOpen(read_data=RECORD)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = XMLRecordsReader('file.xml')
+            self.assertEqual(expectedRecords, list(reader.dictRecords()))
+            self.assertEqual(expectedParams, reader.params)
+
+    def testMissingFrames(self):
+        """
+        A missing query or hit frame must be given as 0 by both our streaming
+        XML parser and the BioPython parser.
+        """
+        for tag, expected in (('hit', (1, 0)), ('query', (0, 1)),
+                              ('(?:query|hit)', (0, 0))):
+            record = re.sub(r'\s*<Hsp_%s-frame>1</Hsp_%s-frame>' % (tag, tag),
+                            '', RECORD)
+            for useBiopython in False, True:
+                reader = XMLRecordsReader(StringIO(record),
+                                          useBiopython=useBiopython)
+                records = list(reader.dictRecords())
+                self.assertEqual(
+                    expected,
+                    records[1]['alignments'][0]['hsps'][0]['frame'])
+
+    def testSmallBlockSize(self):
+        """
+        The streaming XML parser must give the same result when it reads its
+        input in blocks that are much smaller than an XML iteration (so tags
+        are split across blocks).
+        """
+        for blockSize in 1, 7, 100:
+            reader = XMLRecordsReader(StringIO(RECORD))
+            reader.BLOCK_SIZE = blockSize
+            records = list(reader.dictRecords())
+            self.assertEqual(2, len(records))
+            self.assertEqual(['ICUR3MX01AGWKS', 'ICUR3MX01C58U5'],
+                             [record['query'] for record in records])
+            self.assertEqual(2, len(records[1]['alignments']))
+            self.assertEqual('BLASTN', reader.params['application'])
+
+    def testSaveAsJSONMatchesBiopython(self):
+        """
+        The JSON written by saveAsJSON must be the same whether or not the
+        BioPython parser is used.
+        """
+        expected = StringIO()
+        XMLRecordsReader(StringIO(RECORD), useBiopython=True).saveAsJSON(
+            expected)
+        result = StringIO()
+        XMLRecordsReader(StringIO(RECORD)).saveAsJSON(result)
+        self.assertEqual(expected.getvalue(), result.getvalue())
+
+    def testEmptyInput(self):
+        """
+        The streaming XML parser must not yield any records (or set params)
+        when given no input.
+        """
+        reader = XMLRecordsReader(StringIO(''))
+        self.assertEqual([], list(reader.dictRecords()))
+        self.assertIs(None, reader.params)
+
+    def testUnknownRootElement(self):
+        """
+        The streaming XML parser must raise a C{ValueError} if it is given
+        XML that does not have a BlastOutput root element.
+        """
+        reader = XMLRecordsReader(StringIO('<BlastXML2></BlastXML2>'))
+        error = ("^Unrecognized BLAST XML root element 'BlastXML2'\\. Only "
+                 "BlastOutput XML \\(version 1\\) can be parsed\\. Use "
+                 "the BioPython parser for other XML\\.$")
+        six.assertRaisesRegex(self, ValueError, error, list,
+                              reader.dictRecords())
+
 
 _JSON_RECORDS = [
     {
@@ -456,3 +582,296 @@ class TestJSONRecordsReader(TestCase):
             self.assertEqual(7, readAlignments[1][1].hsps[0].positiveCount)
             self.assertEqual(3800, readAlignments[1][2].hsps[0].identicalCount)
             self.assertEqual(7700, readAlignments[1][2].hsps[0].positiveCount)
+
+
+class TestJSONRecordsReaderIndex(TestCase):
+    """
+    Test the indexed record access of the JSONRecordsReader class.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+        self.filename = os.path.join(self.dirname, 'file.json')
+        with open(self.filename, 'w') as fp:
+            fp.write(JSON)
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def testRecordFor(self):
+        """
+        The record for a read must be found by its id.
+        """
+        reader = JSONRecordsReader(self.filename)
+        self.assertEqual(
+            _JSON_RECORDS[4],
+            reader.recordFor('BIOMICS-HISEQTP:140:HJFH5BCXX:1:1101:14734:7512 '
+                             '1:N:0:TGACCA'))
+
+    def testRecordForUnknownRead(self):
+        """
+        Asking for the record of an unknown read must raise KeyError.
+        """
+        reader = JSONRecordsReader(self.filename)
+        self.assertRaises(KeyError, reader.recordFor, 'unknown id')
+
+    def testRecordsInRange(self):
+        """
+        A range of records must be returned.
+        """
+        reader = JSONRecordsReader(self.filename)
+        self.assertEqual(_JSON_RECORDS[2:4],
+                         list(reader.recordsInRange(1, 3)))
+
+    def testRecordsInRangeDoNotAffectReadAlignments(self):
+        """
+        Reading records via the index must not interfere with reading read
+        alignments.
+        """
+        reader = JSONRecordsReader(self.filename)
+        self.assertEqual(_JSON_RECORDS[1:2],
+                         list(reader.recordsInRange(0, 1)))
+        readAlignments = list(reader.readAlignments(
+            TestJSONRecordsReader.READS))
+        self.assertEqual(4, len(readAlignments))
+
+
+def _tabular(records, comments=True):
+    """
+    Make BLAST tabular output with the same content as some JSON records.
+
+    @param records: A C{list} of C{dict}s, the first containing BLAST params
+        and the rest containing BLAST records.
+    @param comments: If C{True}, make output format 7 (with comment lines),
+        else output format 6.
+    @return: A C{str} of BLAST tabular output.
+    """
+    lines = []
+    for record in records[1:]:
+        if comments:
+            lines.extend([
+                '# BLASTN 2.2.30+',
+                '# Query: %s' % record['query'],
+                '# Database: virus-refseq-20160316',
+            ])
+            if record['alignments']:
+                lines.append('# Fields: query id, subject id, ...')
+            lines.append('# %d hits found' % len(record['alignments']))
+        for alignment in record['alignments']:
+            sseqid, stitle = alignment['title'].split(' ', 1)
+            for hsp in alignment['hsps']:
+                lines.append('\t'.join(map(str, [
+                    record['query'].split()[0], sseqid, stitle, hsp['bits'],
+                    hsp['expect'], hsp['frame'][0], hsp['frame'][1],
+                    hsp['query'], hsp['query_start'], hsp['query_end'],
+                    hsp['sbjct'], hsp['sbjct_start'], hsp['sbjct_end'],
+                    alignment['length'], '99', hsp['identicalCount'],
+                    hsp['positiveCount']])))
+    if comments:
+        lines.append('# BLAST processed %d queries' % (len(records) - 1))
+    return '\n'.join(lines) + '\n'
+
+
+class TestBlastTabularFormatReader(TestCase):
+    """
+    Test the BlastTabularFormatReader class.
+    """
+
+    def testFormat7Records(self):
+        """
+        The records read from BLAST tabular output with comment lines must be
+        the same as those made from the equivalent XML (apart from also
+        having a btop value in their HSPs).
+        """
+        reader = BlastTabularFormatReader(StringIO(_tabular(_JSON_RECORDS)))
+        records = list(reader.records())
+        for record in records:
+            for alignment in record['alignments']:
+                for hsp in alignment['hsps']:
+                    self.assertEqual('99', hsp.pop('btop'))
+                    hsp['frame'] = list(hsp['frame'])
+        self.assertEqual(_JSON_RECORDS[1:], records)
+
+    def testFormat7Params(self):
+        """
+        The BLAST program, version, and database must be found in the comment
+        lines of BLAST tabular output format 7.
+        """
+        reader = BlastTabularFormatReader(StringIO(_tabular(_JSON_RECORDS)),
+                                          application='blastx')
+        list(reader.records())
+        self.assertEqual(
+            {
+                'application': 'BLASTN',
+                'database': 'virus-refseq-20160316',
+                'version': '2.2.30+',
+            },
+            reader.params)
+
+    def testFormat6(self):
+        """
+        When reading BLAST tabular output format 6 (with no comment lines),
+        there must be no records for queries with no hits, the query ids
+        must be the first word of the read ids, and the params must use the
+        passed application.
+        """
+        reader = BlastTabularFormatReader(
+            StringIO(_tabular(_JSON_RECORDS, comments=False)),
+            application='blastx')
+        records = list(reader.records())
+        self.assertEqual(
+            ['BIOMICS-HISEQTP:140:HJFH5BCXX:1:1101:9489:4234',
+             'BIOMICS-HISEQTP:140:HJFH5BCXX:1:1101:19964:6287'],
+            [record['query'] for record in records])
+        self.assertEqual([1, 3], [len(record['alignments'])
+                                  for record in records])
+        self.assertEqual('BLASTX', reader.params['application'])
+
+    def testHSPsOfOneSubjectAreInOneAlignment(self):
+        """
+        Lines for the same query and subject must be HSPs in one alignment.
+        """
+        line = '\t'.join(['id1', 'gi|3|', 'Subject', '30.0', '1e-5', '1',
+                          '1', 'ACGT', '1', '4', 'ACGT', '%d', '%d', '100',
+                          '4', '4', '4'])
+        data = '\n'.join([line % (1, 4), line % (50, 53)]) + '\n'
+        records = list(BlastTabularFormatReader(StringIO(data)).records())
+        self.assertEqual(1, len(records))
+        alignment, = records[0]['alignments']
+        self.assertEqual('gi|3| Subject', alignment['title'])
+        self.assertEqual(100, alignment['length'])
+        self.assertEqual([1, 50], [hsp['sbjct_start']
+                                   for hsp in alignment['hsps']])
+
+    def testWrongNumberOfFields(self):
+        """
+        A line with the wrong number of fields must cause a C{ValueError}.
+        """
+        reader = BlastTabularFormatReader(StringIO('id1\tgi|3|\t30.0\n'))
+        error = ("^Line 1 of .* has 3 tab-separated fields \\(expected "
+                 "17\\)\\. BLAST must be run with -outfmt '6 qseqid ")
+        six.assertRaisesRegex(self, ValueError, error, list,
+                              reader.records())
+
+    def testSaveAsJSON(self):
+        """
+        A BlastTabularFormatReader must be able to save itself as JSON, with
+        the params on the first line.
+        """
+        reader = BlastTabularFormatReader(StringIO(_tabular(_JSON_RECORDS)))
+        fp = StringIO()
+        reader.saveAsJSON(fp)
+        lines = fp.getvalue().split('\n')
+        self.assertEqual(6, len(lines))
+        self.assertEqual(reader.params, loads(lines[0]))
+        self.assertEqual('', lines[5])
+
+    def testSaveAsJSONNoRecords(self):
+        """
+        A BlastTabularFormatReader with no records must still save its params
+        as JSON.
+        """
+        reader = BlastTabularFormatReader(StringIO(''))
+        fp = StringIO()
+        reader.saveAsJSON(fp)
+        self.assertEqual(
+            '{"application":"BLASTN","database":"","version":""}\n',
+            fp.getvalue())
+
+
+class TestTabularRecordsReader(TestCase):
+    """
+    Test the TabularRecordsReader class.
+    """
+
+    def _compare(self, data, count=4):
+        """
+        Check that the read alignments made from BLAST tabular output are the
+        same as those from the equivalent JSON.
+
+        @param data: The C{str} BLAST tabular output to check.
+        @param count: The C{int} number of read alignments that should be
+            made from C{data}.
+        """
+        mockOpener = mockOpen(read_data=data)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = TabularRecordsReader('file.tsv')
+            self.assertEqual('blastn', reader.application)
+            result = list(reader.readAlignments(
+                iter(TestJSONRecordsReader.READS)))
+
+        mockOpener = mockOpen(read_data=JSON)
+        with patch.object(builtins, 'open', mockOpener):
+            expected = list(JSONRecordsReader('file.json').readAlignments(
+                TestJSONRecordsReader.READS))[:count]
+
+        self.assertEqual(len(expected), len(result))
+        for expectedReadAlignments, readAlignments in zip(expected, result):
+            self.assertIs(expectedReadAlignments.read, readAlignments.read)
+            self.assertEqual(len(expectedReadAlignments),
+                             len(readAlignments))
+            for expectedAlignment, alignment in zip(expectedReadAlignments,
+                                                    readAlignments):
+                self.assertEqual(expectedAlignment.subjectTitle,
+                                 alignment.subjectTitle)
+                self.assertEqual(expectedAlignment.subjectLength,
+                                 alignment.subjectLength)
+                for expectedHsp, hsp in zip(expectedAlignment.hsps,
+                                            alignment.hsps):
+                    self.assertEqual(expectedHsp.score.score, hsp.score.score)
+                    expectedAttrs = vars(expectedHsp)
+                    attrs = vars(hsp)
+                    del expectedAttrs['score'], attrs['score']
+                    self.assertEqual(expectedAttrs, attrs)
+
+    def testFormat7SameAsJSON(self):
+        """
+        The read alignments from BLAST tabular output format 7 must be the
+        same as those from the equivalent JSON.
+        """
+        self._compare(_tabular(_JSON_RECORDS))
+
+    def testFormat6SameAsJSON(self):
+        """
+        The read alignments from BLAST tabular output format 6 must be the
+        same as those from the equivalent JSON. The final two reads have no
+        hits, so they are not in the tabular output and must be left for the
+        caller to deal with.
+        """
+        self._compare(_tabular(_JSON_RECORDS, comments=False), 2)
+
+    def testFormat6ReadWithNoHitsBeforeARecord(self):
+        """
+        When reading BLAST tabular output format 6, a read with no hits that
+        comes before a read with hits must be yielded with no alignments.
+        """
+        reads = Reads([DNARead('id0', 'ACGT'), DNARead('id1', 'ACGT')])
+        line = '\t'.join(['id1', 'gi|3|', 'Subject', '30.0', '1e-5', '1',
+                          '1', 'ACGT', '1', '4', 'ACGT', '1', '4', '100',
+                          '4', '4', '4'])
+        mockOpener = mockOpen(read_data=line + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reader = TabularRecordsReader('file.tsv')
+            result = list(reader.readAlignments(iter(reads)))
+            self.assertEqual(['id0', 'id1'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual([0, 1], [len(readAlignments)
+                                      for readAlignments in result])
+
+    def testUnknownQuery(self):
+        """
+        If a record is for a query that is not one of the reads, a
+        C{ValueError} must be raised.
+        """
+        reads = Reads([DNARead('id0', 'ACGT')])
+        line = '\t'.join(['id1', 'gi|3|', 'Subject', '30.0', '1e-5', '1',
+                          '1', 'ACGT', '1', '4', 'ACGT', '1', '4', '100',
+                          '4', '4', '4'])
+        mockOpener = mockOpen(read_data=line + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reader = TabularRecordsReader('file.tsv')
+            error = ("^Read generator failed to yield a read with id 'id1' "
+                     "as found in record number 1 during parsing of BLAST "
+                     "file 'file.tsv'\\.$")
+            six.assertRaisesRegex(self, ValueError, error, list,
+                                  reader.readAlignments(iter(reads)))
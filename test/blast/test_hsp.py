@@ -1,6 +1,15 @@
+import sys
+import six
+from random import Random
+from six import StringIO
 from unittest import TestCase
 
-from dark.blast.hsp import normalizeHSP
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from dark.blast.hsp import normalizeHSP, normalizeHSPs
 
 
 class Frame(object):
@@ -920,3 +929,162 @@ class Old_ReadPositiveHitNegative(TestCase):
             'readStartInSubject': 1775,
             'readEndInSubject': 1925,
         }, normalized)
+
+
+class TestNormalizeHSPs(TestCase):
+    """
+    Tests for normalizeHSPs, which must give exactly what calling normalizeHSP
+    on each HSP gives.
+    """
+    KEYS = ('readStart', 'readEnd', 'readStartInSubject', 'readEndInSubject',
+            'subjectStart', 'subjectEnd')
+
+    def _randomHSP(self, rand, blastApplication):
+        """
+        Make a random HSP. Most are valid, but some have an offset changed
+        so they may not be.
+
+        @param rand: A C{random.Random} instance.
+        @param blastApplication: The C{str} BLAST program, 'blastn' or
+            'blastx'.
+        @return: A 2-tuple with a C{FakeHSP} and the C{int} read length.
+        """
+        matchLength = rand.randint(4, 30)
+        readGaps = rand.randint(0, 3)
+        hitGaps = rand.randint(0, 3)
+        unmatchedLeft = rand.randint(0, 20)
+        unmatchedRight = rand.randint(0, 20)
+        subjectStart = rand.randint(1, 100)
+        subjectEnd = subjectStart + matchLength + readGaps - hitGaps - 1
+        hitFrame = rand.choice((-1, 1))
+
+        if blastApplication == 'blastx':
+            readFrame = rand.choice((-3, -2, -1, 1, 2, 3))
+            ignored = abs(readFrame) - 1
+            readLen = (ignored + 3 * (unmatchedLeft + matchLength +
+                                      unmatchedRight) + rand.randint(0, 2))
+            readStart = ignored + 3 * unmatchedLeft + 1
+            readEnd = ignored + 3 * (unmatchedLeft + matchLength)
+        else:
+            readFrame = 1
+            readLen = unmatchedLeft + matchLength + unmatchedRight
+            readStart = unmatchedLeft + 1
+            readEnd = unmatchedLeft + matchLength
+
+        if hitFrame < 0 and rand.random() < 0.5:
+            # Negative hits may have descending offsets.
+            subjectStart, subjectEnd = subjectEnd, subjectStart
+
+        hsp = FakeHSP(subjectStart=subjectStart, subjectEnd=subjectEnd,
+                      readStart=readStart, readEnd=readEnd,
+                      frame=Frame(readFrame, hitFrame),
+                      read='A' * matchLength + '-' * readGaps,
+                      hit='A' * matchLength + '-' * hitGaps)
+        # normalizeHSP prints these when it finds an invalid HSP.
+        hsp['bits'] = hsp['expect'] = None
+
+        if rand.random() < 0.2:
+            key = rand.choice(('query_start', 'query_end', 'sbjct_start',
+                               'sbjct_end'))
+            hsp[key] += rand.choice((-40, -3, -1, 1, 3, 40))
+
+        return hsp, readLen
+
+    def _normalizeHSPs(self, hsps, readLens, blastApplication):
+        """
+        Call normalizeHSPs on some HSPs.
+
+        @param hsps: A C{list} of C{FakeHSP} instances.
+        @param readLens: A C{list} of C{int} read lengths.
+        @param blastApplication: The C{str} BLAST program, 'blastn' or
+            'blastx'.
+        @return: A C{list} of C{dict}s, as returned by normalizeHSP.
+        """
+        normalized = normalizeHSPs(
+            [hsp['query_start'] for hsp in hsps],
+            [hsp['query_end'] for hsp in hsps],
+            [hsp['sbjct_start'] for hsp in hsps],
+            [hsp['sbjct_end'] for hsp in hsps],
+            [hsp['frame'][0] for hsp in hsps],
+            [hsp['frame'][1] for hsp in hsps],
+            readLens,
+            [hsp['query'].count('-') for hsp in hsps],
+            [hsp['sbjct'].count('-') for hsp in hsps],
+            blastApplication)
+        return [dict(zip(self.KEYS, values))
+                for values in zip(*[normalized[key].tolist()
+                                    for key in self.KEYS])]
+
+    def _check(self, blastApplication, seed):
+        """
+        Check that normalizeHSPs agrees with normalizeHSP on many random HSPs.
+
+        @param blastApplication: The C{str} BLAST program, 'blastn' or
+            'blastx'.
+        @param seed: The C{int} random seed to use.
+        """
+        rand = Random(seed)
+        validHSPs, validReadLens, expected, invalid = [], [], [], []
+
+        # Don't let normalizeHSP print debugging output for invalid HSPs.
+        with patch.object(sys, 'stdout', new=StringIO()):
+            for _ in range(500):
+                hsp, readLen = self._randomHSP(rand, blastApplication)
+                try:
+                    normalized = normalizeHSP(hsp, readLen, blastApplication)
+                except AssertionError:
+                    invalid.append((hsp, readLen))
+                else:
+                    validHSPs.append(hsp)
+                    validReadLens.append(readLen)
+                    expected.append(normalized)
+
+        # Make sure the HSPs tested both outcomes reasonably often.
+        self.assertGreater(len(expected), 300)
+        self.assertGreater(len(invalid), 20)
+
+        self.assertEqual(expected, self._normalizeHSPs(
+            validHSPs, validReadLens, blastApplication))
+
+        for hsp, readLen in invalid:
+            self.assertRaises(AssertionError, self._normalizeHSPs,
+                              validHSPs[:5] + [hsp], validReadLens[:5] +
+                              [readLen], blastApplication)
+
+    def testBlastnAgreesWithNormalizeHSP(self):
+        """
+        normalizeHSPs must give the same results as normalizeHSP for blastn
+        HSPs.
+        """
+        self._check('blastn', 0)
+        self._check('blastn', 1)
+
+    def testBlastxAgreesWithNormalizeHSP(self):
+        """
+        normalizeHSPs must give the same results as normalizeHSP for blastx
+        HSPs.
+        """
+        self._check('blastx', 0)
+        self._check('blastx', 1)
+
+    def testEmpty(self):
+        """
+        normalizeHSPs must return empty arrays when given no HSPs.
+        """
+        normalized = normalizeHSPs([], [], [], [], [], [], [], [], [],
+                                   'blastn')
+        self.assertEqual(set(self.KEYS), set(normalized))
+        for key in self.KEYS:
+            self.assertEqual([], normalized[key].tolist())
+
+    def testErrorMessageIdentifiesHSP(self):
+        """
+        The error raised by normalizeHSPs must give the index of the first
+        HSP that fails a sanity check, and the check it failed.
+        """
+        error = ('^HSP 1: Assertion "read_start <= read_end" failed. Read '
+                 'positive is True. read_start = 3, read_end = 1$')
+        six.assertRaisesRegex(
+            self, AssertionError, error, normalizeHSPs,
+            [1, 3, 1], [3, 1, 3], [1, 1, 1], [3, 3, 3], [1, 1, 1],
+            [1, 1, 1], [3, 3, 3], [0, 0, 0], [0, 0, 0], 'blastn')
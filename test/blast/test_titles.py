@@ -11,12 +11,17 @@ from six.moves import builtins
 
 from ..mocking import mockOpen, File
 from .sample_data import PARAMS, RECORD0, RECORD1, RECORD2, RECORD3, RECORD4
+from .sample_files import BlastFilesMixin
 
+from dark.alignments import ReadIdIndex
+from dark.fasta import FastaReads, IndexedFasta
 from dark.reads import Read, Reads
 from dark.hsp import HSP
 from dark.score import LowerIsBetterScore
 from dark.blast.alignments import BlastReadsAlignments
-from dark.titles import titleCounts, TitleAlignments, TitlesAlignments
+from dark import titles
+from dark.titles import (
+    titleCounts, TitleAlignments, TitlesAlignments, TitlesSummary)
 
 
 class TestTitleCounts(TestCase):
@@ -120,6 +125,69 @@ class TestTitlesAlignments(TestCase):
                 ],
                 sorted(titlesAlignments.keys()))
 
+    def testReadIndex(self):
+        """
+        If a TitlesAlignments is given a read index, its TitleAlignment
+        instances must keep only read ids, and look up reads in the index
+        only when they are needed.
+        """
+        lookups = []
+
+        class ReadIndex(ReadIdIndex):
+            def __getitem__(self, id_):
+                lookups.append(id_)
+                return ReadIdIndex.__getitem__(self, id_)
+
+        mockOpener = mockOpen(read_data=(
+            dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n' +
+            dumps(RECORD1) + '\n' + dumps(RECORD2) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            reads.add(Read('id2', 'A' * 70))
+            readsAlignments = BlastReadsAlignments(reads, 'file.json')
+            titlesAlignments = TitlesAlignments(
+                readsAlignments, readIndex=ReadIndex(reads))
+        title = 'gi|887699|gb|DQ37780 Squirrelpox virus 55'
+        titleAlignments = titlesAlignments[title]
+        self.assertEqual('id0', titleAlignments[0]._read)
+        self.assertEqual({'id0'}, titleAlignments.readIds())
+        self.assertEqual([], lookups)
+        self.assertEqual([Read('id0', 'A' * 70)],
+                         list(titleAlignments.reads()))
+        self.assertEqual(['id0'], lookups)
+
+    def testReadIndexFiltered(self):
+        """
+        Filtering a TitlesAlignments that was given a read index must not
+        look up reads, and must return a TitlesAlignments with the same read
+        index.
+        """
+        lookups = []
+
+        class ReadIndex(ReadIdIndex):
+            def __getitem__(self, id_):
+                lookups.append(id_)
+                return ReadIdIndex.__getitem__(self, id_)
+
+        mockOpener = mockOpen(read_data=(
+            dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n' +
+            dumps(RECORD1) + '\n' + dumps(RECORD2) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            reads.add(Read('id2', 'A' * 70))
+            readsAlignments = BlastReadsAlignments(reads, 'file.json')
+            readIndex = ReadIndex(reads)
+            titlesAlignments = TitlesAlignments(readsAlignments,
+                                                readIndex=readIndex)
+        result = titlesAlignments.filter(minMatchingReads=2, minNewReads=0.5,
+                                         minCoverage=0.1)
+        self.assertIs(readIndex, result.readIndex)
+        self.assertEqual([], lookups)
+
     def testExpectedTitleDetails(self):
         """
         An instance of TitleAlignments in a TitlesAlignments instance must
@@ -903,3 +971,385 @@ class TestTitleSorting(TestCase):
                 'gi|887699|gb|DQ37780 Squirrelpox virus 1296/99',
                 'gi|887699|gb|DQ37780 Squirrelpox virus 55',
             ], result)
+
+
+class TestTopTitles(TestCase):
+    """
+    Tests for the L{dark.titles.TitlesAlignments.topTitles} and
+    L{dark.titles.TitlesAlignments.iterSortedTitles} functions.
+    """
+
+    def _titlesAlignments(self, scoreClass=None):
+        """
+        Make a TitlesAlignments with five titles.
+
+        @param scoreClass: A score class for BlastReadsAlignments, or C{None}
+            to use its default.
+        @return: A L{TitlesAlignments} instance.
+        """
+        mockOpener = mockOpen(read_data=(
+            dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n' +
+            dumps(RECORD1) + '\n' + dumps(RECORD2) + '\n' +
+            dumps(RECORD3) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            reads.add(Read('id2', 'A' * 70))
+            reads.add(Read('id3', 'A' * 70))
+            kwargs = {} if scoreClass is None else {'scoreClass': scoreClass}
+            readsAlignments = BlastReadsAlignments(reads, 'file.json',
+                                                   **kwargs)
+            return TitlesAlignments(readsAlignments)
+
+    def testUnknown(self):
+        """
+        Asking for the top titles on an unknown attribute must raise
+        C{ValueError}, as must asking for an iterator of sorted titles
+        (even before any titles are taken from it).
+        """
+        titlesAlignments = self._titlesAlignments()
+        self.assertRaises(ValueError, titlesAlignments.topTitles, 'xxx', 2)
+        self.assertRaises(ValueError, titlesAlignments.iterSortedTitles,
+                          'xxx')
+
+    def testSameAsSortTitles(self):
+        """
+        The top titles and the sorted titles iterator must give the titles in
+        the order given by sortTitles, for all sort attributes and for both
+        kinds of score.
+        """
+        for scoreClass in None, LowerIsBetterScore:
+            titlesAlignments = self._titlesAlignments(scoreClass)
+            for by in ('length', 'maxScore', 'medianScore', 'readCount',
+                       'title'):
+                expected = titlesAlignments.sortTitles(by)
+                for n in range(7):
+                    self.assertEqual(expected[:n],
+                                     titlesAlignments.topTitles(by, n))
+                self.assertEqual(expected,
+                                 list(titlesAlignments.iterSortedTitles(by)))
+
+    def testIterSortedTitlesIsLazy(self):
+        """
+        The sorted titles iterator must give titles one at a time.
+        """
+        titlesAlignments = self._titlesAlignments()
+        titles = titlesAlignments.iterSortedTitles('readCount')
+        self.assertEqual('gi|887699|gb|DQ37780 Cowpox virus 15', next(titles))
+        self.assertEqual(4, len(list(titles)))
+
+    def testMaxTitlesWithRejectedTitles(self):
+        """
+        When titles near the top of the sort order are rejected by filter,
+        the next titles must be used.
+        """
+        titlesAlignments = self._titlesAlignments()
+        # The title with the best score has a coverage below 0.0011.
+        result = titlesAlignments.filter(maxTitles=2, sortOn='maxScore',
+                                         minCoverage=0.0011)
+        self.assertEqual(
+            [
+                'gi|887699|gb|DQ37780 Cowpox virus 15',
+                'gi|887699|gb|DQ37780 Monkeypox virus 456',
+            ],
+            sorted(result))
+
+
+class TestTitlesSummary(TestCase):
+    """
+    Test the TitlesSummary class.
+    """
+
+    def _readsAlignments(self, **kwargs):
+        """
+        Make a BlastReadsAlignments for four reads (must be called with
+        C{open} patched).
+
+        @param kwargs: Keyword arguments for BlastReadsAlignments.
+        @return: A L{BlastReadsAlignments} instance.
+        """
+        reads = Reads()
+        for readId in 'id0', 'id1', 'id2', 'id3':
+            reads.add(Read(readId, 'A' * 70))
+        return BlastReadsAlignments(reads, 'file.json', **kwargs)
+
+    def _mockOpener(self):
+        """
+        Make a mock opener for a JSON file with four records.
+
+        @return: A mock C{open} function.
+        """
+        return mockOpen(read_data=(
+            dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n' +
+            dumps(RECORD1) + '\n' + dumps(RECORD2) + '\n' +
+            dumps(RECORD3) + '\n'))
+
+    def testEmpty(self):
+        """
+        A TitlesSummary made from a ReadsAlignments with no alignments must
+        be empty.
+        """
+        mockOpener = mockOpen(read_data=dumps(PARAMS) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            readsAlignments = BlastReadsAlignments(Reads(), 'file.json')
+            self.assertEqual({}, TitlesSummary(readsAlignments))
+
+    def testSameAsTitlesAlignments(self):
+        """
+        A TitlesSummary must have the same titles and summary as the
+        corresponding TitlesAlignments, whatever the sort order.
+        """
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesAlignments = TitlesAlignments(self._readsAlignments())
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesSummary = TitlesSummary(self._readsAlignments())
+        self.assertEqual(sorted(titlesAlignments), sorted(titlesSummary))
+        for sortOn in ('length', 'maxScore', 'medianScore', 'readCount',
+                       'title'):
+            self.assertEqual(
+                titlesAlignments.tabSeparatedSummary(sortOn=sortOn),
+                titlesSummary.tabSeparatedSummary(sortOn=sortOn))
+
+    def testSameAsTitlesAlignmentsEValue(self):
+        """
+        A TitlesSummary must have the same summary as the corresponding
+        TitlesAlignments when lower scores are better.
+        """
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesAlignments = TitlesAlignments(
+                self._readsAlignments(scoreClass=LowerIsBetterScore))
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesSummary = TitlesSummary(
+                self._readsAlignments(scoreClass=LowerIsBetterScore))
+        self.assertEqual(titlesAlignments.tabSeparatedSummary('maxScore'),
+                         titlesSummary.tabSeparatedSummary('maxScore'))
+
+    def testFilter(self):
+        """
+        Filtering a TitlesSummary must give a TitlesSummary with the same
+        titles as filtering the corresponding TitlesAlignments.
+        """
+        kwargs = {
+            'minMatchingReads': 2,
+            'withScoreBetterThan': 30,
+            'maxTitles': 2,
+        }
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesAlignments = TitlesAlignments(
+                self._readsAlignments()).filter(**kwargs)
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesSummary = TitlesSummary(
+                self._readsAlignments()).filter(**kwargs)
+        self.assertTrue(isinstance(titlesSummary, TitlesSummary))
+        self.assertEqual(sorted(titlesAlignments), sorted(titlesSummary))
+
+    def testFilterMinNewReads(self):
+        """
+        Filtering a TitlesSummary with minNewReads must raise ValueError.
+        """
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesSummary = TitlesSummary(self._readsAlignments())
+        error = ('^minNewReads cannot be used to filter a TitlesSummary, as '
+                 'no read ids are kept\\.$')
+        six.assertRaisesRegex(self, ValueError, error, titlesSummary.filter,
+                              minNewReads=0.5)
+
+    def testApproximateMedian(self):
+        """
+        A TitlesSummary that estimates median scores must have the same
+        summary as the corresponding TitlesAlignments when there are few
+        HSPs (as the median is then exact).
+        """
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesAlignments = TitlesAlignments(self._readsAlignments())
+        with patch.object(builtins, 'open', self._mockOpener()):
+            titlesSummary = TitlesSummary(self._readsAlignments(),
+                                          exactMedian=False)
+        self.assertEqual(titlesAlignments.tabSeparatedSummary('title'),
+                         titlesSummary.tabSeparatedSummary('title'))
+
+
+class TestParallelTitlesAlignments(BlastFilesMixin, TestCase):
+    """
+    Test making a TitlesAlignments instance with several worker processes.
+    """
+    # The reads are deliberately not in the order of the records.
+    READ_IDS = ('id3', 'id0', 'id2', 'id1', 'id4')
+    JSON_RECORDS = ([RECORD0], [RECORD1, RECORD2], [RECORD3])
+
+    def _readsAlignments(self, **filterKwargs):
+        """
+        Make a BlastReadsAlignments for our files, with reads found by id.
+
+        @param filterKwargs: If not empty, keyword arguments for a filter to
+            add to the BlastReadsAlignments.
+        @return: A L{BlastReadsAlignments} instance.
+        """
+        return self.readsAlignments(
+            readIndex=ReadIdIndex(FastaReads(self.fastaFilename)),
+            **filterKwargs)
+
+    def assertSameTitlesAlignments(self, expected, titlesAlignments):
+        """
+        Check that two TitlesAlignments have the same titles, reads, and
+        HSPs (in the same order).
+
+        @param expected: The expected L{TitlesAlignments} instance.
+        @param titlesAlignments: The L{TitlesAlignments} instance to check.
+        """
+        self.assertEqual(sorted(expected), sorted(titlesAlignments))
+        for title, expectedTitleAlignments in expected.items():
+            titleAlignments = titlesAlignments[title]
+            self.assertEqual(expectedTitleAlignments.subjectLength,
+                             titleAlignments.subjectLength)
+            self.assertEqual(
+                [alignment.read for alignment in expectedTitleAlignments],
+                [alignment.read for alignment in titleAlignments])
+            self.assertEqual(
+                [hsp.score.score for hsp in expectedTitleAlignments.hsps()],
+                [hsp.score.score for hsp in titleAlignments.hsps()])
+
+    def testSameAsSerial(self):
+        """
+        A TitlesAlignments made with several workers must be the same as one
+        made with one.
+        """
+        titlesAlignments = TitlesAlignments(
+            self._readsAlignments(), importReadsAlignmentsTitles=False)
+        self.assertTrue(titlesAlignments._importTitlesInParallel(2))
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments()), titlesAlignments)
+
+    def testMoreWorkersThanFiles(self):
+        """
+        A TitlesAlignments made with more workers than there are result
+        files must be the same as one made with one worker.
+        """
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments()),
+            TitlesAlignments(self._readsAlignments(), workers=5))
+
+    def testReadsAlignmentsAndScoreClass(self):
+        """
+        A TitlesAlignments made with several workers must have the
+        readsAlignments it was made from, and its score class.
+        """
+        readsAlignments = self._readsAlignments()
+        titlesAlignments = TitlesAlignments(readsAlignments, workers=2)
+        self.assertIs(readsAlignments, titlesAlignments.readsAlignments)
+        self.assertIs(readsAlignments.scoreClass,
+                      titlesAlignments.scoreClass)
+
+    def testSubjectTitlesAdded(self):
+        """
+        A TitlesAlignments made with several workers must add the matched
+        titles to the subject titles of its readsAlignments.
+        """
+        readsAlignments = self._readsAlignments()
+        titlesAlignments = TitlesAlignments(readsAlignments, workers=2)
+        for title in titlesAlignments:
+            self.assertIsNotNone(readsAlignments.subjectTitles.id(title))
+
+    def testReadFilter(self):
+        """
+        A TitlesAlignments made with several workers must use the filters of
+        its readsAlignments.
+        """
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments(titleRegex='Cowpox')),
+            TitlesAlignments(self._readsAlignments(titleRegex='Cowpox'),
+                             workers=2))
+
+    def testTitleFilter(self):
+        """
+        Filtering a TitlesAlignments made with several workers must give the
+        same result as filtering one made with one worker.
+        """
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments()).filter(
+                minMatchingReads=2),
+            TitlesAlignments(self._readsAlignments(), workers=2).filter(
+                minMatchingReads=2))
+
+    def testReadIndex(self):
+        """
+        A TitlesAlignments made with several workers and a read index must
+        keep read ids, and find the same reads as one made with one worker.
+        """
+        readIndex = ReadIdIndex(FastaReads(self.fastaFilename))
+        titlesAlignments = TitlesAlignments(
+            self._readsAlignments(), importReadsAlignmentsTitles=False,
+            readIndex=readIndex)
+        self.assertTrue(titlesAlignments._importTitlesInParallel(2))
+        for titleAlignments in titlesAlignments.values():
+            for titleAlignment in titleAlignments:
+                self.assertIs(readIndex, titleAlignment._readIndex)
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments()), titlesAlignments)
+
+    def testLazyReadIndex(self):
+        """
+        A TitlesAlignments made with several workers and a read index must
+        find the reads in the workers using the read index, not by making an
+        index of all the reads of its readsAlignments.
+        """
+        readIndex = IndexedFasta(self.fastaFilename)
+        readsAlignments = BlastReadsAlignments(
+            FastaReads(self.fastaFilename), self.jsonFilenames)
+        titlesAlignments = TitlesAlignments(
+            readsAlignments, importReadsAlignmentsTitles=False,
+            readIndex=readIndex)
+        with patch.object(readsAlignments, 'readIdIndex') as readIdIndex:
+            self.assertTrue(titlesAlignments._importTitlesInParallel(2))
+        readIdIndex.assert_not_called()
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments()), titlesAlignments)
+        readIndex.close()
+
+    def testLazyReadIndexMadeFirst(self):
+        """
+        A read index that is made on first use must be made before the
+        workers are started, so they do not all try to make it at once.
+        """
+        readIndex = IndexedFasta(self.fastaFilename)
+        titlesAlignments = TitlesAlignments(
+            self._readsAlignments(), importReadsAlignmentsTitles=False,
+            readIndex=readIndex)
+        with patch.object(IndexedFasta, '_makeIndex',
+                          wraps=readIndex._makeIndex) as makeIndex:
+            self.assertTrue(titlesAlignments._importTitlesInParallel(2))
+        makeIndex.assert_called_once_with()
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments()), titlesAlignments)
+        readIndex.close()
+
+    def testShardStateNotSet(self):
+        """
+        Reading alignments with several workers must not set the state of
+        the workers in the parent process.
+        """
+        titlesAlignments = TitlesAlignments(
+            self._readsAlignments(), importReadsAlignmentsTitles=False)
+        self.assertTrue(titlesAlignments._importTitlesInParallel(2))
+        self.assertIsNone(titles._shardState)
+
+    def testStatefulFilterIsNotParallel(self):
+        """
+        If the readsAlignments has a filter that keeps state from one read to
+        the next, its alignments must not be read in parallel.
+        """
+        titlesAlignments = TitlesAlignments(
+            self._readsAlignments(limit=2), importReadsAlignmentsTitles=False)
+        self.assertFalse(titlesAlignments._importTitlesInParallel(2))
+        self.assertEqual({}, titlesAlignments)
+
+    def testStatefulFilter(self):
+        """
+        A TitlesAlignments made with several workers when the readsAlignments
+        has a filter that keeps state from one read to the next must be the
+        same as one made with one worker.
+        """
+        self.assertSameTitlesAlignments(
+            TitlesAlignments(self._readsAlignments(limit=2)),
+            TitlesAlignments(self._readsAlignments(limit=2), workers=2))
@@ -6,6 +6,9 @@ from six.moves import builtins
 from copy import deepcopy
 from json import dumps
 from unittest import TestCase
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 
 try:
     from unittest.mock import patch
@@ -15,11 +18,15 @@ except ImportError:
 from ..mocking import mockOpen, File
 from .sample_data import PARAMS, RECORD0, RECORD1, RECORD2, RECORD3, RECORD4
 
+from dark.alignments import Alignment, ReadIdIndex
 from dark.reads import Read, Reads, AAReadWithX
 from dark.hsp import HSP, LSP
 from dark.score import LowerIsBetterScore
 from dark.diamond.alignments import (
     DiamondReadsAlignments, ZERO_EVALUE_UPPER_RANDOM_INCREMENT)
+from dark.diamond.conversion import JSONRecordsReader
+from dark.diamond.hsp import normalizeHSP
+from dark.fasta import IndexedFasta
 from dark.titles import TitlesAlignments
 
 
@@ -207,6 +214,137 @@ class TestDiamondReadsAlignments(TestCase):
             self.assertEqual('id1', result[1].read.id)
             self.assertEqual(0, len(result[1]))
 
+    def testReadIndexRecordsOutOfOrder(self):
+        """
+        If a read index is given, records that are not in the order of the
+        reads must be matched to the correct reads.
+        """
+        mockOpener = mockOpen(
+            read_data=(dumps(PARAMS) + '\n' + dumps(RECORD1) + '\n' +
+                       dumps(RECORD0) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'G' * 70))
+            readsAlignments = DiamondReadsAlignments(
+                reads, 'file.json', databaseFilename='database.fasta',
+                readIndex=ReadIdIndex(reads))
+            result = list(readsAlignments)
+            self.assertEqual(['id1', 'id0'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual('G' * 70, result[0].read.sequence)
+            self.assertEqual('A' * 70, result[1].read.sequence)
+
+    def testReadIndexUnmatchedReadsYieldedLast(self):
+        """
+        If a read index is given, reads that have no record must be yielded
+        (with no alignments) after all records have been read.
+        """
+        mockOpener = mockOpen(
+            read_data=dumps(PARAMS) + '\n' + dumps(RECORD1) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'G' * 70))
+            reads.add(Read('id2', 'T' * 70))
+            readsAlignments = DiamondReadsAlignments(
+                reads, 'file.json', databaseFilename='database.fasta',
+                readIndex=ReadIdIndex(reads))
+            result = list(readsAlignments)
+            self.assertEqual(['id1', 'id0', 'id2'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual([2, 0, 0], [len(readAlignments)
+                                         for readAlignments in result])
+
+    def testIndexedFastaReadIndexIdWithSpace(self):
+        """
+        If an L{IndexedFasta} is given as the read index, a record must be
+        matched to a read whose id is the record's query id followed by a
+        description.
+        """
+        dirname = mkdtemp()
+        try:
+            fastaFilename = join(dirname, 'reads.fasta')
+            jsonFilename = join(dirname, 'file.json')
+            with open(fastaFilename, 'w') as fp:
+                fp.write('>id0 description\n%s\n' % ('A' * 70))
+            with open(jsonFilename, 'w') as fp:
+                fp.write(dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+            reads = Reads()
+            reads.add(Read('id0 description', 'A' * 70))
+            readIndex = IndexedFasta(fastaFilename)
+            readsAlignments = DiamondReadsAlignments(
+                reads, jsonFilename, databaseFilename='database.fasta',
+                readIndex=readIndex)
+            result = list(readsAlignments)
+            readIndex.close()
+            self.assertEqual(['id0 description'],
+                             [readAlignments.read.id
+                              for readAlignments in result])
+            self.assertEqual('A' * 70, result[0].read.sequence)
+        finally:
+            rmtree(dirname)
+
+    def testReadIndexUnknownReadId(self):
+        """
+        If a read index is given and a record is for a read that is not in
+        the index, a C{ValueError} must be raised.
+        """
+        mockOpener = mockOpen(
+            read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id1', 'A' * 70))
+            error = ("^No read with id 'id0' \\(from record number 1 of "
+                     "DIAMOND output file 'file.json'\\) could be found\\.$")
+            readsAlignments = DiamondReadsAlignments(
+                reads, 'file.json', databaseFilename='database.fasta',
+                readIndex=ReadIdIndex(reads))
+            six.assertRaisesRegex(self, ValueError, error, list,
+                                  readsAlignments)
+
+    def testChunkedNormalizationMatchesNormalizeHSP(self):
+        """
+        The HSPs of records read in chunks (whose HSPs are normalized
+        together) must have the offsets given by normalizeHSP, and reads
+        with no matches must be yielded in order with no alignments.
+        """
+        records = [RECORD0, RECORD1, RECORD2, RECORD3, RECORD4]
+        mockOpener = mockOpen(
+            read_data=(dumps(PARAMS) + '\n' +
+                       '\n'.join(dumps(record) for record in records) +
+                       '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('unmatched', 'A' * 70))
+            for i in range(1, 5):
+                reads.add(Read('id%d' % i, 'A' * 70))
+            readsAlignments = DiamondReadsAlignments(
+                reads, 'file.json', databaseFilename='database.fasta')
+            with patch.object(JSONRecordsReader, 'CHUNK_SIZE', 2):
+                result = list(readsAlignments)
+
+        expected = [
+            [normalizeHSP(hsp, 70, 'blastx')
+             for alignment in record['alignments']
+             for hsp in alignment['hsps']]
+            for record in records]
+        expected.insert(1, [])
+
+        keys = ('readStart', 'readEnd', 'readStartInSubject',
+                'readEndInSubject', 'subjectStart', 'subjectEnd')
+        self.assertEqual(['id0', 'unmatched', 'id1', 'id2', 'id3', 'id4'],
+                         [readAlignments.read.id
+                          for readAlignments in result])
+        self.assertEqual(expected, [
+            [dict((key, getattr(hsp, key)) for key in keys)
+             for alignment in readAlignments
+             for hsp in alignment.hsps]
+            for readAlignments in result])
+
     def testOneJSONInput(self):
         """
         If a JSON file contains a parameters section and one record, it must
@@ -222,6 +360,42 @@ class TestDiamondReadsAlignments(TestCase):
                 reads, 'file.json', databaseFilename='database.fasta')
             self.assertEqual(1, len(list(readsAlignments)))
 
+    def testCompact(self):
+        """
+        If compact is C{True}, the HSPs must not hold the matched sequences
+        given in the JSON, but have the btop to make them from.
+        """
+        result = File([dumps(PARAMS) + '\n', dumps(RECORD0) + '\n'])
+
+        with patch.object(builtins, 'open') as mockMethod:
+            mockMethod.return_value = result
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            readsAlignments = DiamondReadsAlignments(
+                reads, 'file.json', databaseFilename='database.fasta',
+                compact=True)
+            [readAlignments] = list(readsAlignments)
+            hsp = readAlignments[0].hsps[0]
+            self.assertIs(None, hsp._readMatchedSequence)
+            self.assertIs(None, hsp._subjectMatchedSequence)
+            self.assertEqual('', hsp.btop)
+
+    def testReaderOptions(self):
+        """
+        The reader options must include the compact and randomizeZeroEValues
+        arguments.
+        """
+        result = File([dumps(PARAMS) + '\n', dumps(RECORD0) + '\n'])
+
+        with patch.object(builtins, 'open') as mockMethod:
+            mockMethod.return_value = result
+            readsAlignments = DiamondReadsAlignments(
+                Reads(), 'file.json', databaseFilename='database.fasta',
+                compact=True, randomizeZeroEValues=False)
+            self.assertEqual(
+                {'compact': True, 'randomizeZeroEValues': False},
+                readsAlignments.readerOptions())
+
     def testTwoJSONInputs(self):
         """
         If two JSON files are passed to L{DiamondReadsAlignments} each with a
@@ -254,6 +428,38 @@ class TestDiamondReadsAlignments(TestCase):
             self.assertEqual('id0', result[0].read.id)
             self.assertEqual('id1', result[1].read.id)
 
+    def testForFiles(self):
+        """
+        The L{DiamondReadsAlignments} returned by forFiles must read just the
+        given files, find the reads by id, and not yield reads that have no
+        record.
+        """
+        files = {
+            'file1.json': [PARAMS, RECORD0],
+            'file2.json': [PARAMS, RECORD1],
+        }
+
+        def sideEffect(filename, **kwargs):
+            return File([dumps(record) + '\n' for record in files[filename]])
+
+        with patch.object(builtins, 'open') as mockMethod:
+            mockMethod.side_effect = sideEffect
+            reads = Reads()
+            reads.add(Read('id2', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            reads.add(Read('id0', 'A' * 70))
+            readsAlignments = DiamondReadsAlignments(
+                reads, ['file1.json', 'file2.json'],
+                databaseFilename='database.fasta')
+            shard = readsAlignments.forFiles(['file2.json'],
+                                             ReadIdIndex(reads))
+            self.assertEqual(['file2.json'], shard.resultFilenames())
+            self.assertEqual(['id1'],
+                             [readAlignments.read.id
+                              for readAlignments in shard])
+            self.assertEqual(['file1.json', 'file2.json'],
+                             readsAlignments.resultFilenames())
+
     def testThreeJSONInputs(self):
         """
         If three JSON files are passed to L{DiamondReadsAlignments} with names
@@ -300,39 +506,88 @@ class TestDiamondReadsAlignments(TestCase):
             self.assertEqual('id1', result[1].read.id)
             self.assertEqual('id2', result[2].read.id)
 
-    def testGetSubjectSequence(self):
+    def testSubjectTitlesInternedAcrossInputs(self):
         """
-        The getSubjectSequence function must return an AAReadWithX instance
-        with a string sequence.
+        If two JSON files have records with alignments against the same
+        subject, the alignments must have the same subject id and the same
+        (interned) subject title object.
         """
+
         class SideEffect(object):
-            def __init__(self, test):
-                self.test = test
-                self.count = 0
+            def __init__(self):
+                self.first = True
 
-            def sideEffect(self, filename, mode='r'):
-                if self.count == 0:
-                    self.test.assertEqual('file.json', filename)
-                    self.count += 1
-                    return File([dumps(PARAMS) + '\n', dumps(RECORD0) + '\n'])
-                elif self.count == 1:
-                    self.count += 1
-                    return File(['>id1 Description', 'AA\n'])
+            def sideEffect(self, _ignoredFilename, **kwargs):
+                if self.first:
+                    self.first = False
+                    return File([dumps(PARAMS) + '\n', dumps(RECORD2) + '\n'])
                 else:
-                    self.fail('Unexpected third call to open.')
-
-        sideEffect = SideEffect(self)
+                    return File([dumps(PARAMS) + '\n', dumps(RECORD3) + '\n'])
 
+        sideEffect = SideEffect()
         with patch.object(builtins, 'open') as mockMethod:
             mockMethod.side_effect = sideEffect.sideEffect
             reads = Reads()
+            reads.add(Read('id2', 'A' * 70))
+            reads.add(Read('id3', 'A' * 70))
             readsAlignments = DiamondReadsAlignments(
-                reads, 'file.json', databaseFilename='database.fasta')
+                reads, ['file1.json', 'file2.json'],
+                databaseFilename='database.fasta')
+            alignment2, alignment3 = [readAlignments[0] for readAlignments
+                                      in readsAlignments]
+            self.assertEqual(0, alignment2.subjectId)
+            self.assertEqual(0, alignment3.subjectId)
+            self.assertIs(alignment2.subjectTitle, alignment3.subjectTitle)
+            self.assertEqual(1, len(readsAlignments.subjectTitles))
+            self.assertEqual('gi|887699|gb|DQ37780 Cowpox virus 15',
+                             readsAlignments.subjectTitles.title(0))
+
+    def testGetSubjectSequence(self):
+        """
+        The getSubjectSequence function must return an AAReadWithX instance
+        with a string sequence.
+        """
+        dirname = mkdtemp()
+        try:
+            databaseFilename = join(dirname, 'database.fasta')
+            with open(databaseFilename, 'w') as fp:
+                fp.write('>id0 Other\nCC\n>id1 Description\nAA\n')
+            mockOpener = mockOpen(
+                read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+            with patch.object(builtins, 'open', mockOpener):
+                reads = Reads()
+                readsAlignments = DiamondReadsAlignments(
+                    reads, 'file.json', databaseFilename=databaseFilename)
             subject = readsAlignments.getSubjectSequence('id1 Description')
             self.assertIsInstance(subject, AAReadWithX)
             self.assertIsInstance(subject.sequence, str)
             self.assertEqual('id1 Description', subject.id)
             self.assertEqual('AA', subject.sequence)
+        finally:
+            rmtree(dirname)
+
+    def testGetSubjectSequenceDuplicateId(self):
+        """
+        The getSubjectSequence function must return the last subject with a
+        given id if the id is duplicated in the FASTA database (which can
+        then not be indexed).
+        """
+        dirname = mkdtemp()
+        try:
+            databaseFilename = join(dirname, 'database.fasta')
+            with open(databaseFilename, 'w') as fp:
+                fp.write('>id1 Description\nCC\n>id1 Description\nAA\n')
+            mockOpener = mockOpen(
+                read_data=dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n')
+            with patch.object(builtins, 'open', mockOpener):
+                reads = Reads()
+                readsAlignments = DiamondReadsAlignments(
+                    reads, 'file.json', databaseFilename=databaseFilename)
+            self.assertEqual(
+                AAReadWithX('id1 Description', 'AA'),
+                readsAlignments.getSubjectSequence('id1 Description'))
+        finally:
+            rmtree(dirname)
 
     def testHsps(self):
         """
@@ -1425,6 +1680,53 @@ class TestDiamondReadsAlignmentsFiltering(TestCase):
             self.assertEqual('id1', result[0].read.id)
             self.assertEqual('id2', result[1].read.id)
 
+    def testReadIdFilteredReadsNotConverted(self):
+        """
+        When filtering on read ids, no alignments must be made for the
+        records of reads whose ids do not match.
+        """
+        mockOpener = mockOpen(read_data=(
+            dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n' +
+            dumps(RECORD1) + '\n' + dumps(RECORD2) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            reads.add(Read('id2', 'A' * 70))
+            readsAlignments = DiamondReadsAlignments(
+                reads, 'file.json', databaseFilename='database.fasta')
+            with patch.object(
+                    JSONRecordsReader, '_dictToAlignments', autospec=True,
+                    side_effect=lambda self, record, read, normalized=None: []
+            ) as mockMethod:
+                list(readsAlignments.filter(readIdRegex='id2'))
+                self.assertEqual(
+                    ['id2'],
+                    [c[0][2].id for c in mockMethod.call_args_list])
+
+    def testTitleFilteredAlignmentsNotConverted(self):
+        """
+        When filtering on titles, no alignments must be made for unwanted
+        titles.
+        """
+        mockOpener = mockOpen(read_data=(
+            dumps(PARAMS) + '\n' + dumps(RECORD0) + '\n' +
+            dumps(RECORD1) + '\n' + dumps(RECORD2) + '\n'))
+        with patch.object(builtins, 'open', mockOpener):
+            reads = Reads()
+            reads.add(Read('id0', 'A' * 70))
+            reads.add(Read('id1', 'A' * 70))
+            reads.add(Read('id2', 'A' * 70))
+            readsAlignments = DiamondReadsAlignments(
+                reads, 'file.json', databaseFilename='database.fasta')
+            with patch('dark.diamond.conversion.Alignment',
+                       wraps=Alignment) as mockClass:
+                result = list(readsAlignments.filter(titleRegex='Mummy'))
+                self.assertEqual(
+                    ['gi|887699|gb|DQ37780 Mummypox virus 3000 B.C.'],
+                    [c[0][1] for c in mockClass.call_args_list])
+            self.assertEqual(1, len(result))
+
     def testReadIdAnchored(self):
         """
         It must be possible to filter alignments based on a regex for
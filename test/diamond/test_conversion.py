@@ -1,8 +1,11 @@
+import os
 from six.moves import builtins
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest import TestCase
 from io import BytesIO, StringIO
 import bz2file
-from bz2 import compress
+from bz2 import compress, decompress
 
 try:
     from unittest.mock import patch
@@ -12,10 +15,13 @@ except ImportError:
 from ..mocking import mockOpen
 
 from json import dumps
+from six.moves import cPickle as pickle
 
 from dark.diamond.conversion import (JSONRecordsReader,
-                                     DiamondTabularFormatReader)
-from dark.reads import Reads, AARead
+                                     DiamondTabularFormatReader, _queryBlocks,
+                                     _matchedSequences)
+from dark.reads import Reads, AARead, DNARead
+from dark.titles import TitleAlignment
 
 
 # The 15 fields expected in the DIAMOND output we parse are:
@@ -356,6 +362,21 @@ class TestDiamondTabularFormatReader(TestCase):
                     for hsp in alignment['hsps']:
                         self.assertIs(None, hsp['identicalCount'])
 
+    def testCompactInput(self):
+        """
+        If a DiamondTabularFormatReader is compact, the HSPs of its records
+        must not have the matched sequences.
+        """
+        mockOpener = mockOpen(read_data=DIAMOND_RECORDS)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = DiamondTabularFormatReader('file.txt', compact=True)
+            for record in reader.records():
+                for alignment in record['alignments']:
+                    for hsp in alignment['hsps']:
+                        self.assertNotIn('query', hsp)
+                        self.assertNotIn('sbjct', hsp)
+                        self.assertIn('btop', hsp)
+
     def testSaveAsJSON(self):
         """
         A DiamondTabularFormatReader must be able to save itself as JSON.
@@ -384,6 +405,41 @@ class TestDiamondTabularFormatReader(TestCase):
                 compress(DIAMOND_RECORDS_DUMPED.encode('UTF-8')),
                 data.getvalue())
 
+    def testSaveAsJSONWithWorkers(self):
+        """
+        A DiamondTabularFormatReader must write the same JSON when it uses
+        worker processes to convert blocks of its input.
+        """
+        mockOpener = mockOpen(read_data=DIAMOND_RECORDS)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = DiamondTabularFormatReader('file.txt')
+            reader.BLOCK_SIZE = 2
+            fp = StringIO()
+            reader.saveAsJSON(fp, workers=2)
+            self.maxDiff = None
+            self.assertEqual(DIAMOND_RECORDS_DUMPED, fp.getvalue())
+
+    def testSaveAsJSONBzip2Blocks(self):
+        """
+        A DiamondTabularFormatReader must be able to save itself as a series
+        of bzip2 streams (one for the parameters, then one per block) which
+        decompress to the uncompressed JSON.
+        """
+        mockOpener = mockOpen(read_data=DIAMOND_RECORDS)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = DiamondTabularFormatReader('file.txt')
+            reader.BLOCK_SIZE = 2
+            fp = BytesIO()
+            reader.saveAsJSON(fp, bzip2=True)
+            self.assertEqual(DIAMOND_RECORDS_DUMPED.encode('UTF-8'),
+                             decompress(fp.getvalue()))
+            # Each of the 3 queries in DIAMOND_RECORDS has at least
+            # BLOCK_SIZE lines, so each is compressed on its own.
+            self.assertEqual(
+                b''.join(compress((line + '\n').encode('UTF-8'))
+                         for line in DIAMOND_RECORDS_DUMPED.splitlines()),
+                fp.getvalue())
+
     def testSpacesMustBePreserved(self):
         """
         If there are spaces in the query title or subject titles, the spaces
@@ -397,6 +453,284 @@ class TestDiamondTabularFormatReader(TestCase):
             self.assertEqual('IN SV', acc94[0]['alignments'][0]['title'])
 
 
+class TestJSONRecordsReaderIndex(TestCase):
+    """
+    Test the indexed record access of the JSONRecordsReader class.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def testRecordsInBzip2Blocks(self):
+        """
+        Records must be found by read id and by range in a JSON file that has
+        been written as several bzip2 streams.
+        """
+        diamondFilename = os.path.join(self.dirname, 'file.diamond')
+        with open(diamondFilename, 'w') as fp:
+            fp.write(DIAMOND_RECORDS)
+        reader = DiamondTabularFormatReader(diamondFilename)
+        reader.BLOCK_SIZE = 2
+        expected = list(reader.records())
+
+        jsonFilename = os.path.join(self.dirname, 'file.json.bz2')
+        with open(jsonFilename, 'wb') as fp:
+            reader.saveAsJSON(fp, bzip2=True)
+
+        reader = JSONRecordsReader(jsonFilename)
+        self.assertEqual(expected[1], reader.recordFor('AKAV'))
+        # The first word of a read id must also be looked up.
+        self.assertEqual(expected[2], reader.recordFor('BHAV description'))
+        self.assertRaises(KeyError, reader.recordFor, 'unknown')
+        self.assertEqual(expected[1:], list(reader.recordsInRange(1, 3)))
+
+    def testReadAllBzip2Blocks(self):
+        """
+        All the records in a JSON file that has been written as several bzip2
+        streams must be read.
+        """
+        diamondFilename = os.path.join(self.dirname, 'file.diamond')
+        with open(diamondFilename, 'w') as fp:
+            fp.write(DIAMOND_RECORDS)
+        reader = DiamondTabularFormatReader(diamondFilename)
+        reader.BLOCK_SIZE = 2
+        expected = list(reader.records())
+
+        jsonFilename = os.path.join(self.dirname, 'file.json.bz2')
+        with open(jsonFilename, 'wb') as fp:
+            reader.saveAsJSON(fp, workers=2, bzip2=True)
+
+        reader = JSONRecordsReader(jsonFilename)
+        self.assertEqual(expected,
+                         [record for _, record in reader._records()])
+
+
+class TestMatchedSequences(TestCase):
+    """
+    Test the _matchedSequences function.
+    """
+    def testBlastxPositiveFrame(self):
+        """
+        The matched sequences of a blastx HSP in a positive frame must be
+        made from the translated read, with no gaps.
+        """
+        # From offset 2 the read translates to MKWFP.
+        self.assertEqual(
+            ('MKWFP', 'MRWAFP'),
+            _matchedSequences('1KR1-A2', 3, 3, 17, 'blastx',
+                              'GGATGAAATGGTTTCCC'))
+
+    def testBlastxNegativeFrame(self):
+        """
+        The matched sequences of a blastx HSP in a negative frame must be
+        made from the translated reverse complement of the read.
+        """
+        read = DNARead('id', 'GGATGAAATGGTTTCCC').reverseComplement()
+        self.assertEqual(
+            ('MKWFP', 'MRWAFP'),
+            _matchedSequences('1KR1-A2', -3, 15, 1, 'blastx', read.sequence))
+
+    def testBlastxIncompleteCodon(self):
+        """
+        Nucleotides that do not make a complete codon must be ignored.
+        """
+        self.assertEqual(
+            ('MK', 'MK'),
+            _matchedSequences('2', 1, 1, 8, 'blastx', 'ATGAAATG'))
+
+    def testBlastp(self):
+        """
+        The matched sequences of a blastp HSP must be made from the read.
+        """
+        self.assertEqual(
+            ('KWF', 'RWAF'),
+            _matchedSequences('KR1-A1', 1, 2, 4, 'blastp', 'MKWFP'))
+
+    def testSubjectGap(self):
+        """
+        Gaps in the subject must not be in the matched subject sequence.
+        """
+        self.assertEqual(
+            ('MKWFP', 'MKFP'),
+            _matchedSequences('2W-2', 1, 1, 5, 'blastp', 'MKWFP'))
+
+
+class TestCompactJSON(TestCase):
+    """
+    Test reading JSON written without matched sequences.
+    """
+    # blastx matches of two reads that translate (in frames 3 and -3) to
+    # MKWFP, as DIAMOND would give them.
+    READS = Reads([
+        DNARead('id1', 'GGATGAAATGGTTTCCC'),
+        DNARead('id2', 'GGATGAAATGGTTTCCC').reverseComplement(),
+    ])
+    DIAMOND = ''.join('\t'.join(fields) + '\n' for fields in (
+        ['id1', 'subject', '30.0', '1e-5', '3', 'MKWFP', '3', '17', 'MRWAFP',
+         '1', '6', '6', '1KR1-A2', '4', '4'],
+        ['id2', 'subject', '30.0', '1e-5', '-3', 'MKWFP', '15', '1',
+         'MRWAFP', '1', '6', '6', '1KR1-A2', '4', '4'],
+    ))
+
+    def _json(self, compact):
+        """
+        Convert our DIAMOND output to JSON.
+
+        @param compact: If C{True}, leave the matched sequences out of the
+            JSON.
+        @return: The C{str} JSON.
+        """
+        mockOpener = mockOpen(read_data=self.DIAMOND)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = DiamondTabularFormatReader('file.txt', compact=compact)
+            fp = StringIO()
+            reader.saveAsJSON(fp)
+        return fp.getvalue()
+
+    def _readsAlignments(self, json, compact=False):
+        """
+        Read the read alignments from some JSON.
+
+        @param json: The C{str} JSON.
+        @param compact: Passed to C{JSONRecordsReader}.
+        @return: A C{list} of L{dark.alignments.ReadAlignments}.
+        """
+        mockOpener = mockOpen(read_data=json)
+        with patch.object(builtins, 'open', mockOpener):
+            reader = JSONRecordsReader('file.json', compact=compact)
+            return list(reader.readAlignments(self.READS))
+
+    def _hsp(self, json, compact=False):
+        """
+        Read the HSP of the first read from some JSON.
+
+        @param json: The C{str} JSON.
+        @param compact: Passed to C{JSONRecordsReader}.
+        @return: The L{dark.hsp.HSP}.
+        """
+        return self._readsAlignments(json, compact)[0][0].hsps[0]
+
+    def testCompactJSONIsSmaller(self):
+        """
+        Compact JSON must be smaller and have no matched sequences.
+        """
+        json = self._json(False)
+        compactJSON = self._json(True)
+        self.assertLess(len(compactJSON), len(json))
+        self.assertNotIn('"sbjct"', compactJSON)
+
+    def testMatchedSequencesFromCompactJSON(self):
+        """
+        The HSPs read from compact JSON must have the btop and the matched
+        sequences must be made when they are needed.
+        """
+        hsp = self._hsp(self._json(True))
+        self.assertEqual('1KR1-A2', hsp.btop)
+        self.assertIsNot(None, hsp._matchedSequences)
+        self.assertEqual('MKWFP', hsp.readMatchedSequence)
+        self.assertEqual('MRWAFP', hsp.subjectMatchedSequence)
+
+    def testSameMatchedSequences(self):
+        """
+        The HSPs read from the same DIAMOND output with and without compact
+        JSON and with and without a compact reader must all have the same
+        matched sequences.
+        """
+        expected = [
+            (hsp.readMatchedSequence, hsp.subjectMatchedSequence)
+            for readAlignments in self._readsAlignments(self._json(False))
+            for hsp in readAlignments[0].hsps]
+        self.assertEqual([('MKWFP', 'MRWAFP')] * 2, expected)
+
+        for compactJSON, compactReader in ((True, False), (False, True),
+                                           (True, True)):
+            readsAlignments = self._readsAlignments(self._json(compactJSON),
+                                                    compactReader)
+            self.assertEqual(
+                expected,
+                [(hsp.readMatchedSequence, hsp.subjectMatchedSequence)
+                 for readAlignments in readsAlignments
+                 for hsp in readAlignments[0].hsps])
+
+    def testOffsetsUnchanged(self):
+        """
+        HSPs read from compact JSON must have the same offsets as those read
+        from JSON with matched sequences.
+        """
+        hsp = self._hsp(self._json(False))
+        compactHsp = self._hsp(self._json(True))
+        for attr in ('readStart', 'readEnd', 'readStartInSubject',
+                     'readEndInSubject', 'subjectStart', 'subjectEnd'):
+            self.assertEqual(getattr(hsp, attr), getattr(compactHsp, attr))
+
+    def testCompactReader(self):
+        """
+        A compact JSONRecordsReader must not keep the matched sequences in
+        the JSON, but make them when needed.
+        """
+        hsp = self._hsp(self._json(False), compact=True)
+        self.assertIs(None, hsp._readMatchedSequence)
+        self.assertEqual('MKWFP', hsp.readMatchedSequence)
+        self.assertEqual('MRWAFP', hsp.subjectMatchedSequence)
+
+    def testReadSequenceNotKept(self):
+        """
+        An HSP read from compact JSON must not keep the sequence of its read,
+        so it is not pickled with the HSP.
+        """
+        hsp = self._hsp(self._json(True))
+        self.assertNotIn(b'GGATGAAATGG', pickle.dumps(hsp))
+
+    def testMatchedSequencesFromReadIndex(self):
+        """
+        The matched sequences of an HSP read from compact JSON whose
+        L{TitleAlignment} looks up its read in an index must be made from
+        the read in the index, including after the L{TitleAlignment} has
+        been pickled (and given its read index again).
+        """
+        hsp = self._hsp(self._json(True))
+        readIndex = {'id1': list(self.READS)[0]}
+        titleAlignment = TitleAlignment('id1', [hsp], readIndex=readIndex)
+        unpickled = pickle.loads(pickle.dumps(titleAlignment))
+        unpickled.setReadIndex(readIndex)
+        self.assertEqual('MKWFP', unpickled.hsps[0].readMatchedSequence)
+        self.assertEqual('MRWAFP', unpickled.hsps[0].subjectMatchedSequence)
+
+
+class TestQueryBlocks(TestCase):
+    """
+    Test the _queryBlocks function.
+    """
+    def testEmpty(self):
+        """
+        No blocks must be made from no lines.
+        """
+        self.assertEqual([], list(_queryBlocks([], 3)))
+
+    def testQueriesAreNotSplit(self):
+        """
+        Blocks must have at least the block size number of lines (except the
+        last) and the lines for a query must not be split across blocks.
+        """
+        lines = ['a\t1\n', 'a\t2\n', 'b\t1\n', 'b\t2\n', 'b\t3\n',
+                 'c\t1\n']
+        self.assertEqual(
+            [['a\t1\n', 'a\t2\n', 'b\t1\n', 'b\t2\n', 'b\t3\n'],
+             ['c\t1\n']],
+            list(_queryBlocks(lines, 3)))
+
+    def testBlockSizeOne(self):
+        """
+        With a block size of one, each query must be in its own block.
+        """
+        lines = ['a\t1\n', 'a\t2\n', 'b\t1\n', 'c\t1\n']
+        self.assertEqual(
+            [['a\t1\n', 'a\t2\n'], ['b\t1\n'], ['c\t1\n']],
+            list(_queryBlocks(lines, 1)))
+
+
 _JSON_RECORDS = [
     {
         'application': 'DIAMOND',
@@ -1,6 +1,16 @@
+import sys
+import six
+from random import Random
+from six import StringIO
 from unittest import TestCase
 
-from dark.diamond.hsp import normalizeHSP
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from dark.btop import countGaps
+from dark.diamond.hsp import normalizeHSP, normalizeHSPs
 
 
 class FakeHSP(dict):
@@ -1987,3 +1997,153 @@ class TestBlastxFrameMinus1WithGaps(TestCase):
             'readStartInSubject': 0,
             'readEndInSubject': 4,
         }, normalized)
+
+
+class TestNormalizeHSPs(TestCase):
+    """
+    Tests for normalizeHSPs, which must give exactly what calling normalizeHSP
+    on each HSP gives.
+    """
+    KEYS = ('readStart', 'readEnd', 'readStartInSubject', 'readEndInSubject',
+            'subjectStart', 'subjectEnd')
+
+    def _randomHSP(self, rand, diamondTask):
+        """
+        Make a random HSP. Most are valid, but some have an offset changed
+        so they may not be.
+
+        @param rand: A C{random.Random} instance.
+        @param diamondTask: The C{str} DIAMOND task, 'blastx' or 'blastp'.
+        @return: A 2-tuple with a C{FakeHSP} and the C{int} query length.
+        """
+        matchLength = rand.randint(4, 30)
+        queryGaps = rand.randint(0, 3)
+        subjectGaps = rand.randint(0, 3)
+        unmatchedLeft = rand.randint(0, 20)
+        unmatchedRight = rand.randint(0, 20)
+        subjectStart = rand.randint(1, 100)
+        subjectEnd = subjectStart + matchLength + queryGaps - subjectGaps - 1
+        btop = '1' + '-K' * queryGaps + 'K-' * subjectGaps
+
+        if diamondTask == 'blastx':
+            frame = rand.choice((-3, -2, -1, 1, 2, 3))
+            ignored = abs(frame) - 1
+            queryLen = (ignored + 3 * (unmatchedLeft + matchLength +
+                                       unmatchedRight) + rand.randint(0, 2))
+            start = ignored + 3 * unmatchedLeft
+            end = ignored + 3 * (unmatchedLeft + matchLength)
+            if frame > 0:
+                queryStart, queryEnd = start + 1, end
+            else:
+                queryStart, queryEnd = queryLen - start, queryLen - end + 1
+        else:
+            frame = 1
+            queryLen = unmatchedLeft + matchLength + unmatchedRight
+            queryStart = unmatchedLeft + 1
+            queryEnd = unmatchedLeft + matchLength
+
+        hsp = FakeHSP(subjectStart=subjectStart, subjectEnd=subjectEnd,
+                      queryStart=queryStart, queryEnd=queryEnd, frame=frame,
+                      btop=btop)
+
+        if rand.random() < 0.2:
+            key = rand.choice(('query_start', 'query_end', 'sbjct_start',
+                               'sbjct_end'))
+            hsp[key] += rand.choice((-40, -3, -1, 1, 3, 40))
+
+        return hsp, queryLen
+
+    def _normalizeHSPs(self, hsps, queryLens, diamondTask):
+        """
+        Call normalizeHSPs on some HSPs.
+
+        @param hsps: A C{list} of C{FakeHSP} instances.
+        @param queryLens: A C{list} of C{int} query lengths.
+        @param diamondTask: The C{str} DIAMOND task, 'blastx' or 'blastp'.
+        @return: A C{list} of C{dict}s, as returned by normalizeHSP.
+        """
+        gaps = [countGaps(hsp['btop']) for hsp in hsps]
+        normalized = normalizeHSPs(
+            [hsp['query_start'] for hsp in hsps],
+            [hsp['query_end'] for hsp in hsps],
+            [hsp['sbjct_start'] for hsp in hsps],
+            [hsp['sbjct_end'] for hsp in hsps],
+            [hsp['frame'] for hsp in hsps],
+            queryLens,
+            [queryGaps for queryGaps, _ in gaps],
+            [subjectGaps for _, subjectGaps in gaps],
+            diamondTask)
+        return [dict(zip(self.KEYS, values))
+                for values in zip(*[normalized[key].tolist()
+                                    for key in self.KEYS])]
+
+    def _check(self, diamondTask, seed):
+        """
+        Check that normalizeHSPs agrees with normalizeHSP on many random HSPs.
+
+        @param diamondTask: The C{str} DIAMOND task, 'blastx' or 'blastp'.
+        @param seed: The C{int} random seed to use.
+        """
+        rand = Random(seed)
+        validHSPs, validQueryLens, expected, invalid = [], [], [], []
+
+        # Don't let normalizeHSP print debugging output for invalid HSPs.
+        with patch.object(sys, 'stderr', new=StringIO()):
+            for _ in range(500):
+                hsp, queryLen = self._randomHSP(rand, diamondTask)
+                try:
+                    normalized = normalizeHSP(hsp, queryLen, diamondTask)
+                except AssertionError:
+                    invalid.append((hsp, queryLen))
+                else:
+                    validHSPs.append(hsp)
+                    validQueryLens.append(queryLen)
+                    expected.append(normalized)
+
+        # Make sure the HSPs tested both outcomes reasonably often.
+        self.assertGreater(len(expected), 300)
+        self.assertGreater(len(invalid), 20)
+
+        self.assertEqual(expected, self._normalizeHSPs(
+            validHSPs, validQueryLens, diamondTask))
+
+        for hsp, queryLen in invalid:
+            self.assertRaises(AssertionError, self._normalizeHSPs,
+                              validHSPs[:5] + [hsp], validQueryLens[:5] +
+                              [queryLen], diamondTask)
+
+    def testBlastxAgreesWithNormalizeHSP(self):
+        """
+        normalizeHSPs must give the same results as normalizeHSP for blastx
+        HSPs.
+        """
+        self._check('blastx', 0)
+        self._check('blastx', 1)
+
+    def testBlastpAgreesWithNormalizeHSP(self):
+        """
+        normalizeHSPs must give the same results as normalizeHSP for blastp
+        HSPs.
+        """
+        self._check('blastp', 0)
+        self._check('blastp', 1)
+
+    def testEmpty(self):
+        """
+        normalizeHSPs must return empty arrays when given no HSPs.
+        """
+        normalized = normalizeHSPs([], [], [], [], [], [], [], [], 'blastx')
+        self.assertEqual(set(self.KEYS), set(normalized))
+        for key in self.KEYS:
+            self.assertEqual([], normalized[key].tolist())
+
+    def testErrorMessageIdentifiesHSP(self):
+        """
+        The error raised by normalizeHSPs must give the index of the first
+        HSP that fails a sanity check, and the check it failed.
+        """
+        error = ('^HSP 1: subjectStart >= subjectEnd$')
+        six.assertRaisesRegex(
+            self, AssertionError, error, normalizeHSPs,
+            [1, 1, 1], [3, 3, 3], [1, 5, 5], [3, 4, 4], [1, 1, 1],
+            [3, 3, 3], [0, 0, 0], [0, 0, 0], 'blastp')
@@ -1,12 +1,18 @@
 import six
 from unittest import TestCase
 
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
 from dark.reads import Read, Reads
-from dark.score import HigherIsBetterScore
+from dark.score import HigherIsBetterScore, LowerIsBetterScore
 from dark.hsp import HSP, LSP
 from dark.alignments import (
-    Alignment, bestAlignment, ReadAlignments, ReadsAlignmentsParams,
-    ReadsAlignments)
+    Alignment, bestAlignment, lookupRead, ReadAlignments, ReadIdIndex,
+    ReadsAlignmentsParams, ReadsAlignments, ReadsAlignmentsFilter,
+    SubjectTitles)
 
 
 class TestAlignment(TestCase):
@@ -22,6 +28,20 @@ class TestAlignment(TestCase):
         self.assertEqual('title', alignment.subjectTitle)
         self.assertEqual(45, alignment.subjectLength)
 
+    def testNoSubjectIdByDefault(self):
+        """
+        An alignment must have a C{None} subject id if none is given.
+        """
+        alignment = Alignment(45, 'title')
+        self.assertIsNone(alignment.subjectId)
+
+    def testSubjectId(self):
+        """
+        An alignment must store the subject id it is given.
+        """
+        alignment = Alignment(45, 'title', 3)
+        self.assertEqual(3, alignment.subjectId)
+
     def testNoHspsWhenCreated(self):
         """
         An alignment must have no HSPs when it is created.
@@ -38,6 +58,87 @@ class TestAlignment(TestCase):
         self.assertEqual(HSP(3), alignment.hsps[0])
 
 
+class TestSubjectTitles(TestCase):
+    """
+    Tests for the dark.alignment.SubjectTitles class
+    """
+
+    def testEmpty(self):
+        """
+        A new SubjectTitles instance must be empty.
+        """
+        self.assertEqual(0, len(SubjectTitles()))
+
+    def testAdd(self):
+        """
+        Adding a title must return the title and an id of zero for the first
+        title.
+        """
+        self.assertEqual(('title', 0), SubjectTitles().add('title'))
+
+    def testAddTwoTitles(self):
+        """
+        Adding two different titles must give them different ids.
+        """
+        subjectTitles = SubjectTitles()
+        self.assertEqual(('title1', 0), subjectTitles.add('title1'))
+        self.assertEqual(('title2', 1), subjectTitles.add('title2'))
+        self.assertEqual(2, len(subjectTitles))
+
+    def testAddUnicodeTitle(self):
+        """
+        Adding a unicode title (as read from JSON on Python 2) must work.
+        """
+        subjectTitles = SubjectTitles()
+        self.assertEqual((u'title', 0), subjectTitles.add(u'title'))
+        self.assertEqual(0, subjectTitles.id(u'title'))
+
+    def testAddSameTitleTwice(self):
+        """
+        Adding an equal title twice must return the first title object and
+        the same id.
+        """
+        subjectTitles = SubjectTitles()
+        title1 = ''.join(['tit', 'le'])
+        title2 = ''.join(['ti', 'tle'])
+        self.assertIsNot(title1, title2)
+        title, subjectId1 = subjectTitles.add(title1)
+        interned, subjectId2 = subjectTitles.add(title2)
+        self.assertIs(title, interned)
+        self.assertEqual(subjectId1, subjectId2)
+        self.assertEqual(1, len(subjectTitles))
+
+    def testId(self):
+        """
+        The id method must return the id of a title.
+        """
+        subjectTitles = SubjectTitles()
+        subjectTitles.add('title1')
+        subjectTitles.add('title2')
+        self.assertEqual(1, subjectTitles.id('title2'))
+
+    def testIdUnknownTitle(self):
+        """
+        The id method must raise KeyError if the title is not known.
+        """
+        self.assertRaises(KeyError, SubjectTitles().id, 'title')
+
+    def testTitle(self):
+        """
+        The title method must return the title with a given id.
+        """
+        subjectTitles = SubjectTitles()
+        subjectTitles.add('title1')
+        subjectTitles.add('title2')
+        self.assertEqual('title2', subjectTitles.title(1))
+
+    def testTitleUnknownId(self):
+        """
+        The title method must raise IndexError if the id is not known.
+        """
+        self.assertRaises(IndexError, SubjectTitles().title, 0)
+
+
 class TestReadAlignments(TestCase):
     """
     Tests for the dark.alignment.ReadAlignments class
@@ -158,6 +259,84 @@ class TestBestAlignmentLSP(TestCase):
         self.assertEqual(44, best.subjectLength)
 
 
+class TestReadIdIndex(TestCase):
+    """
+    Test the ReadIdIndex class.
+    """
+    def testEmpty(self):
+        """
+        An index made from no reads must have length zero.
+        """
+        self.assertEqual(0, len(ReadIdIndex([])))
+
+    def testLength(self):
+        """
+        An index must have the length of the number of reads it was given.
+        """
+        index = ReadIdIndex([Read('id1', 'AC'), Read('id2', 'GT')])
+        self.assertEqual(2, len(index))
+
+    def testExactId(self):
+        """
+        A read must be found by its exact id.
+        """
+        read = Read('id1 description', 'AC')
+        index = ReadIdIndex([Read('id0', 'GT'), read])
+        self.assertIs(read, index['id1 description'])
+
+    def testFirstWordOfReadId(self):
+        """
+        A read must be found if the query id is the first word of its id.
+        """
+        read = Read('id1 description', 'AC')
+        index = ReadIdIndex([read])
+        self.assertIs(read, index['id1'])
+
+    def testFirstWordOfQueryId(self):
+        """
+        A read must be found if its id is the first word of the query id.
+        """
+        read = Read('id1', 'AC')
+        index = ReadIdIndex([read])
+        self.assertIs(read, index['id1 description'])
+
+    def testUnknownId(self):
+        """
+        Looking up an unknown id must raise a KeyError.
+        """
+        index = ReadIdIndex([Read('id1', 'AC')])
+        six.assertRaisesRegex(self, KeyError, "'id2'", index.__getitem__,
+                              'id2')
+
+
+class TestLookupRead(TestCase):
+    """
+    Test the lookupRead function.
+    """
+    def testExactId(self):
+        """
+        A read must be found by its exact id.
+        """
+        read = Read('id1 description', 'AC')
+        self.assertIs(read, lookupRead({'id1 description': read},
+                                       'id1 description'))
+
+    def testFirstWordOfQueryId(self):
+        """
+        A read must be found in an index that does not look up first words
+        if its id is the first word of the query id.
+        """
+        read = Read('id1', 'AC')
+        self.assertIs(read, lookupRead({'id1': read}, 'id1 description'))
+
+    def testUnknownId(self):
+        """
+        Looking up an unknown id must raise a KeyError.
+        """
+        self.assertRaises(KeyError, lookupRead, {'id1': Read('id1', 'AC')},
+                          'id2 description')
+
+
 class TestReadsAlignmentsParams(TestCase):
     """
     Test the L{dark.alignments.ReadsAlignmentsParams} class.
@@ -200,6 +379,17 @@ class TestReadsAlignments(TestCase):
         self.assertEqual('app name', readsAlignments.params['application'])
         self.assertIs(params, readsAlignments.params)
         self.assertIs(HigherIsBetterScore, readsAlignments.scoreClass)
+        self.assertEqual(0, len(readsAlignments.subjectTitles))
+
+    def testSubjectTitles(self):
+        """
+        A ReadsAlignments instance must use the subject titles instance it is
+        given.
+        """
+        subjectTitles = SubjectTitles()
+        readsAlignments = ReadsAlignments(Reads(), {},
+                                          subjectTitles=subjectTitles)
+        self.assertIs(subjectTitles, readsAlignments.subjectTitles)
 
     def testNotIterable(self):
         """
@@ -219,3 +409,276 @@ class TestReadsAlignments(TestCase):
         error = 'getSubjectSequence must be implemented by a subclass'
         six.assertRaisesRegex(self, NotImplementedError, error,
                               readsAlignments.getSubjectSequence, 'title')
+
+    def testNoResultFilenames(self):
+        """
+        A ReadsAlignments instance must have no result file names.
+        """
+        readsAlignments = ReadsAlignments(Reads(), 'applicationName', None)
+        self.assertEqual([], readsAlignments.resultFilenames())
+
+    def testForFiles(self):
+        """
+        A ReadsAlignments instance will not implement forFiles. Subclasses
+        are expected to implement it.
+        """
+        readsAlignments = ReadsAlignments(Reads(), 'applicationName', None)
+        error = 'forFiles must be implemented by a subclass'
+        six.assertRaisesRegex(self, NotImplementedError, error,
+                              readsAlignments.forFiles, ['file.json'], {})
+
+    def testReadIdIndex(self):
+        """
+        The readIdIndex method must return an index of the reads.
+        """
+        reads = Reads()
+        reads.add(Read('id0 description', 'ACGT'))
+        readsAlignments = ReadsAlignments(reads, 'applicationName', None)
+        readIndex = readsAlignments.readIdIndex()
+        self.assertEqual(1, len(readIndex))
+        self.assertEqual('id0 description', readIndex['id0'].id)
+
+    def testNoRecordFilterByDefault(self):
+        """
+        A ReadsAlignments instance with no filters must not have a record
+        filter.
+        """
+        readsAlignments = ReadsAlignments(Reads(), 'applicationName', None)
+        self.assertIsNone(readsAlignments.recordFilter())
+
+    def testRecordFilterFromFirstFilterOnly(self):
+        """
+        The record filter of a ReadsAlignments instance must come from the
+        first filter added to it.
+        """
+        readsAlignments = ReadsAlignments(Reads(), 'applicationName', None)
+        readsAlignments.filter(readIdRegex='^a')
+        recordFilter = readsAlignments.recordFilter()
+        readsAlignments.filter(readIdRegex='^b')
+        self.assertIs(recordFilter.__self__,
+                      readsAlignments.recordFilter().__self__)
+        record = {'query': 'a', 'alignments': []}
+        self.assertIs(record, recordFilter('a', record, HigherIsBetterScore))
+
+    def testFilterKwargs(self):
+        """
+        A ReadsAlignments instance must record the keyword arguments of its
+        filters, in order.
+        """
+        readsAlignments = ReadsAlignments(Reads(), 'applicationName', None)
+        self.assertEqual([], readsAlignments.filterKwargs)
+        readsAlignments.filter(readIdRegex='^a')
+        readsAlignments.filter(minSequenceLen=10, maxSequenceLen=20)
+        self.assertEqual(
+            [{'readIdRegex': '^a'},
+             {'minSequenceLen': 10, 'maxSequenceLen': 20}],
+            readsAlignments.filterKwargs)
+
+
+def _record(*alignments):
+    """
+    Make a JSON-like record dict.
+
+    @param alignments: (title, length, scores) 3-tuples, where scores is a
+        C{list} of numeric HSP scores.
+    @return: A C{dict} in the form made by our JSON conversion code.
+    """
+    return {
+        'query': 'read',
+        'alignments': [
+            {
+                'title': title,
+                'length': length,
+                'hsps': [{'bits': score, 'expect': score}
+                         for score in scores],
+            } for (title, length, scores) in alignments]
+    }
+
+
+class TestReadsAlignmentsFilterTaxonomy(TestCase):
+    """
+    Test the choice of taxonomy database made by L{ReadsAlignmentsFilter}.
+    """
+
+    def testNoTaxonomy(self):
+        """
+        If no taxonomy is given, no lineage fetcher must be made.
+        """
+        self.assertIsNone(ReadsAlignmentsFilter().lineageFetcher)
+
+    def testMySQLByDefault(self):
+        """
+        If a taxonomy but no taxonomy database is given, the MySQL lineage
+        fetcher must be used.
+        """
+        with patch('dark.alignments.LineageFetcher') as mockClass:
+            readsAlignmentsFilter = ReadsAlignmentsFilter(taxonomy='Vira')
+            mockClass.assert_called_once_with()
+            self.assertIs(mockClass.return_value,
+                          readsAlignmentsFilter.lineageFetcher)
+
+    def testLocalDatabase(self):
+        """
+        If a taxonomy database is given, a local lineage fetcher must be made
+        for it.
+        """
+        with patch('dark.alignments.LocalLineageFetcher') as mockClass:
+            readsAlignmentsFilter = ReadsAlignmentsFilter(
+                taxonomy='Vira', taxonomyDatabase='taxonomy.db')
+            mockClass.assert_called_once_with('taxonomy.db')
+            self.assertIs(mockClass.return_value,
+                          readsAlignmentsFilter.lineageFetcher)
+
+
+class TestReadsAlignmentsFilterFilterRecord(TestCase):
+    """
+    Test the L{dark.alignments.ReadsAlignmentsFilter.filterRecord} method.
+    """
+
+    def testNoFiltering(self):
+        """
+        If there is no filtering to do, the record must be returned as is.
+        """
+        record = _record(('title1', 100, [10]))
+        filterRecord = ReadsAlignmentsFilter().filterRecord
+        self.assertIs(record, filterRecord('read', record,
+                                           HigherIsBetterScore))
+
+    def testLimitReached(self):
+        """
+        If the filter limit has been reached, the record must be rejected.
+        """
+        readsAlignmentsFilter = ReadsAlignmentsFilter(limit=0)
+        record = _record(('title1', 100, [10]))
+        self.assertFalse(readsAlignmentsFilter.filterRecord(
+            'read', record, HigherIsBetterScore))
+
+    def testMaxAlignmentsPerRead(self):
+        """
+        A record with too many alignments must be rejected.
+        """
+        filterRecord = ReadsAlignmentsFilter(
+            maxAlignmentsPerRead=1).filterRecord
+        record = _record(('title1', 100, [10]), ('title2', 100, [10]))
+        self.assertFalse(filterRecord('read', record, HigherIsBetterScore))
+
+    def testReadIdRegex(self):
+        """
+        A record for a read whose id does not match the read id regex must
+        be rejected.
+        """
+        filterRecord = ReadsAlignmentsFilter(readIdRegex='^x').filterRecord
+        record = _record(('title1', 100, [10]))
+        self.assertFalse(filterRecord('read', record, HigherIsBetterScore))
+        self.assertIs(record, filterRecord('xread', record,
+                                           HigherIsBetterScore))
+
+    def testTitleRegex(self):
+        """
+        Alignments whose titles do not match the title regex must be removed,
+        without changing the passed record.
+        """
+        filterRecord = ReadsAlignmentsFilter(titleRegex='pox').filterRecord
+        record = _record(('cowpox', 100, [10]), ('measles', 100, [10]))
+        result = filterRecord('read', record, HigherIsBetterScore)
+        self.assertEqual(['cowpox'],
+                         [a['title'] for a in result['alignments']])
+        self.assertEqual(2, len(record['alignments']))
+
+    def testTitleRegexRejectsAll(self):
+        """
+        If no alignment title matches the title regex, the record must be
+        rejected.
+        """
+        filterRecord = ReadsAlignmentsFilter(titleRegex='pox').filterRecord
+        record = _record(('measles', 100, [10]))
+        self.assertFalse(filterRecord('read', record, HigherIsBetterScore))
+
+    def testTruncateTitlesAfterMatchesFilter(self):
+        """
+        When titles are truncated, filterRecord followed by filter must keep
+        the same alignments as filter alone.
+        """
+        record = _record(('virus 1 pox', 100, [10]),
+                         ('virus 2 pox', 100, [10]),
+                         ('other', 100, [10]))
+
+        def alignments(record):
+            readAlignments = ReadAlignments(Read('read', 'AAA'))
+            for alignmentDict in record['alignments']:
+                alignment = Alignment(alignmentDict['length'],
+                                      alignmentDict['title'])
+                for hspDict in alignmentDict['hsps']:
+                    alignment.addHsp(HSP(hspDict['bits']))
+                readAlignments.append(alignment)
+            return readAlignments
+
+        expected = ReadsAlignmentsFilter(
+            truncateTitlesAfter='virus').filter(alignments(record))
+
+        readsAlignmentsFilter = ReadsAlignmentsFilter(
+            truncateTitlesAfter='virus')
+        filtered = readsAlignmentsFilter.filterRecord(
+            'read', record, HigherIsBetterScore)
+        result = readsAlignmentsFilter.filter(alignments(filtered))
+
+        self.assertEqual([a.subjectTitle for a in expected],
+                         [a.subjectTitle for a in result])
+        self.assertEqual(['virus 1 pox', 'other'],
+                         [a.subjectTitle for a in result])
+
+    def testSequenceLength(self):
+        """
+        Alignments against subjects of unwanted length must be removed.
+        """
+        filterRecord = ReadsAlignmentsFilter(
+            minSequenceLen=50, maxSequenceLen=150).filterRecord
+        record = _record(('title1', 10, [10]), ('title2', 100, [10]),
+                         ('title3', 200, [10]))
+        result = filterRecord('read', record, HigherIsBetterScore)
+        self.assertEqual(['title2'],
+                         [a['title'] for a in result['alignments']])
+
+    def testScoreCutoffBitScores(self):
+        """
+        HSPs whose bit scores are not better than the cutoff must be removed,
+        as must alignments with no remaining HSPs.
+        """
+        filterRecord = ReadsAlignmentsFilter(scoreCutoff=20).filterRecord
+        record = _record(('title1', 100, [30, 10]), ('title2', 100, [10]))
+        result = filterRecord('read', record, HigherIsBetterScore)
+        self.assertEqual(1, len(result['alignments']))
+        self.assertEqual([30], [hsp['bits'] for hsp in
+                                result['alignments'][0]['hsps']])
+        self.assertEqual(2, len(record['alignments'][0]['hsps']))
+
+    def testScoreCutoffEValues(self):
+        """
+        HSPs whose e-values are not better than the cutoff must be removed.
+        """
+        filterRecord = ReadsAlignmentsFilter(scoreCutoff=1e-5).filterRecord
+        record = _record(('title1', 100, [1e-10, 1e-2]))
+        result = filterRecord('read', record, LowerIsBetterScore)
+        self.assertEqual([1e-10], [hsp['expect'] for hsp in
+                                   result['alignments'][0]['hsps']])
+
+    def testScoreCutoffAfterMaxHspsPerHit(self):
+        """
+        The score cutoff must only be applied to the HSPs that remain after
+        maxHspsPerHit is taken into account.
+        """
+        filterRecord = ReadsAlignmentsFilter(
+            scoreCutoff=20, maxHspsPerHit=1).filterRecord
+        record = _record(('title1', 100, [10, 30]))
+        self.assertFalse(filterRecord('read', record, HigherIsBetterScore))
+
+    def testScoreCutoffNotAppliedWithOneAlignmentPerRead(self):
+        """
+        The score cutoff must not be applied when only the best alignment is
+        wanted, because that alignment is chosen before HSP filtering.
+        """
+        filterRecord = ReadsAlignmentsFilter(
+            scoreCutoff=20, oneAlignmentPerRead=True).filterRecord
+        record = _record(('title1', 100, [10]), ('title2', 100, [30]))
+        self.assertIs(record, filterRecord('read', record,
+                                           HigherIsBetterScore))
@@ -1,7 +1,11 @@
 from six import assertRaisesRegex
 from unittest import TestCase
 
-from dark.btop import countGaps, parseBtop
+import numpy as np
+
+from dark.btop import (
+    alignmentFromBtop, btopRuns, btopStats, btopToCigar, cigarToBtop,
+    countGaps, parseBtop)
 
 
 class TestParseBtop(TestCase):
@@ -162,3 +166,382 @@ class TestCountGaps(TestCase):
         expected result.
         """
         self.assertEqual((3, 2), countGaps('-GG-34-T-T39F-'))
+
+    def testTwoNumbersWithOneLetterBetween(self):
+        """
+        An argument that is a number, a single letter, and another number must
+        result in a ValueError that gives the offset of the letter.
+        """
+        error = ("^btop string '36F77' has a query letter 'F' at offset 2 "
+                 "with no corresponding subject letter$")
+        assertRaisesRegex(self, ValueError, error, countGaps, '36F77')
+
+    def testConsecutiveIdenticalAfterPairs(self):
+        """
+        An argument that has two consecutive identical (non-gap) characters
+        after other pairs must result in a ValueError that gives the offset
+        of the identical characters.
+        """
+        error = ("^btop string '4AGK-CC3' has two consecutive identical 'C' "
+                 "letters at offset 5$")
+        assertRaisesRegex(self, ValueError, error, countGaps, '4AGK-CC3')
+
+    def testConsecutiveGapsInOddRun(self):
+        """
+        If a run of letters has an odd length and also two consecutive gaps,
+        the error reported must be the first one in the string.
+        """
+        error = "^btop string '3---' has two consecutive gaps at offset 1$"
+        assertRaisesRegex(self, ValueError, error, countGaps, '3---')
+
+
+class TestAlignmentFromBtop(TestCase):
+    """
+    Tests for the alignmentFromBtop function.
+    """
+    def testNoSequence(self):
+        """
+        If neither a query nor a subject is given, a ValueError must be
+        raised.
+        """
+        error = '^Exactly one of query and subject must be given\\.$'
+        assertRaisesRegex(self, ValueError, error, alignmentFromBtop, '3')
+
+    def testTwoSequences(self):
+        """
+        If both a query and a subject are given, a ValueError must be raised.
+        """
+        error = '^Exactly one of query and subject must be given\\.$'
+        assertRaisesRegex(self, ValueError, error, alignmentFromBtop, '3',
+                          query='ACG', subject='ACG')
+
+    def testInvalidBtop(self):
+        """
+        If the btop string is not valid, a ValueError must be raised.
+        """
+        error = ("^btop string 'F36' has a query letter 'F' at offset 0 with "
+                 "no corresponding subject letter$")
+        assertRaisesRegex(self, ValueError, error, alignmentFromBtop, 'F36',
+                          query='ACG')
+
+    def testEmpty(self):
+        """
+        An empty btop string must give empty sequences.
+        """
+        self.assertEqual(('', ''), alignmentFromBtop('', query=''))
+
+    def testNumberOnly(self):
+        """
+        A btop string that is a number must give two copies of the sequence.
+        """
+        self.assertEqual(('ACGT', 'ACGT'),
+                         alignmentFromBtop('4', query='ACGT'))
+
+    def testMismatchFromQuery(self):
+        """
+        A btop string with a mismatch must give the expected result when the
+        query is given.
+        """
+        self.assertEqual(('ACGT', 'AGGT'),
+                         alignmentFromBtop('1CG2', query='ACGT'))
+
+    def testMismatchFromSubject(self):
+        """
+        A btop string with a mismatch must give the expected result when the
+        subject is given.
+        """
+        self.assertEqual(('ACGT', 'AGGT'),
+                         alignmentFromBtop('1CG2', subject='AGGT'))
+
+    def testGapsFromQuery(self):
+        """
+        A btop string with query and subject gaps must give the expected
+        result when the query is given.
+        """
+        self.assertEqual(('AC-GTTA', 'A-TGT-C'),
+                         alignmentFromBtop('1C--T2T-AC', query='ACGTTA'))
+
+    def testGapsFromSubject(self):
+        """
+        A btop string with query and subject gaps must give the expected
+        result when the subject is given.
+        """
+        self.assertEqual(('AC-GTTA', 'A-TGT-C'),
+                         alignmentFromBtop('1C--T2T-AC', subject='ATGTC'))
+
+    def testRoundTrip(self):
+        """
+        The sequences made from a btop string must have the gaps that
+        countGaps finds in it.
+        """
+        btop = '-GG-34-T-T39F-'
+        query, subject = alignmentFromBtop(btop, query='G' + 'A' * 74 + 'F')
+        self.assertEqual(countGaps(btop),
+                         (query.count('-'), subject.count('-')))
+        self.assertEqual(len(query), len(subject))
+
+
+class TestBtopRuns(TestCase):
+    """
+    Tests for the btopRuns function.
+    """
+    def assertRuns(self, kinds, lengths, letters, s):
+        """
+        Check the result of btopRuns.
+
+        @param kinds: The expected C{list} of C{str} run kinds.
+        @param lengths: The expected C{list} of C{int} run lengths.
+        @param letters: The expected C{str} letters of the runs that are not
+            matches.
+        @param s: The C{str} btop sequence to pass to btopRuns.
+        """
+        resultKinds, resultLengths, resultLetters = btopRuns(s)
+        self.assertEqual(kinds, resultKinds.tolist())
+        self.assertEqual(lengths, resultLengths.tolist())
+        self.assertEqual(len(resultKinds), len(resultLengths))
+        self.assertEqual(letters, resultLetters)
+
+    def testEmpty(self):
+        """
+        An empty argument must result in empty arrays and no letters.
+        """
+        self.assertRuns([], [], '', '')
+
+    def testOneNumber(self):
+        """
+        An argument that is just one number must give one run of matches.
+        """
+        self.assertRuns(['='], [88], '', '88')
+
+    def testZero(self):
+        """
+        A match count of zero must not give a run.
+        """
+        self.assertRuns([], [], '', '0')
+
+    def testLettersOnly(self):
+        """
+        An argument that is just mismatched letters must give one run.
+        """
+        self.assertRuns(['X'], [2], 'AGCT', 'AGCT')
+
+    def testMixed(self):
+        """
+        An argument with numbers and letters must give the expected result.
+        """
+        self.assertRuns(['D', '=', 'I', 'D', 'I'], [1, 34, 1, 1, 1],
+                        '-GG--TF-', '-G34G--T0F-')
+
+    def testRunsMerged(self):
+        """
+        Consecutive pairs of the same kind, and pairs of the same kind
+        separated by a zero match count, must be one run.
+        """
+        self.assertRuns(['=', 'I', '=', 'X', '='], [2, 3, 1, 2, 4],
+                        'A-C-G-ACGT', '2A-0C-G-1ACGT0004')
+
+    def testArrayTypes(self):
+        """
+        The kinds and lengths must be numpy arrays of strings and ints.
+        """
+        kinds, lengths, _ = btopRuns('3AC-G')
+        self.assertIsInstance(kinds, np.ndarray)
+        self.assertIsInstance(lengths, np.ndarray)
+        self.assertTrue(np.issubdtype(lengths.dtype, np.integer))
+
+    def testInvalid(self):
+        """
+        An invalid argument must result in the same ValueError given by
+        parseBtop.
+        """
+        error = ("^btop string '36AA' has two consecutive identical 'A' "
+                 "letters at offset 2$")
+        assertRaisesRegex(self, ValueError, error, btopRuns, '36AA')
+
+
+class TestBtopStats(TestCase):
+    """
+    Tests for the btopStats function.
+    """
+    def testNoBtops(self):
+        """
+        If no btop strings are given, the statistics must be empty.
+        """
+        stats = btopStats([])
+        self.assertEqual(
+            ['alignmentLength', 'identicalCount', 'identity', 'mismatchCount',
+             'queryGaps', 'subjectGaps'], sorted(stats))
+        for values in stats.values():
+            self.assertEqual(0, len(values))
+
+    def testStats(self):
+        """
+        The statistics for several btop strings must be as expected.
+        """
+        stats = btopStats(['', '5', 'AG3', '-GG-34-T-T39F-'])
+        self.assertEqual([0, 5, 4, 78], stats['alignmentLength'].tolist())
+        self.assertEqual([0, 5, 3, 73], stats['identicalCount'].tolist())
+        self.assertEqual([0.0, 1.0, 0.75, 73.0 / 78.0],
+                         stats['identity'].tolist())
+        self.assertEqual([0, 0, 1, 0], stats['mismatchCount'].tolist())
+        self.assertEqual([0, 0, 0, 3], stats['queryGaps'].tolist())
+        self.assertEqual([0, 0, 0, 2], stats['subjectGaps'].tolist())
+
+    def testGapsMatchCountGaps(self):
+        """
+        The gap counts must be the same as those given by countGaps.
+        """
+        btops = ['-GG-34-T-T39F-', 'FGAC', 'G--G', '88']
+        stats = btopStats(btops)
+        self.assertEqual(
+            [countGaps(btop) for btop in btops],
+            list(zip(stats['queryGaps'].tolist(),
+                     stats['subjectGaps'].tolist())))
+
+    def testInvalid(self):
+        """
+        If a btop string is invalid, a ValueError must be raised.
+        """
+        error = "^btop string '36--' has two consecutive gaps at offset 2$"
+        assertRaisesRegex(self, ValueError, error, btopStats, ['4', '36--'])
+
+
+class TestBtopToCigar(TestCase):
+    """
+    Tests for the btopToCigar function.
+    """
+    def testEmpty(self):
+        """
+        An empty btop string must give an empty CIGAR string.
+        """
+        self.assertEqual('', btopToCigar(''))
+
+    def testMatchesOnly(self):
+        """
+        A btop string that is a number must give a CIGAR string of matches.
+        """
+        self.assertEqual('20=', btopToCigar('20'))
+
+    def testMatchesOnlyConcise(self):
+        """
+        A btop string that is a number must give a CIGAR string of matches
+        when a concise CIGAR string is asked for.
+        """
+        self.assertEqual('20M', btopToCigar('20', concise=True))
+
+    def testZeroMatches(self):
+        """
+        A zero match count must not appear in the CIGAR string.
+        """
+        self.assertEqual('2X', btopToCigar('AG0TC'))
+
+    def testGaps(self):
+        """
+        A gap in the subject must give an insertion and a gap in the query
+        must give a deletion.
+        """
+        self.assertEqual('1D1I34=2D39=1I', btopToCigar('-GG-34-T-T39F-'))
+
+    def testConcise(self):
+        """
+        Matches and mismatches must be merged when a concise CIGAR string is
+        asked for.
+        """
+        self.assertEqual('3M1D2M', btopToCigar('1KR1-A2', concise=True))
+
+    def testInvalid(self):
+        """
+        An invalid btop string must result in a ValueError.
+        """
+        error = ("^btop string 'ABC' has a trailing query letter 'C' with no "
+                 "corresponding subject letter$")
+        assertRaisesRegex(self, ValueError, error, btopToCigar, 'ABC')
+
+
+class TestCigarToBtop(TestCase):
+    """
+    Tests for the cigarToBtop function.
+    """
+    def testEmpty(self):
+        """
+        An empty CIGAR string must give an empty btop string.
+        """
+        self.assertEqual('', cigarToBtop('', '', ''))
+
+    def testInvalid(self):
+        """
+        An invalid CIGAR string must result in a ValueError.
+        """
+        error = "^Invalid CIGAR string '3M2'\\.$"
+        assertRaisesRegex(self, ValueError, error, cigarToBtop, '3M2', 'ACG',
+                          'ACG')
+
+    def testUnsupportedOperation(self):
+        """
+        A CIGAR string with an operation that cannot be converted must result
+        in a ValueError.
+        """
+        error = ("^CIGAR string '1M2N1M' has an operation \\('N'\\) that "
+                 "cannot be converted to btop\\.$")
+        assertRaisesRegex(self, ValueError, error, cigarToBtop, '1M2N1M',
+                          'AC', 'AGGC')
+
+    def testQueryTooShort(self):
+        """
+        A CIGAR string that needs more query than is given must result in a
+        ValueError.
+        """
+        error = "^CIGAR string '4M' is longer than the query\\.$"
+        assertRaisesRegex(self, ValueError, error, cigarToBtop, '4M', 'ACG',
+                          'ACGT')
+
+    def testSubjectTooShort(self):
+        """
+        A CIGAR string that needs more subject than is given must result in a
+        ValueError.
+        """
+        error = "^CIGAR string '2M2D' is longer than the subject\\.$"
+        assertRaisesRegex(self, ValueError, error, cigarToBtop, '2M2D', 'AC',
+                          'ACG')
+
+    def testMismatchThatMatches(self):
+        """
+        A CIGAR mismatch where the query and subject are the same must result
+        in a ValueError.
+        """
+        error = ("^CIGAR string '1X' has a mismatch where the query and "
+                 "subject both have 'A'\\.$")
+        assertRaisesRegex(self, ValueError, error, cigarToBtop, '1X', 'A',
+                          'A')
+
+    def testMatchAndMismatch(self):
+        """
+        'M' operations must be split into matches and mismatches.
+        """
+        self.assertEqual('1KR1', cigarToBtop('3M', 'MKW', 'MRW'))
+
+    def testGaps(self):
+        """
+        Insertions and deletions must give gaps in the subject and the query.
+        """
+        self.assertEqual('1KR1-A2', cigarToBtop('1=1X1=1D2=', 'MKWFP',
+                                                'MRWAFP'))
+
+    def testClipping(self):
+        """
+        Soft clipped query letters must be skipped, and hard clipping must be
+        ignored.
+        """
+        self.assertEqual('1KR1F-1',
+                         cigarToBtop('3H2S3M1I1M', 'GGMKWFP', 'MRWP'))
+
+    def testRoundTrip(self):
+        """
+        Converting a btop string to CIGAR and back must give the original
+        btop string.
+        """
+        btop = '-GG-34-T-T39F-'
+        query, subject = alignmentFromBtop(btop, query='G' + 'A' * 74 + 'F')
+        self.assertEqual(
+            btop, cigarToBtop(btopToCigar(btop), query.replace('-', ''),
+                              subject.replace('-', '')))
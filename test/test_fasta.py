@@ -1,6 +1,12 @@
 from six.moves import builtins
+from six.moves import cPickle as pickle
 from io import BytesIO
+import bz2
+import gzip
 import os
+import sqlite3
+from shutil import rmtree
+from tempfile import mkdtemp
 
 from unittest import TestCase
 from Bio import SeqIO, bgzf
@@ -15,7 +21,8 @@ from .mocking import mockOpen, File
 
 from dark.reads import Read, AARead, DNARead, RNARead, Reads
 from dark.fasta import (dedupFasta, dePrefixAndSuffixFasta, fastaSubtract,
-                        FastaReads, FastaFaiReads, combineReads, SqliteIndex)
+                        FastaReads, FastaFaiReads, combineReads, SqliteIndex,
+                        IndexedFasta, fastaIndex)
 from dark.utils import StringIO
 
 
@@ -725,6 +732,39 @@ class TestSqliteIndex(TestCase):
         error = "^Duplicate file name: 'f.fas'$"
         self.assertRaisesRegexp(ValueError, error, index._addFilename, 'f.fas')
 
+    def testReadOnlyNonexistent(self):
+        """
+        Opening a database that does not exist with readOnly=True must raise
+        sqlite3.OperationalError and must not create the database.
+        """
+        dirname = mkdtemp()
+        try:
+            filename = os.path.join(dirname, 'index.sqlite3')
+            self.assertRaises(sqlite3.OperationalError, SqliteIndex,
+                              filename, readOnly=True)
+            self.assertFalse(os.path.exists(filename))
+        finally:
+            rmtree(dirname)
+
+    def testReadOnly(self):
+        """
+        An existing database opened with readOnly=True must find sequences.
+        """
+        dirname = mkdtemp()
+        try:
+            fastaFilename = os.path.join(dirname, 'reads.fasta')
+            with open(fastaFilename, 'w') as fp:
+                fp.write('>id0\nAC\n')
+            filename = os.path.join(dirname, 'index.sqlite3')
+            index = SqliteIndex(filename)
+            index.addFile(fastaFilename)
+            index.close()
+            index = SqliteIndex(filename, readOnly=True)
+            self.assertEqual(DNARead('id0', 'AC'), index['id0'])
+            index.close()
+        finally:
+            rmtree(dirname)
+
     def testGetNonexistentFilename(self):
         """"
         If the internal _getFilename method is called with a file number that
@@ -1220,3 +1260,260 @@ class TestSqliteIndex(TestCase):
             self.assertEqual(DNARead('id2', 'ACTGCCCCGGG'), index['id2'])
             self.assertEqual(DNARead('id3', 'AACCTG'), index['id3'])
             index.close()
+
+    def testIdForFirstWord(self):
+        """
+        The idForFirstWord method must return the full id of the sequence
+        whose id starts with the given word, or C{None} if there is none.
+        """
+        mockOpener = mockOpen(
+            read_data='>id1 Desc\nAC\n>id10 Other\nGG\n>id2\tTabbed\nT\n')
+        with patch.object(builtins, 'open', mockOpener):
+            index = SqliteIndex(':memory:')
+            index.addFile('filename.fasta')
+            self.assertEqual('id1 Desc', index.idForFirstWord('id1'))
+            self.assertEqual('id10 Other', index.idForFirstWord('id10'))
+            self.assertEqual('id2\tTabbed', index.idForFirstWord('id2'))
+            self.assertIs(None, index.idForFirstWord('id'))
+            self.assertIs(None, index.idForFirstWord('id3'))
+            index.close()
+
+
+class TestIndexedFasta(TestCase):
+    """
+    Tests for the IndexedFasta class.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+        self.filename = os.path.join(self.dirname, 'database.fasta')
+        self.indexFilename = self.filename + IndexedFasta.INDEX_SUFFIX
+        with open(self.filename, 'w') as fp:
+            fp.write('>id0\nAC\n>id1 Description\nACTG\nCC\n>id2\nT\n')
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def testIndexNotMadeUntilNeeded(self):
+        """
+        The index must not be made when an IndexedFasta is created.
+        """
+        IndexedFasta(self.filename)
+        self.assertFalse(os.path.exists(self.indexFilename))
+
+    def testGetItem(self):
+        """
+        Sequences must be returned by id, with the right read class.
+        """
+        fasta = IndexedFasta(self.filename, readClass=AARead)
+        self.assertEqual(AARead('id1 Description', 'ACTGCC'),
+                         fasta['id1 Description'])
+        self.assertIsInstance(fasta['id2'], AARead)
+        self.assertEqual(AARead('id0', 'AC'), fasta['id0'])
+        fasta.close()
+
+    def testGetItemByFirstWord(self):
+        """
+        A sequence whose id contains a space must be returned (with its full
+        id) when the first word of its id is asked for.
+        """
+        fasta = IndexedFasta(self.filename)
+        self.assertEqual(DNARead('id1 Description', 'ACTGCC'), fasta['id1'])
+        fasta.close()
+
+    def testUnknownId(self):
+        """
+        Asking for an unknown id must raise a KeyError.
+        """
+        fasta = IndexedFasta(self.filename)
+        self.assertRaises(KeyError, fasta.__getitem__, 'id3')
+        fasta.close()
+
+    def testIndexSaved(self):
+        """
+        The index must be saved next to the FASTA file and must be used by a
+        later IndexedFasta instance.
+        """
+        fasta = IndexedFasta(self.filename)
+        fasta['id0']
+        fasta.close()
+        self.assertTrue(os.path.exists(self.indexFilename))
+        fasta = IndexedFasta(self.filename)
+        with patch.object(SqliteIndex, 'addFile') as mockMethod:
+            self.assertEqual(DNARead('id2', 'T'), fasta['id2'])
+            self.assertEqual(0, mockMethod.call_count)
+        fasta.close()
+
+    def testStaleIndexRemade(self):
+        """
+        If the FASTA file is newer than its saved index, the index must be
+        remade.
+        """
+        fasta = IndexedFasta(self.filename)
+        fasta['id0']
+        fasta.close()
+        with open(self.filename, 'w') as fp:
+            fp.write('>id3\nGG\n')
+        indexTime = os.path.getmtime(self.indexFilename)
+        os.utime(self.filename, (indexTime + 10, indexTime + 10))
+        fasta = IndexedFasta(self.filename)
+        self.assertEqual(DNARead('id3', 'GG'), fasta['id3'])
+        self.assertRaises(KeyError, fasta.__getitem__, 'id0')
+        fasta.close()
+
+    def testUnsavableIndex(self):
+        """
+        If the index cannot be saved, an in-memory index must be used.
+        """
+        indexFilename = os.path.join(self.dirname, 'missing', 'index')
+        fasta = IndexedFasta(self.filename, indexFilename=indexFilename)
+        self.assertEqual(DNARead('id0', 'AC'), fasta['id0'])
+        self.assertFalse(os.path.exists(indexFilename))
+        fasta.close()
+
+    def testMakeIndex(self):
+        """
+        The makeIndex method must save the index.
+        """
+        fasta = IndexedFasta(self.filename)
+        fasta.makeIndex()
+        self.assertTrue(os.path.exists(self.indexFilename))
+        fasta.close()
+
+    def testMissingIndexNotCreated(self):
+        """
+        If the index is missing when it is opened (e.g., because another
+        process is making it), an empty index must not be created in its
+        place, and an in-memory index must be used.
+        """
+        fasta = IndexedFasta(self.filename)
+        with patch.object(IndexedFasta, '_indexIsCurrent', return_value=True):
+            self.assertEqual(DNARead('id0', 'AC'), fasta['id0'])
+        self.assertFalse(os.path.exists(self.indexFilename))
+        fasta.close()
+
+    def testStaleIndexReplaced(self):
+        """
+        When a stale index is remade, it must be replaced without first
+        being removed (so another process never finds it missing).
+        """
+        fasta = IndexedFasta(self.filename)
+        fasta.makeIndex()
+        fasta.close()
+        indexTime = os.path.getmtime(self.indexFilename)
+        os.utime(self.filename, (indexTime + 10, indexTime + 10))
+        fasta = IndexedFasta(self.filename)
+        with patch.object(os, 'unlink', wraps=os.unlink) as mockUnlink:
+            self.assertEqual(DNARead('id0', 'AC'), fasta['id0'])
+        for call in mockUnlink.call_args_list:
+            self.assertNotEqual(self.indexFilename, call[0][0])
+        fasta.close()
+
+    def testCachedRead(self):
+        """
+        Asking for the same sequence twice must return the cached read.
+        """
+        fasta = IndexedFasta(self.filename)
+        read = fasta['id0']
+        self.assertIs(read, fasta['id0'])
+        fasta.close()
+
+    def testLeastRecentlyUsedEvicted(self):
+        """
+        When the cache is full, the least recently used read must be removed
+        from it.
+        """
+        fasta = IndexedFasta(self.filename, cacheSize=2)
+        read0 = fasta['id0']
+        read1 = fasta['id1 Description']
+        # Use id0 so id1 becomes the least recently used.
+        self.assertIs(read0, fasta['id0'])
+        fasta['id2']
+        self.assertIs(read0, fasta['id0'])
+        self.assertIsNot(read1, fasta['id1 Description'])
+        fasta.close()
+
+    def testNoCache(self):
+        """
+        If the cache size is zero, reads must not be cached.
+        """
+        fasta = IndexedFasta(self.filename, cacheSize=0)
+        self.assertIsNot(fasta['id0'], fasta['id0'])
+        fasta.close()
+
+    def testPickle(self):
+        """
+        An IndexedFasta that has been used must be able to be pickled, and
+        the unpickled instance must find sequences.
+        """
+        fasta = IndexedFasta(self.filename)
+        fasta['id0']
+        unpickled = pickle.loads(pickle.dumps(fasta))
+        fasta.close()
+        self.assertEqual(DNARead('id2', 'T'), unpickled['id2'])
+        unpickled.close()
+
+
+class TestFastaIndex(TestCase):
+    """
+    Tests for the fastaIndex function.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def _write(self, basename, data, opener=open):
+        """
+        Write a FASTA file in our temporary directory.
+
+        @param basename: The C{str} base name of the file.
+        @param data: The C{str} FASTA data to write.
+        @param opener: A function to open the file for writing.
+        @return: The C{str} name of the file.
+        """
+        filename = os.path.join(self.dirname, basename)
+        with opener(filename, 'wb') as fp:
+            fp.write(data.encode('ascii'))
+        return filename
+
+    def testIndexedFasta(self):
+        """
+        An IndexedFasta must be returned for an uncompressed FASTA file with
+        no duplicated ids.
+        """
+        index = fastaIndex(self._write('db.fasta', '>id0\nAC\n>id1\nG\n'),
+                           readClass=AARead)
+        self.assertIsInstance(index, IndexedFasta)
+        self.assertEqual(AARead('id1', 'G'), index['id1'])
+        index.close()
+
+    def testDuplicateId(self):
+        """
+        If the FASTA file has a duplicated id, a dict must be returned, with
+        the last read with that id.
+        """
+        index = fastaIndex(
+            self._write('db.fasta', '>id0\nAC\n>id1\nG\n>id0\nTT\n'))
+        self.assertEqual({'id0': DNARead('id0', 'TT'),
+                          'id1': DNARead('id1', 'G')}, index)
+
+    def testGzip(self):
+        """
+        If the FASTA file is compressed with gzip (not bgzip), a dict of its
+        reads must be returned.
+        """
+        index = fastaIndex(
+            self._write('db.fasta.gz', '>id0\nAC\n>id1\nG\n', gzip.open))
+        self.assertEqual({'id0': DNARead('id0', 'AC'),
+                          'id1': DNARead('id1', 'G')}, index)
+
+    def testBzip2(self):
+        """
+        If the FASTA file is compressed with bzip2, a dict of its reads must
+        be returned.
+        """
+        index = fastaIndex(
+            self._write('db.fasta.bz2', '>id0\nAC\n>id1\nG\n', bz2.BZ2File))
+        self.assertEqual({'id0': DNARead('id0', 'AC'),
+                          'id1': DNARead('id1', 'G')}, index)
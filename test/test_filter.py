@@ -1,3 +1,5 @@
+import six
+from math import ceil
 from six.moves import builtins
 from unittest import TestCase
 
@@ -197,6 +199,83 @@ class TitleFilterTest(TestCase):
             self.assertEqual(TitleFilter.WHITELIST_ACCEPT, tf.accept('id3'))
             self.assertEqual(TitleFilter.REJECT, tf.accept('id4'))
 
+    def testRepeatedTitleIsCached(self):
+        """
+        Accepting the same title twice must only check the title's regex
+        once, and must give the same result both times.
+        """
+        tf = TitleFilter(positiveRegex=r'virus')
+        with patch.object(tf, '_accept', wraps=tf._accept) as mockMethod:
+            self.assertEqual(TitleFilter.DEFAULT_ACCEPT,
+                             tf.accept('herpes virus'))
+            self.assertEqual(TitleFilter.DEFAULT_ACCEPT,
+                             tf.accept('herpes virus'))
+            self.assertEqual(1, mockMethod.call_count)
+
+    def testNoCache(self):
+        """
+        If a title filter is made with cache=False, accepting the same title
+        twice must check the title twice.
+        """
+        tf = TitleFilter(positiveRegex=r'virus', cache=False)
+        with patch.object(tf, '_accept', wraps=tf._accept) as mockMethod:
+            tf.accept('herpes virus')
+            tf.accept('herpes virus')
+            self.assertEqual(2, mockMethod.call_count)
+
+    def testCachedWordTruncationRepeat(self):
+        """
+        With title truncation in effect, the cache must keep accepting the
+        first title seen and keep rejecting a later title with the same
+        truncated form.
+        """
+        tf = TitleFilter(truncateAfter=r'virus')
+        for _ in range(2):
+            self.assertEqual(
+                TitleFilter.DEFAULT_ACCEPT,
+                tf.accept('gi|400684|gb|AY421767.1| herpes virus 1'))
+            self.assertEqual(
+                TitleFilter.REJECT,
+                tf.accept('gi|400684|gb|AY421767.1| herpes virus 2'))
+
+    def testPrecompute(self):
+        """
+        After precomputing decisions for some titles, accepting one of those
+        titles must not check it again.
+        """
+        tf = TitleFilter(negativeRegex=r'herpes')
+        tf.precompute(['herpes virus', 'pox virus'])
+        with patch.object(tf, '_accept', wraps=tf._accept) as mockMethod:
+            self.assertEqual(TitleFilter.REJECT, tf.accept('herpes virus'))
+            self.assertEqual(TitleFilter.DEFAULT_ACCEPT,
+                             tf.accept('pox virus'))
+            self.assertEqual(0, mockMethod.call_count)
+
+    def testPrecomputeWordTruncationOrder(self):
+        """
+        When precomputing with title truncation in effect, the first title
+        in the precomputed titles with a given truncated form must be the one
+        that is accepted.
+        """
+        tf = TitleFilter(truncateAfter=r'virus')
+        tf.precompute(['gi|400684|gb|AY421767.1| herpes virus 2',
+                       'gi|400684|gb|AY421767.1| herpes virus 1'])
+        self.assertEqual(
+            TitleFilter.REJECT,
+            tf.accept('gi|400684|gb|AY421767.1| herpes virus 1'))
+        self.assertEqual(
+            TitleFilter.DEFAULT_ACCEPT,
+            tf.accept('gi|400684|gb|AY421767.1| herpes virus 2'))
+
+    def testPrecomputeWithoutCache(self):
+        """
+        Precomputing with a title filter that was made with cache=False must
+        raise a ValueError.
+        """
+        tf = TitleFilter(cache=False)
+        error = '^Cannot precompute title decisions without a cache\\.$'
+        six.assertRaisesRegex(self, ValueError, error, tf.precompute, ['x'])
+
 
 class ReadSetTest(TestCase):
     """
@@ -318,6 +397,88 @@ class ReadSetTest(TestCase):
         rsf = ReadSetFilter(0.5)
         self.assertEqual([], rsf.invalidates('title1'))
 
+    def testInvalidatedByFirstAcceptedSet(self):
+        """
+        If a new read set is insufficiently different from several accepted
+        read sets, it must be invalidated by the first of them to have been
+        accepted (not the one with the most reads in common).
+        """
+        rsf = ReadSetFilter(0.5)
+        self.assertTrue(
+            rsf.accept('title1', self.makeTitleAlignments(*range(0, 10))))
+        self.assertTrue(
+            rsf.accept('title2', self.makeTitleAlignments(*range(5, 15))))
+        self.assertFalse(
+            rsf.accept('title3', self.makeTitleAlignments(*range(3, 15))))
+        self.assertEqual(['title3'], rsf.invalidates('title1'))
+        self.assertEqual([], rsf.invalidates('title2'))
+
+    def testMinNewGreaterThanOne(self):
+        """
+        If C{minNew} is greater than one, a read set with no reads in common
+        with the first accepted read set must still be invalidated by it.
+        """
+        rsf = ReadSetFilter(1.5)
+        rsf.accept('title1', self.makeTitleAlignments(0))
+        self.assertFalse(rsf.accept('title2', self.makeTitleAlignments(1)))
+        self.assertEqual(['title2'], rsf.invalidates('title1'))
+
+    def testSameAsComparingAllSets(self):
+        """
+        The accepted titles and the invalidated titles must be the same as
+        those found by comparing each read set with all accepted read sets.
+        """
+        readSets = [set((title * 7 + i) % 40 for i in range(title % 9 + 1))
+                    for title in range(60)]
+        for minNew in 0.0, 0.3, 0.5, 1.0:
+            rsf = ReadSetFilter(minNew)
+            accepted = []
+            invalidated = {}
+            for title, readSet in enumerate(readSets):
+                readIds = set('id%d' % readId for readId in readSet)
+                required = ceil(minNew * len(readIds))
+                for acceptedTitle, acceptedReadIds in accepted:
+                    if len(readIds - acceptedReadIds) < required:
+                        invalidated[acceptedTitle].append(title)
+                        break
+                else:
+                    accepted.append((title, readIds))
+                    invalidated[title] = []
+                self.assertEqual(
+                    invalidated.get(title) == [],
+                    rsf.accept(title, self.makeTitleAlignments(*readSet)))
+            for title, _ in accepted:
+                self.assertEqual(invalidated[title], rsf.invalidates(title))
+
+    def testMinHashDuplicate(self):
+        """
+        With MinHash bands, a read set that is the same as an accepted read
+        set must be rejected.
+        """
+        rsf = ReadSetFilter(0.5, minHashBands=8)
+        rsf.accept('title1', self.makeTitleAlignments(*range(20)))
+        self.assertFalse(rsf.accept('title2',
+                                    self.makeTitleAlignments(*range(20))))
+        self.assertEqual(['title2'], rsf.invalidates('title1'))
+
+    def testMinHashDifferent(self):
+        """
+        With MinHash bands, a read set with no reads in common with the
+        accepted read sets must be accepted.
+        """
+        rsf = ReadSetFilter(0.5, minHashBands=8)
+        rsf.accept('title1', self.makeTitleAlignments(*range(20)))
+        self.assertTrue(rsf.accept('title2',
+                                   self.makeTitleAlignments(*range(20, 40))))
+
+    def testMinHashEmpty(self):
+        """
+        With MinHash bands, empty read sets must be accepted.
+        """
+        rsf = ReadSetFilter(0.5, minHashBands=8)
+        self.assertTrue(rsf.accept('title1', self.makeTitleAlignments()))
+        self.assertTrue(rsf.accept('title2', self.makeTitleAlignments()))
+
 
 class FakeCursor(object):
     def __init__(self, results):
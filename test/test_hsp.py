@@ -1,6 +1,14 @@
+from copy import deepcopy
+import six
+from six.moves import cPickle as pickle
 from unittest import TestCase
 
-from dark.hsp import HSP, LSP
+import numpy as np
+
+from dark.alignments import ReadAlignments
+from dark.hsp import HSP, LSP, sanityCheckHSPs
+from dark.reads import Read
+from dark.score import HigherIsBetterScore, LowerIsBetterScore
 
 
 class TestHSP(TestCase):
@@ -55,6 +63,134 @@ class TestHSP(TestCase):
         """
         self.assertFalse(HSP(5).betterThan(7))
 
+    def testMatchedSequencesNotMadeUntilNeeded(self):
+        """
+        A matchedSequences function must not be called when an HSP is made or
+        given its read holder.
+        """
+        calls = []
+
+        def matchedSequences(sequence):
+            calls.append(None)
+            return 'aaa', 'ccc'
+
+        hsp = HSP(7, btop='3', matchedSequences=matchedSequences)
+        hsp.setReadHolder(ReadAlignments(Read('id', 'ACGT')))
+        self.assertEqual('3', hsp.btop)
+        self.assertEqual([], calls)
+
+    def testMatchedSequencesMadeOnce(self):
+        """
+        A matchedSequences function must be called just once, with the
+        sequence of the read, when either matched sequence is first needed.
+        """
+        calls = []
+
+        def matchedSequences(sequence):
+            calls.append(sequence)
+            return 'aaa', 'ccc'
+
+        hsp = HSP(7, matchedSequences=matchedSequences)
+        hsp.setReadHolder(ReadAlignments(Read('id', 'ACGT')))
+        self.assertEqual('ccc', hsp.subjectMatchedSequence)
+        self.assertEqual('aaa', hsp.readMatchedSequence)
+        self.assertEqual('ccc', hsp.subjectMatchedSequence)
+        self.assertEqual(['ACGT'], calls)
+
+    def testMatchedSequencesWithoutReadHolder(self):
+        """
+        If the matched sequences of an HSP need to be made but its read
+        holder has not been set, a ValueError must be raised.
+        """
+        hsp = HSP(7, matchedSequences=lambda sequence: ('aaa', 'ccc'))
+        error = ('^The matched sequences of this HSP cannot be made because '
+                 'its read is not known\\.$')
+        six.assertRaisesRegex(self, ValueError, error, getattr, hsp,
+                              'readMatchedSequence')
+
+    def testReadHolderNotKept(self):
+        """
+        An HSP with no matchedSequences function (or whose matched sequences
+        have been made) must not keep a read holder.
+        """
+        hsp = HSP(7)
+        hsp.setReadHolder(ReadAlignments(Read('id', 'ACGT')))
+        self.assertNotIn('_readHolder', vars(hsp))
+
+        hsp = HSP(7, matchedSequences=lambda sequence: ('aaa', 'ccc'))
+        hsp.setReadHolder(ReadAlignments(Read('id', 'ACGT')))
+        self.assertEqual('aaa', hsp.readMatchedSequence)
+        self.assertNotIn('_readHolder', vars(hsp))
+
+    def testMatchedSequencesGivenAreKept(self):
+        """
+        A matched sequence that is passed must not be replaced by one made by
+        a matchedSequences function.
+        """
+        hsp = HSP(7, readMatchedSequence='ggg',
+                  matchedSequences=lambda sequence: ('aaa', 'ccc'))
+        hsp.setReadHolder(ReadAlignments(Read('id', 'ACGT')))
+        self.assertEqual('ggg', hsp.readMatchedSequence)
+        self.assertEqual('ccc', hsp.subjectMatchedSequence)
+
+    def testSetMatchedSequence(self):
+        """
+        It must be possible to set the matched sequences of an HSP.
+        """
+        hsp = HSP(7, matchedSequences=lambda sequence: ('aaa', 'ccc'))
+        hsp.setReadHolder(ReadAlignments(Read('id', 'ACGT')))
+        hsp.readMatchedSequence = 'ggg'
+        self.assertEqual('ggg', hsp.readMatchedSequence)
+        self.assertEqual('ccc', hsp.subjectMatchedSequence)
+
+    def testPickle(self):
+        """
+        An HSP must be able to be pickled and unpickled.
+        """
+        hsp = HSP(7, readStart=1, readEnd=2, readMatchedSequence='aaa',
+                  subjectMatchedSequence='ccc', btop='3')
+        hsp.extra = 'xxx'
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            unpickled = pickle.loads(pickle.dumps(hsp, protocol))
+            self.assertIsInstance(unpickled, HSP)
+            self.assertIsInstance(unpickled.score, HigherIsBetterScore)
+            self.assertEqual(7, unpickled.score.score)
+            self.assertEqual(vars(hsp).keys(), vars(unpickled).keys())
+            self.assertEqual(1, unpickled.readStart)
+            self.assertEqual('aaa', unpickled.readMatchedSequence)
+            self.assertEqual('ccc', unpickled.subjectMatchedSequence)
+            self.assertEqual('3', unpickled.btop)
+            self.assertEqual('xxx', unpickled.extra)
+
+    def testDeepcopy(self):
+        """
+        An HSP must be able to be deep copied.
+        """
+        hsp = HSP(7, readStart=1, readMatchedSequence='aaa')
+        copied = deepcopy(hsp)
+        self.assertIsNot(hsp, copied)
+        self.assertEqual(7, copied.score.score)
+        self.assertEqual(1, copied.readStart)
+        self.assertEqual('aaa', copied.readMatchedSequence)
+
+    def testPlottingCopy(self):
+        """
+        Changing the score and offsets of a plotting copy of an HSP must not
+        change the HSP, and the copy must share its matched sequences.
+        """
+        readMatchedSequence = 'a' * 100
+        hsp = HSP(7, readStartInSubject=3, subjectStart=5,
+                  readMatchedSequence=readMatchedSequence)
+        copied = hsp.plottingCopy()
+        self.assertIsInstance(copied, HSP)
+        self.assertIs(readMatchedSequence, copied.readMatchedSequence)
+        copied.score.score = 1
+        copied.readStartInSubject = 0
+        copied.subjectStart = 2
+        self.assertEqual(7, hsp.score.score)
+        self.assertEqual(3, hsp.readStartInSubject)
+        self.assertEqual(5, hsp.subjectStart)
+
 
 class TestLSP(TestCase):
     """
@@ -107,3 +243,49 @@ class TestLSP(TestCase):
         score is better than the score of the LSP.
         """
         self.assertFalse(LSP(7).betterThan(5))
+
+    def testPlottingCopy(self):
+        """
+        A plotting copy of an LSP must be an LSP with its own score.
+        """
+        lsp = LSP(7)
+        copied = lsp.plottingCopy()
+        self.assertIsInstance(copied, LSP)
+        self.assertIsInstance(copied.score, LowerIsBetterScore)
+        copied.score.score = 1
+        self.assertEqual(7, lsp.score.score)
+
+    def testPickle(self):
+        """
+        An LSP must be able to be pickled and unpickled.
+        """
+        unpickled = pickle.loads(pickle.dumps(LSP(7, readStart=1),
+                                              pickle.HIGHEST_PROTOCOL))
+        self.assertIsInstance(unpickled, LSP)
+        self.assertIsInstance(unpickled.score, LowerIsBetterScore)
+        self.assertEqual(7, unpickled.score.score)
+        self.assertEqual(1, unpickled.readStart)
+
+
+class TestSanityCheckHSPs(TestCase):
+    """
+    Tests of the L{dark.hsp.sanityCheckHSPs} function.
+    """
+
+    def testNoFailures(self):
+        """
+        If no HSP fails a check, no exception must be raised.
+        """
+        sanityCheckHSPs([(np.array([False, False]), lambda i: 'one')])
+
+    def testFirstFailure(self):
+        """
+        The error must describe the first check failed by the first failing
+        HSP.
+        """
+        checks = [
+            (np.array([False, False, True]), lambda i: 'one %d' % i),
+            (np.array([False, True, True]), lambda i: 'two %d' % i),
+        ]
+        six.assertRaisesRegex(self, AssertionError, '^HSP 1: two 1$',
+                              sanityCheckHSPs, checks)
@@ -1,8 +1,10 @@
 from unittest import TestCase
 from collections import Counter
 
-from dark.intervals import OffsetAdjuster, ReadIntervals
+from dark.intervals import MergedIntervals, OffsetAdjuster, ReadIntervals
 from dark.hsp import HSP
+from dark.reads import Read
+from dark.titles import TitleAlignment, TitleAlignments
 
 
 class TestReadIntervals(TestCase):
@@ -472,6 +474,149 @@ class TestReadIntervals(TestCase):
         ri.add(70, 110)
         self.assertEqual(1.0, ri.coverage())
 
+    def testAddIntervals(self):
+        """
+        Adding intervals with addIntervals must give the same result as
+        adding them one at a time.
+        """
+        ri1 = ReadIntervals(100)
+        ri2 = ReadIntervals(100)
+        intervals = [(-10, 20), (15, 40), (45, 70), (66, 89), (95, 110)]
+        for start, end in intervals:
+            ri1.add(start, end)
+        ri2.addIntervals([start for start, _ in intervals],
+                         [end for _, end in intervals])
+        self.assertEqual(list(ri1.walk()), list(ri2.walk()))
+        self.assertEqual(ri1.coverage(), ri2.coverage())
+        self.assertEqual(ri1.coverageCounts(), ri2.coverageCounts())
+
+    def testAddAfterWalk(self):
+        """
+        Adding an interval after walking must change the result of a
+        subsequent walk.
+        """
+        ri = ReadIntervals(100)
+        ri.add(10, 20)
+        self.assertEqual(
+            [
+                (ReadIntervals.EMPTY, (0, 10)),
+                (ReadIntervals.FULL, (10, 20)),
+                (ReadIntervals.EMPTY, (20, 100)),
+            ],
+            list(ri.walk()))
+        ri.add(20, 100)
+        self.assertEqual(
+            [
+                (ReadIntervals.EMPTY, (0, 10)),
+                (ReadIntervals.FULL, (10, 100)),
+            ],
+            list(ri.walk()))
+        self.assertEqual(0.9, ri.coverage())
+
+    def testDepth(self):
+        """
+        The depth method must return the number of reads covering each
+        location, ignoring parts of reads outside the subject.
+        """
+        ri = ReadIntervals(10)
+        ri.add(-3, 2)
+        ri.add(1, 4)
+        ri.add(8, 15)
+        self.assertEqual([1, 2, 1, 1, 0, 0, 0, 0, 1, 1], list(ri.depth()))
+
+    def testDepthEmpty(self):
+        """
+        The depth method must return all zeroes if no reads have been added.
+        """
+        self.assertEqual([0, 0, 0], list(ReadIntervals(3).depth()))
+
+    def testManyIntervals(self):
+        """
+        Many intervals that cover the subject must be merged into one.
+        """
+        ri = ReadIntervals(1000)
+        ri.addIntervals(range(0, 1000, 2), range(5, 1005, 2))
+        self.assertEqual([(ReadIntervals.FULL, (0, 1003))], list(ri.walk()))
+        self.assertEqual(1.0, ri.coverage())
+        self.assertEqual(3, ri.depth()[500])
+
+
+class TestMergedIntervals(TestCase):
+    """
+    Tests for the MergedIntervals class.
+    """
+    def testEmpty(self):
+        """
+        When no intervals have been added, there must be no intervals and no
+        coverage.
+        """
+        mi = MergedIntervals(100)
+        self.assertEqual(0, len(mi))
+        self.assertEqual([], mi.intervals())
+        self.assertEqual(0.0, mi.coverage())
+
+    def testZeroLengthTarget(self):
+        """
+        A zero-length target must have zero coverage.
+        """
+        mi = MergedIntervals(0)
+        mi.add(0, 10)
+        self.assertEqual(0.0, mi.coverage())
+
+    def testDisjoint(self):
+        """
+        Disjoint intervals must be kept separately, sorted.
+        """
+        mi = MergedIntervals(100)
+        mi.add(50, 60)
+        mi.add(10, 20)
+        self.assertEqual([(10, 20), (50, 60)], mi.intervals())
+        self.assertEqual(0.2, mi.coverage())
+
+    def testTouching(self):
+        """
+        Intervals that touch must be merged.
+        """
+        mi = MergedIntervals(100)
+        mi.add(10, 20)
+        mi.add(20, 30)
+        self.assertEqual([(10, 30)], mi.intervals())
+
+    def testMergeSeveral(self):
+        """
+        An interval that overlaps several others must be merged with all of
+        them.
+        """
+        mi = MergedIntervals(100)
+        mi.add(10, 20)
+        mi.add(30, 40)
+        mi.add(50, 60)
+        mi.add(80, 90)
+        mi.add(15, 55)
+        self.assertEqual([(10, 60), (80, 90)], mi.intervals())
+
+    def testContained(self):
+        """
+        An interval inside another must not change the intervals.
+        """
+        mi = MergedIntervals(100)
+        mi.add(10, 50)
+        mi.add(20, 30)
+        self.assertEqual([(10, 50)], mi.intervals())
+
+    def testCoverageMatchesReadIntervals(self):
+        """
+        The coverage must be the same as that of a ReadIntervals with the
+        same intervals, including ones that extend outside the target.
+        """
+        intervals = [(-10, 20), (15, 40), (45, 70), (66, 89), (95, 110)]
+        mi = MergedIntervals(100)
+        ri = ReadIntervals(100)
+        for start, end in intervals:
+            mi.add(start, end)
+            ri.add(start, end)
+        self.assertEqual(ri.coverage(), mi.coverage())
+
 
 class TestOffsetAdjuster(TestCase):
     """
@@ -651,3 +796,67 @@ class TestOffsetAdjuster(TestCase):
         self.assertEqual(19, hsp.readStartInSubject)
         self.assertEqual(27, hsp.subjectEnd)
         self.assertEqual(21, hsp.subjectStart)
+
+    def testAdjustOffsetsEmpty(self):
+        """
+        When there are no adjustments, adjustOffsets must return the offsets
+        unchanged.
+        """
+        adjuster = OffsetAdjuster()
+        self.assertEqual([0, 5, 10],
+                         adjuster.adjustOffsets([0, 5, 10]).tolist())
+
+    def testAdjustOffsets(self):
+        """
+        adjustOffsets must give the same results as adjustOffset, for offsets
+        before, at, between, and after the adjustment offsets.
+        """
+        ri = ReadIntervals(132)
+        ri.add(32, 42)
+        ri.add(58, 68)
+        adjuster = OffsetAdjuster(ri)
+        offsets = [-5, 0, 31, 32, 33, 42, 57, 58, 100, 132, 140]
+        self.assertEqual([adjuster.adjustOffset(offset) for offset in offsets],
+                         adjuster.adjustOffsets(offsets).tolist())
+
+    def testAdjustHSPs(self):
+        """
+        adjustHSPs must adjust the HSPs of a title's alignments as adjustHSP
+        does, and clear the cached statistics of the alignments.
+        """
+        def hsps():
+            return [
+                HSP(10, readEndInSubject=10, readStartInSubject=0,
+                    subjectEnd=10, subjectStart=0),
+                HSP(10, readEndInSubject=42, readStartInSubject=32,
+                    subjectEnd=40, subjectStart=35),
+                HSP(10, readEndInSubject=68, readStartInSubject=58,
+                    subjectEnd=66, subjectStart=60),
+                HSP(10, readEndInSubject=140, readStartInSubject=130,
+                    subjectEnd=132, subjectStart=131),
+            ]
+
+        ri = ReadIntervals(132)
+        ri.add(32, 42)
+        ri.add(58, 68)
+        adjuster = OffsetAdjuster(ri)
+
+        expected = hsps()
+        for hsp in expected:
+            adjuster.adjustHSP(hsp)
+
+        titleAlignments = TitleAlignments('title', 132)
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id0', 'A'), hsps()[:2]))
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id1', 'A'), hsps()[2:]))
+        coverage = titleAlignments.coverage()
+        adjuster.adjustHSPs(titleAlignments)
+
+        def offsets(hsp):
+            return (hsp.readStartInSubject, hsp.readEndInSubject,
+                    hsp.subjectStart, hsp.subjectEnd)
+
+        self.assertEqual([offsets(hsp) for hsp in expected],
+                         [offsets(hsp) for hsp in titleAlignments.hsps()])
+        self.assertNotEqual(coverage, titleAlignments.coverage())
@@ -0,0 +1,252 @@
+import os
+from bz2 import compress
+from json import dumps
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from dark.jsonindex import JSONRecordIndex, _lineOffsets
+
+PARAMS = {'application': 'BLASTN'}
+RECORDS = [
+    {'query': 'id0', 'alignments': []},
+    {'query': 'id1 description', 'alignments': []},
+    {'query': 'id2', 'alignments': [{'title': 'x', 'hsps': []}]},
+    {'query': 'id1 description', 'alignments': []},
+]
+LINES = [dumps(PARAMS) + '\n'] + [dumps(record) + '\n'
+                                  for record in RECORDS]
+
+
+class TestLineOffsets(TestCase):
+    """
+    Tests for the _lineOffsets function.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def _write(self, name, data):
+        """
+        Write data to a file in our temporary directory.
+
+        @param name: The C{str} name of the file.
+        @param data: The C{bytes} to write.
+        @return: The C{str} path of the file.
+        """
+        filename = os.path.join(self.dirname, name)
+        with open(filename, 'wb') as fp:
+            fp.write(data)
+        return filename
+
+    def testUncompressed(self):
+        """
+        The lines of an uncompressed file must be found, in stream zero.
+        """
+        filename = self._write('file.json', b'ab\ncde\n\nf')
+        self.assertEqual(
+            [(0, 0, b'ab\n'), (0, 3, b'cde\n'), (0, 7, b'\n'), (0, 8, b'f')],
+            list(_lineOffsets(filename)))
+
+    def testOneStream(self):
+        """
+        The lines of a bzip2 file with one stream must be found, in stream
+        zero.
+        """
+        filename = self._write('file.json.bz2', compress(b'ab\ncde\n'))
+        self.assertEqual([(0, 0, b'ab\n'), (0, 3, b'cde\n')],
+                         list(_lineOffsets(filename)))
+
+    def testSeveralStreams(self):
+        """
+        The stream offsets of the lines of a bzip2 file with several streams
+        must be found, even when the file is read in small pieces.
+        """
+        stream1 = compress(b'ab\ncde\n')
+        stream2 = compress(b'fg\n')
+        stream3 = compress(b'h\ni\n')
+        filename = self._write('file.json.bz2', stream1 + stream2 + stream3)
+        offset2 = len(stream1)
+        offset3 = offset2 + len(stream2)
+        expected = [(0, 0, b'ab\n'), (0, 3, b'cde\n'), (offset2, 0, b'fg\n'),
+                    (offset3, 0, b'h\n'), (offset3, 2, b'i\n')]
+        self.assertEqual(expected, list(_lineOffsets(filename)))
+        self.assertEqual(expected, list(_lineOffsets(filename, chunkSize=7)))
+
+    def testLineSpanningStreams(self):
+        """
+        A line that starts in one stream and ends in another must be given
+        the offset of its start.
+        """
+        stream1 = compress(b'ab\ncd')
+        stream2 = compress(b'e\nf\n')
+        filename = self._write('file.json.bz2', stream1 + stream2)
+        self.assertEqual(
+            [(0, 0, b'ab\n'), (0, 3, b'cde\n'), (len(stream1), 2, b'f\n')],
+            list(_lineOffsets(filename)))
+
+
+class TestJSONRecordIndex(TestCase):
+    """
+    Tests for the JSONRecordIndex class.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def _write(self, bzip2=False):
+        """
+        Write our JSON to a file, one bzip2 stream per line if C{bzip2} is
+        C{True}.
+
+        @return: The C{str} path of the file.
+        """
+        if bzip2:
+            filename = os.path.join(self.dirname, 'file.json.bz2')
+            data = b''.join(compress(line.encode('UTF-8')) for line in LINES)
+        else:
+            filename = os.path.join(self.dirname, 'file.json')
+            data = ''.join(LINES).encode('UTF-8')
+        with open(filename, 'wb') as fp:
+            fp.write(data)
+        return filename
+
+    def testIndexNotMadeUntilNeeded(self):
+        """
+        The index must not be made when a JSONRecordIndex is created.
+        """
+        filename = self._write()
+        JSONRecordIndex(filename)
+        self.assertFalse(
+            os.path.exists(filename + JSONRecordIndex.INDEX_SUFFIX))
+
+    def testLength(self):
+        """
+        The length of an index must be the number of records.
+        """
+        index = JSONRecordIndex(self._write())
+        self.assertEqual(4, len(index))
+        index.close()
+
+    def testIndexSaved(self):
+        """
+        The index must be saved next to the JSON file and be current.
+        """
+        filename = self._write()
+        index = JSONRecordIndex(filename)
+        self.assertFalse(index.isCurrent())
+        len(index)
+        index.close()
+        self.assertTrue(
+            os.path.exists(filename + JSONRecordIndex.INDEX_SUFFIX))
+        self.assertTrue(JSONRecordIndex(filename).isCurrent())
+
+    def testMake(self):
+        """
+        The make method must return the number of records indexed.
+        """
+        index = JSONRecordIndex(self._write())
+        self.assertEqual(4, index.make())
+        self.assertTrue(index.isCurrent())
+
+    def testOrdinal(self):
+        """
+        The ordinal method must return the number of the first record for a
+        query.
+        """
+        index = JSONRecordIndex(self._write())
+        self.assertEqual(0, index.ordinal('id0'))
+        self.assertEqual(1, index.ordinal('id1 description'))
+        self.assertEqual(2, index.ordinal('id2'))
+        index.close()
+
+    def testUnknownQuery(self):
+        """
+        The ordinal method must raise KeyError for an unknown query.
+        """
+        index = JSONRecordIndex(self._write())
+        self.assertRaises(KeyError, index.ordinal, 'id3')
+        index.close()
+
+    def testLines(self):
+        """
+        The lines method must return the JSON of the records in a range.
+        """
+        index = JSONRecordIndex(self._write())
+        self.assertEqual(LINES[2:4], list(index.lines(1, 3)))
+        self.assertEqual(LINES[4:], list(index.lines(3, 10)))
+        self.assertEqual([], list(index.lines(2, 2)))
+        self.assertEqual([], list(index.lines(5, 7)))
+        index.close()
+
+    def testLinesBzip2(self):
+        """
+        The lines method must return the JSON of the records in a range when
+        the JSON file has been compressed as several bzip2 streams.
+        """
+        index = JSONRecordIndex(self._write(bzip2=True))
+        self.assertEqual(4, len(index))
+        self.assertEqual(LINES[1:], list(index.lines(0, 4)))
+        self.assertEqual([LINES[3]], list(index.lines(2, 3)))
+        index.close()
+
+    def testUnsavableIndex(self):
+        """
+        If the index cannot be saved, an in-memory index must be used.
+        """
+        filename = self._write()
+        indexFilename = os.path.join(self.dirname, 'missing', 'index')
+        index = JSONRecordIndex(filename, indexFilename=indexFilename)
+        self.assertEqual(2, index.ordinal('id2'))
+        self.assertFalse(os.path.exists(indexFilename))
+        index.close()
+
+    def testMissingIndexNotCreated(self):
+        """
+        If the index is missing when it is opened (e.g., because another
+        process is making it), an empty index must not be created in its
+        place, and an in-memory index must be used.
+        """
+        filename = self._write()
+        index = JSONRecordIndex(filename)
+        with patch.object(JSONRecordIndex, 'isCurrent', return_value=True):
+            self.assertEqual(2, index.ordinal('id2'))
+        self.assertFalse(
+            os.path.exists(filename + JSONRecordIndex.INDEX_SUFFIX))
+        index.close()
+
+    def testStaleIndexReplaced(self):
+        """
+        When a stale index is remade, it must be replaced without first
+        being removed (so another process never finds it missing).
+        """
+        filename = self._write()
+        indexFilename = filename + JSONRecordIndex.INDEX_SUFFIX
+        JSONRecordIndex(filename).make()
+        indexTime = os.path.getmtime(indexFilename)
+        os.utime(filename, (indexTime + 10, indexTime + 10))
+        index = JSONRecordIndex(filename)
+        with patch.object(os, 'unlink', wraps=os.unlink) as mockUnlink:
+            self.assertEqual(2, index.ordinal('id2'))
+        for call in mockUnlink.call_args_list:
+            self.assertNotEqual(indexFilename, call[0][0])
+        index.close()
+
+    def testRecordWithNoQuery(self):
+        """
+        A ValueError must be raised if a record has no query id.
+        """
+        filename = os.path.join(self.dirname, 'file.json')
+        with open(filename, 'w') as fp:
+            fp.write(LINES[0] + '{"alignments": []}\n')
+        index = JSONRecordIndex(filename)
+        self.assertRaises(ValueError, len, index)
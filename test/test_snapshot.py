@@ -0,0 +1,260 @@
+import os
+from unittest import TestCase
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from .blast.sample_files import BlastFilesMixin
+
+from dark.blast.alignments import BlastReadsAlignments
+from dark.fasta import FastaReads
+from dark.score import HigherIsBetterScore
+from dark.snapshot import (
+    fingerprint, loadSnapshot, saveSnapshot, snapshotTitlesAlignments)
+from dark.titles import TitlesAlignments
+
+
+class _SnapshotMixin(BlastFilesMixin):
+    """
+    Make FASTA and BLAST JSON files in a temporary directory.
+    """
+    def setUp(self):
+        BlastFilesMixin.setUp(self)
+        self.snapshotFilename = os.path.join(self.dirname, 'snapshot')
+        self.filenames = [self.fastaFilename, self.jsonFilename]
+
+
+class TestFingerprint(_SnapshotMixin, TestCase):
+    """
+    Tests for the fingerprint function.
+    """
+    def testSameInputs(self):
+        """
+        The fingerprints of the same inputs must be equal.
+        """
+        self.assertEqual(
+            fingerprint(self.filenames, self.readsAlignments()),
+            fingerprint(self.filenames, self.readsAlignments()))
+
+    def testMissingFile(self):
+        """
+        If a file does not exist, an EnvironmentError must be raised.
+        """
+        self.assertRaises(EnvironmentError, fingerprint,
+                          [os.path.join(self.dirname, 'missing')],
+                          self.readsAlignments())
+
+    def testModifiedFile(self):
+        """
+        If a file has been modified, the fingerprint must change.
+        """
+        before = fingerprint(self.filenames, self.readsAlignments())
+        stat = os.stat(self.jsonFilename)
+        os.utime(self.jsonFilename, (stat.st_atime, stat.st_mtime + 10))
+        self.assertNotEqual(
+            before, fingerprint(self.filenames, self.readsAlignments()))
+
+    def testDifferentFilter(self):
+        """
+        If the filtering is different, the fingerprint must change.
+        """
+        self.assertNotEqual(
+            fingerprint(self.filenames, self.readsAlignments(scoreCutoff=10)),
+            fingerprint(self.filenames, self.readsAlignments(scoreCutoff=20)))
+
+    def testDifferentReaderOptions(self):
+        """
+        If the options of the reads alignments are different, the fingerprint
+        must change.
+        """
+        readsAlignments = BlastReadsAlignments(
+            FastaReads(self.fastaFilename), self.jsonFilename,
+            randomizeZeroEValues=False)
+        self.assertNotEqual(
+            fingerprint(self.filenames, self.readsAlignments()),
+            fingerprint(self.filenames, readsAlignments))
+
+    def testLazyReads(self):
+        """
+        If reads are looked up via a read index, the fingerprint must change.
+        """
+        readsAlignments = self.readsAlignments()
+        self.assertNotEqual(
+            fingerprint(self.filenames, readsAlignments),
+            fingerprint(self.filenames, readsAlignments,
+                        readsAlignments.readIdIndex()))
+
+    def testSetFilterArguments(self):
+        """
+        Filter arguments that are sets must give the same fingerprint
+        whatever order they are made in.
+        """
+        self.assertEqual(
+            fingerprint(self.filenames,
+                        self.readsAlignments(whitelist={'a', 'b', 'c'})),
+            fingerprint(self.filenames,
+                        self.readsAlignments(whitelist={'c', 'b', 'a'})))
+
+
+class TestSnapshot(_SnapshotMixin, TestCase):
+    """
+    Tests for saving and loading snapshots.
+    """
+    def testLoadMissing(self):
+        """
+        Loading a snapshot that does not exist must return C{None}.
+        """
+        self.assertIs(None, loadSnapshot(self.snapshotFilename, 'xxx'))
+
+    def testLoadGarbage(self):
+        """
+        Loading a file that is not a snapshot must return C{None}.
+        """
+        with open(self.snapshotFilename, 'w') as fp:
+            fp.write('not a snapshot')
+        self.assertIs(None, loadSnapshot(self.snapshotFilename, 'xxx'))
+
+    def testLoadDifferentFingerprint(self):
+        """
+        Loading a snapshot made from different inputs must return C{None}.
+        """
+        titlesAlignments = TitlesAlignments(self.readsAlignments())
+        saveSnapshot(titlesAlignments, self.snapshotFilename, 'xxx')
+        self.assertIs(None, loadSnapshot(self.snapshotFilename, 'yyy'))
+
+    def testRoundTrip(self):
+        """
+        A loaded snapshot must have the titles, reads, and HSPs of the
+        L{TitlesAlignments} that was saved, and use the given
+        C{readsAlignments}.
+        """
+        titlesAlignments = TitlesAlignments(self.readsAlignments())
+        saveSnapshot(titlesAlignments, self.snapshotFilename, 'xxx')
+        readsAlignments = self.readsAlignments()
+        loaded = loadSnapshot(self.snapshotFilename, 'xxx', readsAlignments)
+        self.assertIs(readsAlignments, loaded.readsAlignments)
+        self.assertIs(HigherIsBetterScore, loaded.scoreClass)
+        self.assertEqual(sorted(titlesAlignments), sorted(loaded))
+        for title, titleAlignments in titlesAlignments.items():
+            loadedTitleAlignments = loaded[title]
+            self.assertEqual(titleAlignments.subjectLength,
+                             loadedTitleAlignments.subjectLength)
+            self.assertEqual(titleAlignments.readIds(),
+                             loadedTitleAlignments.readIds())
+            self.assertEqual(
+                [hsp.score.score for hsp in titleAlignments.hsps()],
+                [hsp.score.score for hsp in loadedTitleAlignments.hsps()])
+
+    def testSaveReplaces(self):
+        """
+        Saving a snapshot must replace an existing snapshot without first
+        removing it (so another process never finds it missing).
+        """
+        titlesAlignments = TitlesAlignments(self.readsAlignments())
+        saveSnapshot(titlesAlignments, self.snapshotFilename, 'xxx')
+        with patch.object(os, 'unlink', wraps=os.unlink) as mockUnlink:
+            saveSnapshot(titlesAlignments, self.snapshotFilename, 'yyy')
+        for call in mockUnlink.call_args_list:
+            self.assertNotEqual(self.snapshotFilename, call[0][0])
+        self.assertIsNotNone(loadSnapshot(self.snapshotFilename, 'yyy'))
+
+    def testLoadWithReadIndex(self):
+        """
+        The reads of a snapshot of a L{TitlesAlignments} made with a read
+        index must not be saved, and must be looked up in the read index
+        given when the snapshot is loaded.
+        """
+        readsAlignments = self.readsAlignments()
+        readIndex = readsAlignments.readIdIndex()
+        saveSnapshot(TitlesAlignments(readsAlignments, readIndex=readIndex),
+                     self.snapshotFilename, 'xxx')
+        with open(self.snapshotFilename, 'rb') as fp:
+            self.assertNotIn(b'A' * 70, fp.read())
+        readIndex = self.readsAlignments().readIdIndex()
+        loaded = loadSnapshot(self.snapshotFilename, 'xxx',
+                              readIndex=readIndex)
+        self.assertIs(readIndex, loaded.readIndex)
+        self.assertIs(readIndex, loaded.filter().readIndex)
+        for titleAlignments in loaded.values():
+            for titleAlignment in titleAlignments:
+                self.assertIs(readIndex[titleAlignment.readId],
+                              titleAlignment.read)
+
+    def testLoadWithoutReadsAlignments(self):
+        """
+        If no C{readsAlignments} is given when loading a snapshot, the loaded
+        L{TitlesAlignments} must have the saved parameters.
+        """
+        readsAlignments = self.readsAlignments()
+        saveSnapshot(TitlesAlignments(readsAlignments),
+                     self.snapshotFilename, 'xxx')
+        loaded = loadSnapshot(self.snapshotFilename, 'xxx')
+        self.assertEqual(readsAlignments.params.application,
+                         loaded.readsAlignments.params.application)
+        self.assertEqual(readsAlignments.params.scoreTitle,
+                         loaded.readsAlignments.params.scoreTitle)
+
+    def testSnapshotTitlesAlignments(self):
+        """
+        snapshotTitlesAlignments must make and save a L{TitlesAlignments}
+        the first time it is called, and load it from the snapshot when it
+        is next called with the same inputs.
+        """
+        titlesAlignments, loaded = snapshotTitlesAlignments(
+            self.readsAlignments(), self.filenames, self.snapshotFilename)
+        self.assertFalse(loaded)
+        self.assertTrue(os.path.exists(self.snapshotFilename))
+
+        snapshot, loaded = snapshotTitlesAlignments(
+            self.readsAlignments(), self.filenames, self.snapshotFilename)
+        self.assertTrue(loaded)
+        self.assertEqual(sorted(titlesAlignments), sorted(snapshot))
+
+    def testSnapshotTitlesAlignmentsDifferentFilter(self):
+        """
+        snapshotTitlesAlignments must not use a snapshot that was made with
+        different filtering.
+        """
+        snapshotTitlesAlignments(
+            self.readsAlignments(), self.filenames, self.snapshotFilename)
+        titlesAlignments, loaded = snapshotTitlesAlignments(
+            self.readsAlignments(titleRegex='Cowpox'), self.filenames,
+            self.snapshotFilename)
+        self.assertFalse(loaded)
+        self.assertEqual(['gi|887699|gb|DQ37780 Cowpox virus 15'],
+                         list(titlesAlignments))
+
+    def testSnapshotTitlesAlignmentsLoadLazyReads(self):
+        """
+        A L{TitlesAlignments} loaded by snapshotTitlesAlignments from a
+        snapshot made with a read index must use the given read index.
+        """
+        readsAlignments = self.readsAlignments()
+        snapshotTitlesAlignments(
+            readsAlignments, self.filenames, self.snapshotFilename,
+            readIndex=readsAlignments.readIdIndex())
+        readsAlignments = self.readsAlignments()
+        readIndex = readsAlignments.readIdIndex()
+        titlesAlignments, loaded = snapshotTitlesAlignments(
+            readsAlignments, self.filenames, self.snapshotFilename,
+            readIndex=readIndex)
+        self.assertTrue(loaded)
+        self.assertIs(readIndex, titlesAlignments.readIndex)
+        for titleAlignments in titlesAlignments.values():
+            for titleAlignment in titleAlignments:
+                self.assertIs(readIndex, titleAlignment._readIndex)
+
+    def testSnapshotTitlesAlignmentsLazyReads(self):
+        """
+        snapshotTitlesAlignments must not use a snapshot made with the reads
+        kept in memory when reads are to be looked up via a read index.
+        """
+        snapshotTitlesAlignments(
+            self.readsAlignments(), self.filenames, self.snapshotFilename)
+        readsAlignments = self.readsAlignments()
+        titlesAlignments, loaded = snapshotTitlesAlignments(
+            readsAlignments, self.filenames, self.snapshotFilename,
+            readIndex=readsAlignments.readIdIndex())
+        self.assertFalse(loaded)
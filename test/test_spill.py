@@ -0,0 +1,200 @@
+import os
+from unittest import TestCase
+
+from .blast.sample_files import BlastFilesMixin
+
+from dark.spill import SpilledTitlesAlignments
+from dark.titles import TitlesAlignments
+
+
+class TestSpilledTitlesAlignments(BlastFilesMixin, TestCase):
+    """
+    Tests for the SpilledTitlesAlignments class.
+    """
+    def spilled(self, **kwargs):
+        """
+        Make a SpilledTitlesAlignments for our files, with its files in our
+        temporary directory.
+
+        @param kwargs: Keyword arguments for L{SpilledTitlesAlignments}.
+        @return: A L{SpilledTitlesAlignments} instance.
+        """
+        return SpilledTitlesAlignments(self.readsAlignments(),
+                                       directory=self.dirname, **kwargs)
+
+    def spillDirectories(self):
+        """
+        Find the directories made for spilled files.
+
+        @return: A C{list} of C{str} directory names.
+        """
+        return [name for name in os.listdir(self.dirname)
+                if name.startswith('dark-spill-')]
+
+    def assertSameAlignments(self, titlesAlignments, spilled):
+        """
+        Check that a SpilledTitlesAlignments has the same titles, reads, and
+        HSPs (in the same order) as a TitlesAlignments.
+
+        @param titlesAlignments: The expected L{TitlesAlignments} instance.
+        @param spilled: The L{SpilledTitlesAlignments} instance to check.
+        """
+        self.assertEqual(sorted(titlesAlignments), sorted(spilled))
+        for title, titleAlignments in titlesAlignments.items():
+            loaded = spilled[title].load()
+            self.assertEqual(titleAlignments.subjectLength,
+                             loaded.subjectLength)
+            self.assertEqual([alignment.read for alignment in titleAlignments],
+                             [alignment.read for alignment in loaded])
+            self.assertEqual(
+                [hsp.score.score for hsp in titleAlignments.hsps()],
+                [hsp.score.score for hsp in loaded.hsps()])
+
+    def testSameAlignments(self):
+        """
+        A SpilledTitlesAlignments must have the same titles and alignments as
+        a TitlesAlignments made from the same alignments.
+        """
+        self.assertSameAlignments(TitlesAlignments(self.readsAlignments()),
+                                  self.spilled())
+
+    def testSmallBufferAndFewSegments(self):
+        """
+        A SpilledTitlesAlignments that writes its HSPs to disk as soon as it
+        reads them, with several titles in each segment, must have the same
+        titles and alignments as a TitlesAlignments.
+        """
+        self.assertSameAlignments(
+            TitlesAlignments(self.readsAlignments()),
+            self.spilled(maxBufferedHsps=1, segmentCount=2))
+
+    def testSummary(self):
+        """
+        A SpilledTitlesAlignments must have the same summary as a
+        TitlesAlignments made from the same alignments.
+        """
+        self.assertEqual(
+            TitlesAlignments(self.readsAlignments()).tabSeparatedSummary(
+                sortOn='title'),
+            self.spilled(segmentCount=3).tabSeparatedSummary(sortOn='title'))
+
+    def testTitleAPI(self):
+        """
+        The values of a SpilledTitlesAlignments must give the same results as
+        those of a TitlesAlignments.
+        """
+        titlesAlignments = TitlesAlignments(self.readsAlignments())
+        spilled = self.spilled()
+        for title, titleAlignments in titlesAlignments.items():
+            spilledTitleAlignments = spilled[title]
+            self.assertEqual(len(titleAlignments),
+                             len(spilledTitleAlignments))
+            self.assertEqual(titleAlignments.readCount(),
+                             spilledTitleAlignments.readCount())
+            self.assertEqual(titleAlignments.hspCount(),
+                             spilledTitleAlignments.hspCount())
+            self.assertEqual(titleAlignments.readIds(),
+                             spilledTitleAlignments.readIds())
+            self.assertEqual(titleAlignments.coverage(),
+                             spilledTitleAlignments.coverage())
+            self.assertEqual(titleAlignments.medianScore(),
+                             spilledTitleAlignments.medianScore())
+            self.assertEqual(titleAlignments.bestHsp().score.score,
+                             spilledTitleAlignments.bestHsp().score.score)
+            self.assertEqual(titleAlignments.worstHsp().score.score,
+                             spilledTitleAlignments.worstHsp().score.score)
+            self.assertEqual(titleAlignments.hasScoreBetterThan(30),
+                             spilledTitleAlignments.hasScoreBetterThan(30))
+            self.assertEqual(
+                [alignment.read.id for alignment in titleAlignments],
+                [alignment.read.id for alignment in spilledTitleAlignments])
+            self.assertEqual(titleAlignments.summary(),
+                             spilledTitleAlignments.summary())
+
+    def testPlottingCopy(self):
+        """
+        Changing the HSPs of a plotting copy of a title's alignments must
+        not change the spilled alignments.
+        """
+        spilled = self.spilled()
+        title = sorted(spilled)[0]
+        scores = [hsp.score.score for hsp in spilled[title].hsps()]
+        copy = spilled[title].plottingCopy()
+        for hsp in copy.hsps():
+            hsp.score.score = 0
+        self.assertEqual(scores,
+                         [hsp.score.score for hsp in spilled[title].hsps()])
+
+    def testHsps(self):
+        """
+        The hsps method must return the scores of all HSPs of all titles.
+        """
+        self.assertEqual(
+            sorted(hsp.score.score for hsp in
+                   TitlesAlignments(self.readsAlignments()).hsps()),
+            sorted(hsp.score.score for hsp in self.spilled().hsps()))
+
+    def testSortTitles(self):
+        """
+        Titles must be sorted in the same way as those of a
+        TitlesAlignments.
+        """
+        titlesAlignments = TitlesAlignments(self.readsAlignments())
+        spilled = self.spilled()
+        for by in 'length', 'maxScore', 'medianScore', 'readCount', 'title':
+            self.assertEqual(titlesAlignments.sortTitles(by),
+                             spilled.sortTitles(by))
+
+    def testFilter(self):
+        """
+        Filtering must give the same titles as filtering a TitlesAlignments,
+        and return a SpilledTitlesAlignments.
+        """
+        titlesAlignments = TitlesAlignments(self.readsAlignments())
+        spilled = self.spilled()
+        for kwargs in ({'minMatchingReads': 2}, {'minMedianScore': 30},
+                       {'withScoreBetterThan': 40}, {'minCoverage': 0.1},
+                       {'maxTitles': 2, 'sortOn': 'readCount'},
+                       {'minNewReads': 0.5}):
+            filtered = spilled.filter(**kwargs)
+            self.assertTrue(isinstance(filtered, SpilledTitlesAlignments))
+            self.assertEqual(sorted(titlesAlignments.filter(**kwargs)),
+                             sorted(filtered))
+
+    def testFilteredAlignments(self):
+        """
+        The alignments of the titles of a filtered SpilledTitlesAlignments
+        must still be loadable.
+        """
+        titlesAlignments = TitlesAlignments(self.readsAlignments()).filter(
+            minMatchingReads=2)
+        spilled = self.spilled()
+        filtered = spilled.filter(minMatchingReads=2)
+        del spilled
+        self.assertSameAlignments(titlesAlignments, filtered)
+
+    def testDirectory(self):
+        """
+        The files must be put in a new directory in the given directory.
+        """
+        spilled = self.spilled()
+        self.assertEqual(1, len(self.spillDirectories()))
+        spilled.close()
+
+    def testClose(self):
+        """
+        Closing a SpilledTitlesAlignments must remove its files.
+        """
+        spilled = self.spilled()
+        spilled.close()
+        self.assertEqual([], self.spillDirectories())
+
+    def testUnreferenced(self):
+        """
+        The files must be removed when a SpilledTitlesAlignments and its
+        values are no longer referenced.
+        """
+        spilled = self.spilled()
+        spilled.filter(minMatchingReads=2)
+        del spilled
+        self.assertEqual([], self.spillDirectories())
@@ -1,6 +1,17 @@
 from unittest import TestCase
+from tempfile import mkstemp
+from os import close, unlink
+from contextlib import contextmanager
+from six import StringIO
 
-from dark.taxonomy import LineageFetcher
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from dark import taxonomy
+from dark.taxonomy import (
+    LineageFetcher, LocalLineageFetcher, makeLocalTaxonomyDatabase)
 
 
 class FakeCursor(object):
@@ -61,3 +72,207 @@ class TestLineageFetcher(TestCase):
                 (2, 'Vira'),
             ],
             lineage)
+
+    def testLineages(self):
+        """
+        The lineages method must return the lineage of each title.
+        """
+        db = FakeDbConnection([
+            [15], ['Merkel cell polyomavirus'],
+            [1],
+            [4], ['Polyomavirus'],
+            [1],
+        ])
+        lineageFetcher = LineageFetcher(db=db, cursor=db.cursor())
+        self.assertEqual(
+            [
+                [(15, 'Merkel cell polyomavirus')],
+                [(4, 'Polyomavirus')],
+            ],
+            lineageFetcher.lineages(['gi|5|gb|EU375804.1| Merkel',
+                                     'gi|6|gb|EU375805.1| Polyoma']))
+
+
+NODES = """\
+1\t|\t1\t|\tno rank\t|
+2\t|\t1\t|\tsuperkingdom\t|
+3\t|\t2\t|\tno rank\t|
+4\t|\t3\t|\tgenus\t|
+15\t|\t4\t|\tspecies\t|
+16\t|\t99\t|\tspecies\t|
+"""
+
+NAMES = """\
+1\t|\troot\t|\t\t|\tscientific name\t|
+2\t|\tVira\t|\t\t|\tscientific name\t|
+2\t|\tViruses\t|\t\t|\tsynonym\t|
+3\t|\tdsDNA viruses\t|\t\t|\tscientific name\t|
+4\t|\tPolyomavirus\t|\t\t|\tscientific name\t|
+15\t|\tMerkel cell polyomavirus\t|\t\t|\tscientific name\t|
+16\t|\tOrphan virus\t|\t\t|\tscientific name\t|
+"""
+
+GI_TAXID = """\
+5\t15
+6\t16
+"""
+
+ACCESSION_TAXID = """\
+accession\taccession.version\ttaxid\tgi
+NC_001538\tNC_001538.1\t4\tna
+YP_009111\tYP_009111.1\t3\t7
+"""
+
+
+@contextmanager
+def localDatabase():
+    """
+    Make a temporary local taxonomy database, and later remove it.
+    """
+    fd, filename = mkstemp()
+    close(fd)
+    makeLocalTaxonomyDatabase(filename, StringIO(NODES), StringIO(NAMES),
+                              [StringIO(GI_TAXID)],
+                              [StringIO(ACCESSION_TAXID)])
+    yield filename
+    unlink(filename)
+
+
+class TestMakeLocalTaxonomyDatabase(TestCase):
+    """
+    Test the makeLocalTaxonomyDatabase function.
+    """
+    def testCounts(self):
+        """
+        The numbers of nodes, gi numbers, and accessions stored must be
+        returned.
+        """
+        fd, filename = mkstemp()
+        close(fd)
+        try:
+            self.assertEqual(
+                (6, 3, 2),
+                makeLocalTaxonomyDatabase(
+                    filename, StringIO(NODES), StringIO(NAMES),
+                    [StringIO(GI_TAXID)], [StringIO(ACCESSION_TAXID)]))
+        finally:
+            unlink(filename)
+
+    def testSeveralAccessionBatches(self):
+        """
+        Accession2taxid files with more lines than are inserted at once must
+        have all their accessions and gi numbers stored.
+        """
+        fd, filename = mkstemp()
+        close(fd)
+        try:
+            with patch.object(taxonomy, '_ACCESSION_BATCH_SIZE', 1):
+                self.assertEqual(
+                    (6, 3, 2),
+                    makeLocalTaxonomyDatabase(
+                        filename, StringIO(NODES), StringIO(NAMES),
+                        [StringIO(GI_TAXID)], [StringIO(ACCESSION_TAXID)]))
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual(
+                [(3, 'dsDNA viruses'), (2, 'Vira')],
+                lineageFetcher.lineage('gi|7|ref|XX_1.1| Protein'))
+            lineageFetcher.close()
+        finally:
+            unlink(filename)
+
+
+class TestLocalLineageFetcher(TestCase):
+    """
+    Test the LocalLineageFetcher class.
+    """
+    def testLineageFromGi(self):
+        """
+        The lineage of a title with a gi number must be found.
+        """
+        with localDatabase() as filename:
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual(
+                [
+                    (15, 'Merkel cell polyomavirus'),
+                    (4, 'Polyomavirus'),
+                    (3, 'dsDNA viruses'),
+                    (2, 'Vira'),
+                ],
+                lineageFetcher.lineage(
+                    'gi|5|gb|EU375804.1| Merkel cell polyomavirus'))
+            lineageFetcher.close()
+
+    def testLineageFromAccession(self):
+        """
+        The lineage of a title that starts with a (versioned) accession must
+        be found.
+        """
+        with localDatabase() as filename:
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual(
+                [(4, 'Polyomavirus'), (3, 'dsDNA viruses'), (2, 'Vira')],
+                lineageFetcher.lineage('NC_001538.1 Polyomavirus genome'))
+            lineageFetcher.close()
+
+    def testLineageFromAccessionWhenGiUnknown(self):
+        """
+        If the gi number in a title is not known, the accession in the title
+        must be used.
+        """
+        with localDatabase() as filename:
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual(
+                [(4, 'Polyomavirus'), (3, 'dsDNA viruses'), (2, 'Vira')],
+                lineageFetcher.lineage('gi|100|ref|NC_001538.1| Polyoma'))
+            lineageFetcher.close()
+
+    def testGiFromAccessionFile(self):
+        """
+        A gi number given in an accession2taxid file must be found.
+        """
+        with localDatabase() as filename:
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual(
+                [(3, 'dsDNA viruses'), (2, 'Vira')],
+                lineageFetcher.lineage('gi|7|ref|XX_1.1| Protein'))
+            lineageFetcher.close()
+
+    def testUnknownTitle(self):
+        """
+        The lineage of a title that is not in the database must be empty.
+        """
+        with localDatabase() as filename:
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual([], lineageFetcher.lineage('XX_1.1 Unknown'))
+            lineageFetcher.close()
+
+    def testMissingParent(self):
+        """
+        The lineage of a title whose taxonomy does not lead to the root of
+        the taxonomy tree must be empty.
+        """
+        with localDatabase() as filename:
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual([], lineageFetcher.lineage('gi|6|gb|X| Orphan'))
+            lineageFetcher.close()
+
+    def testLineages(self):
+        """
+        The lineages method must return the lineage of each title, in order.
+        """
+        with localDatabase() as filename:
+            lineageFetcher = LocalLineageFetcher(filename)
+            self.assertEqual(
+                [
+                    [(3, 'dsDNA viruses'), (2, 'Vira')],
+                    [],
+                    [(4, 'Polyomavirus'), (3, 'dsDNA viruses'), (2, 'Vira')],
+                    [(3, 'dsDNA viruses'), (2, 'Vira')],
+                ],
+                lineageFetcher.lineages([
+                    'YP_009111.1 Protein',
+                    'XX_1.1 Unknown',
+                    'NC_001538.1 Polyomavirus genome',
+                    'YP_009111.1 Protein',
+                ]))
+            lineageFetcher.close()
@@ -1,16 +1,18 @@
 # Note: Tests for the TitlesAlignments class are in blast/test_titles.py
 #       because that class needs a concrete (iterable)
 #       dark.alignments.ReadsAlignments class passed to its __init__.  The
-#       tests below test the simpler dark.titles classes, TitleAlignment
-#       and TitleAlignments.
+#       tests below test the simpler dark.titles classes, TitleAlignment,
+#       TitleAlignments, and TitleSummary.
 
 from collections import Counter
+from copy import deepcopy
 import six
 import warnings
+from six.moves import cPickle as pickle
 import platform
 from unittest import TestCase
 
-from dark.titles import TitleAlignment, TitleAlignments
+from dark.titles import TitleAlignment, TitleAlignments, TitleSummary
 from dark.reads import Read
 from dark.hsp import HSP, LSP
 
@@ -48,6 +50,61 @@ class TestTitleAlignment(TestCase):
         self.assertEqual(read, titleAlignment.read)
         self.assertEqual([], titleAlignment.hsps)
 
+    def testReadId(self):
+        """
+        The readId attribute of a TitleAlignment must be the id of its read.
+        """
+        titleAlignment = TitleAlignment(Read('id', 'AAA'), [])
+        self.assertEqual('id', titleAlignment.readId)
+
+    def testReadIndex(self):
+        """
+        If a TitleAlignment is given a read index, it must look its read up
+        each time the read is needed, but not to get the read id.
+        """
+        read = Read('id', 'AAA')
+        lookups = []
+
+        class ReadIndex(dict):
+            def __getitem__(self, id_):
+                lookups.append(id_)
+                return dict.__getitem__(self, id_)
+
+        titleAlignment = TitleAlignment('id', [], ReadIndex(id=read))
+        self.assertEqual('id', titleAlignment.readId)
+        self.assertEqual([], lookups)
+        self.assertIs(read, titleAlignment.read)
+        self.assertIs(read, titleAlignment.read)
+        self.assertEqual(['id', 'id'], lookups)
+
+    def testPickle(self):
+        """
+        A pickled TitleAlignment without a read index must have its read
+        when unpickled.
+        """
+        titleAlignment = pickle.loads(pickle.dumps(
+            TitleAlignment(Read('id', 'AAA'), [HSP(3)])))
+        self.assertEqual(Read('id', 'AAA'), titleAlignment.read)
+        self.assertEqual(3, titleAlignment.hsps[0].score.score)
+
+    def testReadIndexNotPickled(self):
+        """
+        The read index of a TitleAlignment must not be pickled. A ValueError
+        must be raised if the read of an unpickled TitleAlignment is needed
+        before its read index is set again.
+        """
+        readIndex = {'id': Read('id', 'ACGTTGCA')}
+        data = pickle.dumps(TitleAlignment('id', [], readIndex))
+        self.assertNotIn(b'ACGTTGCA', data)
+        titleAlignment = pickle.loads(data)
+        self.assertEqual('id', titleAlignment.readId)
+        error = (r"^The read index of the alignment of read 'id' has not "
+                 r"been set \(see TitleAlignment\.setReadIndex\)\.$")
+        six.assertRaisesRegex(self, ValueError, error, getattr,
+                              titleAlignment, 'read')
+        titleAlignment.setReadIndex(readIndex)
+        self.assertIs(readIndex['id'], titleAlignment.read)
+
 
 class TestTitleAlignments(WarningTestMixin, TestCase):
     """
@@ -793,6 +850,105 @@ class TestTitleAlignments(WarningTestMixin, TestCase):
             },
             titleAlignments.residueCounts())
 
+    def testCoverageArraysNoReads(self):
+        """
+        When a title has no reads aligned to it, the coverageArrays method
+        must return empty arrays.
+        """
+        titleAlignments = TitleAlignments('subject title', 55)
+        offsets, codes, scores = titleAlignments.coverageArrays()
+        self.assertEqual([], offsets.tolist())
+        self.assertEqual([], codes.tolist())
+        self.assertEqual([], scores.tolist())
+
+    def testCoverageArrays(self):
+        """
+        The coverageArrays method must return the offsets, base codes, and
+        scores of the matched bases of all HSPs, in order.
+        """
+        titleAlignments = TitleAlignments('subject title', 55)
+        hsp1 = HSP(15, subjectStart=1, subjectEnd=4, readMatchedSequence='A-A')
+        hsp2 = HSP(10, subjectStart=3, subjectEnd=6, readMatchedSequence='CGT')
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id1', 'AAACGT'), [hsp1, hsp2]))
+        offsets, codes, scores = titleAlignments.coverageArrays()
+        self.assertEqual([1, 2, 3, 3, 4, 5], offsets.tolist())
+        self.assertEqual(b'A-ACGT', codes.tobytes())
+        self.assertEqual([15, 15, 15, 10, 10, 10], scores.tolist())
+
+    def testResidueCountMatrixNoReads(self):
+        """
+        When a title has no reads aligned to it, the residueCountMatrix
+        method must return a matrix with a row for each subject offset and
+        no columns.
+        """
+        titleAlignments = TitleAlignments('subject title', 55)
+        start, alphabet, counts = titleAlignments.residueCountMatrix()
+        self.assertEqual(0, start)
+        self.assertEqual([], alphabet)
+        self.assertEqual((55, 0), counts.shape)
+
+    def testResidueCountMatrixUnknownCaseConversion(self):
+        """
+        The residueCountMatrix method must raise a ValueError when asked to
+        do an unknown case conversion.
+        """
+        titleAlignments = TitleAlignments('subject title', 55)
+        error = "convertCaseTo must be one of 'none', 'lower', or 'upper'"
+        six.assertRaisesRegex(
+            self, ValueError, error, titleAlignments.residueCountMatrix,
+            convertCaseTo='xxx')
+
+    def testResidueCountMatrixWhiskers(self):
+        """
+        The residueCountMatrix method must count the residues of whiskers
+        that extend beyond the left and right of the subject.
+
+        Subject:      ACG
+        Read:       aaCGTtt
+        """
+        read = Read('id', 'aaCGTtt')
+        hsp = HSP(33, readStart=2, readEnd=5, readStartInSubject=-2,
+                  readEndInSubject=5, subjectStart=0, subjectEnd=3,
+                  readMatchedSequence='CGT', subjectMatchedSequence='ACG')
+        titleAlignments = TitleAlignments('subject title', 3)
+        titleAlignments.addAlignment(TitleAlignment(read, [hsp]))
+        start, alphabet, counts = titleAlignments.residueCountMatrix()
+        self.assertEqual(-2, start)
+        self.assertEqual(['A', 'C', 'G', 'T'], alphabet)
+        self.assertEqual(
+            [
+                [1, 0, 0, 0],
+                [1, 0, 0, 0],
+                [0, 1, 0, 0],
+                [0, 0, 1, 0],
+                [0, 0, 0, 1],
+                [0, 0, 0, 1],
+                [0, 0, 0, 1],
+            ],
+            counts.tolist())
+
+    def testResidueCountMatrixNoCaseConversion(self):
+        """
+        The residueCountMatrix method must keep upper and lower case residues
+        apart when asked not to convert case, and the matrix must extend to
+        the end of the subject.
+        """
+        read = Read('id', 'Aa')
+        hsp1 = HSP(33, readStart=0, readEnd=2, readStartInSubject=0,
+                   readEndInSubject=2, subjectStart=0, subjectEnd=2,
+                   readMatchedSequence='Aa', subjectMatchedSequence='AA')
+        hsp2 = HSP(33, readStart=0, readEnd=2, readStartInSubject=0,
+                   readEndInSubject=2, subjectStart=0, subjectEnd=2,
+                   readMatchedSequence='AA', subjectMatchedSequence='AA')
+        titleAlignments = TitleAlignments('subject title', 3)
+        titleAlignments.addAlignment(TitleAlignment(read, [hsp1, hsp2]))
+        start, alphabet, counts = titleAlignments.residueCountMatrix(
+            convertCaseTo='none')
+        self.assertEqual(0, start)
+        self.assertEqual(['A', 'a'], alphabet)
+        self.assertEqual([[2, 0], [1, 1], [0, 0]], counts.tolist())
+
     def testSummaryWhenEmpty(self):
         """
         If summary is called on an instance of TitleAlignments with no
@@ -828,6 +984,122 @@ class TestTitleAlignments(WarningTestMixin, TestCase):
             },
             titleAlignments.summary())
 
+    def testStatsAfterAddAlignment(self):
+        """
+        Adding an alignment must change the (cached) HSP statistics.
+        """
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id1', 'ACGT'), [
+                HSP(30, subjectStart=0, subjectEnd=2)]))
+        self.assertEqual(1, titleAlignments.hspCount())
+        self.assertEqual(30, titleAlignments.bestHsp().score.score)
+        self.assertEqual(0.2, titleAlignments.coverage())
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id2', 'ACGT'), [
+                HSP(55, subjectStart=2, subjectEnd=4),
+                HSP(40, subjectStart=8, subjectEnd=9)]))
+        self.assertEqual(3, titleAlignments.hspCount())
+        self.assertEqual(55, titleAlignments.bestHsp().score.score)
+        self.assertEqual(30, titleAlignments.worstHsp().score.score)
+        self.assertEqual(40, titleAlignments.medianScore())
+        self.assertEqual(0.5, titleAlignments.coverage())
+
+    def testStatsAfterListChange(self):
+        """
+        Changing the list of alignments with a list method must change the
+        (cached) HSP statistics.
+        """
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id1', 'ACGT'), [HSP(30)]))
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id2', 'ACGT'), [HSP(55)]))
+        self.assertEqual(55, titleAlignments.bestHsp().score.score)
+        titleAlignments.pop()
+        self.assertEqual(30, titleAlignments.bestHsp().score.score)
+        titleAlignments[0] = TitleAlignment(Read('id3', 'ACGT'), [HSP(20)])
+        self.assertEqual(20, titleAlignments.bestHsp().score.score)
+        del titleAlignments[0]
+        self.assertEqual(0, titleAlignments.hspCount())
+
+    def testInvalidateStats(self):
+        """
+        After the HSPs of an alignment are changed and invalidateStats is
+        called, the HSP statistics must be recomputed.
+        """
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleAlignment = TitleAlignment(Read('id1', 'ACGT'), [HSP(30)])
+        titleAlignments.addAlignment(titleAlignment)
+        self.assertEqual(30, titleAlignments.medianScore())
+        titleAlignment.hsps.append(HSP(40))
+        titleAlignments.invalidateStats()
+        self.assertEqual(35, titleAlignments.medianScore())
+        self.assertEqual(2, titleAlignments.hspCount())
+
+    def testBestHspTie(self):
+        """
+        If several HSPs have the best score, bestHsp must return the first of
+        them (as Python's max does).
+        """
+        hsp1 = HSP(10)
+        hsp2 = HSP(20)
+        hsp3 = HSP(20)
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id1', 'ACGT'), [hsp1, hsp2, hsp3]))
+        self.assertIs(hsp2, titleAlignments.bestHsp())
+
+    def testDeepcopyWithStats(self):
+        """
+        A copy of a TitleAlignments whose statistics are cached must not
+        share the cache, and must compute the same statistics.
+        """
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleAlignments.addAlignment(
+            TitleAlignment(Read('id1', 'ACGT'), [HSP(30), HSP(55)]))
+        self.assertEqual(55, titleAlignments.bestHsp().score.score)
+        copy = deepcopy(titleAlignments)
+        self.assertIs(None, copy._stats)
+        self.assertEqual(55, copy.bestHsp().score.score)
+        self.assertEqual('subject title', copy.subjectTitle)
+
+    def testPlottingCopy(self):
+        """
+        Changing the HSPs of a plotting copy of a TitleAlignments must not
+        change the original, and the copy must share its reads.
+        """
+        read = Read('id1', 'ACGT')
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleAlignments.addAlignment(
+            TitleAlignment(read, [HSP(30, subjectStart=4), HSP(55)]))
+        self.assertEqual(55, titleAlignments.bestHsp().score.score)
+        copy = titleAlignments.plottingCopy()
+        self.assertEqual('subject title', copy.subjectTitle)
+        self.assertEqual(10, copy.subjectLength)
+        self.assertIs(read, copy[0].read)
+        for hsp in copy.hsps():
+            hsp.score.score = 1
+            hsp.subjectStart = 0
+        self.assertEqual(1, copy.bestHsp().score.score)
+        self.assertEqual([30, 55], [hsp.score.score
+                                    for hsp in titleAlignments.hsps()])
+        self.assertEqual(4, titleAlignments[0].hsps[0].subjectStart)
+        self.assertEqual(55, titleAlignments.bestHsp().score.score)
+
+    def testPlottingCopyWithReadIndex(self):
+        """
+        A plotting copy of a TitleAlignments whose reads are looked up in an
+        index must look its reads up in the same index.
+        """
+        read = Read('id1', 'ACGT')
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleAlignments.addAlignment(
+            TitleAlignment('id1', [HSP(30)], readIndex={'id1': read}))
+        copy = titleAlignments.plottingCopy()
+        self.assertEqual('id1', copy[0].readId)
+        self.assertIs(read, copy[0].read)
+
 
 class TestTitleAlignmentsLSP(TestCase):
     """
@@ -927,3 +1199,80 @@ class TestTitleAlignmentsLSP(TestCase):
         titleAlignment = TitleAlignment(read, [hsp3])
         titleAlignments.addAlignment(titleAlignment)
         self.assertEqual(set(['id1', 'id2']), titleAlignments.readIds())
+
+
+class TestTitleSummary(TestCase):
+    """
+    Test the TitleSummary class.
+    """
+
+    def testEmpty(self):
+        """
+        A TitleSummary with no HSPs must have zero counts and coverage, and
+        raise ValueError when asked for its best HSP or median score.
+        """
+        titleSummary = TitleSummary('subject title', 10)
+        self.assertEqual(0, titleSummary.readCount())
+        self.assertEqual(0, titleSummary.hspCount())
+        self.assertEqual(0.0, titleSummary.coverage())
+        self.assertFalse(titleSummary.hasScoreBetterThan(0))
+        error = '^No HSPs have been added\\.$'
+        six.assertRaisesRegex(self, ValueError, error, titleSummary.bestHsp)
+        self.assertRaises(ValueError, titleSummary.medianScore)
+
+    def testHasScoreBetterThan(self):
+        """
+        The hasScoreBetterThan method must compare with the best HSP.
+        """
+        titleSummary = TitleSummary('subject title', 10)
+        titleSummary.addHsps([HSP(30, subjectStart=0, subjectEnd=2),
+                              HSP(55, subjectStart=2, subjectEnd=4)])
+        self.assertTrue(titleSummary.hasScoreBetterThan(50))
+        self.assertFalse(titleSummary.hasScoreBetterThan(55))
+
+    def testHasScoreBetterThanLSP(self):
+        """
+        The hasScoreBetterThan method must work when lower scores are better.
+        """
+        titleSummary = TitleSummary('subject title', 10)
+        titleSummary.addHsps([LSP(1e-3, subjectStart=0, subjectEnd=2),
+                              LSP(1e-5, subjectStart=2, subjectEnd=4)])
+        self.assertIs(1e-5, titleSummary.bestHsp().score.score)
+        self.assertTrue(titleSummary.hasScoreBetterThan(1e-4))
+        self.assertFalse(titleSummary.hasScoreBetterThan(1e-6))
+
+    def _summaries(self, exactMedian):
+        """
+        Make a TitleAlignments and a TitleSummary with the same HSPs.
+
+        @param exactMedian: Passed to TitleSummary.
+        @return: A 2-tuple with the C{dict} summaries of the TitleAlignments
+            and the TitleSummary.
+        """
+        titleAlignments = TitleAlignments('subject title', 10)
+        titleSummary = TitleSummary('subject title', 10, exactMedian)
+        for readId, hsps in (
+                ('id1', [HSP(30, subjectStart=0, subjectEnd=2)]),
+                ('id2', [HSP(55, subjectStart=2, subjectEnd=4),
+                         HSP(40, subjectStart=8, subjectEnd=9)])):
+            titleAlignments.addAlignment(
+                TitleAlignment(Read(readId, 'ACGT'), hsps))
+            titleSummary.addHsps(hsps)
+        return titleAlignments.summary(), titleSummary.summary()
+
+    def testSummary(self):
+        """
+        The summary method must return the same result as that of a
+        TitleAlignments with the same HSPs.
+        """
+        expected, summary = self._summaries(True)
+        self.assertEqual(expected, summary)
+
+    def testSummaryApproximateMedian(self):
+        """
+        The summary method must return the same result as that of a
+        TitleAlignments with the same HSPs when the median is estimated
+        (it is exact for so few HSPs).
+        """
+        expected, summary = self._summaries(False)
+        self.assertEqual(expected, summary)
@@ -1,6 +1,10 @@
 import six
 import bz2
 import gzip
+import os
+import sqlite3
+from shutil import rmtree
+from tempfile import mkdtemp
 from six.moves import builtins
 from unittest import TestCase
 from six import assertRaisesRegex
@@ -13,7 +17,8 @@ except ImportError:
 from .mocking import mockOpen, File
 
 from dark.utils import (
-    numericallySortFilenames, median, asHandle, parseRangeString, StringIO)
+    numericallySortFilenames, median, asHandle, parseRangeString, StringIO,
+    ApproximateMedian, replaceFile, connectExisting)
 
 
 class TestNumericallySortFilenames(TestCase):
@@ -116,6 +121,67 @@ class TestMedian(TestCase):
         self.assertEqual(5.9, median([3.1, 1.3, 7.6, 9.9, 5.9]))
 
 
+class TestApproximateMedian(TestCase):
+    """
+    Tests for the ApproximateMedian class.
+    """
+    def testEmpty(self):
+        """
+        Asking for the median when no numbers have been added must raise
+        ValueError.
+        """
+        self.assertRaises(ValueError, ApproximateMedian().median)
+
+    def testSmallExactLimit(self):
+        """
+        An exactLimit of less than 5 must raise ValueError.
+        """
+        error = r'^exactLimit must be at least 5\.$'
+        assertRaisesRegex(self, ValueError, error, ApproximateMedian, 4)
+
+    def testLength(self):
+        """
+        The length of an ApproximateMedian must be the number of numbers
+        added.
+        """
+        approximateMedian = ApproximateMedian(exactLimit=5)
+        for value in range(20):
+            approximateMedian.add(value)
+        self.assertEqual(20, len(approximateMedian))
+
+    def testExact(self):
+        """
+        The median must be exact if no more than exactLimit numbers have been
+        added.
+        """
+        approximateMedian = ApproximateMedian(exactLimit=5)
+        for value in 3.1, 1.3, 7.6, 5.9:
+            approximateMedian.add(value)
+        self.assertEqual(4.5, approximateMedian.median())
+        approximateMedian.add(9.9)
+        self.assertEqual(5.9, approximateMedian.median())
+
+    def testSorted(self):
+        """
+        The median of numbers added in increasing order must be exact.
+        """
+        approximateMedian = ApproximateMedian(exactLimit=5)
+        for value in range(101):
+            approximateMedian.add(value)
+        self.assertEqual(50, approximateMedian.median())
+
+    def testEstimate(self):
+        """
+        The estimated median of many numbers must be close to their median.
+        """
+        approximateMedian = ApproximateMedian()
+        values = [(value * 7919) % 1000 for value in range(10000)]
+        for value in values:
+            approximateMedian.add(value)
+        self.assertAlmostEqual(median(values), approximateMedian.median(),
+                               delta=10)
+
+
 class TestAsHandle(TestCase):
     """
     Test the asHandle function
@@ -313,3 +379,88 @@ class TestStringIO(TestCase):
         with StringIO() as s:
             s.write('hey')
             self.assertEqual('hey', s.getvalue())
+
+
+class TestReplaceFile(TestCase):
+    """
+    Test the replaceFile function.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+        self.source = os.path.join(self.dirname, 'source')
+        self.destination = os.path.join(self.dirname, 'destination')
+        with open(self.source, 'w') as fp:
+            fp.write('new')
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def testNoDestination(self):
+        """
+        If the destination does not exist, the file must be renamed.
+        """
+        replaceFile(self.source, self.destination)
+        self.assertFalse(os.path.exists(self.source))
+        with open(self.destination) as fp:
+            self.assertEqual('new', fp.read())
+
+    def testExistingDestination(self):
+        """
+        If the destination exists, it must be replaced.
+        """
+        with open(self.destination, 'w') as fp:
+            fp.write('old')
+        replaceFile(self.source, self.destination)
+        self.assertFalse(os.path.exists(self.source))
+        with open(self.destination) as fp:
+            self.assertEqual('new', fp.read())
+
+
+class TestConnectExisting(TestCase):
+    """
+    Test the connectExisting function.
+    """
+    def setUp(self):
+        self.dirname = mkdtemp()
+        self.filename = os.path.join(self.dirname, 'db.sqlite3')
+
+    def tearDown(self):
+        rmtree(self.dirname)
+
+    def testNonexistent(self):
+        """
+        Opening a database that does not exist must raise
+        sqlite3.OperationalError and must not create the database.
+        """
+        self.assertRaises(sqlite3.OperationalError, connectExisting,
+                          self.filename)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def testExisting(self):
+        """
+        An existing database must be opened.
+        """
+        connection = sqlite3.connect(self.filename)
+        connection.execute('CREATE TABLE t (x INTEGER)')
+        connection.execute('INSERT INTO t VALUES (3)')
+        connection.commit()
+        connection.close()
+        connection = connectExisting(self.filename)
+        self.assertEqual([(3,)], connection.execute(
+            'SELECT x FROM t').fetchall())
+        connection.close()
+
+    def testReadOnly(self):
+        """
+        The database must be opened read-only (on Python 3).
+        """
+        if not six.PY3:
+            self.skipTest('Databases are not opened read-only on Python 2')
+        connection = sqlite3.connect(self.filename)
+        connection.execute('CREATE TABLE t (x INTEGER)')
+        connection.commit()
+        connection.close()
+        connection = connectExisting(self.filename)
+        self.assertRaises(sqlite3.OperationalError, connection.execute,
+                          'INSERT INTO t VALUES (3)')
+        connection.close()